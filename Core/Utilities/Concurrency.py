@@ -0,0 +1,43 @@
+"""
+Call a function for many items with a pool of threads, for the agents and operations making many slow calls to the
+services and storage elements.
+
+The results are returned in the order of the items, whatever the order in which the calls finish.
+
+:since: Oct 17, 2026
+"""
+
+from multiprocessing.pool import ThreadPool
+
+__RCSID__ = "$Id$"
+
+
+def mapConcurrently(func, items, maxThreads):
+  """Call func for every item with up to maxThreads threads.
+
+  The calls are made in the current thread if there is a single thread or item.
+
+  :param func: function taking a single item, exceptions are raised again by this function
+  :param items: arguments of the calls
+  :param int maxThreads: maximum number of threads
+  :returns: list of the results in the order of items
+  """
+  items = list(items)
+  maxThreads = int(maxThreads)
+  if maxThreads <= 1 or len(items) <= 1:
+    return [func(item) for item in items]
+
+  pool = ThreadPool(min(maxThreads, len(items)))
+  try:
+    return pool.map(func, items)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def starmapConcurrently(func, argsList, maxThreads):
+  """Call func for every tuple of arguments in argsList with up to maxThreads threads, see :func:`mapConcurrently`.
+
+  :returns: list of the results in the order of argsList
+  """
+  return mapConcurrently(lambda args: func(*args), argsList, maxThreads)
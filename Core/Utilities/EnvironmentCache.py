@@ -0,0 +1,237 @@
+"""
+Environments of the software setup scripts, captured once per node instead of sourcing the scripts for every step.
+
+The environment script returned by
+:func:`~ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation.getEnvironmentScript` for a platform, application and
+version is sourced once in a bash shell, and the changes it makes to the environment are kept as an
+:class:`EnvironmentSnapshot`: the variables it sets, the variables it extends (e.g. a directory prepended to the
+PATH) and the variables it unsets. The snapshot is then applied to any environment, either in python, e.g. to read
+the MARLIN_DLL, or by a short shell script exporting the variables, which replaces sourcing the environment script
+in the scripts running the applications.
+
+The :class:`EnvironmentCache` keeps the snapshots in memory for the following steps of the job, and as JSON files in
+cache directories for the following jobs on the node. A snapshot belongs to the path and content of the environment
+script, so a changed script is captured again.
+
+:since: Oct 17, 2026
+"""
+
+import hashlib
+import json
+import os
+import pipes
+import re
+import subprocess
+import tempfile
+
+from DIRAC import S_OK, S_ERROR, gLogger
+
+__RCSID__ = "$Id$"
+
+LOG = gLogger.getSubLogger('EnvironmentCache')
+
+#: version of the snapshot format, cached snapshots with another version are ignored
+SNAPSHOT_VERSION = 1
+#: variables changed by the shell itself and not by the environment script
+IGNORED_VARIABLES = ('_', 'SHLVL', 'PWD', 'OLDPWD')
+#: names of the variables that can be exported by a shell script, exported functions are not kept
+VARIABLE_NAME = re.compile('^[A-Za-z_][A-Za-z0-9_]*$')
+#: separator printed between the environments before and after sourcing the script
+SEPARATOR = '--ILCDIRAC-ENVIRONMENT--'
+#: bash commands printing the environment before and after sourcing the script given as first argument, the last
+#: separator is missing if the script exits the shell
+CAPTURE_COMMAND = 'env -0; printf "%%s\\0" %(sep)s; source "$1" > /dev/null 2>&1 < /dev/null; env -0; ' \
+                  'printf "%%s\\0" %(sep)s' % dict(sep=SEPARATOR)
+
+
+class EnvironmentSnapshot(object):
+  """Changes made to the environment by sourcing an environment script."""
+
+  def __init__(self, setVariables=None, extendedVariables=None, unsetVariables=None, script=''):
+    """
+    :param dict setVariables: value of the variables set by the script
+    :param dict extendedVariables: [prefix, suffix] added around the previous value of the variables
+    :param list unsetVariables: variables removed by the script
+    :param str script: path to the environment script
+    """
+    self.setVariables = dict(setVariables or {})
+    self.extendedVariables = dict(extendedVariables or {})
+    self.unsetVariables = sorted(unsetVariables or [])
+    self.script = script
+
+  @classmethod
+  def fromEnvironments(cls, before, after, script=''):
+    """Create the snapshot from the environments before and after sourcing the script.
+
+    A variable whose previous value is still part of its new value is kept as extended, so that the snapshot can
+    be applied to another environment, e.g. with other paths in the PATH or LD_LIBRARY_PATH.
+    """
+    setVariables = {}
+    extendedVariables = {}
+    for name, value in after.iteritems():
+      previous = before.get(name)
+      if name in IGNORED_VARIABLES or value == previous:
+        continue
+      if previous and previous in value:
+        index = value.find(previous)
+        extendedVariables[name] = [value[:index], value[index + len(previous):]]
+      else:
+        setVariables[name] = value
+    unsetVariables = [name for name in before if name not in after and name not in IGNORED_VARIABLES]
+    return cls(setVariables, extendedVariables, unsetVariables, script)
+
+  def apply(self, environment):
+    """Return a copy of the environment changed as if the script was sourced."""
+    newEnvironment = dict(environment)
+    for name in self.unsetVariables:
+      newEnvironment.pop(name, None)
+    newEnvironment.update(self.setVariables)
+    for name, (prefix, suffix) in self.extendedVariables.iteritems():
+      newEnvironment[name] = prefix + newEnvironment.get(name, '') + suffix
+    return newEnvironment
+
+  def getScript(self):
+    """Return the lines of a bash script making the same changes to the environment as the environment script."""
+    lines = ['## environment of %s' % self.script]
+    lines.extend('unset %s' % name for name in self.unsetVariables)
+    lines.extend('export %s=%s' % (name, pipes.quote(value)) for name, value in sorted(self.setVariables.items()))
+    lines.extend('export %s=%s"${%s}"%s' % (name, pipes.quote(prefix), name, pipes.quote(suffix))
+                 for name, (prefix, suffix) in sorted(self.extendedVariables.items()))
+    return lines
+
+  def toDict(self):
+    """Return the snapshot as a dictionary that can be stored as JSON."""
+    return dict(Version=SNAPSHOT_VERSION, Script=self.script, Set=self.setVariables,
+                Extended=self.extendedVariables, Unset=self.unsetVariables)
+
+  @classmethod
+  def fromDict(cls, snapshotDict):
+    """Create the snapshot from the dictionary given by :func:`toDict`.
+
+    :raises: ValueError for a dictionary in another version
+    """
+    if snapshotDict.get('Version') != SNAPSHOT_VERSION:
+      raise ValueError('snapshot has version %s' % snapshotDict.get('Version'))
+    return cls(dict((_encode(name), _encode(value)) for name, value in snapshotDict['Set'].iteritems()),
+               dict((_encode(name), [_encode(prefix), _encode(suffix)])
+                    for name, (prefix, suffix) in snapshotDict['Extended'].iteritems()),
+               [_encode(name) for name in snapshotDict['Unset']],
+               _encode(snapshotDict['Script']))
+
+
+def _encode(value):
+  """Return the string read from JSON as the bytes found in the environment."""
+  return value.encode('utf-8')
+
+
+def _parseEnvironment(output):
+  """Return the dictionary of the NUL separated variables printed by env -0, without the exported functions."""
+  environment = {}
+  for entry in output.split('\0'):
+    name, sep, value = entry.partition('=')
+    if sep and VARIABLE_NAME.match(name):
+      environment[name] = value
+  return environment
+
+
+def captureEnvironment(envScript, environment=None):
+  """Source the environment script in bash and return S_OK with its :class:`EnvironmentSnapshot`.
+
+  :param str envScript: path to the environment script
+  :param dict environment: environment in which the script is sourced, the current one by default
+  """
+  try:
+    ## bash reads the .bashrc if its input is a socket
+    with open(os.devnull) as devnull:
+      proc = subprocess.Popen(['bash', '-c', CAPTURE_COMMAND, 'bash', envScript], env=environment,
+                              stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+      output, error = proc.communicate()
+  except (IOError, OSError) as err:
+    return S_ERROR('Failed to run bash: %s' % err)
+  parts = output.split('\0%s\0' % SEPARATOR)
+  if proc.returncode or len(parts) != 3:
+    return S_ERROR('Failed to source %s: status %s %s' % (envScript, proc.returncode, error.strip()))
+  before, after, _ = parts
+  return S_OK(EnvironmentSnapshot.fromEnvironments(_parseEnvironment(before), _parseEnvironment(after), envScript))
+
+
+class EnvironmentCache(object):
+  """Snapshots of the environment scripts, in memory and in cache directories."""
+
+  #: snapshots captured or read by this process, shared by the steps of the job
+  _snapshots = {}
+
+  def __init__(self, cacheDirs=None):
+    """
+    :param list cacheDirs: directories containing the snapshots, the last one must be writable to add new ones
+    """
+    self.cacheDirs = [cacheDir for cacheDir in cacheDirs or [] if cacheDir]
+
+  @staticmethod
+  def getSnapshotName(envScript, content):
+    """Return the name of the snapshot of the environment script with the content."""
+    key = hashlib.md5(content)
+    key.update(json.dumps([SNAPSHOT_VERSION, os.path.abspath(envScript)]))
+    return 'environment_%s.json' % key.hexdigest()
+
+  def getSnapshot(self, envScript):
+    """Return the snapshot of the environment script, source the script if it is not cached yet.
+
+    :param str envScript: path to the environment script
+    :returns: S_OK with the :class:`EnvironmentSnapshot`, S_ERROR if the script cannot be read or sourced
+    """
+    try:
+      with open(envScript) as scriptFile:
+        content = scriptFile.read()
+    except (IOError, OSError) as err:
+      return S_ERROR('Cannot read environment script %s: %s' % (envScript, err))
+
+    snapshotName = self.getSnapshotName(envScript, content)
+    if snapshotName in self._snapshots:
+      return S_OK(self._snapshots[snapshotName])
+    for cacheDir in self.cacheDirs:
+      res = self._readSnapshot(os.path.join(cacheDir, snapshotName))
+      if res['OK']:
+        LOG.verbose('Using environment snapshot from %s' % cacheDir)
+        self._snapshots[snapshotName] = res['Value']
+        return res
+      LOG.debug(res['Message'])
+
+    res = captureEnvironment(envScript)
+    if not res['OK']:
+      return res
+    self._snapshots[snapshotName] = res['Value']
+    if self.cacheDirs:
+      resWrite = self._writeSnapshot(os.path.join(self.cacheDirs[-1], snapshotName), res['Value'])
+      if not resWrite['OK']:
+        LOG.warn('Failed to cache the environment snapshot', resWrite['Message'])
+    return res
+
+  @staticmethod
+  def _readSnapshot(snapshotFile):
+    """Read a snapshot written by :func:`_writeSnapshot`."""
+    try:
+      with open(snapshotFile) as cacheFile:
+        return S_OK(EnvironmentSnapshot.fromDict(json.load(cacheFile)))
+    except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError) as err:
+      return S_ERROR('Cannot read environment snapshot %s: %s' % (snapshotFile, err))
+
+  @staticmethod
+  def _writeSnapshot(snapshotFile, snapshot):
+    """Write the snapshot, the file is replaced atomically so concurrent readers never see a partial snapshot.
+
+    The variables are written one per line and sorted, so that the snapshots of two versions can be compared with
+    diff.
+    """
+    cacheDir = os.path.dirname(snapshotFile) or '.'
+    try:
+      if not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+      tmpHandle, tmpName = tempfile.mkstemp(dir=cacheDir, prefix='.tmp_environment_')
+      with os.fdopen(tmpHandle, 'w') as cacheFile:
+        json.dump(snapshot.toDict(), cacheFile, indent=1, sort_keys=True)
+      os.chmod(tmpName, 0644)
+      os.rename(tmpName, snapshotFile)
+    except (IOError, OSError, ValueError) as err:
+      return S_ERROR('Cannot write environment snapshot %s: %s' % (snapshotFile, err))
+    return S_OK(snapshotFile)
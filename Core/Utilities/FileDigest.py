@@ -0,0 +1,146 @@
+"""
+Single pass checksum and GUID engine for local files.
+
+The Adler32 checksum, the GUID and optionally the full MD5 sum of a file are computed
+while reading the file only once. Results are cached for the lifetime of the process,
+keyed by (path, size, mtime), so the output files of a job are not read again when
+several modules ask for the same metadata.
+
+The GUID is compatible with :func:`DIRAC.Core.Utilities.File.makeGuid`, i.e. it is built
+from the MD5 sum of the first 10 MB of the file.
+
+:since: Oct 17, 2026
+"""
+
+import hashlib
+import os
+import threading
+import zlib
+
+from multiprocessing.pool import ThreadPool
+
+from DIRAC import S_OK, S_ERROR, gLogger
+from DIRAC.Core.Utilities.Adler import intAdlerToHex
+from DIRAC.Core.Utilities.File import generateGuid
+
+__RCSID__ = "$Id$"
+
+LOG = gLogger.getSubLogger('FileDigest')
+
+#: size of the blocks read from disk
+BLOCK_SIZE = 4 * 1024 * 1024
+#: number of bytes entering the GUID, same as in DIRAC makeGuid
+GUID_BYTES = 10 * 1024 * 1024
+#: default number of files hashed in parallel
+MAX_THREADS = 4
+
+_DIGEST_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def _cacheKey(fileName):
+  """Return the cache key of a file: (realpath, size, mtime)."""
+  fileStat = os.stat(fileName)
+  return (os.path.realpath(fileName), fileStat.st_size, fileStat.st_mtime)
+
+
+def _computeDigest(fileName, withMD5, blockSize=BLOCK_SIZE):
+  """Read the file once and feed every block to all the checksum algorithms."""
+  adler = 1
+  guidMd5 = hashlib.md5()
+  fullMd5 = hashlib.md5() if withMD5 else None
+  guidBytesLeft = GUID_BYTES
+  size = 0
+  with open(fileName, 'rb') as inputFile:
+    while True:
+      data = inputFile.read(blockSize)
+      if not data:
+        break
+      size += len(data)
+      adler = zlib.adler32(data, adler)
+      if guidBytesLeft > 0:
+        guidMd5.update(data[:guidBytesLeft])
+        guidBytesLeft -= len(data)
+      if fullMd5 is not None:
+        fullMd5.update(data)
+
+  digest = {'Size': size,
+            'Adler32': intAdlerToHex(adler),
+            'GUID': generateGuid(guidMd5.hexdigest().upper(), 'MD5'),
+           }
+  if fullMd5 is not None:
+    digest['MD5'] = fullMd5.hexdigest()
+  return digest
+
+
+def getFileDigest(fileName, withMD5=False):
+  """Return the checksums of a local file, computed in a single pass over its content.
+
+  :param str fileName: path to the file
+  :param bool withMD5: also compute the MD5 sum of the full file
+  :returns: S_OK with dict with keys Size, Adler32, GUID (and MD5 if requested), S_ERROR
+  """
+  try:
+    key = _cacheKey(fileName)
+  except OSError as err:
+    return S_ERROR("Cannot access file %s: %s" % (fileName, err))
+
+  with _CACHE_LOCK:
+    cached = _DIGEST_CACHE.get(key)
+  if cached is not None and (not withMD5 or 'MD5' in cached):
+    LOG.debug("Using cached checksums for", fileName)
+    return S_OK(dict(cached))
+
+  try:
+    digest = _computeDigest(fileName, withMD5)
+  except (IOError, OSError) as err:
+    LOG.error("Failed to compute checksums", "%s: %s" % (fileName, err))
+    return S_ERROR("Failed to compute checksums of %s: %s" % (fileName, err))
+
+  with _CACHE_LOCK:
+    _DIGEST_CACHE[key] = digest
+  return S_OK(dict(digest))
+
+
+def getFileDigests(fileNames, withMD5=False, maxThreads=MAX_THREADS):
+  """Return the checksums of several files, hashing up to `maxThreads` files at the same time.
+
+  The zlib and hashlib functions release the GIL while they process a block, so the
+  threads really run in parallel.
+
+  :param list fileNames: paths to the files
+  :param bool withMD5: also compute the MD5 sums of the full files
+  :param int maxThreads: maximum number of files hashed in parallel
+  :returns: S_OK with dict {fileName: digest}, S_ERROR if any file could not be read
+  """
+  fileNames = list(fileNames)
+  if not fileNames:
+    return S_OK({})
+
+  nThreads = max(1, min(maxThreads, len(fileNames)))
+  if nThreads == 1:
+    results = [getFileDigest(fileName, withMD5) for fileName in fileNames]
+  else:
+    pool = ThreadPool(nThreads)
+    try:
+      results = pool.map(lambda fileName: getFileDigest(fileName, withMD5), fileNames)
+    finally:
+      pool.close()
+      pool.join()
+
+  digests = {}
+  errors = []
+  for fileName, result in zip(fileNames, results):
+    if not result['OK']:
+      errors.append(result['Message'])
+      continue
+    digests[fileName] = result['Value']
+  if errors:
+    return S_ERROR("; ".join(errors))
+  return S_OK(digests)
+
+
+def clearDigestCache():
+  """Forget all cached checksums."""
+  with _CACHE_LOCK:
+    _DIGEST_CACHE.clear()
@@ -0,0 +1,202 @@
+"""
+Cache of input data files, shared between the jobs running on a node.
+
+Popular input files, e.g. geometries, steering tarballs or background files, are downloaded by many jobs of the same
+node. The first job downloading a file stores it in the cache directory, the following jobs get a hard link to the
+cached file, or a reflink or copy if the cache is on another file system.
+
+Entries are keyed by the LFN and the checksum (or GUID) of the file, so a file that is replaced in the catalog is not
+served from the cache. Every entry is protected by a lock file: concurrent jobs wanting the same file wait for the
+single download. Downloads go to a temporary directory and are moved into the cache with an atomic rename.
+When the cache is larger than its maximum size, the least recently used entries are removed. Jobs holding a hard
+link to a removed entry keep their file.
+
+:since: Oct 17, 2026
+"""
+
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from DIRAC import S_OK, S_ERROR, gLogger
+
+__RCSID__ = "$Id$"
+
+LOG = gLogger.getSubLogger('InputDataCache')
+
+#: default maximum size of the cache in bytes
+DEFAULT_MAX_SIZE = 20 * 1024 * 1024 * 1024
+#: prefix of the temporary download directories in the cache
+TMP_PREFIX = '.tmp_'
+#: suffix of the lock files of the entries
+LOCK_SUFFIX = '.lock'
+
+
+def _linkOrCopy(source, destination):
+  """Make the destination point to the same data as the source: hard link, reflink or copy, whatever works."""
+  try:
+    os.link(source, destination)
+    return 'link'
+  except OSError as err:
+    LOG.verbose('Cannot hard link %s:' % source, str(err))
+  try:
+    if subprocess.call(['cp', '--reflink=auto', source, destination]) == 0:
+      return 'reflink'
+  except OSError as err:
+    LOG.verbose('Cannot reflink %s:' % source, str(err))
+  shutil.copyfile(source, destination)
+  return 'copy'
+
+
+class InputDataCache(object):
+  """Node-local cache of input data files."""
+
+  def __init__(self, cacheDir, maxSize=DEFAULT_MAX_SIZE):
+    """
+    :param str cacheDir: directory of the cache, shared between the jobs
+    :param int maxSize: maximum size of the cache in bytes
+    """
+    self.cacheDir = cacheDir
+    self.maxSize = maxSize
+    self.hits = 0
+    self.misses = 0
+    self.bytesFromCache = 0
+    self.statsLock = threading.Lock()
+
+  @staticmethod
+  def getEntryName(lfn, checksum):
+    """Return the name of the cache entry of a file.
+
+    :param str lfn: LFN of the file
+    :param str checksum: checksum or GUID of the file
+    """
+    return '%s_%s' % (hashlib.md5('%s:%s' % (lfn, checksum)).hexdigest(), os.path.basename(lfn))
+
+  def getFile(self, lfn, checksum, destination, downloadFunction):
+    """Put the file at destination, from the cache if possible, otherwise with the downloadFunction.
+
+    :param str lfn: LFN of the file
+    :param str checksum: checksum or GUID of the file
+    :param str destination: path the file must be placed at
+    :param downloadFunction: function taking a directory, downloading the file into that directory with its
+                             base name and returning S_OK or S_ERROR
+    :returns: S_OK with True if the file was served from the cache, False if it was downloaded
+    """
+    entry = os.path.join(self.cacheDir, self.getEntryName(lfn, checksum))
+    try:
+      if not os.path.isdir(self.cacheDir):
+        os.makedirs(self.cacheDir)
+      lockFile = open(entry + LOCK_SUFFIX, 'a')
+    except (IOError, OSError) as err:
+      return S_ERROR('Cannot use the input data cache %s: %s' % (self.cacheDir, err))
+
+    fromCache = True
+    try:
+      ## one job downloads, the others wait for it and then find the file
+      fcntl.flock(lockFile, fcntl.LOCK_EX)
+      if not os.path.exists(entry):
+        fromCache = False
+        res = self.__addEntry(entry, lfn, downloadFunction)
+        if not res['OK']:
+          return res
+      try:
+        os.utime(entry, None)
+      except OSError as err:
+        LOG.verbose('Cannot mark %s as used:' % entry, str(err))
+      method = _linkOrCopy(entry, destination)
+    except (IOError, OSError) as err:
+      return S_ERROR('Failed to get %s from the input data cache: %s' % (lfn, err))
+    finally:
+      fcntl.flock(lockFile, fcntl.LOCK_UN)
+      lockFile.close()
+
+    with self.statsLock:
+      if fromCache:
+        self.hits += 1
+        self.bytesFromCache += os.path.getsize(destination)
+      else:
+        self.misses += 1
+    if fromCache:
+      LOG.info('Got %s from the input data cache with %s' % (lfn, method))
+    else:
+      self.evict()
+    return S_OK(fromCache)
+
+  def __addEntry(self, entry, lfn, downloadFunction):
+    """Download the file to a temporary directory and move it to the entry."""
+    tmpDir = tempfile.mkdtemp(prefix=TMP_PREFIX, dir=self.cacheDir)
+    try:
+      res = downloadFunction(tmpDir)
+      if not res['OK']:
+        return res
+      downloaded = os.path.join(tmpDir, os.path.basename(lfn))
+      if not os.path.exists(downloaded):
+        return S_ERROR('Downloaded file %s not found' % downloaded)
+      ## read only, so that jobs do not change the cached file through their hard link
+      os.chmod(downloaded, 0444)
+      os.rename(downloaded, entry)
+    finally:
+      shutil.rmtree(tmpDir, ignore_errors=True)
+    return S_OK()
+
+  def getEntries(self):
+    """Return the list of (modification time, size, path) of the entries of the cache."""
+    entries = []
+    for name in os.listdir(self.cacheDir):
+      if name.startswith(TMP_PREFIX) or name.endswith(LOCK_SUFFIX):
+        continue
+      path = os.path.join(self.cacheDir, name)
+      try:
+        fileStat = os.stat(path)
+      except OSError:
+        continue
+      entries.append((fileStat.st_mtime, fileStat.st_size, path))
+    return entries
+
+  def evict(self):
+    """Remove the least recently used entries until the cache is not larger than maxSize.
+    Entries used by other jobs at the same time are skipped.
+
+    :returns: S_OK with the number of removed entries
+    """
+    try:
+      entries = sorted(self.getEntries())
+    except OSError as err:
+      return S_ERROR('Cannot list the input data cache %s: %s' % (self.cacheDir, err))
+    totalSize = sum(size for _mtime, size, _path in entries)
+    removed = 0
+    for _mtime, size, path in entries:
+      if totalSize <= self.maxSize:
+        break
+      try:
+        with open(path + LOCK_SUFFIX, 'a') as lockFile:
+          try:
+            fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+          except IOError as err:
+            if err.errno in (errno.EAGAIN, errno.EACCES):
+              continue
+            raise
+          ## the lock file is kept, a job may already have opened it to wait for the entry
+          try:
+            os.unlink(path)
+          finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+      except (IOError, OSError) as err:
+        LOG.warn('Cannot remove %s from the input data cache:' % path, str(err))
+        continue
+      totalSize -= size
+      removed += 1
+    if removed:
+      LOG.info('Removed %d files from the input data cache, %d bytes left' % (removed, totalSize))
+    return S_OK(removed)
+
+  def getStatistics(self):
+    """Return a summary of the use of the cache, for the job parameters."""
+    requests = self.hits + self.misses
+    return 'hits %d/%d (%d%%), %.1f MB from cache' % (self.hits, requests, 100 * self.hits / max(requests, 1),
+                                                       self.bytesFromCache / 1024. / 1024.)
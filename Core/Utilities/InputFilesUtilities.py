@@ -1,5 +1,9 @@
 '''
-For any input file, try to determine from the FC the number of events / luminosity / event type. 
+For any input file, try to determine from the FC the number of events / luminosity / event type.
+
+The metadata of all files and directories is fetched in bulk: the catalog is called by a pool of threads and
+every directory and file is asked at most once per call. The files are only asked in the directories without
+NumberOfEvents: the user metadata of a file already contains the metadata of its directories.
 
 :author: S. Poss
 :since: Nov 2, 2010
@@ -7,13 +11,46 @@ For any input file, try to determine from the FC the number of events / luminosi
 
 __RCSID__ = "$Id$"
 
+from multiprocessing.pool import ThreadPool
+
 from DIRAC.Resources.Catalog.FileCatalogClient import FileCatalogClient
 import os
 
 from DIRAC import gLogger, S_OK, S_ERROR
 
-def getNumberOfEvents(inputfile):
-  """ Find from the FileCatalog the number of events in a file
+#: number of catalog calls made in parallel
+MAX_THREADS = 8
+#: number of LFNs or directories given to a thread at once
+CHUNK_SIZE = 50
+
+def _getMetadataBulk(method, keys, maxThreads=MAX_THREADS):
+  """ Call the catalog method for all keys, in chunks handled by a pool of threads
+
+  :param method: function taking a single LFN or directory, e.g. getFileUserMetadata
+  :param keys: LFNs or directories
+  :param int maxThreads: maximum number of parallel calls
+  :returns: dictionary of key to result of the call
+  """
+  keys = list(keys)
+  if len(keys) <= 1:
+    return dict((key, method(key)) for key in keys)
+  pool = ThreadPool(min(maxThreads, len(keys)))
+  try:
+    results = pool.map(method, keys, CHUNK_SIZE)
+  finally:
+    pool.close()
+    pool.join()
+  return dict(zip(keys, results))
+
+def _hasNumberOfEvents(res):
+  """ Check if the metadata query succeeded and contains the NumberOfEvents """
+  return res['OK'] and "NumberOfEvents" in res['Value']
+
+def _resolveNumberOfEvents(inputfile):
+  """ Find from the FileCatalog the number of events of the files
+
+  :returns: S_OK with tuple of the summary dictionary returned by :func:`getNumberOfEvents` and the dictionary
+            LFN: number of events, for the files where it is known
   """
 
   files = inputfile
@@ -26,9 +63,22 @@ def getNumberOfEvents(inputfile):
       flist[bpath] = [myfile]
     else:
       flist[bpath].append(myfile)
-      
+
   fc = FileCatalogClient()
-  nbevts = {} 
+
+  ## get all the metadata first: the files alone in their directory, then the directories that are still needed,
+  ## then the files of the directories without number of events
+  fileMeta = _getMetadataBulk(fc.getFileUserMetadata,
+                              set(files[0] for files in flist.values() if len(files) == 1))
+  dirMeta = _getMetadataBulk(fc.getDirectoryUserMetadata,
+                             [path for path, files in flist.items()
+                              if len(files) != 1 or not _hasNumberOfEvents(fileMeta[files[0]])])
+  fileMeta.update(_getMetadataBulk(fc.getFileUserMetadata,
+                                   set(myfile for path, res in dirMeta.items() if not _hasNumberOfEvents(res)
+                                       for myfile in flist[path]) - set(fileMeta)))
+
+  nbevts = {}
+  eventsPerFile = {}
   luminosity = 0
   numberofevents = 0
   evttype = ''
@@ -40,13 +90,14 @@ def getNumberOfEvents(inputfile):
     found_lumi = False
 
     if len(files) == 1:
-      res = fc.getFileUserMetadata(files[0])
+      res = fileMeta[files[0]]
       if not res['OK']:
         gLogger.warn("Failed to get Metadata from file: %s, because: %s" % (files[0], res['Message']))
       else:
         tags = res['Value']
         if "NumberOfEvents" in tags and not found_nbevts:
           numberofevents += int(tags["NumberOfEvents"])
+          eventsPerFile[files[0]] = int(tags["NumberOfEvents"])
           found_nbevts = True
           completeFailure = False
         if "Luminosity" in tags and not found_lumi:
@@ -56,11 +107,12 @@ def getNumberOfEvents(inputfile):
         if found_nbevts:
           continue
 
-    res = fc.getDirectoryUserMetadata(path)
-    if res['OK']:   
+    res = dirMeta[path]
+    if res['OK']:
       tags = res['Value']
       if "NumberOfEvents" in tags and not found_nbevts:
         numberofevents += len(files)*int(tags["NumberOfEvents"])
+        eventsPerFile.update(dict.fromkeys(files, int(tags["NumberOfEvents"])))
         found_nbevts = True
         completeFailure = False
       if "Luminosity" in tags and not found_lumi:
@@ -68,25 +120,26 @@ def getNumberOfEvents(inputfile):
         found_lumi = True
 
       evttype = tags.get("EvtType", evttype)
-      others.update(tags)    
-      if found_nbevts: 
+      others.update(tags)
+      if found_nbevts:
         continue
     else:
       gLogger.warn("Failed to get Metadata from path: %s, because: %s" % (path, res['Message']))
 
     for myfile in files:
-      res = fc.getFileUserMetadata(myfile)
+      res = fileMeta[myfile]
       if not res['OK']:
         gLogger.warn("Failed to get Metadata from file: %s, because: %s" % (myfile, res['Message']))
         continue
       tags = res['Value']
       if "NumberOfEvents" in tags:
         numberofevents += int(tags["NumberOfEvents"])
+        eventsPerFile[myfile] = int(tags["NumberOfEvents"])
         completeFailure = False
       if "Luminosity" in tags and not found_lumi:
         luminosity += float(tags["Luminosity"])
-      others.update(tags)  
-        
+      others.update(tags)
+
   nbevts['nbevts'] = numberofevents
   nbevts['lumi'] = luminosity
   nbevts['EvtType'] = evttype
@@ -100,4 +153,23 @@ def getNumberOfEvents(inputfile):
     gLogger.warn("Did not obtain NumberOfEvents from FileCatalog")
     return S_ERROR("Failed to get Number of Events")
 
-  return S_OK(nbevts)
+  return S_OK((nbevts, eventsPerFile))
+
+def getNumberOfEvents(inputfile):
+  """ Find from the FileCatalog the number of events in a file
+  """
+  res = _resolveNumberOfEvents(inputfile)
+  if not res['OK']:
+    return res
+  return S_OK(res['Value'][0])
+
+def getNumberOfEventsPerFile(inputfile):
+  """ Find from the FileCatalog the number of events of each file
+
+  :param list inputfile: list of LFNs
+  :returns: S_OK with dictionary LFN: number of events, files without NumberOfEvents are not included
+  """
+  res = _resolveNumberOfEvents(inputfile)
+  if not res['OK']:
+    return res
+  return S_OK(res['Value'][1])
@@ -0,0 +1,232 @@
+"""
+Scanner of LCIO files, to count the events and their collections without the LCIO tools.
+
+The LCIO files are written with SIO. All numbers are big endian, strings are preceded by their length and padded to a
+multiple of 4 bytes. A file is a sequence of records:
+
+* The record header gives its length, the record marker, the options, the length of the data in the file and
+  uncompressed, and the name of the record. The data is compressed with zlib if the first bit of the options is set,
+  it follows the header and is padded to a multiple of 4 bytes.
+* The data of a record is a sequence of blocks, every block starts with its length, the block marker, its version
+  and its name.
+
+Every event is an ``LCEventHeader`` record, whose ``EventHeader`` block lists the names and types of the
+collections of the event, followed by an ``LCEvent`` record with one block per collection. Only the event headers
+are read, the data of all other records is skipped, so a file is checked in a single pass without reading the
+collections themselves.
+
+:since: Oct 17, 2026
+"""
+
+import os
+import struct
+import zlib
+
+from collections import OrderedDict, namedtuple
+from multiprocessing import Pool
+
+from DIRAC import S_OK, S_ERROR, gLogger
+
+__RCSID__ = "$Id$"
+
+LOG = gLogger.getSubLogger('LCIOReader')
+
+RECORD_MARKER = 0xabadcafe
+BLOCK_MARKER = 0xdeadbeef
+#: option bit of the records with compressed data
+COMPRESSED = 0x1
+EVENT_RECORD = 'LCEvent'
+EVENT_HEADER_RECORD = 'LCEventHeader'
+EVENT_HEADER_BLOCK = 'EventHeader'
+#: default number of worker processes of :func:`scanFiles`, the job usually shares the node with other jobs
+DEFAULT_PROCESSES = 2
+
+#: header of one event, collections is the list of (name, type) of its collections
+EventHeader = namedtuple('EventHeader', 'runNumber eventNumber timeStamp detectorName collections')
+
+
+class LCIOFormatError(Exception):
+  """Raised for files that cannot be read as LCIO files."""
+  pass
+
+
+def _padded(length):
+  """Return the length padded to a multiple of 4 bytes."""
+  return (length + 3) & ~3
+
+
+class _Buffer(object):
+  """Data of a record, read from the beginning to the end."""
+
+  def __init__(self, data, description):
+    self.data = data
+    self.offset = 0
+    self.description = description
+
+  def _check(self, length):
+    if length < 0 or self.offset + length > len(self.data):
+      raise LCIOFormatError('%s is corrupted at %d' % (self.description, self.offset))
+
+  def unpack(self, fmt):
+    """Return the values of the struct format fmt read at the current position."""
+    size = struct.calcsize(fmt)
+    self._check(size)
+    values = struct.unpack_from(fmt, self.data, self.offset)
+    self.offset += size
+    return values
+
+  def string(self):
+    """Return the string read at the current position."""
+    length = self.unpack('>i')[0]
+    self._check(length)
+    value = self.data[self.offset:self.offset + length]
+    self.offset += _padded(length)
+    return value
+
+
+class LCIOFile(object):
+  """LCIO file opened for reading."""
+
+  def __init__(self, fileName):
+    """
+    :param str fileName: path of the file
+    :raises: IOError
+    """
+    self.fileName = fileName
+    self._file = open(fileName, 'rb')
+    self.size = os.fstat(self._file.fileno()).st_size
+
+  def close(self):
+    """Release the file."""
+    self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def _read(self, length):
+    """Return the next length bytes of the file."""
+    data = self._file.read(length)
+    if len(data) != length:
+      raise LCIOFormatError('%s is truncated at %d' % (self.fileName, self._file.tell() - len(data)))
+    return data
+
+  def iterRecords(self, readRecords=()):
+    """Yield the name and the data of every record of the file.
+
+    :param readRecords: names of the records whose data is read, the data of the others is skipped and given as None
+    :raises: LCIOFormatError
+    """
+    self._file.seek(0)
+    position = 0
+    while position < self.size:
+      headerLength, marker = struct.unpack('>2I', self._read(8))
+      if marker != RECORD_MARKER or headerLength < 24:
+        raise LCIOFormatError('%s: expected a record at %d' % (self.fileName, position))
+      header = _Buffer(self._read(headerLength - 8), '%s: record at %d' % (self.fileName, position))
+      options, dataLength, uncompressedLength = header.unpack('>3I')
+      name = header.string()
+      position += headerLength + _padded(dataLength)
+      if position > self.size:
+        raise LCIOFormatError('%s is truncated in record %s' % (self.fileName, name))
+      if name not in readRecords:
+        self._file.seek(position)
+        yield name, None
+        continue
+      data = self._read(_padded(dataLength))[:dataLength]
+      if options & COMPRESSED:
+        try:
+          data = zlib.decompress(data)
+        except zlib.error as err:
+          raise LCIOFormatError('%s: cannot uncompress record %s: %s' % (self.fileName, name, err))
+      if len(data) != uncompressedLength:
+        raise LCIOFormatError('%s: wrong length of record %s' % (self.fileName, name))
+      yield name, data
+
+  def iterBlocks(self, data, recordName):
+    """Yield the name, version and content of the blocks in the data of a record."""
+    record = _Buffer(data, '%s: record %s' % (self.fileName, recordName))
+    while record.offset < len(data):
+      start = record.offset
+      blockLength, marker, version = record.unpack('>3I')
+      name = record.string()
+      if marker != BLOCK_MARKER or blockLength < record.offset - start or start + blockLength > len(data):
+        raise LCIOFormatError('%s: corrupted block in record %s' % (self.fileName, recordName))
+      yield name, version, _Buffer(data[record.offset:start + blockLength],
+                                   '%s: block %s' % (self.fileName, name))
+      record.offset = start + _padded(blockLength)
+
+  def iterEventHeaders(self):
+    """Yield the :data:`EventHeader` of every event of the file."""
+    for recordName, data in self.iterRecords(readRecords=(EVENT_HEADER_RECORD,)):
+      if data is not None:
+        yield self.getEventHeader(data, recordName)
+
+  def getEventHeader(self, data, recordName=EVENT_HEADER_RECORD):
+    """Return the :data:`EventHeader` in the data of an event header record, the parameters of the event are
+    skipped.
+    """
+    for blockName, _version, block in self.iterBlocks(data, recordName):
+      if blockName != EVENT_HEADER_BLOCK:
+        continue
+      runNumber, eventNumber, timeStamp = block.unpack('>iiq')
+      detectorName = block.string()
+      collections = []
+      for _ in xrange(block.unpack('>i')[0]):
+        name = block.string()
+        collections.append((name, block.string()))
+      return EventHeader(runNumber, eventNumber, timeStamp, detectorName, collections)
+    raise LCIOFormatError('%s: no %s block in record %s' % (self.fileName, EVENT_HEADER_BLOCK, recordName))
+
+
+def scanFile(fileName):
+  """Count the events and the events containing every collection in the file.
+
+  The events are the ``LCEvent`` records, the collections are counted from the event headers.
+
+  :param str fileName: path of the LCIO file
+  :returns: S_OK with the dictionary with the number of ``Events`` and the ``Collections``, the dictionary of the
+            number of events for every collection name
+  """
+  numberOfEvents = 0
+  collections = {}
+  try:
+    with LCIOFile(fileName) as lcioFile:
+      for recordName, data in lcioFile.iterRecords(readRecords=(EVENT_HEADER_RECORD,)):
+        if recordName == EVENT_RECORD:
+          numberOfEvents += 1
+        elif data is not None:
+          for name in set(name for name, _type in lcioFile.getEventHeader(data, recordName).collections):
+            collections[name] = collections.get(name, 0) + 1
+  except (IOError, LCIOFormatError) as err:
+    LOG.error('Failed to read the LCIO file:', str(err))
+    return S_ERROR('Failed to read %s: %s' % (fileName, err))
+  return S_OK(dict(Events=numberOfEvents, Collections=collections))
+
+
+def scanFiles(fileNames, maxProcesses=DEFAULT_PROCESSES):
+  """Scan the files with :func:`scanFile`, several files at the same time in worker processes.
+
+  :param list fileNames: paths of the LCIO files
+  :param int maxProcesses: maximum number of worker processes
+  :returns: S_OK with the ordered dictionary of the result of :func:`scanFile` for every file, S_ERROR if a file
+            cannot be read
+  """
+  nProcesses = min(maxProcesses, len(fileNames))
+  if nProcesses > 1:
+    pool = Pool(nProcesses)
+    try:
+      results = pool.map(scanFile, fileNames)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = [scanFile(fileName) for fileName in fileNames]
+  content = OrderedDict()
+  for fileName, res in zip(fileNames, results):
+    if not res['OK']:
+      return res
+    content[fileName] = res['Value']
+  return S_OK(content)
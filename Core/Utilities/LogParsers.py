@@ -0,0 +1,156 @@
+"""
+Parsers extracting the results of an application from its log while it runs.
+
+A parser is given to :func:`~ILCDIRAC.Workflow.Modules.ModuleBase.ModuleBase.addLogParser` before the application
+is started, every output line of the application is then passed to :func:`LogParser.parseLine` by the log sink, so
+the module does not have to read the log again once the application is done. The number of events processed so far,
+:func:`LogParser.getProgress`, is reported as a job parameter while the application runs.
+
+If the lines did not go through python, e.g. when the output is appended to the log by the shell, the module parses
+the log file with :func:`LogParser.parseLines` instead.
+
+:since: Oct 17, 2026
+"""
+
+from collections import OrderedDict
+
+__RCSID__ = "$Id$"
+
+
+class LogParser(object):
+  """Base class of the log parsers, the subclasses implement :func:`_parse`."""
+
+  def __init__(self):
+    self.linesParsed = 0
+
+  def parseLine(self, line):
+    """Extract the information from one line of the log."""
+    self.linesParsed += 1
+    self._parse(line.rstrip())
+
+  def parseLines(self, lines):
+    """Extract the information from all lines, e.g. of the log file."""
+    for line in lines:
+      self.parseLine(line)
+
+  def _parse(self, line):
+    """Extract the information from one line without the end of line characters."""
+    raise NotImplementedError('_parse must be implemented by the log parsers')
+
+  def getProgress(self):
+    """Return the number of events processed so far, None if the log does not tell."""
+    return None
+
+
+class StdHepSplitLogParser(LogParser):
+  """Number of events written in every output file of HepSplit."""
+
+  def __init__(self):
+    super(StdHepSplitLogParser, self).__init__()
+    self.numberOfEvents = {}
+    self._fileName = ''
+
+  def _parse(self, line):
+    if 'Open output file' in line:
+      self._fileName = line.split()[-1].rstrip().rstrip("\0")
+      self.numberOfEvents[self._fileName] = 0
+    elif 'Record' in line and 'Output Begin Run' not in line:
+      try:
+        value = int(line.partition('=')[2])
+      except ValueError:
+        ## other lines mentioning records
+        return
+      if value:
+        self.numberOfEvents[self._fileName] = value
+
+  def getProgress(self):
+    return sum(self.numberOfEvents.values())
+
+
+class LCIOSplitLogParser(LogParser):
+  """Output files of the LCIO split and the number of events they contain, in the order they were written.
+
+  The output files are printed with their full path, they are recognised by the name of the input file.
+  """
+
+  def __init__(self, baseInputFileName):
+    """
+    :param str baseInputFileName: name of the input file without the .slcio extension
+    """
+    super(LCIOSplitLogParser, self).__init__()
+    self.baseInputFileName = baseInputFileName
+    self.numberOfEvents = OrderedDict()
+    self._fileName = ''
+
+  def _parse(self, line):
+    if self.baseInputFileName in line:
+      self._fileName = line
+      self.numberOfEvents[self._fileName] = 0
+    elif 'events' in line and self._fileName:
+      try:
+        self.numberOfEvents[self._fileName] = int(line.split()[0])
+      except ValueError:
+        ## other lines mentioning events
+        pass
+
+  def getProgress(self):
+    return sum(self.numberOfEvents.values())
+
+
+class StdHepCutLogParser(LogParser):
+  """Event counts printed by the StdHepCut applications at the end of the run."""
+
+  #: text of the lines with the event counts, and the attribute they set
+  COUNTERS = (('Events kept', 'eventsWritten'), ('Events passing cuts', 'eventsPassing'),
+              ('Events total', 'eventsRead'))
+
+  def __init__(self):
+    super(StdHepCutLogParser, self).__init__()
+    self.eventsWritten = -1
+    self.eventsPassing = 0
+    self.eventsRead = 0
+
+  def _parse(self, line):
+    for text, attribute in self.COUNTERS:
+      if text in line:
+        try:
+          setattr(self, attribute, int(line.split()[-1]))
+        except ValueError:
+          ## other lines mentioning the events
+          pass
+
+  def getProgress(self):
+    return self.eventsRead or None
+
+
+class WhizardLogParser(LogParser):
+  """Luminosity of the generated sample and success of the Whizard 1 run.
+
+  The first fatal error found is kept in :attr:`errorMessage`, the lines after it are ignored: the generation
+  succeeded if it finished before any fatal error.
+  """
+
+  #: lines telling that the generation failed
+  ERRORS = ('*** Fatal error:', 'PYSTOP', 'No matrix element available', 'Floating point exception')
+
+  def __init__(self):
+    super(WhizardLogParser, self).__init__()
+    self.luminosity = ''
+    self.errorMessage = ''
+    self.finished = False
+
+  def _parse(self, line):
+    if self.errorMessage:
+      return
+    if '! Event sample corresponds to luminosity' in line:
+      self.luminosity = line.split()[-1]
+    for error in self.ERRORS:
+      if error in line:
+        self.errorMessage = line
+        return
+    if 'Event generation finished.' in line:
+      self.finished = True
+
+  def succeeded(self):
+    """Return True if the generation finished."""
+    return self.finished
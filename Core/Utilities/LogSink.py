@@ -0,0 +1,184 @@
+"""
+Destination of the output of the applications run by the workflow modules.
+
+The output lines of an application are written to its log file through one buffered file handle, kept open while
+the application runs. The event strings selecting the lines printed to the job output are compiled once into a single
+regular expression. The stderr lines are kept in a bounded ring buffer, so that the memory used does not grow with
+the verbosity of the application.
+
+The lines are also given to the :mod:`~ILCDIRAC.Core.Utilities.LogParsers` added to the sink, whether they are
+written to the log or not.
+
+In zero copy mode the output of the command is appended to the log file by ``tee`` in the shell, only the lines to be
+printed reach python.
+
+:since: Oct 17, 2026
+"""
+
+import os
+import pipes
+import re
+import sys
+import time
+
+from collections import deque
+
+from DIRAC import gLogger
+
+__RCSID__ = "$Id$"
+
+LOG = gLogger.getSubLogger('LogSink')
+
+#: size of the buffer of the log file
+BUFFER_SIZE = 1024 * 1024
+#: the log file is flushed at least that often, in seconds, so that it can be followed while the application runs
+FLUSH_INTERVAL = 10
+#: number of stderr lines kept
+MAX_ERROR_LINES = 1000
+#: number of bytes read at the end of the log to get the last lines in zero copy mode
+TAIL_BYTES = 64 * 1024
+
+
+class LogSink(object):
+  """Write the output lines of an application to its log file and to stdout."""
+
+  def __init__(self, logFile='', maxErrorLines=MAX_ERROR_LINES):
+    """
+    :param str logFile: path of the log file
+    :param int maxErrorLines: number of stderr lines kept
+    """
+    self.logFile = logFile
+    self.errorLines = deque(maxlen=maxErrorLines)
+    self.zeroCopy = False
+    self._handle = None
+    self._lastFlush = 0
+    self._filterKey = None
+    self._printAll = False
+    self._logAll = True
+    self._matcher = None
+    self.parsers = []
+
+  def addParser(self, parser):
+    """Give all lines written from now on to the parser, see :class:`~ILCDIRAC.Core.Utilities.LogParsers.LogParser`"""
+    self.parsers.append(parser)
+
+  def setLogFile(self, logFile):
+    """Write to logFile from now on."""
+    if logFile != self.logFile:
+      self.close()
+      self.logFile = logFile
+
+  def setFilter(self, eventStrings, excludeAllButEventString=False):
+    """Select the lines printed and written to the log.
+
+    * If eventStrings is None print everything.
+    * If it is an empty list, an empty string, or starts with an empty string print nothing
+    * If it is a string or a list of strings print only the lines containing one of them
+
+    With excludeAllButEventString only the printed lines are written to the log, otherwise all of them.
+    """
+    if isinstance(eventStrings, basestring):
+      eventStrings = [eventStrings]
+    key = (None if eventStrings is None else tuple(eventStrings), bool(excludeAllButEventString))
+    if key == self._filterKey:
+      return
+    self._filterKey = key
+    self._printAll = eventStrings is None
+    if eventStrings and eventStrings[0]:
+      self._matcher = re.compile('|'.join(re.escape(eventString) for eventString in eventStrings))
+    else:
+      self._matcher = None
+    self._logAll = not excludeAllButEventString
+
+  def write(self, fd, message):
+    """Handle one line of output, fd is 0 for stdout and 1 for stderr as in the shellCall callbacks."""
+    if not message:
+      return
+    if fd == 1:
+      self.errorLines.append(message)
+    for parser in self.parsers:
+      parser.parseLine(message)
+
+    selected = self._printAll or (self._matcher is not None and self._matcher.search(message) is not None)
+    if selected:
+      print message
+      sys.stdout.flush()
+
+    if self.zeroCopy:
+      return
+    if self._handle is None:
+      if not self.logFile:
+        LOG.error("Application Log file not defined")
+        return
+      ## the log is created even if no line is written to it, the modules look for it
+      self._handle = open(self.logFile, 'a', BUFFER_SIZE)
+      self._lastFlush = time.time()
+    if not (self._logAll or (selected and self._matcher is not None)):
+      return
+    self._handle.write(message + '\n')
+    now = time.time()
+    if now - self._lastFlush > FLUSH_INTERVAL:
+      self._handle.flush()
+      self._lastFlush = now
+
+  def close(self):
+    """Write the buffered lines and close the log file, the next line opens it again."""
+    if self._handle is not None:
+      self._handle.close()
+      self._handle = None
+    if self.zeroCopy:
+      self.zeroCopy = False
+      if not self.errorLines:
+        self.errorLines.extend(self.getTail())
+
+  def getTail(self):
+    """Return the last lines of the log file."""
+    try:
+      with open(self.logFile) as logFile:
+        logFile.seek(0, os.SEEK_END)
+        size = logFile.tell()
+        logFile.seek(max(0, size - TAIL_BYTES))
+        lines = logFile.read().splitlines()
+    except IOError:
+      return []
+    if size > TAIL_BYTES:
+      lines = lines[1:]
+    return lines[-self.errorLines.maxlen:]
+
+  def getErrors(self):
+    """Return the stderr lines kept."""
+    return '\n'.join(self.errorLines)
+
+  def setErrors(self, errors):
+    """Replace the stderr lines kept, e.g. by an empty string before running an application."""
+    self.errorLines.clear()
+    if errors:
+      self.errorLines.append(errors)
+
+  def getTeeCommand(self, command):
+    """Return the bash command running command with its output appended directly to the log file.
+
+    The stdout and stderr of the command go to the log file through ``tee`` and ``grep``, only the lines to print
+    come back to the caller. Until :func:`close` is called, :func:`write` does not write to the log file anymore.
+    """
+    self.close()
+    self.zeroCopy = True
+    logFile = pipes.quote(self.logFile or os.devnull)
+    if self._matcher is not None:
+      grep = 'grep --line-buffered -F %s' % ' '.join('-e %s' % pipes.quote(eventString)
+                                                       for eventString in self._filterKey[0])
+    else:
+      grep = None
+    if self._printAll and self._logAll:
+      pipeline = '{ %s ; } 2>&1 | tee -a %s' % (command, logFile)
+    elif self._printAll:
+      pipeline = '{ %s ; } 2>&1' % command
+    elif not self._logAll and grep:
+      pipeline = '{ %s ; } 2>&1 | %s | tee -a %s' % (command, grep, logFile)
+    elif not self._logAll:
+      pipeline = '{ %s ; } > /dev/null 2>&1' % command
+    elif grep:
+      pipeline = '{ %s ; } 2>&1 | tee -a %s | %s' % (command, logFile, grep)
+    else:
+      pipeline = '{ %s ; } >> %s 2>&1' % (command, logFile)
+    return 'bash -c %s' % pipes.quote('%s ; exit ${PIPESTATUS[0]}' % pipeline)
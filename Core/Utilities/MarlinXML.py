@@ -11,13 +11,15 @@ from ILCDIRAC.Core.Utilities.OverlayFiles import getOverlayFiles
 
 DEFAULT_OVERLAY_PROCESSORS = [ 'overlaytiming', 'bgoverlay' ]
 
-def setOverlayFilesParameter( tree, overlayParam=None ):
+def setOverlayFilesParameter( tree, overlayParam=None, overlayFiles=None ):
   """ set the parameters for overlay processors in MarlinSteering xml
 
   treat processors and groups of processors
 
   :param tree: XML tree of marlin steering file
   :param overlayParam: list of three tuples of backgroundType, eventsPerBackgroundFile, processorName
+  :param overlayFiles: function returning the list of overlay files for a backgroundType, default
+                       :func:`~ILCDIRAC.Core.Utilities.OverlayFiles.getOverlayFiles`
   """
 
   overlayActive = __checkOverlayActive( tree )
@@ -30,10 +32,12 @@ def setOverlayFilesParameter( tree, overlayParam=None ):
   for backgroundType, eventsPerBackgroundFile, processorName in overlayParam:
     processorsToCheck = [ processorName ] if processorName else DEFAULT_OVERLAY_PROCESSORS
     for processorType in processorsToCheck:
-      resOT = __checkOverlayProcessor( tree, eventsPerBackgroundFile, processorType.lower(), backgroundType  )
+      resOT = __checkOverlayProcessor( tree, eventsPerBackgroundFile, processorType.lower(), backgroundType,
+                                       overlayFiles=overlayFiles )
       if not resOT['OK']:
         return resOT
-      resGroupO = __checkOverlayGroup( tree, eventsPerBackgroundFile, processorType.lower(), backgroundType )
+      resGroupO = __checkOverlayGroup( tree, eventsPerBackgroundFile, processorType.lower(), backgroundType,
+                                       overlayFiles )
       if not resGroupO['OK']:
         return resGroupO
 
@@ -67,23 +71,25 @@ def __checkOverlayActive( tree ):
   return True
 
 
-def __checkOverlayGroup( tree, eventsPerBackgroundFile, processorType, bkgType ):
+def __checkOverlayGroup( tree, eventsPerBackgroundFile, processorType, bkgType, overlayFiles=None ):
   """ check if there is an OverlayProcessor, also handling overlay processors that get parameters from a group """
   groups = tree.findall('group')
   for group in groups:
     groupParameters = group.findall('parameter')
-    resG = __checkOverlayProcessor( group, eventsPerBackgroundFile, processorType, bkgType, groupParameters )
+    resG = __checkOverlayProcessor( group, eventsPerBackgroundFile, processorType, bkgType, groupParameters,
+                                    overlayFiles )
     if not resG['OK']:
       return resG
   return S_OK()
 
-def __checkOverlayProcessor( tree, eventsPerBackgroundFile, processorType, bkgType, groupParameters=None,  ):
+def __checkOverlayProcessor( tree, eventsPerBackgroundFile, processorType, bkgType, groupParameters=None,
+                             overlayFiles=None ):
   """ check the for the overlay processor *processorType* and set the appropriate parameter values """
 
   for processor in tree.findall('processor'):
     if processor.attrib.get('name', '').lower().count(processorType.lower()) or \
        processor.attrib.get('type', '').lower().count(processorType.lower()):
-      files = getOverlayFiles( bkgType )
+      files = ( overlayFiles or getOverlayFiles )( bkgType )
       if not files:
         return S_ERROR('Could not find any overlay files')
       if 'overlaytiming' in processor.attrib.get('type', '').lower():
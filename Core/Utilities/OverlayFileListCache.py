@@ -0,0 +1,128 @@
+"""
+Cache of the overlay file lists, shared between the jobs of a node or site.
+
+All jobs of a production ask the FileCatalog for the same list of background files, often hundreds of thousands
+of LFNs. The first job on a node stores the answer as a compressed snapshot in a cache directory, and the
+following jobs read the snapshot as long as it is younger than the TTL.
+
+A snapshot is a gzipped JSON file named after the ProdID and a hash of the metadata query. It contains the
+format version, the query, its creation time and the LFNs grouped by directory. Snapshots can also be placed in a
+read-only location, e.g. CVMFS, which is looked at before the writable cache directory.
+
+:since: Oct 17, 2026
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from DIRAC import S_OK, S_ERROR, gLogger
+
+__RCSID__ = "$Id$"
+
+LOG = gLogger.getSubLogger('OverlayFileListCache')
+
+#: version of the snapshot format, snapshots with another version are ignored
+CACHE_VERSION = 1
+#: default time in seconds after which a snapshot is refreshed from the catalog
+DEFAULT_TTL = 24 * 3600
+
+
+def getSnapshotName(meta, path=''):
+  """Return the file name of the snapshot for the metadata query.
+
+  :param dict meta: metadata query, the ProdID is part of the name
+  :param str path: path the query is restricted to
+  :returns: file name
+  """
+  query = json.dumps([meta, path], sort_keys=True)
+  return 'overlay_lfns_%s_%s.json.gz' % (meta.get('ProdID', 0), hashlib.md5(query).hexdigest())
+
+
+def readSnapshot(fileName, meta, path='', ttl=DEFAULT_TTL):
+  """Read the file list from a snapshot.
+
+  :param str fileName: path to the snapshot
+  :param dict meta: metadata query the snapshot has to belong to
+  :param str path: path the query is restricted to
+  :param int ttl: maximum age of the snapshot in seconds
+  :returns: S_OK with the list of LFNs, S_ERROR if the snapshot is missing, too old or invalid
+  """
+  try:
+    with gzip.open(fileName, 'rb') as snapshotFile:
+      snapshot = json.load(snapshotFile)
+  except (IOError, OSError, ValueError) as err:
+    return S_ERROR('Cannot read snapshot %s: %s' % (fileName, err))
+  if snapshot.get('Version') != CACHE_VERSION:
+    return S_ERROR('Snapshot %s has version %s' % (fileName, snapshot.get('Version')))
+  if snapshot.get('Query') != json.loads(json.dumps([meta, path])):
+    return S_ERROR('Snapshot %s belongs to another query' % fileName)
+  if time.time() - snapshot.get('Created', 0) > ttl:
+    return S_ERROR('Snapshot %s is too old' % fileName)
+  return S_OK([str(os.path.join(directory, name))
+               for directory, names in sorted(snapshot['Directories'].items()) for name in names])
+
+
+def writeSnapshot(fileName, meta, path, lfns):
+  """Write the file list to a snapshot, the file is replaced atomically so concurrent readers never see a
+  partial snapshot.
+
+  :param str fileName: path to the snapshot
+  :param dict meta: metadata query
+  :param str path: path the query is restricted to
+  :param list lfns: list of LFNs
+  """
+  directories = {}
+  for lfn in lfns:
+    directory, name = os.path.split(lfn)
+    directories.setdefault(directory, []).append(name)
+  snapshot = dict(Version=CACHE_VERSION, Query=[meta, path], Created=time.time(), Directories=directories)
+  cacheDir = os.path.dirname(fileName) or '.'
+  try:
+    if not os.path.isdir(cacheDir):
+      os.makedirs(cacheDir)
+    tmpHandle, tmpName = tempfile.mkstemp(dir=cacheDir, prefix='.tmp_overlay_lfns_')
+    os.close(tmpHandle)
+    with gzip.open(tmpName, 'wb') as snapshotFile:
+      json.dump(snapshot, snapshotFile, separators=(',', ':'))
+    os.chmod(tmpName, 0644)
+    os.rename(tmpName, fileName)
+  except (IOError, OSError) as err:
+    return S_ERROR('Cannot write snapshot %s: %s' % (fileName, err))
+  return S_OK(fileName)
+
+
+def findFilesByMetadataCached(fcc, meta, path='/', cacheDirs=None, ttl=DEFAULT_TTL):
+  """Return the result of fcc.findFilesByMetadata(meta, path), using the snapshots in the cache directories.
+
+  The directories are searched in order for a valid snapshot. If none is found, the catalog is queried and the
+  answer is written to the last directory.
+
+  :param fcc: FileCatalogClient
+  :param dict meta: metadata query
+  :param str path: path the query is restricted to
+  :param list cacheDirs: directories containing the snapshots, the last one must be writable
+  :param int ttl: maximum age of the snapshots in seconds, 0 disables the cache
+  :returns: S_OK with the list of LFNs
+  """
+  if not cacheDirs or ttl <= 0:
+    return fcc.findFilesByMetadata(meta, path)
+
+  snapshotName = getSnapshotName(meta, path)
+  for cacheDir in cacheDirs:
+    res = readSnapshot(os.path.join(cacheDir, snapshotName), meta, path, ttl)
+    if res['OK']:
+      LOG.info('Using cached overlay file list from %s' % cacheDir)
+      return res
+    LOG.verbose(res['Message'])
+
+  res = fcc.findFilesByMetadata(meta, path)
+  if not res['OK'] or not res['Value']:
+    return res
+  resWrite = writeSnapshot(os.path.join(cacheDirs[-1], snapshotName), meta, path, res['Value'])
+  if not resWrite['OK']:
+    LOG.warn('Failed to cache the overlay file list', resWrite['Message'])
+  return res
@@ -8,6 +8,7 @@ Provides a set of methods to prepare the option files needed by the ILC applicat
 import os
 
 
+from xml.sax.saxutils                                     import escape
 from xml.etree.ElementTree                                import ElementTree
 from xml.etree.ElementTree                                import Element
 from xml.etree.ElementTree                                import Comment
@@ -20,11 +21,15 @@ from ILCDIRAC.Core.Utilities.PrepareLibs                  import removeLibc
 from ILCDIRAC.Core.Utilities.OverlayFiles                 import getOverlayFiles
 from ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation import getSoftwareFolder
 from ILCDIRAC.Core.Utilities.MarlinXML                    import setOverlayFilesParameter, setOutputFileParameter
+from ILCDIRAC.Core.Utilities.SteeringTemplate             import slot, numberSlot, SteeringTemplate
 from ILCDIRAC.Workflow.Modules.OverlayInput               import allowedBkg
 
 
 __RCSID__ = "$Id$"
 
+#: characters escaped in attribute values by ElementTree, in addition to &, < and >
+ATTRIBUTE_ENTITIES = {'"': "&quot;", "\n": "&#10;"}
+
 def getNewLDLibs(platform, application, applicationVersion):
   """ Prepare the LD_LIBRARY_PATH environment variable: make sure all lib folder are included
 
@@ -293,6 +298,7 @@ def prepareXMLFile(finalxml, inputXML, inputGEAR, inputSLCIO,
                    numberofevts, outputFile, outputREC, outputDST, debug,
                    dd4hepGeoFile=None,
                    overlayParam=None,
+                   templateCache=None,
                   ):
   """Write out a xml file for Marlin
   
@@ -310,21 +316,59 @@ def prepareXMLFile(finalxml, inputXML, inputGEAR, inputSLCIO,
   :param bool debug: set to True to use given mode, otherwise set verbosity to SILENT
   :param str dd4hepGeoFile: path to the dd4hep Geometry XML file, optional, default None
   :param int overlayParam: list of tuples of background type, number of events in each background file, and processorName; optional, default None
+  :param templateCache: :class:`~ILCDIRAC.Core.Utilities.SteeringTemplate.SteeringTemplateCache`, if given the
+                        steering file is compiled once into a template that is filled for every job
   :return: S_OK
   """
+  # Handle inputSLCIO being list or string
+  if isinstance(inputSLCIO, list):
+    inputSLCIO = " ".join(inputSLCIO)
+  elif not isinstance(inputSLCIO, basestring):
+    return S_ERROR("inputSLCIO is neither string nor list! Actual type is %s " % type(inputSLCIO))
+
+  if templateCache is not None:
+    return _prepareXMLFileFromTemplate(templateCache, finalxml, inputXML, inputGEAR, inputSLCIO,
+                                       numberofevts, outputFile, outputREC, outputDST, debug,
+                                       dd4hepGeoFile, overlayParam)
+
+  res = _parseSteeringFile(inputXML)
+  if not res['OK']:
+    return res
+  tree = res['Value']
+
+  res = _patchSteeringTree(tree, inputGEAR, inputSLCIO, numberofevts, outputFile, outputREC, outputDST, debug,
+                           dd4hepGeoFile, overlayParam)
+  if not res['OK']:
+    return res
+
+  #now, we need to de-escape some characters as otherwise LCFI goes crazy because it does not unescape
+  root = tree.getroot()
+  root_str = fixedXML(tostring(root))
+  with open(finalxml,"w") as of:
+    of.write(root_str)
+  #tree.write(finalxml)
+  return S_OK(True)
+
+
+def _parseSteeringFile(inputXML):
+  """ Return S_OK with the ElementTree of the Marlin steering file """
   tree = ElementTree()
   try:
     tree.parse(inputXML)
   except Exception as x:
     gLogger.error( "Found Exception when parsing Marlin input XML", repr(x) )
     return S_ERROR("Found Exception when parsing Marlin input XML")
+  return S_OK(tree)
 
-  # Handle inputSLCIO being list or string
-  if isinstance(inputSLCIO, list):
-    inputSLCIO = " ".join(inputSLCIO)
-  elif not isinstance(inputSLCIO, basestring):
-    return S_ERROR("inputSLCIO is neither string nor list! Actual type is %s " % type(inputSLCIO))
 
+def _patchSteeringTree(tree, inputGEAR, inputSLCIO, numberofevts, outputFile, outputREC, outputDST, debug,
+                       dd4hepGeoFile, overlayParam, overlayFiles=None):
+  """ Set the parameters of the job in the tree of the Marlin steering file, see :func:`prepareXMLFile`
+
+  :param str inputSLCIO: space separated list of input files
+  :param overlayFiles: function returning the list of overlay files for a background type, see
+                       :func:`~ILCDIRAC.Core.Utilities.MarlinXML.setOverlayFilesParameter`
+  """
   glob = tree.find('global')
   lciolistfound = False
   for param in glob.findall("parameter"): #pylint: disable=E1101
@@ -364,7 +408,7 @@ def prepareXMLFile(finalxml, inputXML, inputGEAR, inputSLCIO,
   resOF = setOutputFileParameter( tree, outputFile, outputREC, outputDST )
   if not resOF['OK']:
     return resOF
-  resOver = setOverlayFilesParameter( tree, overlayParam )
+  resOver = setOverlayFilesParameter( tree, overlayParam, overlayFiles )
   if not resOver['OK']:
     return resOver
 
@@ -379,14 +423,79 @@ def prepareXMLFile(finalxml, inputXML, inputGEAR, inputSLCIO,
           com = Comment("DD4hepGeoFile changed")
           param.insert(0, com)
 
+  return S_OK()
 
 
-  #now, we need to de-escape some characters as otherwise LCFI goes crazy because it does not unescape
-  root = tree.getroot()
-  root_str = fixedXML(tostring(root))
-  with open(finalxml,"w") as of:
-    of.write(root_str)
-  #tree.write(finalxml)
+def _escapeSteeringValue(value, inAttribute):
+  """ Return the value as it is written to the steering file by :func:`prepareXMLFile` """
+  value = escape(value if isinstance(value, basestring) else str(value), ATTRIBUTE_ENTITIES if inAttribute else {})
+  if isinstance(value, unicode):
+    value = value.encode('ascii', 'xmlcharrefreplace')
+  return fixedXML(value)
+
+
+def _prepareXMLFileFromTemplate(templateCache, finalxml, inputXML, inputGEAR, inputSLCIO,
+                                numberofevts, outputFile, outputREC, outputDST, debug,
+                                dd4hepGeoFile, overlayParam):
+  """ Write the xml file for Marlin from the template of the steering file, see :func:`prepareXMLFile`
+
+  The template is compiled by patching the tree with placeholders for all values of the job, the values only
+  change where they are written, not which patches apply. The shape lists what decides which patches apply.
+  """
+  overlayParam = overlayParam or []
+  shape = [bool(inputSLCIO), numberofevts > 0, bool(debug), bool(outputFile), bool(outputREC), bool(outputDST),
+           dd4hepGeoFile is not None, [processorName or '' for _bkg, _events, processorName in overlayParam]]
+
+  def compileTemplate(fileName):
+    """ Patch the steering file with placeholders and split it at them """
+    res = _parseSteeringFile(fileName)
+    if not res['OK']:
+      return res
+    tree = res['Value']
+    usedOverlay = set()
+
+    def overlayFiles(index):
+      """ Placeholder for the overlay files of the index-th background """
+      usedOverlay.add(index)
+      return [slot('OverlayFiles%d' % index)]
+
+    ## overlayFiles gets the index instead of the background type, the numbers are replaced by placeholder numbers,
+    ## NSkipEventsRandom = 1 * number of events per file is then found in the xml
+    numberSlots = dict(MaxRecordNumber=numberSlot(0))
+    numberSlots.update(('NSkipEvents%d' % index, numberSlot(index + 1)) for index in xrange(len(overlayParam)))
+    templateOverlay = [(index, numberSlots['NSkipEvents%d' % index], processorName)
+                       for index, (_bkg, _events, processorName) in enumerate(overlayParam)]
+    res = _patchSteeringTree(tree, slot('GearXMLFile'), slot('LCIOInputFiles') if inputSLCIO else '',
+                             numberSlots['MaxRecordNumber'] if numberofevts > 0 else numberofevts,
+                             slot('OutputFile') if outputFile else '',
+                             slot('OutputREC') if outputREC else '', slot('OutputDST') if outputDST else '', debug,
+                             slot('DD4hepXMLFile') if dd4hepGeoFile is not None else None,
+                             templateOverlay, overlayFiles)
+    if not res['OK']:
+      return res
+    xmlString = fixedXML(tostring(tree.getroot()))
+    return S_OK(SteeringTemplate.fromXML(xmlString, numberSlots, sorted(usedOverlay)))
+
+  res = templateCache.getTemplate(inputXML, shape, compileTemplate)
+  if not res['OK']:
+    return res
+  template = res['Value']
+  if template is None:
+    return prepareXMLFile(finalxml, inputXML, inputGEAR, inputSLCIO, numberofevts, outputFile, outputREC, outputDST,
+                          debug, dd4hepGeoFile, overlayParam)
+
+  values = dict(GearXMLFile=inputGEAR, LCIOInputFiles=inputSLCIO, MaxRecordNumber=numberofevts,
+                OutputFile=outputFile, OutputREC=outputREC, OutputDST=outputDST, DD4hepXMLFile=dd4hepGeoFile)
+  for index in template.overlayIndices:
+    bkgType, eventsPerBackgroundFile, _processorName = overlayParam[index]
+    files = getOverlayFiles(bkgType)
+    if not files:
+      return S_ERROR('Could not find any overlay files')
+    values['OverlayFiles%d' % index] = '\n'.join(files)
+    values['NSkipEvents%d' % index] = "%d" % int(len(files) * eventsPerBackgroundFile)
+
+  with open(finalxml, "w") as of:
+    of.write(template.render(values, _escapeSteeringValue))
   return S_OK(True)
 
 
@@ -1,6 +1,9 @@
 '''
 Try some fancy splitting, DO NOT USE
 
+Use :func:`~ILCDIRAC.Core.Utilities.Splitting.packFilesByEvents` instead, e.g. via
+:func:`~ILCDIRAC.Interfaces.API.NewInterface.UserJob.UserJob.setSplitInputDataByEvents`
+
 Based on :func:`DIRAC.SplitByFiles` idea, but doing the splitting by number of events
 
 :since: Feb 10, 2010
@@ -9,7 +12,7 @@ Based on :func:`DIRAC.SplitByFiles` idea, but doing the splitting by number of e
 
 __RCSID__ = "$Id$"
 
-from ILCDIRAC.Core.Utilities.InputFilesUtilities import getNumberOfEvents
+from ILCDIRAC.Core.Utilities.InputFilesUtilities import getNumberOfEventsPerFile
 from DIRAC import S_OK, S_ERROR
 
 def SplitByFilesAndEvents(listoffiles, evtsperjob):
@@ -20,17 +23,19 @@ def SplitByFilesAndEvents(listoffiles, evtsperjob):
   :param int eventsperjob: desired number of events per job
   :returns: S_OK with a list of dictionaries
   """
-  mylist = [] 
+  mylist = []
   total_evts = 0
+  resInfo = getNumberOfEventsPerFile(listoffiles)
+  if not resInfo['OK']:
+    return S_ERROR("The files do not have attached number of events, cannot split")
   for files in listoffiles:
     myfdict = {}
-    resInfo =  getNumberOfEvents([files])
-    if not resInfo['OK'] or "nbevts" not in resInfo['Value']:
+    if files not in resInfo['Value']:
       return S_ERROR("The file %s does not have attached number of events, cannot split" % files)
     myfdict['file'] = files
-    myfdict['nbevts'] = resInfo['Value']['nbevts']
-    mylist.append(myfdict) 
-    total_evts += resInfo['Value']['nbevts']
+    myfdict['nbevts'] = resInfo['Value'][files]
+    mylist.append(myfdict)
+    total_evts += resInfo['Value'][files]
 
   #nb_jobs = total_evts/evtsperjob
   joblist = []
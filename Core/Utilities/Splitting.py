@@ -1,6 +1,9 @@
 ''' module for splitting utilities and everything related to it
 '''
 
+import heapq
+from math import ceil
+
 
 def addJobIndexToFilename( filename, jobIndex ):
   """ add the jobIndex number to the filename before the extension or replace %n with jobIndex
@@ -25,3 +28,62 @@ def addJobIndexToFilename( filename, jobIndex ):
 
   filename = "%s_%d" % ( filename, jobIndex )
   return filename
+
+
+def packFilesByEvents( eventsPerFile, eventsPerJob, splitLargeFiles=False ):
+  """ distribute input files over jobs so that all jobs process about the same number of events
+
+  Files with more than eventsPerJob events are split into event ranges of a single file each, if splitLargeFiles is
+  set, otherwise they form a job on their own. The other files are packed with the longest processing time
+  heuristic: sorted by decreasing number of events, each file goes to the job with the fewest events. The number
+  of jobs starts at the total number of events divided by eventsPerJob and is increased until no job has more
+  than eventsPerJob events.
+
+  For example, with eventsPerJob=100::
+
+    [('a', 60), ('b', 50), ('c', 40), ('d', 30)] --> a+d, b+c
+    [('a', 250), ('b', 50), ('c', 50), ('d', 50)] --> a, b+d, c
+    [('a', 250)], splitLargeFiles=True --> a[0:84], a[84:167], a[167:250]
+
+  :param list eventsPerFile: list of tuples (lfn, number of events)
+  :param int eventsPerJob: maximum number of events in a job
+  :param bool splitLargeFiles: split files with more than eventsPerJob events into event ranges
+  :returns: list of dictionaries with the keys InputData (list of LFNs), NumberOfEvents and StartFrom, the number
+            of events to skip in the input file
+  """
+  jobs = []
+  wholeFiles = []
+  for position, ( lfn, nbevts ) in enumerate( eventsPerFile ):
+    if splitLargeFiles and nbevts > eventsPerJob:
+      nChunks = int( ceil( float( nbevts ) / eventsPerJob ) )
+      startFrom = 0
+      for chunk in xrange( nChunks ):
+        chunkEvents = nbevts / nChunks + ( 1 if chunk < nbevts % nChunks else 0 )
+        jobs.append( ( position, dict( InputData=[lfn], NumberOfEvents=chunkEvents, StartFrom=startFrom ) ) )
+        startFrom += chunkEvents
+    elif nbevts > eventsPerJob:
+      jobs.append( ( position, dict( InputData=[lfn], NumberOfEvents=nbevts, StartFrom=0 ) ) )
+    else:
+      wholeFiles.append( ( nbevts, position, lfn ) )
+
+  if wholeFiles:
+    wholeFiles.sort( key=lambda item: ( -item[0], item[1] ) )
+    totalEvents = sum( nbevts for nbevts, _position, _lfn in wholeFiles )
+    nJobs = max( 1, int( ceil( float( totalEvents ) / eventsPerJob ) ) )
+    while True:
+      bins = [ ( 0, index, [] ) for index in xrange( nJobs ) ]
+      for nbevts, position, lfn in wholeFiles:
+        load, index, files = heapq.heappop( bins )
+        files.append( ( position, lfn ) )
+        heapq.heappush( bins, ( load + nbevts, index, files ) )
+      if max( load for load, _index, _files in bins ) <= eventsPerJob or nJobs >= len( wholeFiles ):
+        break
+      nJobs += 1
+    for load, _index, files in bins:
+      if files:
+        files.sort()
+        jobs.append( ( files[0][0], dict( InputData=[ lfn for _position, lfn in files ], NumberOfEvents=load,
+                                          StartFrom=0 ) ) )
+
+  jobs.sort( key=lambda job: ( job[0], job[1]['StartFrom'] ) )
+  return [ job for _position, job in jobs ]
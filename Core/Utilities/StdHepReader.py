@@ -0,0 +1,430 @@
+"""
+Reader and writer of StdHep files, to count, split and select events without the StdHep applications.
+
+The StdHep files are written with the XDR based mcfio library. All numbers are big endian, integers have 32 bits,
+strings and arrays are preceded by their length and padded to a multiple of 4 bytes.
+
+* The file header gives the version of the format, the number of records and the position of the first event table
+* Every event table lists the position of up to dimTable records and the position of the next table,
+  the last table points to -2
+* A record is an event header followed by its blocks. The event header gives the ids and the positions of the
+  blocks. The begin and end run records are records with only run blocks.
+
+The file is memory mapped and only the tables and the event headers are read, the blocks are copied as they are.
+The particles are decoded only for the records given to a selector by :func:`filterEvents`.
+
+:since: Oct 17, 2026
+"""
+
+import math
+import mmap
+import os
+import struct
+
+from collections import OrderedDict, namedtuple
+
+from DIRAC import S_OK, S_ERROR, gLogger
+
+__RCSID__ = "$Id$"
+
+LOG = gLogger.getSubLogger('StdHepReader')
+
+FILE_HEADER = 1
+EVENT_TABLE = 2
+EVENT_HEADER = 4
+#: nextLocator of the last event table
+END_OF_TABLES = -2
+#: block of the HEPEVT common block, the particles of the event
+HEPEVT_BLOCK = 101
+#: blocks of the begin and end run records and of the Les Houches run information
+RUN_BLOCKS = (106, 107, 204)
+
+#: particles of one event, momenta are (px, py, pz, E, m) tuples
+HepEvt = namedtuple('HepEvt', 'eventNumber status pdg mothers daughters momenta')
+
+
+class StdHepFormatError(Exception):
+  """Raised for files that cannot be read as StdHep files."""
+  pass
+
+
+class StdHepRecord(object):
+  """Position and content of one record of the file."""
+
+  def __init__(self, position, end, eventNumber, storeNumber, runNumber, trigMask):
+    self.position = position
+    self.end = end
+    self.eventNumber = eventNumber
+    self.storeNumber = storeNumber
+    self.runNumber = runNumber
+    self.trigMask = trigMask
+    self.blockIds = []
+    self.blockPositions = []
+    #: position of the array of the block positions, they are changed when the record is moved
+    self.blockPositionsOffset = 0
+
+  def isEvent(self):
+    """Return True for the events, False for the run records and the empty records."""
+    return any(blockId not in RUN_BLOCKS for blockId in self.blockIds)
+
+
+class StdHepFile(object):
+  """StdHep file opened for reading."""
+
+  def __init__(self, fileName):
+    """
+    :param str fileName: path of the file
+    :raises: StdHepFormatError, IOError
+    """
+    self.fileName = fileName
+    self._data = None
+    self._file = open(fileName, 'rb')
+    try:
+      self.size = os.fstat(self._file.fileno()).st_size
+      if self.size < 8:
+        raise StdHepFormatError('%s is not a StdHep file' % fileName)
+      self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+      self._readHeader()
+    except BaseException:
+      self.close()
+      raise
+
+  def close(self):
+    """Release the file."""
+    if self._data is not None:
+      self._data.close()
+    self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def _ints(self, offset, number):
+    """Return number integers read at offset."""
+    if offset < 0 or number < 0 or offset + 4 * number > self.size:
+      raise StdHepFormatError('%s is truncated or corrupted at %d' % (self.fileName, offset))
+    return struct.unpack_from('>%di' % number, self._data, offset)
+
+  def _intArray(self, offset):
+    """Return the array of integers at offset and the offset after it."""
+    length = self._ints(offset, 1)[0]
+    return list(self._ints(offset + 4, length)), offset + 4 + 4 * length
+
+  def _doubleArray(self, offset):
+    """Return the array of doubles at offset and the offset after it."""
+    length = self._ints(offset, 1)[0]
+    if length < 0 or offset + 4 + 8 * length > self.size:
+      raise StdHepFormatError('%s is truncated or corrupted at %d' % (self.fileName, offset))
+    return struct.unpack_from('>%dd' % length, self._data, offset + 4), offset + 4 + 8 * length
+
+  def _string(self, offset):
+    """Return the string at offset and the offset after it."""
+    length = self._ints(offset, 1)[0]
+    if length < 0 or offset + 4 + length > self.size:
+      raise StdHepFormatError('%s is truncated or corrupted at %d' % (self.fileName, offset))
+    return self._data[offset + 4:offset + 4 + length], offset + 4 + (length + 3) // 4 * 4
+
+  def _blockStart(self, offset, expectedId):
+    """Return the version of the block at offset and the offset of its content."""
+    blockId = self._ints(offset, 2)[0]
+    if blockId != expectedId:
+      raise StdHepFormatError('%s: expected block %d at %d, found %d' % (self.fileName, expectedId, offset, blockId))
+    return self._string(offset + 8)
+
+  def _readHeader(self):
+    """Read the file header and the format of the event tables."""
+    self.version, offset = self._blockStart(0, FILE_HEADER)
+    self.title, offset = self._string(offset)
+    self.comment, offset = self._string(offset)
+    self.date, offset = self._string(offset)
+    if self.version >= '2':
+      self.closingDate, offset = self._string(offset)
+    self.countsOffset = offset
+    self.expectedEvents, self.numberOfRecords, self.firstTableField, self.dimTable, _nBlocks = self._ints(offset, 5)
+    offset += 20
+    if self.version >= '2':
+      if self._ints(offset, 1)[0]:
+        raise StdHepFormatError('%s: files with ntuples are not supported' % self.fileName)
+      offset += 4
+    self.blockIds, offset = self._intArray(offset)
+    self.blockNames = []
+    for _blockId in self.blockIds:
+      name, offset = self._string(offset)
+      self.blockNames.append(name)
+    self.headerSize = offset
+    ## files written sequentially do not give the position of the first table, it follows the header
+    self.firstTable = self.firstTableField if self.firstTableField > 0 else self.headerSize
+    self.tableSize = self._ints(self.firstTable, 2)[1]
+    self.tableVersion = self._blockStart(self.firstTable, EVENT_TABLE)[0]
+
+  def getHeader(self):
+    """Return the file header, as it is in the file."""
+    return self._data[0:self.headerSize]
+
+  def iterRecords(self):
+    """Iterate over the records in the order of the event tables, the event headers are read one at a time."""
+    position = self.firstTable
+    visited = set()
+    while position != END_OF_TABLES:
+      if position in visited or position <= 0:
+        raise StdHepFormatError('%s: corrupted chain of event tables at %d' % (self.fileName, position))
+      visited.add(position)
+      offset = self._blockStart(position, EVENT_TABLE)[1]
+      nextTable, numberOfRecords = self._ints(offset, 2)
+      offset += 8
+      columns = []
+      for _column in xrange(5):
+        values, offset = self._intArray(offset)
+        columns.append(values[:numberOfRecords])
+      ## the records of a table are written one after the other, after the table and before the next one
+      positions = columns[4] + [nextTable if nextTable > position else self.size]
+      for index in xrange(numberOfRecords):
+        if not positions[index] < positions[index + 1] <= self.size:
+          raise StdHepFormatError('%s: corrupted event table at %d' % (self.fileName, position))
+        record = StdHepRecord(positions[index], positions[index + 1], columns[0][index], columns[1][index],
+                              columns[2][index], columns[3][index])
+        self._readEventHeader(record)
+        yield record
+      position = nextTable
+
+  def _readEventHeader(self, record):
+    """Get the ids and the positions of the blocks of the record."""
+    version, offset = self._blockStart(record.position, EVENT_HEADER)
+    nBlocks = self._ints(offset, 6)[4]
+    offset += 24
+    if version >= '2':
+      if self._ints(offset, 1)[0]:
+        raise StdHepFormatError('%s: events with ntuples are not supported' % self.fileName)
+      offset += 8
+    blockIds, offset = self._intArray(offset)
+    record.blockIds = blockIds[:nBlocks]
+    record.blockPositionsOffset = offset + 4
+    record.blockPositions = self._intArray(offset)[0][:nBlocks]
+
+  def getRecordData(self, record):
+    """Return the bytes of the record."""
+    return self._data[record.position:record.end]
+
+  def getHepEvt(self, record):
+    """Return the particles of an event.
+
+    :raises: StdHepFormatError if the event has no HEPEVT block
+    """
+    if HEPEVT_BLOCK not in record.blockIds:
+      raise StdHepFormatError('%s: event %d has no HEPEVT block' % (self.fileName, record.eventNumber))
+    offset = self._blockStart(record.blockPositions[record.blockIds.index(HEPEVT_BLOCK)], HEPEVT_BLOCK)[1]
+    eventNumber = self._ints(offset, 2)[0]
+    offset += 8
+    status, offset = self._intArray(offset)
+    pdg, offset = self._intArray(offset)
+    mothers, offset = self._intArray(offset)
+    daughters, offset = self._intArray(offset)
+    momenta = self._doubleArray(offset)[0]
+    return HepEvt(eventNumber, status, pdg, zip(mothers[0::2], mothers[1::2]), zip(daughters[0::2], daughters[1::2]),
+                  [momenta[index:index + 5] for index in xrange(0, len(momenta), 5)])
+
+
+class StdHepWriter(object):
+  """Write records of a StdHep file to a new file, with the header of the source file.
+
+  The table is written before its records and filled in when it is full, so only one record is kept in memory.
+  """
+
+  def __init__(self, fileName, source):
+    """
+    :param str fileName: path of the new file
+    :param source: :class:`StdHepFile` the records come from
+    """
+    self.fileName = fileName
+    self.source = source
+    self.numberOfRecords = 0
+    self.numberOfEvents = 0
+    self._table = None
+    self._entries = []
+    self._file = open(fileName, 'wb')
+    self._file.write(source.getHeader())
+
+  def writeRecord(self, record):
+    """Append the record to the file."""
+    if self._table is None or len(self._entries) == self.source.dimTable:
+      self._startTable()
+    position = self._file.tell()
+    data = bytearray(self.source.getRecordData(record))
+    for index, blockPosition in enumerate(record.blockPositions):
+      struct.pack_into('>i', data, record.blockPositionsOffset - record.position + 4 * index,
+                       blockPosition - record.position + position)
+    self._file.write(data)
+    self._entries.append((record.eventNumber, record.storeNumber, record.runNumber, record.trigMask, position))
+    self.numberOfRecords += 1
+    if record.isEvent():
+      self.numberOfEvents += 1
+
+  def _startTable(self):
+    """Reserve the space of a new table after the records written so far."""
+    position = self._file.tell()
+    if self._table is not None:
+      self._writeTable(position)
+    self._table = position
+    self._entries = []
+    self._file.write(self._packTable(END_OF_TABLES))
+
+  def _packTable(self, nextTable):
+    """Return the bytes of the current table."""
+    dimTable = self.source.dimTable
+    version = self.source.tableVersion
+    table = struct.pack('>iii', EVENT_TABLE, self.source.tableSize, len(version))
+    table += version + '\0' * (-len(version) % 4)
+    table += struct.pack('>ii', nextTable, len(self._entries))
+    for column in xrange(5):
+      values = [entry[column] for entry in self._entries]
+      table += struct.pack('>i%di' % dimTable, dimTable, *(values + [0] * (dimTable - len(values))))
+    return table
+
+  def _writeTable(self, nextTable):
+    """Write the entries of the current table, then go back to the end of the file."""
+    end = self._file.tell()
+    self._file.seek(self._table)
+    self._file.write(self._packTable(nextTable))
+    self._file.seek(end)
+
+  def close(self):
+    """Write the last table and the number of records in the header."""
+    if self._table is None:
+      self._startTable()
+    self._writeTable(END_OF_TABLES)
+    ## the first table follows the header
+    firstTable = self.source.headerSize if self.source.firstTableField > 0 else self.source.firstTableField
+    self._file.seek(self.source.countsOffset)
+    self._file.write(struct.pack('>iii', self.numberOfEvents, self.numberOfRecords, firstTable))
+    self._file.close()
+
+
+def countEvents(fileName):
+  """Count the events of a StdHep file, the run records are not counted.
+
+  :param str fileName: path of the file
+  :returns: S_OK with the number of events
+  """
+  try:
+    with StdHepFile(fileName) as stdhep:
+      return S_OK(sum(1 for record in stdhep.iterRecords() if record.isEvent()))
+  except (IOError, StdHepFormatError) as err:
+    return S_ERROR('Cannot count the events of %s: %s' % (fileName, err))
+
+
+def splitFile(fileName, outputPrefix, eventsPerFile, maxEvents=0):
+  """Split a StdHep file into files of eventsPerFile events, named outputPrefix_1.stdhep, outputPrefix_2.stdhep...
+
+  The run records before the first event are copied to every file, the ones after the last event go to the last file.
+
+  :param str fileName: path of the file to split
+  :param str outputPrefix: beginning of the path of the new files
+  :param int eventsPerFile: number of events per file
+  :param int maxEvents: number of events to split, all if 0
+  :returns: S_OK with the ordered dictionary of the new files and their number of events
+  """
+  if eventsPerFile <= 0:
+    return S_ERROR('The number of events per file must be positive, not %s' % eventsPerFile)
+  outputFiles = OrderedDict()
+  writer = None
+  try:
+    with StdHepFile(fileName) as stdhep:
+      runRecords = []
+      for record in stdhep.iterRecords():
+        if not record.isEvent():
+          if writer is None:
+            runRecords.append(record)
+          else:
+            writer.writeRecord(record)
+          continue
+        if maxEvents and sum(outputFiles.values()) >= maxEvents:
+          break
+        if writer is not None and writer.numberOfEvents == eventsPerFile:
+          writer.close()
+          writer = None
+        if writer is None:
+          outputFile = '%s_%d.stdhep' % (outputPrefix, len(outputFiles) + 1)
+          writer = StdHepWriter(outputFile, stdhep)
+          outputFiles[outputFile] = 0
+          for runRecord in runRecords:
+            writer.writeRecord(runRecord)
+        writer.writeRecord(record)
+        outputFiles[writer.fileName] += 1
+      if writer is not None:
+        writer.close()
+        writer = None
+  except (IOError, OSError, StdHepFormatError) as err:
+    for outputFile in outputFiles:
+      if os.path.exists(outputFile):
+        os.remove(outputFile)
+    return S_ERROR('Failed to split %s: %s' % (fileName, err))
+  LOG.info('Split %s into %d files' % (fileName, len(outputFiles)))
+  return S_OK(outputFiles)
+
+
+def filterEvents(fileName, outputFile, selector, maxEvents=0):
+  """Copy the events of fileName selected by selector and all run records to outputFile.
+
+  :param str fileName: path of the input file
+  :param str outputFile: path of the new file
+  :param selector: function taking a :data:`HepEvt` and returning True for the events to keep, e.g.
+                   a :class:`KinematicCut`
+  :param int maxEvents: stop once that many events are selected, all events are read if 0
+  :returns: S_OK with the dictionary of the number of events Read and Selected
+  """
+  read = 0
+  try:
+    with StdHepFile(fileName) as stdhep:
+      writer = StdHepWriter(outputFile, stdhep)
+      for record in stdhep.iterRecords():
+        if not record.isEvent():
+          writer.writeRecord(record)
+          continue
+        if maxEvents and writer.numberOfEvents >= maxEvents:
+          continue
+        read += 1
+        if selector(stdhep.getHepEvt(record)):
+          writer.writeRecord(record)
+      writer.close()
+  except (IOError, OSError, StdHepFormatError) as err:
+    if os.path.exists(outputFile):
+      os.remove(outputFile)
+    return S_ERROR('Failed to select the events of %s: %s' % (fileName, err))
+  return S_OK(dict(Read=read, Selected=writer.numberOfEvents))
+
+
+class KinematicCut(object):
+  """Select the events with at least minParticles final state particles passing all cuts."""
+
+  def __init__(self, pdgIds=None, minPt=0., minEnergy=0., maxAbsCosTheta=1., minParticles=1):
+    """
+    :param list pdgIds: absolute values of the PDG ids of the particles considered, all particles if None
+    :param float minPt: minimal transverse momentum in GeV
+    :param float minEnergy: minimal energy in GeV
+    :param float maxAbsCosTheta: maximal absolute value of the cosine of the polar angle
+    :param int minParticles: number of particles that must pass the cuts
+    """
+    self.pdgIds = set(abs(pdgId) for pdgId in pdgIds) if pdgIds else None
+    self.minPt = minPt
+    self.minEnergy = minEnergy
+    self.maxAbsCosTheta = maxAbsCosTheta
+    self.minParticles = minParticles
+
+  def __call__(self, event):
+    passing = 0
+    for status, pdgId, momentum in zip(event.status, event.pdg, event.momenta):
+      if status != 1 or (self.pdgIds and abs(pdgId) not in self.pdgIds):
+        continue
+      px, py, pz, energy = momentum[:4]
+      pt = math.hypot(px, py)
+      momentumNorm = math.hypot(pt, pz)
+      if pt < self.minPt or energy < self.minEnergy:
+        continue
+      if momentumNorm > 0 and abs(pz) / momentumNorm > self.maxAbsCosTheta:
+        continue
+      passing += 1
+      if passing >= self.minParticles:
+        return True
+    return False
@@ -0,0 +1,195 @@
+"""
+Compiled Marlin steering files, patched for every job by substitution instead of parsing and writing the XML.
+
+The steering file is parsed and patched once with placeholders instead of the values of the job, see
+:func:`~ILCDIRAC.Core.Utilities.PrepareOptionFiles.prepareXMLFile`. The resulting XML is split at the placeholders
+into a :class:`SteeringTemplate`, which knows where each value goes and whether it is the text of an element or the
+value of an attribute. Writing the steering file of a job is then a join of the literal parts and the escaped values.
+
+The patches applied depend on the job parameters, e.g. the MaxRecordNumber is only changed for a positive number of
+events, so a template belongs to the content of the steering file and to the *shape* of the job parameters, the
+list of the patches that apply. The :class:`SteeringTemplateCache` keeps the templates in memory for the following
+steps of the job, and as JSON files in cache directories, e.g. in the local area of the node or in the shared
+area, for the following jobs.
+
+:since: Oct 17, 2026
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from DIRAC import S_OK, S_ERROR, gLogger
+
+__RCSID__ = "$Id$"
+
+LOG = gLogger.getSubLogger('SteeringTemplate')
+
+#: version of the template format, cached templates with another version are ignored
+TEMPLATE_VERSION = 1
+#: placeholder of the value called name in the patched XML
+SLOT_FORMAT = '@@ILCDIRAC_SLOT_%s@@'
+SLOT_PATTERN = re.compile('@@ILCDIRAC_SLOT_(\\w+)@@')
+#: first of the numbers used as placeholders for the values computed from numbers, e.g. NSkipEventsRandom
+NUMBER_SLOT_BASE = 731956284500
+
+
+def slot(name):
+  """Return the placeholder of the value called name."""
+  return SLOT_FORMAT % name
+
+
+def numberSlot(index):
+  """Return the number used as placeholder of the computed number with the index."""
+  return NUMBER_SLOT_BASE + index
+
+
+def canCompile(content):
+  """Return True if the content of the steering file does not contain anything looking like a placeholder."""
+  return SLOT_PATTERN.search(content) is None and str(NUMBER_SLOT_BASE)[:-3] not in content
+
+
+class SteeringTemplate(object):
+  """Steering file split at the values of the job."""
+
+  def __init__(self, chunks, slots, overlayIndices=()):
+    """
+    :param list chunks: literal parts of the steering file, one more than slots
+    :param list slots: list of (name, inAttribute) of the values between the chunks
+    :param overlayIndices: indices of the overlayParam entries whose files are used
+    """
+    self.chunks = chunks
+    self.slots = slots
+    self.overlayIndices = list(overlayIndices)
+
+  @classmethod
+  def fromXML(cls, xmlString, numberSlots=None, overlayIndices=()):
+    """Create the template from the XML patched with placeholders.
+
+    :param str xmlString: the XML as it would be written for the job
+    :param dict numberSlots: placeholder numbers, see :func:`numberSlot`, keyed by the name of their value
+    :param overlayIndices: indices of the overlayParam entries whose files are used
+    """
+    for name, number in (numberSlots or {}).iteritems():
+      xmlString = xmlString.replace(str(number), slot(name))
+    parts = SLOT_PATTERN.split(xmlString)
+    chunks = parts[0::2]
+    ## the attribute values are between quotes, the texts between tags
+    slots = [(name, chunk.endswith('"')) for name, chunk in zip(parts[1::2], chunks)]
+    return cls(chunks, slots, overlayIndices)
+
+  def render(self, values, escape):
+    """Return the steering file with the values.
+
+    :param dict values: value of each slot
+    :param escape: function taking a value and True for attribute values, returning the value as it is written
+    :raises: KeyError if a value is missing
+    """
+    parts = [self.chunks[0]]
+    for (name, inAttribute), chunk in zip(self.slots, self.chunks[1:]):
+      parts.append(escape(values[name], inAttribute))
+      parts.append(chunk)
+    return ''.join(parts)
+
+  def toDict(self):
+    """Return the template as a dictionary that can be stored as JSON."""
+    return dict(Version=TEMPLATE_VERSION, Chunks=self.chunks, Slots=self.slots, Overlay=self.overlayIndices)
+
+  @classmethod
+  def fromDict(cls, templateDict):
+    """Create the template from the dictionary given by :func:`toDict`.
+
+    :raises: ValueError for a dictionary in another version
+    """
+    if templateDict.get('Version') != TEMPLATE_VERSION:
+      raise ValueError('template has version %s' % templateDict.get('Version'))
+    return cls([str(chunk) for chunk in templateDict['Chunks']],
+               [(str(name), inAttribute) for name, inAttribute in templateDict['Slots']],
+               templateDict['Overlay'])
+
+
+class SteeringTemplateCache(object):
+  """Templates of the steering files, in memory and in cache directories."""
+
+  #: templates compiled or read by this process, shared by the steps of the job
+  _templates = {}
+
+  def __init__(self, cacheDirs=None):
+    """
+    :param list cacheDirs: directories containing the templates, the last one must be writable to add new ones
+    """
+    self.cacheDirs = [cacheDir for cacheDir in cacheDirs or [] if cacheDir]
+
+  @staticmethod
+  def getTemplateName(content, shape):
+    """Return the name of the template of the steering file content for the shape of the job parameters."""
+    key = hashlib.md5(content)
+    key.update(json.dumps([TEMPLATE_VERSION, shape], sort_keys=True))
+    return 'marlin_steering_%s.json' % key.hexdigest()
+
+  def getTemplate(self, fileName, shape, compileFunction):
+    """Return the template of the steering file, compile it if it is not cached yet.
+
+    :param str fileName: path to the steering file
+    :param shape: the patches applied to the steering file, anything that can be written as JSON
+    :param compileFunction: function taking the path to the steering file and returning S_OK with the
+                            :class:`SteeringTemplate`
+    :returns: S_OK with the template, or None if the file cannot be made into a template; S_ERROR if the file
+              cannot be read or compiled
+    """
+    try:
+      with open(fileName) as steeringFile:
+        content = steeringFile.read()
+    except (IOError, OSError) as err:
+      return S_ERROR('Cannot read steering file %s: %s' % (fileName, err))
+    if not canCompile(content):
+      LOG.warn('Steering file contains text looking like template placeholders', fileName)
+      return S_OK(None)
+
+    templateName = self.getTemplateName(content, shape)
+    if templateName in self._templates:
+      return S_OK(self._templates[templateName])
+    for cacheDir in self.cacheDirs:
+      res = self._readTemplate(os.path.join(cacheDir, templateName))
+      if res['OK']:
+        LOG.verbose('Using steering template from %s' % cacheDir)
+        self._templates[templateName] = res['Value']
+        return res
+      LOG.debug(res['Message'])
+
+    res = compileFunction(fileName)
+    if not res['OK']:
+      return res
+    self._templates[templateName] = res['Value']
+    if self.cacheDirs:
+      resWrite = self._writeTemplate(os.path.join(self.cacheDirs[-1], templateName), res['Value'])
+      if not resWrite['OK']:
+        LOG.warn('Failed to cache the steering template', resWrite['Message'])
+    return res
+
+  @staticmethod
+  def _readTemplate(templateFile):
+    """Read a template written by :func:`_writeTemplate`."""
+    try:
+      with open(templateFile) as cacheFile:
+        return S_OK(SteeringTemplate.fromDict(json.load(cacheFile)))
+    except (IOError, OSError, ValueError, KeyError, TypeError) as err:
+      return S_ERROR('Cannot read steering template %s: %s' % (templateFile, err))
+
+  @staticmethod
+  def _writeTemplate(templateFile, template):
+    """Write the template, the file is replaced atomically so concurrent readers never see a partial template."""
+    cacheDir = os.path.dirname(templateFile) or '.'
+    try:
+      if not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+      tmpHandle, tmpName = tempfile.mkstemp(dir=cacheDir, prefix='.tmp_marlin_steering_')
+      with os.fdopen(tmpHandle, 'w') as cacheFile:
+        json.dump(template.toDict(), cacheFile, separators=(',', ':'))
+      os.chmod(tmpName, 0644)
+      os.rename(tmpName, templateFile)
+    except (IOError, OSError) as err:
+      return S_ERROR('Cannot write steering template %s: %s' % (templateFile, err))
+    return S_OK(templateFile)
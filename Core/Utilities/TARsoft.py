@@ -1,7 +1,12 @@
 '''
 Function to download and untar the applications, called from :mod:`~ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation`
 
-Also installs all dependencies for the applications
+Also installs all dependencies for the applications, the dependencies are downloaded and unpacked in parallel.
+
+The tar balls are kept in a store keyed by their md5 sum, in the .tarballs directory of the area or in the directory
+given by the ILCDIRAC_TARBALL_STORE environment variable, so each tar ball is only downloaded once. The installation
+of a folder is protected by a flock on its lock file, jobs waiting for another installation resume as soon as it
+is finished.
 
 :since:  Apr 7, 2010
 :author: Stephane Poss
@@ -11,62 +16,81 @@ __RCSID__ = "$Id$"
 from DIRAC import gLogger, S_OK, S_ERROR
 from ILCDIRAC.Core.Utilities.ResolveDependencies            import resolveDeps
 from ILCDIRAC.Core.Utilities.PrepareLibs                    import removeLibc, getLibsToIgnore
+from ILCDIRAC.Core.Utilities.FileDigest                     import getFileDigests
 from DIRAC.DataManagementSystem.Client.DataManager          import DataManager
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations    import Operations
-from ILCDIRAC.Core.Utilities.WasteCPU                       import wasteCPUCycles
-import os, urllib, tarfile, subprocess, shutil, time
+import os, urllib, tarfile, subprocess, shutil, time, tempfile, threading, errno, fcntl, json, random
+from multiprocessing.pool import ThreadPool
 from tarfile import TarError
 try:                      #FIXME: Deprecated import?
   import hashlib as md5
 except ImportError:
   import md5
 
-def createLock(lockname):
+#: name of the directory of the tar ball store in the software area
+TARBALL_STORE = '.tarballs'
+#: environment variable overriding the location of the tar ball store, e.g. to share it between areas
+TARBALL_STORE_ENV = 'ILCDIRAC_TARBALL_STORE'
+#: tar balls not used for this number of days are removed from the store
+TARBALL_MAX_AGE = 7
+#: size of the blocks read to compute md5 sums
+BLOCK_SIZE = 1024 * 1024
+#: maximum number of dependencies unpacked at the same time
+MAX_PARALLEL_INSTALLS = 4
+#: name of the file recording the files of an installation whose md5 sum was verified
+VERIFIED_STAMP = '.md5_verified.json'
+#: number of files hashed at the same time when checking an installation
+MAX_VERIFY_THREADS = 4
+
+## folders installed by this process, so that packages with the overwrite flag are installed only once per job
+_INSTALLED_HERE = set()
+_INSTALLED_LOCK = threading.Lock()
+
+def acquireLock(lockname):
   """ Need to lock the area to prevent 2 jobs to write in the same area
-  """
-  try:
-    with open(lockname,"w") as lock:
-      lock.write("Locking this directory\n")
-  except IOError as e:
-    gLogger.error("Failed creating lock")
-    return S_ERROR("Not allowed to write here: IOError %s" % (str(e)))
-  return S_OK()
 
-def checkLockAge(lockname):
-  """ Check if there is a lock, and in that case deal with it, potentially remove it after n minutes
+  The lock is an exclusive flock on the lock file: jobs waiting for it are woken up as soon as it is released, and
+  the lock disappears with the process holding it, so locks left by crashed jobs never have to be expired.
+
+  :returns: S_OK with the open lock file, to be given to :func:`releaseLock`
   """
-  overwrite = False
-  count = 0
   while True:
-    if not os.path.exists(lockname):
-      break
-    count += 1
-    gLogger.warn("Will wait one minute before proceeding")
-    res = wasteCPUCycles(60)
-    if not res['OK']:
-      continue
-    last_touch = time.time()
     try:
-      stat = os.stat(lockname)
-      last_touch = stat.st_atime
-    except OSError as x:
-      gLogger.warn("File not available: %s %s, assume removed" % (OSError, str(x))) 
-      break
-    loc_time = time.time()
-    if loc_time-last_touch > 30*60: ##this is where I say the file is too old to still be valid (30 minutes)
-      gLogger.info("File is %s seconds old" % str(loc_time-last_touch))
-      overwrite = True
-      res = clearLock(lockname)
-      if res['OK']:
-        break
-    if count > 60: #We have been waiting for 60 minutes, something is wrong, kill it
-      gLogger.error("Seems file stat is wrong, assume buggy, will fail installation")
-      #overwrite = True
-      res = clearLock(lockname)
-      return S_ERROR("Buggy lock, removed: %s" % res['OK'])
-      
-  return S_OK(overwrite)
-  
+      lockFile = open(lockname, "a")
+    except IOError as e:
+      gLogger.error("Failed creating lock")
+      return S_ERROR("Not allowed to write here: IOError %s" % (str(e)))
+    try:
+      try:
+        fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except IOError as e:
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+          raise
+        gLogger.notice("Waiting for the installation of another job:", lockname)
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+      ## the previous holder removes the lock file before releasing it, then we hold a lock nobody else sees
+      try:
+        currentStat = os.stat(lockname)
+      except OSError:
+        currentStat = None
+      if currentStat is not None and os.path.samestat(os.fstat(lockFile.fileno()), currentStat):
+        return S_OK(lockFile)
+    except IOError as e:
+      lockFile.close()
+      return S_ERROR("Failed to lock %s: %s" % (lockname, str(e)))
+    lockFile.close()
+
+def releaseLock(lockname, lockFile):
+  """ Remove the lock file and release the lock obtained with :func:`acquireLock`
+  """
+  ## removed while still locked, jobs already waiting for it notice it and lock a new file
+  res = clearLock(lockname)
+  try:
+    fcntl.flock(lockFile, fcntl.LOCK_UN)
+  finally:
+    lockFile.close()
+  return res
+
 def clearLock(lockname):
   """ And we need to clear the lock once the operation is done
   """
@@ -96,8 +120,8 @@ def deleteOld(folder_name):
     gLogger.error("Oh Oh, something was not right, the directory %s is still here" % folder_name) 
   return S_OK()
 
-def downloadFile(tarballURL, app_tar, folder_name):
-  """ Get the file locally.
+def downloadFile(tarballURL, app_tar, folder_name, destinationDir=''):
+  """ Get the file locally, into destinationDir or the current directory.
   """
   #need to make sure the url ends with /, other wise concatenation below returns bad url
   if tarballURL[-1] != "/":
@@ -109,33 +133,142 @@ def downloadFile(tarballURL, app_tar, folder_name):
       gLogger.debug("Downloading software", '%s' % (folder_name))
       #Copy the file locally, don't try to read from remote, soooo slow
       #Use string conversion %s%s to set the address, makes the system more stable
-      urllib.urlretrieve("%s%s" % (tarballURL, app_tar), app_tar_base)
+      urllib.urlretrieve("%s%s" % (tarballURL, app_tar), os.path.join(destinationDir, app_tar_base))
     except IOError as err:
       gLogger.exception(str(err))
       return S_ERROR('Exception during url retrieve: %s' % str(err))
   else:
     datMan = DataManager()
-    resget = datMan.getFile("%s%s" % (tarballURL, app_tar))
+    if destinationDir:
+      resget = datMan.getFile("%s%s" % (tarballURL, app_tar), destinationDir=destinationDir)
+    else:
+      resget = datMan.getFile("%s%s" % (tarballURL, app_tar))
     if not resget['OK']:
       gLogger.error("File could not be downloaded from the grid")
       return resget
   return S_OK()
 
+def md5File(fileName):
+  """ Return the md5 sum of a file, read block by block
+
+  :raises IOError: if the file cannot be read
+  """
+  fileMd5 = md5.md5()
+  with open(fileName) as myFile:
+    while True:
+      block = myFile.read(BLOCK_SIZE)
+      if not block:
+        break
+      fileMd5.update(block)
+  return fileMd5.hexdigest()
+
 def tarMd5Check(app_tar_base, md5sum ):
-  """ Check the tar ball md5 sum 
+  """ Check the tar ball md5 sum
+
+  :returns: S_OK with the md5 sum of the tar ball, empty if it could not be computed
   """
   ##Tar ball is obtained, need to check its md5 sum
   tar_ball_md5 = ''
   try:
-    with open(app_tar_base) as myFile:
-      tar_ball_md5 = md5.md5(myFile.read()).hexdigest()
+    tar_ball_md5 = md5File(app_tar_base)
   except IOError:
     gLogger.warn("Failed to get tar ball md5, try without")
     md5sum = ''
   if md5sum and md5sum != tar_ball_md5:
     gLogger.error('Hash does not correspond, found %s, expected %s, cannot continue' % (tar_ball_md5, md5sum))
     return S_ERROR("Hash does not correspond")
-  return S_OK()
+  return S_OK(tar_ball_md5)
+
+def getTarBallStore(area):
+  """ Return the directory of the tar ball store used for installations in area
+  """
+  return os.environ.get(TARBALL_STORE_ENV) or os.path.join(area, TARBALL_STORE)
+
+def getTarBall(tarballURL, app_tar, md5sum, store):
+  """ Return the path of the tar ball in the store, download it if it is not there yet
+
+  The tar balls are stored under their md5 sum: a tar ball is downloaded once per store, whatever job or
+  application needs it, and only tar balls with the right checksum enter the store. If the md5 sum of the
+  download cannot be computed, the tar ball is used without check, under a name that is not a checksum.
+
+  :returns: S_OK with the path of the tar ball, S_ERROR
+  """
+  if md5sum:
+    storedTarBall = os.path.join(store, md5sum)
+    if os.path.exists(storedTarBall):
+      gLogger.info("Found %s in the tar ball store" % app_tar)
+      try:
+        os.utime(storedTarBall, None)
+      except OSError as e:
+        gLogger.verbose("Cannot mark %s as used:" % storedTarBall, str(e))
+      return S_OK(storedTarBall)
+
+  try:
+    if not os.path.isdir(store):
+      os.makedirs(store)
+    tmpDir = tempfile.mkdtemp(prefix='.tmp', dir=store)
+  except OSError as e:
+    return S_ERROR("Cannot use the tar ball store %s: %s" % (store, str(e)))
+  try:
+    downloadedTarBall = os.path.join(tmpDir, os.path.basename(app_tar))
+    for attempt in range(2):
+      if attempt:
+        gLogger.error("Will try getting the file again, who knows")
+      res = downloadFile(tarballURL, app_tar, app_tar, tmpDir)
+      if not res['OK']:
+        return res
+      ## Check that the tar ball is there. Should never happen as download file catches the errors
+      if not os.path.exists(downloadedTarBall):
+        gLogger.error('Failed to download software', '%s' % (app_tar))
+        return S_ERROR('Failed to download software')
+      res = tarMd5Check(downloadedTarBall, md5sum)
+      if res['OK']:
+        break
+      try:#Remove tar ball that we just got
+        os.unlink(downloadedTarBall)
+      except OSError:
+        gLogger.error("Failed to clean tar ball, something bad is happening")
+    else:
+      gLogger.error("Hash failed again, something is really wrong, cannot continue.")
+      return S_ERROR("MD5 check failed")
+    if res['Value']:
+      storedTarBall = os.path.join(store, res['Value'])
+    else:
+      ## never found by its checksum, removed from the store once unused
+      storedTarBall = os.path.join(store, "unchecked_%s" % os.path.basename(app_tar))
+    os.rename(downloadedTarBall, storedTarBall)
+  except OSError as e:
+    return S_ERROR("Failed to store %s: %s" % (app_tar, str(e)))
+  finally:
+    shutil.rmtree(tmpDir, ignore_errors=True)
+  cleanTarBallStore(store)
+  return S_OK(storedTarBall)
+
+def cleanTarBallStore(store, maxAge=TARBALL_MAX_AGE):
+  """ Remove the tar balls not used for maxAge days and the leftovers of failed downloads from the store
+  """
+  limit = time.time() - maxAge * 24 * 3600
+  try:
+    names = os.listdir(store)
+  except OSError as e:
+    gLogger.warn("Cannot list the tar ball store %s:" % store, str(e))
+    return S_OK(0)
+  removed = 0
+  for name in names:
+    path = os.path.join(store, name)
+    try:
+      if os.path.getmtime(path) > limit:
+        continue
+      if os.path.isdir(path):
+        shutil.rmtree(path)
+      else:
+        os.unlink(path)
+      removed += 1
+    except OSError as e:
+      gLogger.verbose("Cannot remove %s from the tar ball store:" % path, str(e))
+  if removed:
+    gLogger.info("Removed %d old tar balls from the store %s" % (removed, store))
+  return S_OK(removed)
 
 def installDependencies(app, config, areas):
   """install dependencies for application"""
@@ -143,14 +276,45 @@ def installDependencies(app, config, areas):
   appVersion = app[1]
 
   deps = resolveDeps(config, appName, appVersion)
-  for dep in deps:
-    depapp = [ dep["app"], dep["version"] ]
+  depapps = [ [ dep["app"], dep["version"] ] for dep in deps ]
+  ## download and unpack all of them at the same time, the environment is then set up in order
+  unpackPackages(depapps, config, areas)
+  for depapp in depapps:
     resDep = installInAnyArea(areas, depapp, config)
     if not resDep['OK']:
       return S_ERROR("Failed to install dependency: %s" % str(depapp))
 
   return S_OK()
 
+def unpackPackages(apps, config, areas, maxThreads=MAX_PARALLEL_INSTALLS):
+  """ Download and unpack the applications in parallel, without configuring them
+
+  :func:`install` only uses absolute paths, so it can run in several threads. Failures are only logged, they
+  show up again when the applications are installed one by one with :func:`installInAnyArea`.
+  """
+  if maxThreads <= 1 or len(apps) <= 1:
+    return S_OK()
+  pool = ThreadPool(min(maxThreads, len(apps)))
+  try:
+    pool.map(lambda app: unpackInAnyArea(areas, app, config), apps)
+  finally:
+    pool.close()
+    pool.join()
+  return S_OK()
+
+def unpackInAnyArea(areas, app, jobConfig):
+  """try to download and unpack app in any area of areas"""
+  for area in areas:
+    res = getTarBallLocation(app, jobConfig, area)
+    if not res['OK']:
+      return res
+    app_tar, tarballURL, overwrite, md5sum = res['Value']
+    res = install(app, app_tar, tarballURL, overwrite, md5sum, area)
+    if res['OK']:
+      return res
+    gLogger.verbose("Failed to unpack %s_%s in %s:" % (app[0], app[1], area), res['Message'])
+  return S_ERROR("Failed to unpack software")
+
 def installInAnyArea(areas, app, jobConfig):
   """try to install app in any area of areas"""
   for area in areas:
@@ -197,6 +361,10 @@ def getTarBallLocation(app, config, dummy_area):
 
 def install(app, app_tar, tarballURL, overwrite, md5sum, area):
   """ Install the software
+
+  The tar ball comes from the tar ball store, see :func:`getTarBall`, and is unpacked in a temporary directory,
+  the software only appears in the area once it is complete. Only absolute paths are used, so that several
+  applications can be installed at the same time.
   """
   appName    = app[0]
   appVersion = app[1]
@@ -204,179 +372,221 @@ def install(app, app_tar, tarballURL, overwrite, md5sum, area):
   #jar file does not contain .tgz nor tar.gz so the file name is untouched and folder_name = app_tar
   if appName == "slic":
     folder_name = "%s%s" % (appName, appVersion)
-  
-  appli_exists = False
-  app_tar_base = os.path.basename(app_tar)
 
-  ###########################################
-  ###Go where the software is to be installed
-  os.chdir(area)
-  #We go back to the initial place at any return
-  ###########################################
-  ##Handle the locking
-  lockname = folder_name+".lock"
-  #Make sure the lock is not too old, or wait until it's gone
-  res = checkLockAge(lockname)
-  if not res['OK']:
-    gLogger.error("Something uncool happened with the lock, will kill installation")
-    gLogger.error("Message: %s" % res['Message'])
-    return S_ERROR("Failed lock checks")
+  app_tar_base = os.path.basename(app_tar)
+  folder = os.path.join(area, folder_name)
+  lockname = folder + ".lock"
 
-  if 'Value' in res and res['Value']: #this means the lock file was very old, meaning that the installation failed elsewhere
-    overwrite = True
+  ## Already installed and nobody is installing it: nothing to wait for
+  if not overwrite and os.path.exists(folder) and not os.path.exists(lockname):
+    gLogger.info("Folder or file %s found in %s, skipping install !" % (folder_name, area))
+    return S_OK([folder_name, app_tar_base])
 
-  #Check if the application is here and not to be overwritten
-  if os.path.exists(folder_name):
-    appli_exists = True
-    if not overwrite:
-      gLogger.info("Folder or file %s found in %s, skipping install !" % (folder_name, area))
-      return S_OK([folder_name, app_tar_base])
-  
-  ## If we are here, it means the application was never installed OR its overwrite flag is true
-    
-  #Now lock the area
-  res = createLock(lockname)##This will fail if not allowed to write here
+  ## Lock the installation of this folder, or wait until the job installing it is done
+  res = acquireLock(lockname)##This will fail if not allowed to write here
   if not res['OK']:
     gLogger.error(res['Message'])
     return res
-  
-  ## Cleanup old version in case it has to be overwritten (implies it's already here)
-  ## In particular the jar file of LCSIM
-  if appli_exists and overwrite:
+  lockFile = res['Value']
+  try:
+    res = installLocked(folder_name, app_tar, tarballURL, overwrite, md5sum, area)
+  finally:
+    releaseLock(lockname, lockFile)
+  if not res['OK']:
+    return res
+  return S_OK([folder_name, app_tar_base])
+
+def installLocked(folder_name, app_tar, tarballURL, overwrite, md5sum, area):
+  """ Install the software while holding the lock of its folder
+  """
+  folder = os.path.join(area, folder_name)
+  with _INSTALLED_LOCK:
+    installedHere = folder in _INSTALLED_HERE
+  #Check if the application is here and not to be overwritten
+  if os.path.exists(folder):
+    if not overwrite or installedHere:
+      gLogger.info("Folder or file %s found in %s, skipping install !" % (folder_name, area))
+      return S_OK()
+    ## Cleanup old version as it has to be overwritten, in particular the jar file of LCSIM
     gLogger.info("Overwriting %s found in %s" % (folder_name, area))
-    res = deleteOld(folder_name) 
+    res = deleteOld(folder)
     if not res['OK']:#should be always OK for the time being
-      clearLock(lockname)
       return res
-    ## Now application must have been removed
-  
-  ## If here, the application DOES NOT exist locally: either it was here and the overwrite flag was false and 
-  ## we returned earlier, either it was here and the overwrite flag was true and it was removed, or finally it
-  ## was never here so here appli_exists=False always
 
-  ## Now we can get the files and unpack them
-    
-  ## Downloading file from url
-  res = downloadFile(tarballURL, app_tar, folder_name)
+  ## leftovers of jobs that died while unpacking, nobody else can be using them while we hold the lock
+  tmpPrefix = '.%s.tmp' % os.path.basename(folder_name)
+  try:
+    for name in os.listdir(area):
+      if name.startswith(tmpPrefix):
+        gLogger.info("Removing unfinished installation %s" % name)
+        shutil.rmtree(os.path.join(area, name), ignore_errors=True)
+  except OSError as e:
+    return S_ERROR("Cannot list %s: %s" % (area, str(e)))
+
+  res = getTarBall(tarballURL, app_tar, md5sum, getTarBallStore(area))
   if not res['OK']:
-    clearLock(lockname)
     return res
-  
-  ## Check that the tar ball is there. Should never happen as download file catches the errors
-  if not os.path.exists("%s/%s" % (os.getcwd(), app_tar_base)):
-    gLogger.error('Failed to download software','%s' % (folder_name))
-    clearLock(lockname)
-    return S_ERROR('Failed to download software')
-
-  # FIXME: this is really bad style, suggestion: create 2 private methods that (download a file and check its md5)
-  # and (delete the old files and cleanup), then call the download_and_check method once and create a loop
-  # with a MAX_TRIES variable that cleans up the old files and tries to download again until MAX_TRIES are used up.
-  # The loop is only entered if download/md5check fail and if anything goes wrong in the loop, `continue` is called
-  # Could also think about creating a clearLockAndExit method that takes a string (lockname) and return value res
-  # and just calls clearLock(lockname) return res. Then replace these double calls in this method with return clearLockAndExit
-
-  ## Check that the downloaded file (or existing one) has the right checksum
-  res = tarMd5Check(app_tar_base, md5sum)
+  res = unpack(res['Value'], folder_name, area)
   if not res['OK']:
-    gLogger.error("Will try getting the file again, who knows")
-    try:#Remove tar ball that we just got
-      os.unlink("%s/%s" % (os.getcwd(), app_tar_base))
-    except OSError:
-      gLogger.error("Failed to clean tar ball, something bad is happening")
-    ## Clean up existing stuff (if any, in particular the jar file)
-    res = deleteOld(folder_name)
-    if not res['OK']:#should be always OK for the time being
-      clearLock(lockname)
-      return res
-    res = downloadFile(tarballURL, app_tar, folder_name)
-    if not res['OK']:
-      clearLock(lockname)
-      return res
-    res = tarMd5Check(app_tar_base, md5sum)
-    if not res['OK']:
-      gLogger.error("Hash failed again, something is really wrong, cannot continue.")
-      clearLock(lockname)
-      return S_ERROR("MD5 check failed")
-  
+    return res
+  with _INSTALLED_LOCK:
+    _INSTALLED_HERE.add(folder)
+  return S_OK()
 
-  if tarfile.is_tarfile(app_tar_base):##needed because LCSIM is jar file
-    app_tar_to_untar = tarfile.open(app_tar_base)
-    try:
-      app_tar_to_untar.extractall()
-    except TarError as e:
-      gLogger.error("Could not extract tar ball %s because of %s, cannot continue !" % (app_tar_base, str(e)))
-      clearLock(lockname)
-      return S_ERROR("Could not extract tar ball %s because of %s, cannot continue !"%(app_tar_base, str(e)))
-    if folder_name.count("slic"):
-      slicname = folder_name
-      members = app_tar_to_untar.getmembers()
-      fileexample = members[0].name
-      basefolder = fileexample.split("/")[0]
-      try:
-        os.rename(basefolder, slicname)
-      except OSError as e:
-        gLogger.error("Failed renaming slic:", str(e))
-        clearLock(lockname)
-        return S_ERROR("Could not rename slic directory")
+def unpack(tarBall, folder_name, area):
+  """ Unpack the tar ball in a temporary directory of the area, then move its content into the area
+  """
+  try:
+    tmpDir = tempfile.mkdtemp(prefix='.%s.tmp' % os.path.basename(folder_name), dir=area)
+  except OSError as e:
+    return S_ERROR("Not allowed to write here: OSError %s" % str(e))
   try:
-    dircontent = os.listdir(folder_name)
-    if not len(dircontent):
-      clearLock(lockname)
+    if tarfile.is_tarfile(tarBall):
+      app_tar_to_untar = tarfile.open(tarBall)
+      try:
+        app_tar_to_untar.extractall(tmpDir)
+      except TarError as e:
+        gLogger.error("Could not extract tar ball %s because of %s, cannot continue !" % (folder_name, str(e)))
+        return S_ERROR("Could not extract tar ball %s because of %s, cannot continue !" % (folder_name, str(e)))
+      if folder_name.count("slic"):
+        members = app_tar_to_untar.getmembers()
+        basefolder = members[0].name.split("/")[0]
+        try:
+          os.rename(os.path.join(tmpDir, basefolder), os.path.join(tmpDir, folder_name))
+        except OSError as e:
+          gLogger.error("Failed renaming slic:", str(e))
+          return S_ERROR("Could not rename slic directory")
+    else:
+      ##needed because LCSIM is jar file
+      shutil.copy(tarBall, os.path.join(tmpDir, folder_name))
+
+    unpackedFolder = os.path.join(tmpDir, folder_name)
+    if os.path.isdir(unpackedFolder) and not os.listdir(unpackedFolder):
       return S_ERROR("Folder %s is empty, considering install as failed" % folder_name)
-  except OSError:
-    pass
-  
-  #Everything went fine, we try to clear the lock  
-  clearLock(lockname)
-    
-  return S_OK([folder_name, app_tar_base]) 
+    ## the folder of the application comes last, it only appears when everything else is in place
+    names = sorted(os.listdir(tmpDir), key=lambda name: name == folder_name.split('/')[0])
+    for name in names:
+      moveInto(os.path.join(tmpDir, name), os.path.join(area, name))
+  except (IOError, OSError) as e:
+    gLogger.error("Failed to unpack %s:" % folder_name, str(e))
+    return S_ERROR("Failed to unpack %s: %s" % (folder_name, str(e)))
+  finally:
+    shutil.rmtree(tmpDir, ignore_errors=True)
+  return S_OK()
 
-def check(app, area, res_from_install):
+def moveInto(source, destination):
+  """ Move source to destination, merging the content of directories already present
+  """
+  if os.path.isdir(source) and not os.path.islink(source) and \
+     os.path.isdir(destination) and not os.path.islink(destination):
+    for name in os.listdir(source):
+      moveInto(os.path.join(source, name), os.path.join(destination, name))
+    return
+  if os.path.isdir(destination) and not os.path.islink(destination):
+    shutil.rmtree(destination)
+  os.rename(source, destination)
+
+def check(app, area, res_from_install, sampleSize=None):
   """ Now that the tar ball is here, we need to check that all is there
+
+  The md5 sums are computed block by block, several files at the same time. The files verified once, by this job or
+  by another one using the same area, are recorded with their size and modification time in a stamp file and are
+  not hashed again. With a sampleSize, only that many randomly chosen files are hashed, the others are only checked
+  for presence. The default sampleSize comes from the Operations option Software/VerifySampleSize, 0 means all.
   """
-  ###########################################
-  ###Go where the software is to be installed
-  os.chdir(area)
-  #We go back to the initial place either at the end of the installation or at any error
-  ###########################################
-  
   basefolder = res_from_install[0]
-  if os.path.isfile(basefolder):
+  folder = os.path.join(area, basefolder)
+  if os.path.isfile(folder):
     #This is the case of LCSIM that's a jar file
     return S_OK([basefolder])
-  
-  if os.path.exists(os.path.join(basefolder,'md5_checksum.md5')):
-    with open(os.path.join(basefolder,'md5_checksum.md5'), 'r') as md5file:
-      for line in md5file:
-        line = line.rstrip()
-        md5sum, fin = line.split()
-        if fin=='-' or fin.count("md5_checksum.md5"):
-          continue
-        found_lib_to_ignore = False
-        for lib in getLibsToIgnore():
-          if fin.count(lib):
-            found_lib_to_ignore = True
-        if found_lib_to_ignore:
-          continue
-        fin = os.path.join(basefolder, fin.replace("./",""))
-        if not os.path.exists(fin):
-          gLogger.error("File missing :", fin)
-          return S_ERROR("Incomplete install: The file %s is missing" % fin)
-        fmd5 = ''
-        try:
-          fmd5 = md5.md5(open(fin).read()).hexdigest()
-        except IOError:
-          gLogger.error("Failed to compute md5 sum")
-          return S_ERROR("Failed to compute md5 sum")
-        if md5sum != fmd5:
-          gLogger.error("File has wrong checksum :", fin)
-          gLogger.error("Found %s, expected %s" % ( fmd5, md5sum ))
-          return S_ERROR("Corrupted install: File %s has a wrong sum" % fin)
-  else:
+
+  checksumFile = os.path.join(folder, 'md5_checksum.md5')
+  if not os.path.exists(checksumFile):
     gLogger.warn("The application does not come with md5 checksum file:", app)
-  
+    return S_OK([basefolder])
+
+  if sampleSize is None:
+    sampleSize = Operations().getValue('Software/VerifySampleSize', 0)
+  libsToIgnore = getLibsToIgnore()
+  md5sums = []
+  with open(checksumFile, 'r') as md5file:
+    for line in md5file:
+      line = line.rstrip()
+      md5sum, fin = line.split()
+      if fin=='-' or fin.count("md5_checksum.md5"):
+        continue
+      if any(fin.count(lib) for lib in libsToIgnore):
+        continue
+      md5sums.append((fin.replace("./",""), md5sum))
+
+  stamps = readVerifiedStamps(folder, checksumFile)
+  fileStats = {}
+  toVerify = []
+  for fin, md5sum in md5sums:
+    try:
+      fileStat = os.stat(os.path.join(folder, fin))
+    except OSError:
+      gLogger.error("File missing :", os.path.join(folder, fin))
+      return S_ERROR("Incomplete install: The file %s is missing" % os.path.join(folder, fin))
+    fileStats[fin] = [fileStat.st_size, fileStat.st_mtime]
+    if stamps.get(fin) != fileStats[fin]:
+      toVerify.append((fin, md5sum))
+  if sampleSize and len(toVerify) > sampleSize:
+    toVerify = random.sample(toVerify, sampleSize)
+  if not toVerify:
+    return S_OK([basefolder])
+
+  gLogger.info("Verifying the md5 sums of %d out of %d files of %s" % (len(toVerify), len(md5sums), basefolder))
+  res = getFileDigests([os.path.join(folder, fin) for fin, _md5sum in toVerify], withMD5=True,
+                       maxThreads=MAX_VERIFY_THREADS)
+  if not res['OK']:
+    gLogger.error("Failed to compute md5 sum", res['Message'])
+    return S_ERROR("Failed to compute md5 sum")
+  for fin, md5sum in toVerify:
+    fmd5 = res['Value'][os.path.join(folder, fin)]['MD5']
+    if md5sum != fmd5:
+      gLogger.error("File has wrong checksum :", os.path.join(folder, fin))
+      gLogger.error("Found %s, expected %s" % ( fmd5, md5sum ))
+      return S_ERROR("Corrupted install: File %s has a wrong sum" % os.path.join(folder, fin))
+    stamps[fin] = fileStats[fin]
+  writeVerifiedStamps(folder, checksumFile, stamps)
   return S_OK([basefolder])
 
+def readVerifiedStamps(folder, checksumFile):
+  """ Return the dictionary file: [size, mtime] of the files of the installation whose md5 sum was verified
+
+  The stamps are only valid for the checksum file they were made with.
+  """
+  stampFile = os.path.join(folder, VERIFIED_STAMP)
+  try:
+    checksumStat = os.stat(checksumFile)
+    with open(stampFile) as stamp:
+      stamps = json.load(stamp)
+  except (IOError, OSError, ValueError):
+    return {}
+  if not isinstance(stamps, dict) or stamps.get('ChecksumFile') != [checksumStat.st_size, checksumStat.st_mtime]:
+    return {}
+  return stamps.get('Files', {})
+
+def writeVerifiedStamps(folder, checksumFile, stamps):
+  """ Record the verified files of the installation, if the area is writable
+  """
+  stampFile = os.path.join(folder, VERIFIED_STAMP)
+  try:
+    checksumStat = os.stat(checksumFile)
+    ## other jobs may have verified other files in the mean time
+    allStamps = readVerifiedStamps(folder, checksumFile)
+    allStamps.update(stamps)
+    fd, tmpName = tempfile.mkstemp(prefix=VERIFIED_STAMP, dir=folder)
+    os.chmod(tmpName, 0644)
+    with os.fdopen(fd, 'w') as stamp:
+      json.dump({'ChecksumFile': [checksumStat.st_size, checksumStat.st_mtime], 'Files': allStamps}, stamp)
+    os.rename(tmpName, stampFile)
+  except (IOError, OSError) as e:
+    gLogger.verbose("Cannot record the verified files of %s:" % folder, str(e))
+    return S_ERROR("Cannot record the verified files: %s" % str(e))
+  return S_OK()
+
 def configure(app, area, res_from_check):
   """ Configure our applications: set the proper env variables
   """
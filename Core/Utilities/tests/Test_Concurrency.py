@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""Test the Concurrency module"""
+
+import threading
+import time
+import unittest
+
+from mock import patch
+
+from ILCDIRAC.Core.Utilities.Concurrency import mapConcurrently, starmapConcurrently
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.Core.Utilities.Concurrency'
+
+def slowSquare( item ):
+  """ the first items take the longest """
+  time.sleep( 0.01 * ( 5 - item ) )
+  return item * item, threading.current_thread().name
+
+class TestConcurrency( unittest.TestCase ):
+  """ Test the calls with a pool of threads """
+
+  def test_map_order( self ):
+    results = mapConcurrently( slowSquare, xrange( 5 ), 3 )
+    assertEqualsImproved( [ square for square, _thread in results ], [ 0, 1, 4, 9, 16 ], self )
+    self.assertNotIn( threading.current_thread().name, [ thread for _square, thread in results ] )
+
+  def test_map_serial( self ):
+    with patch( '%s.ThreadPool' % MODULE_NAME ) as pool_mock:
+      for items, maxThreads in ( ( range( 5 ), 1 ), ( range( 5 ), '0' ), ( [ 3 ], 8 ), ( [], 8 ) ):
+        results = mapConcurrently( slowSquare, items, maxThreads )
+        assertEqualsImproved( [ square for square, _thread in results ], [ item * item for item in items ], self )
+        assertEqualsImproved( set( thread for _square, thread in results ) - set( [ threading.current_thread().name ] ),
+                              set(), self )
+      self.assertFalse( pool_mock.called )
+
+  def test_starmap( self ):
+    assertEqualsImproved( starmapConcurrently( lambda base, exponent: base ** exponent,
+                                               [ ( 2, 3 ), ( 3, 2 ), ( 5, 0 ) ], '4' ), [ 8, 9, 1 ], self )
+
+  def test_exception( self ):
+    def failing( item ):
+      """ fails for one item """
+      if item == 2:
+        raise ValueError( 'bad item' )
+      return item
+    self.assertRaises( ValueError, mapConcurrently, failing, range( 4 ), 2 )
+    self.assertRaises( ValueError, mapConcurrently, failing, range( 4 ), 1 )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestConcurrency )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
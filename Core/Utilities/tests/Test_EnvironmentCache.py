@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""Test the EnvironmentCache module"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from mock import patch, MagicMock as Mock
+
+from ILCDIRAC.Core.Utilities.EnvironmentCache import EnvironmentCache, EnvironmentSnapshot, captureEnvironment
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved, assertDiracFailsWith, \
+  assertDiracSucceeds
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.Core.Utilities.EnvironmentCache'
+ENV_SCRIPT = """
+echo "setting up the software"
+export MYSOFT_DIR="/cvmfs/my soft"
+export PATH=/cvmfs/bin:$PATH:/cvmfs/tools
+export MARLIN_DLL=/cvmfs/libA.so:$MARLIN_DLL
+unset TO_REMOVE
+myfunction() { echo "not kept"; }
+export -f myfunction
+"""
+
+#pylint: disable=protected-access
+class TestEnvironmentCache( unittest.TestCase ):
+  """ Test the snapshots of the environment scripts
+  """
+
+  def setUp( self ):
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    self.cacheDir = os.path.join( self.tmpdir, 'cache' )
+    self.envScript = os.path.join( self.tmpdir, 'env.sh' )
+    with open( self.envScript, 'w' ) as script:
+      script.write( ENV_SCRIPT )
+    self.environment = dict( PATH = '/usr/bin:/bin', TO_REMOVE = 'x', MARLIN_DLL = '' )
+    self.memoryPatch = patch.dict( EnvironmentCache._snapshots, clear = True )
+    self.memoryPatch.start()
+
+  def tearDown( self ):
+    self.memoryPatch.stop()
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
+
+  def test_capture( self ):
+    res = captureEnvironment( self.envScript, self.environment )
+    assertDiracSucceeds( res, self )
+    snapshot = res['Value']
+    assertEqualsImproved( snapshot.setVariables, dict( MYSOFT_DIR = '/cvmfs/my soft',
+                                                       MARLIN_DLL = '/cvmfs/libA.so:' ), self )
+    assertEqualsImproved( snapshot.extendedVariables, dict( PATH = [ '/cvmfs/bin:', ':/cvmfs/tools' ] ), self )
+    assertEqualsImproved( snapshot.unsetVariables, [ 'TO_REMOVE' ], self )
+    environment = snapshot.apply( dict( PATH = '/other/bin', TO_REMOVE = 'y', OTHER = 'z' ) )
+    assertEqualsImproved( environment, dict( PATH = '/cvmfs/bin:/other/bin:/cvmfs/tools', OTHER = 'z',
+                                             MYSOFT_DIR = '/cvmfs/my soft', MARLIN_DLL = '/cvmfs/libA.so:' ), self )
+
+  def test_script( self ):
+    snapshot = captureEnvironment( self.envScript, self.environment )['Value']
+    restoreScript = os.path.join( self.tmpdir, 'restore.sh' )
+    with open( restoreScript, 'w' ) as script:
+      script.write( '\n'.join( snapshot.getScript() ) )
+    ## the restore script gives the same environment as the environment script
+    environment = dict( self.environment, PATH = '/usr/local/bin:/usr/bin:/bin' )
+    for sourced in ( self.envScript, restoreScript ):
+      output = subprocess.Popen( [ 'bash', '-c', 'source "$1" > /dev/null; echo "$PATH|$MYSOFT_DIR|${TO_REMOVE-unset}"',
+                                   'bash', sourced ], env = environment, stdin = open( os.devnull ),
+                                 stdout = subprocess.PIPE ).communicate()[0]
+      assertEqualsImproved( output, '/cvmfs/bin:/usr/local/bin:/usr/bin:/bin:/cvmfs/tools|/cvmfs/my soft|unset\n',
+                            self )
+
+  def test_capture_fails( self ):
+    ## the script exits the shell before the environment is printed
+    with open( self.envScript, 'a' ) as script:
+      script.write( 'exit 0\n' )
+    assertDiracFailsWith( captureEnvironment( self.envScript, self.environment ), 'failed to source', self )
+    with open( self.envScript, 'w' ) as script:
+      script.write( 'exit 3\n' )
+    assertDiracFailsWith( captureEnvironment( self.envScript, self.environment ), 'status 3', self )
+    with patch( '%s.subprocess.Popen' % MODULE_NAME, new = Mock( side_effect = OSError( 'no bash' ) ) ):
+      assertDiracFailsWith( captureEnvironment( self.envScript ), 'no bash', self )
+
+  def test_cache( self ):
+    with patch( '%s.captureEnvironment' % MODULE_NAME,
+                new = Mock( side_effect = lambda script: captureEnvironment( script, self.environment ) ) ) as capture:
+      first = EnvironmentCache( [ self.cacheDir ] ).getSnapshot( self.envScript )
+      second = EnvironmentCache( [ self.cacheDir ] ).getSnapshot( self.envScript )
+      self.assertIs( first['Value'], second['Value'] )
+      ## the following jobs read the snapshot from the cache directory
+      EnvironmentCache._snapshots.clear()
+      third = EnvironmentCache( [ self.cacheDir ] ).getSnapshot( self.envScript )
+      assertEqualsImproved( third['Value'].toDict(), first['Value'].toDict(), self )
+      assertEqualsImproved( capture.call_count, 1, self )
+      ## a changed script is sourced again
+      with open( self.envScript, 'a' ) as script:
+        script.write( 'export NEW_VARIABLE=1\n' )
+      res = EnvironmentCache( [ self.cacheDir ] ).getSnapshot( self.envScript )
+      assertEqualsImproved( res['Value'].setVariables['NEW_VARIABLE'], '1', self )
+      assertEqualsImproved( capture.call_count, 2, self )
+    assertEqualsImproved( len( os.listdir( self.cacheDir ) ), 2, self )
+    assertDiracFailsWith( EnvironmentCache().getSnapshot( os.path.join( self.tmpdir, 'missing.sh' ) ),
+                          'cannot read environment script', self )
+
+  def test_cache_files( self ):
+    snapshot = EnvironmentSnapshot( dict( A = '\xc3\xa9' ), dict( PATH = [ '/a:', '' ] ), [ 'B' ], self.envScript )
+    snapshotName = EnvironmentCache.getSnapshotName( self.envScript, ENV_SCRIPT )
+    os.makedirs( self.cacheDir )
+    with open( os.path.join( self.cacheDir, snapshotName ), 'w' ) as brokenFile:
+      brokenFile.write( '{"Version": 1' )
+    readOnlyDir = os.path.join( self.tmpdir, 'readonly' )
+    with patch( '%s.captureEnvironment' % MODULE_NAME, new = Mock( return_value = { 'OK' : True, 'Value' : snapshot } ) ):
+      res = EnvironmentCache( [ readOnlyDir, self.cacheDir ] ).getSnapshot( self.envScript )
+    self.assertIs( res['Value'], snapshot )
+    ## the broken snapshot is replaced, the snapshot is taken from the read only location once it is there
+    shutil.copytree( self.cacheDir, readOnlyDir )
+    EnvironmentCache._snapshots.clear()
+    res = EnvironmentCache( [ readOnlyDir ] ).getSnapshot( self.envScript )
+    assertEqualsImproved( res['Value'].apply( {} ), dict( A = '\xc3\xa9', PATH = '/a:' ), self )
+    self.assertRaises( ValueError, EnvironmentSnapshot.fromDict, dict( Version = 0 ) )
+    with patch( '%s.os.rename' % MODULE_NAME, new = Mock( side_effect = OSError( 'no space' ) ) ):
+      assertDiracFailsWith( EnvironmentCache._writeSnapshot( os.path.join( self.cacheDir, 'new.json' ), snapshot ),
+                            'no space', self )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestEnvironmentCache )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Test the FileDigest module"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from mock import patch, MagicMock as Mock
+
+from DIRAC.Core.Utilities.Adler import fileAdler
+from DIRAC.Core.Utilities.File import makeGuid
+
+from ILCDIRAC.Core.Utilities import FileDigest
+from ILCDIRAC.Core.Utilities.FileDigest import getFileDigest, getFileDigests, clearDigestCache
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved, assertDiracFailsWith, \
+  assertDiracSucceeds
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.Core.Utilities.FileDigest'
+
+class TestFileDigest( unittest.TestCase ):
+  """ Test the single pass digest engine
+  """
+
+  def setUp( self ):
+    clearDigestCache()
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    self.files = []
+    for index, size in enumerate( [ 0, 1000, 3 * 1024 * 1024 + 17 ] ):
+      fileName = os.path.join( self.tmpdir, 'file%s.slcio' % index )
+      with open( fileName, 'wb' ) as outFile:
+        outFile.write( os.urandom( size ) )
+      self.files.append( fileName )
+
+  def tearDown( self ):
+    clearDigestCache()
+    shutil.rmtree( self.tmpdir )
+
+  def test_digest_matches_dirac( self ):
+    for fileName in self.files:
+      result = getFileDigest( fileName, withMD5 = True )
+      assertDiracSucceeds( result, self )
+      with open( fileName, 'rb' ) as inFile:
+        content = inFile.read()
+      assertEqualsImproved( result['Value']['Size'], len( content ), self )
+      assertEqualsImproved( result['Value']['Adler32'], fileAdler( fileName ), self )
+      assertEqualsImproved( result['Value']['GUID'], makeGuid( fileName ), self )
+      assertEqualsImproved( result['Value']['MD5'], hashlib.md5( content ).hexdigest(), self )
+
+  def test_guid_small_blocks( self ):
+    with patch('%s.BLOCK_SIZE' % MODULE_NAME, 1000), \
+         patch('%s.GUID_BYTES' % MODULE_NAME, 2500):
+      result = getFileDigest( self.files[2] )
+    assertDiracSucceeds( result, self )
+    with open( self.files[2], 'rb' ) as inFile:
+      content = inFile.read()
+    assertEqualsImproved( result['Value']['Adler32'], '%08x' % ( zlib.adler32( content ) & 0xffffffff ), self )
+    expectedGuid = FileDigest.generateGuid( hashlib.md5( content[:2500] ).hexdigest().upper(), 'MD5' )
+    assertEqualsImproved( result['Value']['GUID'], expectedGuid, self )
+
+  def test_digest_cached( self ):
+    assertDiracSucceeds( getFileDigest( self.files[1] ), self )
+    with patch('%s._computeDigest' % MODULE_NAME, new=Mock(side_effect=IOError('should not be called'))):
+      assertDiracSucceeds( getFileDigest( self.files[1] ), self )
+      # the MD5 was not computed the first time, so the file has to be read again
+      assertDiracFailsWith( getFileDigest( self.files[1], withMD5 = True ), 'should not be called', self )
+
+  def test_digest_missing_file( self ):
+    assertDiracFailsWith( getFileDigest( os.path.join( self.tmpdir, 'missing' ) ), 'cannot access file', self )
+
+  def test_digests_parallel( self ):
+    result = getFileDigests( self.files, maxThreads = 3 )
+    assertDiracSucceeds( result, self )
+    assertEqualsImproved( sorted( result['Value'].keys() ), sorted( self.files ), self )
+    for fileName in self.files:
+      assertEqualsImproved( result['Value'][fileName]['Adler32'], fileAdler( fileName ), self )
+
+  def test_digests_failure( self ):
+    result = getFileDigests( self.files + [ os.path.join( self.tmpdir, 'missing' ) ] )
+    assertDiracFailsWith( result, 'missing', self )
+
+  def test_digests_empty( self ):
+    assertEqualsImproved( getFileDigests( [] )['Value'], {}, self )
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Test the InputDataCache module"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import patch
+
+from DIRAC import S_OK, S_ERROR
+
+from ILCDIRAC.Core.Utilities.InputDataCache import InputDataCache
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved, assertDiracFailsWith, \
+  assertDiracSucceedsWith_equals
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.Core.Utilities.InputDataCache'
+
+class TestInputDataCache( unittest.TestCase ):
+  """ Test the node-local cache of input files
+  """
+
+  def setUp( self ):
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    self.cacheDir = os.path.join( self.tmpdir, 'cache' )
+    self.cache = InputDataCache( self.cacheDir, maxSize = 100 )
+    self.downloads = []
+
+  def tearDown( self ):
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
+
+  def download( self, lfn, size = 10 ):
+    """ return a download function writing size bytes """
+    def downloadFunction( directory ):
+      self.downloads.append( lfn )
+      time.sleep( 0.01 )
+      with open( os.path.join( directory, os.path.basename( lfn ) ), 'w' ) as out:
+        out.write( 'x' * size )
+      return S_OK()
+    return downloadFunction
+
+  def destination( self, name ):
+    """ return a new path in a job directory """
+    jobDir = tempfile.mkdtemp( dir = self.tmpdir )
+    return os.path.join( jobDir, name )
+
+  def test_hit_and_miss( self ):
+    lfn = '/ilc/prod/geometry.tgz'
+    first, second = self.destination( 'geometry.tgz' ), self.destination( 'geometry.tgz' )
+    assertDiracSucceedsWith_equals( self.cache.getFile( lfn, 'abc', first, self.download( lfn ) ), False, self )
+    assertDiracSucceedsWith_equals( self.cache.getFile( lfn, 'abc', second, self.download( lfn ) ), True, self )
+    assertEqualsImproved( self.downloads, [ lfn ], self )
+    self.assertTrue( os.path.samefile( first, second ) )
+    ## a new version of the file is downloaded again
+    assertDiracSucceedsWith_equals( self.cache.getFile( lfn, 'def', self.destination( 'geometry.tgz' ),
+                                                        self.download( lfn ) ), False, self )
+    assertEqualsImproved( self.cache.getStatistics(), 'hits 1/3 (33%), 0.0 MB from cache', self )
+
+  def test_concurrent_single_download( self ):
+    lfn = '/ilc/prod/background.slcio'
+    results = []
+    def getFile():
+      results.append( self.cache.getFile( lfn, 'abc', self.destination( 'bg.slcio' ), self.download( lfn ) ) )
+    threads = [ threading.Thread( target = getFile ) for _ in xrange( 5 ) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    assertEqualsImproved( self.downloads, [ lfn ], self )
+    assertEqualsImproved( sorted( res['Value'] for res in results ), [ False ] + [ True ] * 4, self )
+
+  def test_download_fails( self ):
+    destination = self.destination( 'file' )
+    assertDiracFailsWith( self.cache.getFile( '/ilc/file', 'abc', destination,
+                                              lambda directory: S_ERROR( 'SE down' ) ), 'SE down', self )
+    self.assertFalse( os.path.exists( destination ) )
+    assertEqualsImproved( self.cache.getEntries(), [], self )
+    assertEqualsImproved( [ name for name in os.listdir( self.cacheDir ) if not name.endswith( '.lock' ) ], [], self )
+
+  def test_copy_when_link_fails( self ):
+    destination = self.destination( 'file' )
+    with patch( '%s.os.link' % MODULE_NAME, side_effect = OSError( 18, 'Invalid cross-device link' ) ):
+      self.cache.getFile( '/ilc/file', 'abc', destination, self.download( '/ilc/file' ) )
+    with open( destination ) as inFile:
+      assertEqualsImproved( inFile.read(), 'x' * 10, self )
+    self.assertFalse( os.path.samefile( destination, self.cache.getEntries()[0][2] ) )
+
+  def entryNames( self ):
+    """ return the names of the files in the cache """
+    return sorted( os.path.basename( path ).split( '_', 1 )[1] for _mtime, _size, path in self.cache.getEntries() )
+
+  def test_lru_eviction( self ):
+    for index in xrange( 3 ):
+      lfn = '/ilc/file%d' % index
+      self.cache.getFile( lfn, 'abc', self.destination( 'f' ), self.download( lfn, 40 ) )
+      if index == 1:
+        ## file0 is used again, file1 is now the least recently used
+        time.sleep( 0.05 )
+        self.cache.getFile( '/ilc/file0', 'abc', self.destination( 'f' ), self.download( '/ilc/file0' ) )
+      time.sleep( 0.05 )
+    assertEqualsImproved( self.entryNames(), [ 'file0', 'file2' ], self )
+    self.cache.maxSize = 50
+    self.cache.evict()
+    assertEqualsImproved( self.entryNames(), [ 'file2' ], self )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestInputDataCache )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
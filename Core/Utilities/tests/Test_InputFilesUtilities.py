@@ -4,8 +4,8 @@ tests for InputFilesUtilities
 """
 import unittest
 from mock import MagicMock as Mock, patch
-from ILCDIRAC.Core.Utilities.InputFilesUtilities import getNumberOfEvents
-from ILCDIRAC.Tests.Utilities.GeneralUtils import assertDiracSucceedsWith_equals
+from ILCDIRAC.Core.Utilities.InputFilesUtilities import getNumberOfEvents, getNumberOfEventsPerFile
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertDiracSucceedsWith_equals, assertDiracFailsWith
 
 from DIRAC import gLogger, S_OK, S_ERROR
 
@@ -109,6 +109,39 @@ class TestgetNumberOfEvents( unittest.TestCase ):
                                       { 'AdditionalMeta': {}, 'EvtType' : '', 'lumi' : 14.5, 'nbevts' : 28 },
                                       self )
 
+  def test_getnumberofeventsperfile( self ):
+    file_meta_dict = { '/unique/dir/file3' : S_OK( { 'Luminosity' : '49.2' } ),
+                       '/one/file/myfile' : S_OK( { 'NumberOfEvents' : '14' } ),
+                       '/a/b/c/Dir1/someFile' : S_OK( { 'NumberOfEvents' : '12' } ),
+                       '/a/b/c/Dir1/other_file' : S_OK( { 'Luminosity' : '14.5' } ),
+                       '/a/b/c/Dir2/file_%d' % 0 : S_OK( { 'NumberOfEvents' : '1' } ) }
+    directory_meta_dict = { '/a/b/c/Dir1' : S_ERROR( 'no_dir' ),
+                            '/a/b/c/Dir2' : S_OK( { 'NumberOfEvents' : 100 } ),
+                            '/unique/dir' : S_OK( { 'NumberOfEvents' : 814 } ) }
+    fcMock = Mock()
+    fcMock.getDirectoryUserMetadata = Mock(side_effect=lambda path: directory_meta_dict[path])
+    fcMock.getFileUserMetadata = Mock(side_effect=lambda filename : file_meta_dict[filename] )
+    dir2Files = [ '/a/b/c/Dir2/file_%d' % index for index in xrange(200) ]
+    with patch( "%s.FileCatalogClient" % MODULE_NAME, new=Mock(return_value=fcMock)):
+      res = getNumberOfEventsPerFile( [ '/a/b/c/Dir1/someFile', '/a/b/c/Dir1/other_file', '/unique/dir/file3',
+                                        '/one/file/myfile', '' ] + dir2Files )
+    expected = dict.fromkeys( dir2Files, 100 )
+    expected.update( { '/a/b/c/Dir1/someFile' : 12, '/unique/dir/file3' : 814, '/one/file/myfile' : 14 } )
+    assertDiracSucceedsWith_equals( res, expected, self )
+    self.assertEqual( sorted( call[0][0] for call in fcMock.getDirectoryUserMetadata.call_args_list ),
+                      [ '/a/b/c/Dir1', '/a/b/c/Dir2', '/unique/dir' ] )
+    self.assertEqual( sorted( call[0][0] for call in fcMock.getFileUserMetadata.call_args_list ),
+                      [ '/a/b/c/Dir1/other_file', '/a/b/c/Dir1/someFile', '/one/file/myfile',
+                        '/unique/dir/file3' ] )
+
+  def test_getnumberofeventsperfile_fails( self ):
+    fcMock = Mock()
+    fcMock.getDirectoryUserMetadata = Mock(return_value=S_ERROR("No Such File"))
+    fcMock.getFileUserMetadata = Mock(return_value=S_ERROR("No Such File"))
+    with patch( "%s.FileCatalogClient" % MODULE_NAME, new=Mock(return_value=fcMock)):
+      assertDiracFailsWith( getNumberOfEventsPerFile( [ '/no/such/file', '/no/such/file2' ] ),
+                            'failed to get number of events', self )
+
 if __name__ == "__main__":
   SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestgetNumberOfEvents )
   TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Test the LCIOReader module"""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+from mock import patch, MagicMock as Mock
+
+from ILCDIRAC.Core.Utilities.LCIOReader import LCIOFile, EventHeader, scanFile, scanFiles
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved, assertDiracFailsWith, \
+  assertDiracSucceedsWith_equals
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.Core.Utilities.LCIOReader'
+
+def sioString( value ):
+  """ return the SIO representation of a string """
+  return struct.pack( '>i', len( value ) ) + value + '\0' * ( -len( value ) % 4 )
+
+def sioBlock( name, content, version = 0x00020008 ):
+  """ return a SIO block """
+  header = struct.pack( '>II', 0xdeadbeef, version ) + sioString( name )
+  return struct.pack( '>I', 4 + len( header ) + len( content ) ) + header + content + '\0' * ( -len( content ) % 4 )
+
+def sioRecord( name, blocks, compress = True ):
+  """ return a SIO record containing the blocks """
+  data = ''.join( blocks )
+  written = zlib.compress( data ) if compress else data
+  header = struct.pack( '>IIII', 0xabadcafe, int( compress ), len( written ), len( data ) ) + sioString( name )
+  return struct.pack( '>I', 4 + len( header ) ) + header + written + '\0' * ( -len( written ) % 4 )
+
+def lcioEvent( eventNumber, collections, runNumber = 7 ):
+  """ return the header and event records of an event containing the collections """
+  header = struct.pack( '>iiq', runNumber, eventNumber, 1234567890123 ) + sioString( 'CLIC_o3_v14' )
+  header += struct.pack( '>i', len( collections ) )
+  header += ''.join( sioString( name ) + sioString( 'ReconstructedParticle' ) for name in collections )
+  ## the event parameters, no int, float or string parameters
+  header += struct.pack( '>iii', 0, 0, 0 )
+  event = [ sioBlock( name, os.urandom( 37 ) ) for name in collections ]
+  return sioRecord( 'LCEventHeader', [ sioBlock( 'EventHeader', header ) ] ) + \
+    sioRecord( 'LCEvent', event, compress = eventNumber % 2 )
+
+def lcioFile( fileName, events ):
+  """ write a LCIO file with a run header and the events, the list of collections of each event """
+  with open( fileName, 'wb' ) as out:
+    out.write( sioRecord( 'LCRunHeader', [ sioBlock( 'RunHeader', struct.pack( '>i', 7 ) ) ] ) )
+    for eventNumber, collections in enumerate( events ):
+      out.write( lcioEvent( eventNumber, collections ) )
+
+class TestLCIOReader( unittest.TestCase ):
+  """ Test counting the events and collections of LCIO files
+  """
+
+  def setUp( self ):
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    self.fileName = os.path.join( self.tmpdir, 'file.slcio' )
+    lcioFile( self.fileName, [ [ 'PandoraPFOs', 'MCParticle' ], [ 'PandoraPFOs' ],
+                               [ 'PandoraPFOs', 'MCParticle', 'PandoraPFOsSelected' ] ] )
+
+  def tearDown( self ):
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
+
+  def test_records( self ):
+    with LCIOFile( self.fileName ) as lcio:
+      records = list( lcio.iterRecords() )
+      headers = list( lcio.iterEventHeaders() )
+    assertEqualsImproved( [ name for name, _data in records ],
+                          [ 'LCRunHeader' ] + [ 'LCEventHeader', 'LCEvent' ] * 3, self )
+    self.assertTrue( all( data is None for _name, data in records ) )
+    assertEqualsImproved( headers[1], EventHeader( 7, 1, 1234567890123, 'CLIC_o3_v14',
+                                                   [ ( 'PandoraPFOs', 'ReconstructedParticle' ) ] ), self )
+
+  def test_scan( self ):
+    assertDiracSucceedsWith_equals( scanFile( self.fileName ), dict(
+      Events = 3, Collections = dict( PandoraPFOs = 3, MCParticle = 2, PandoraPFOsSelected = 1 ) ), self )
+
+  def test_scan_empty( self ):
+    emptyFile = os.path.join( self.tmpdir, 'empty.slcio' )
+    lcioFile( emptyFile, [] )
+    assertDiracSucceedsWith_equals( scanFile( emptyFile ), dict( Events = 0, Collections = {} ), self )
+
+  def test_scan_fails( self ):
+    with open( self.fileName, 'rb' ) as original:
+      data = original.read()
+    truncated = os.path.join( self.tmpdir, 'truncated.slcio' )
+    with open( truncated, 'wb' ) as out:
+      out.write( data[:-10] )
+    assertDiracFailsWith( scanFile( truncated ), 'truncated in record LCEvent', self )
+    with open( truncated, 'wb' ) as out:
+      out.write( data + 'abcdefgh' )
+    assertDiracFailsWith( scanFile( truncated ), 'expected a record', self )
+    notLCIO = os.path.join( self.tmpdir, 'file.txt' )
+    with open( notLCIO, 'w' ) as out:
+      out.write( 'not a lcio file' )
+    assertDiracFailsWith( scanFile( notLCIO ), 'expected a record at 0', self )
+    assertDiracFailsWith( scanFile( os.path.join( self.tmpdir, 'missing.slcio' ) ), 'failed to read', self )
+
+  def test_scan_corrupted_header( self ):
+    corrupted = os.path.join( self.tmpdir, 'corrupted.slcio' )
+    header = struct.pack( '>iiq', 1, 2, 3 ) + sioString( 'detector' ) + struct.pack( '>i', 5 )
+    with open( corrupted, 'wb' ) as out:
+      out.write( sioRecord( 'LCEventHeader', [ sioBlock( 'EventHeader', header ) ], compress = False ) )
+    assertDiracFailsWith( scanFile( corrupted ), 'block EventHeader is corrupted', self )
+    with open( corrupted, 'wb' ) as out:
+      out.write( sioRecord( 'LCEventHeader', [ sioBlock( 'Other', header ) ] ) )
+    assertDiracFailsWith( scanFile( corrupted ), 'no EventHeader block', self )
+
+  def test_scan_files( self ):
+    otherFile = os.path.join( self.tmpdir, 'other.slcio' )
+    lcioFile( otherFile, [ [ 'MCParticle' ] ] * 5 )
+    res = scanFiles( [ self.fileName, otherFile ], maxProcesses = 2 )
+    assertEqualsImproved( res['Value'].keys(), [ self.fileName, otherFile ], self )
+    assertEqualsImproved( res['Value'][otherFile], dict( Events = 5, Collections = dict( MCParticle = 5 ) ), self )
+    assertDiracFailsWith( scanFiles( [ self.fileName, 'missing.slcio' ], maxProcesses = 2 ),
+                          'failed to read missing.slcio', self )
+
+  def test_scan_files_single_process( self ):
+    with patch( '%s.Pool' % MODULE_NAME, new = Mock() ) as pool_mock:
+      res = scanFiles( [ self.fileName, self.fileName ], maxProcesses = 1 )
+      self.assertFalse( pool_mock.called )
+    assertEqualsImproved( [ content['Events'] for content in res['Value'].values() ], [ 3 ], self )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestLCIOReader )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
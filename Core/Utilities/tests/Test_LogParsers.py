@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Test the LogParsers module"""
+
+import unittest
+
+from ILCDIRAC.Core.Utilities.LogParsers import LogParser, StdHepSplitLogParser, LCIOSplitLogParser, \
+  StdHepCutLogParser, WhizardLogParser
+from ILCDIRAC.Core.Utilities.LogSink import LogSink
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved
+
+__RCSID__ = "$Id$"
+
+class TestLogParsers( unittest.TestCase ):
+  """ Test the extraction of the results from the application logs
+  """
+
+  def test_base( self ):
+    self.assertRaises( NotImplementedError, LogParser().parseLine, 'line' )
+    self.assertIsNone( LogParser().getProgress() )
+
+  def test_stdhepsplit( self ):
+    parser = StdHepSplitLogParser()
+    parser.parseLines( [ 'Open output file opfile1  \n', 'Record = 41298 \n', 'Record = 2 Output Begin Run\n',
+                         'Open output file /mydir/run1.stdhep\x00', 'Record=172', 'Record = 0',
+                         'Open output file empty_file' ] )
+    assertEqualsImproved( parser.numberOfEvents, { 'opfile1' : 41298, '/mydir/run1.stdhep' : 172,
+                                                   'empty_file' : 0 }, self )
+    assertEqualsImproved( parser.getProgress(), 41470, self )
+    assertEqualsImproved( parser.linesParsed, 7, self )
+    ## other lines with records are ignored
+    parser.parseLines( [ 'Record length 512', 'Record = many', 'Records written = 12 of 20' ] )
+    assertEqualsImproved( parser.getProgress(), 41470, self )
+
+  def test_lciosplit( self ):
+    parser = LCIOSplitLogParser( 'input' )
+    parser.parseLines( [ '12 events before any file', '/work/input_0.slcio', '100 events',
+                         'some output', '/work/input_1.slcio', '42 events written' ] )
+    assertEqualsImproved( parser.numberOfEvents.items(), [ ( '/work/input_0.slcio', 100 ),
+                                                           ( '/work/input_1.slcio', 42 ) ], self )
+    assertEqualsImproved( parser.getProgress(), 142, self )
+    ## other lines with events are ignored
+    parser.parseLines( [ 'Processed 10 events', 'events: none' ] )
+    assertEqualsImproved( parser.getProgress(), 142, self )
+
+  def test_stdhepcut( self ):
+    parser = StdHepCutLogParser()
+    self.assertIsNone( parser.getProgress() )
+    parser.parseLines( [ 'Events total 37', 'Events passing cuts 14', 'Events kept 12' ] )
+    assertEqualsImproved( ( parser.eventsRead, parser.eventsPassing, parser.eventsWritten ), ( 37, 14, 12 ), self )
+    assertEqualsImproved( parser.getProgress(), 37, self )
+    parser.parseLines( [ 'Events total are printed below', 'Events kept: see output file' ] )
+    assertEqualsImproved( ( parser.eventsRead, parser.eventsPassing, parser.eventsWritten ), ( 37, 14, 12 ), self )
+
+  def test_whizard( self ):
+    parser = WhizardLogParser()
+    parser.parseLines( [ '! Event sample corresponds to luminosity 92847', 'Event generation finished.',
+                         ' PYSTOP called' ] )
+    assertEqualsImproved( parser.luminosity, '92847', self )
+    assertEqualsImproved( parser.errorMessage, ' PYSTOP called', self )
+    self.assertTrue( parser.succeeded() )
+
+  def test_whizard_fails( self ):
+    parser = WhizardLogParser()
+    parser.parseLines( [ '*** Fatal error: no phase space', 'Event generation finished.' ] )
+    assertEqualsImproved( parser.errorMessage, '*** Fatal error: no phase space', self )
+    self.assertFalse( parser.succeeded() )
+
+  def test_live_parsing( self ):
+    sink = LogSink()
+    parser = StdHepCutLogParser()
+    sink.addParser( parser )
+    ## the lines are parsed even if they are neither printed nor written to a log
+    sink.setFilter( [ '' ], True )
+    for line in [ 'Events total 37', 'Events kept 12' ]:
+      sink.write( 0, line )
+    assertEqualsImproved( ( parser.eventsRead, parser.eventsWritten ), ( 37, 12 ), self )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestLogParsers )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Test the LogSink module"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from mock import patch
+
+from ILCDIRAC.Core.Utilities.LogSink import LogSink
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.Core.Utilities.LogSink'
+
+class TestLogSink( unittest.TestCase ):
+  """ Test the destination of the application output
+  """
+
+  def setUp( self ):
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    self.logFile = os.path.join( self.tmpdir, 'app.log' )
+    self.sink = LogSink( self.logFile, maxErrorLines = 3 )
+    self.lines = [ 'Processing event 1', 'some output', 'Processing event 2', 'WARNING something' ]
+
+  def tearDown( self ):
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
+
+  def readLog( self ):
+    """ return the lines of the log file """
+    with open( self.logFile ) as logFile:
+      return logFile.read().splitlines()
+
+  def writeLines( self, eventStrings, excludeAllButEventString = False ):
+    """ write all lines to the sink, return the printed lines """
+    self.sink.setFilter( eventStrings, excludeAllButEventString )
+    with patch( '%s.sys.stdout' % MODULE_NAME ) as stdoutMock:
+      for line in self.lines:
+        self.sink.write( 0, line )
+    self.sink.close()
+    return [ args[0][0] for args in stdoutMock.write.call_args_list if args[0][0] != '\n' ]
+
+  def test_print_all( self ):
+    assertEqualsImproved( self.writeLines( None ), self.lines, self )
+    assertEqualsImproved( self.readLog(), self.lines, self )
+
+  def test_print_selected( self ):
+    assertEqualsImproved( self.writeLines( [ 'event', 'WARNING' ] ), self.lines[ 0:1 ] + self.lines[ 2: ], self )
+    assertEqualsImproved( self.readLog(), self.lines, self )
+
+  def test_log_selected( self ):
+    assertEqualsImproved( self.writeLines( 'event', True ), self.lines[ 0::2 ], self )
+    assertEqualsImproved( self.readLog(), self.lines[ 0::2 ], self )
+
+  def test_print_nothing( self ):
+    assertEqualsImproved( self.writeLines( [ '' ], True ), [], self )
+    ## the log is created all the same
+    assertEqualsImproved( self.readLog(), [], self )
+
+  def test_error_lines_bounded( self ):
+    for index in xrange( 10 ):
+      self.sink.write( 1, 'error %d' % index )
+    self.sink.write( 0, 'not an error' )
+    assertEqualsImproved( self.sink.getErrors(), 'error 7\nerror 8\nerror 9', self )
+    self.sink.setErrors( '' )
+    assertEqualsImproved( self.sink.getErrors(), '', self )
+
+  def runTee( self, eventStrings, excludeAllButEventString = False ):
+    """ run a command writing the lines in zero copy mode, return the printed lines """
+    self.sink.setFilter( eventStrings, excludeAllButEventString )
+    command = self.sink.getTeeCommand( 'printf "%s\\n"; exit 3' % '\\n'.join( self.lines ) )
+    process = subprocess.Popen( command, shell = True, stdout = subprocess.PIPE )
+    output = process.communicate()[0]
+    assertEqualsImproved( process.returncode, 3, self )
+    for line in output.splitlines():
+      self.sink.write( 0, line )
+    return output.splitlines()
+
+  def test_zero_copy( self ):
+    with patch( '%s.sys.stdout' % MODULE_NAME ):
+      assertEqualsImproved( self.runTee( 'event' ), self.lines[ 0::2 ], self )
+      self.sink.close()
+      assertEqualsImproved( self.readLog(), self.lines, self )
+      ## the lines printed are not written again
+      self.sink.write( 0, 'after' )
+      self.sink.close()
+    assertEqualsImproved( self.readLog(), self.lines + [ 'after' ], self )
+
+  def test_zero_copy_log_selected( self ):
+    with patch( '%s.sys.stdout' % MODULE_NAME ):
+      assertEqualsImproved( self.runTee( 'WARNING', True ), self.lines[ 3: ], self )
+      self.sink.close()
+    assertEqualsImproved( self.readLog(), self.lines[ 3: ], self )
+    ## the errors are taken from the end of the log
+    assertEqualsImproved( self.sink.getErrors(), 'WARNING something', self )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestLogSink )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
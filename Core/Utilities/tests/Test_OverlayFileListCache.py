@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Test the OverlayFileListCache module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch, MagicMock as Mock
+
+from DIRAC import S_OK, S_ERROR
+
+from ILCDIRAC.Core.Utilities.OverlayFileListCache import findFilesByMetadataCached, getSnapshotName, \
+  readSnapshot, writeSnapshot
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved, assertDiracFailsWith, \
+  assertDiracSucceeds, assertDiracSucceedsWith_equals
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.Core.Utilities.OverlayFileListCache'
+
+class TestOverlayFileListCache( unittest.TestCase ):
+  """ Test the cache of the overlay file lists
+  """
+
+  def setUp( self ):
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    self.meta = { 'ProdID' : 1234, 'EvtType' : 'gghad', 'Energy' : '3000' }
+    self.lfns = [ '/ilc/prod/clic/3tev/gghad/SIM/00001234/000/file_%d.slcio' % index for index in xrange(5) ] + \
+                [ '/ilc/prod/clic/3tev/gghad/SIM/00001234/001/file_5.slcio' ]
+    self.fcc = Mock()
+    self.fcc.findFilesByMetadata.return_value = S_OK( self.lfns )
+
+  def tearDown( self ):
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
+
+  def test_snapshotname( self ):
+    name = getSnapshotName( self.meta )
+    self.assertTrue( name.startswith( 'overlay_lfns_1234_' ) )
+    assertEqualsImproved( name, getSnapshotName( dict( self.meta ) ), self )
+    self.assertNotEqual( name, getSnapshotName( self.meta, '/ilc/user' ) )
+    self.assertNotEqual( name, getSnapshotName( dict( self.meta, ProdID = 1235 ) ) )
+
+  def test_write_read( self ):
+    fileName = os.path.join( self.tmpdir, 'sub', 'snap.json.gz' )
+    assertDiracSucceeds( writeSnapshot( fileName, self.meta, '/', self.lfns ), self )
+    assertDiracSucceedsWith_equals( readSnapshot( fileName, self.meta, '/' ), self.lfns, self )
+    assertDiracFailsWith( readSnapshot( fileName, dict( self.meta, ProdID = 1 ), '/' ), 'another query', self )
+    assertDiracFailsWith( readSnapshot( fileName, self.meta, '/', ttl = -1 ), 'too old', self )
+    assertDiracFailsWith( readSnapshot( fileName + 'missing', self.meta, '/' ), 'cannot read', self )
+    assertEqualsImproved( os.listdir( os.path.dirname( fileName ) ), [ 'snap.json.gz' ], self )
+
+  def test_read_other_version( self ):
+    fileName = os.path.join( self.tmpdir, 'snap.json.gz' )
+    with patch( '%s.CACHE_VERSION' % MODULE_NAME, 0 ):
+      writeSnapshot( fileName, self.meta, '/', self.lfns )
+    assertDiracFailsWith( readSnapshot( fileName, self.meta, '/' ), 'has version 0', self )
+
+  def test_find_cached( self ):
+    readOnlyDir = os.path.join( self.tmpdir, 'cvmfs' )
+    cacheDir = os.path.join( self.tmpdir, 'cache' )
+    for _ in xrange(3):
+      assertDiracSucceedsWith_equals( findFilesByMetadataCached( self.fcc, self.meta, '/',
+                                                                 [ readOnlyDir, cacheDir ], 3600 ),
+                                      self.lfns, self )
+    self.fcc.findFilesByMetadata.assert_called_once_with( self.meta, '/' )
+    self.assertTrue( os.path.exists( os.path.join( cacheDir, getSnapshotName( self.meta, '/' ) ) ) )
+    self.assertFalse( os.path.exists( readOnlyDir ) )
+
+  def test_find_readonly_location( self ):
+    readOnlyDir = os.path.join( self.tmpdir, 'cvmfs' )
+    writeSnapshot( os.path.join( readOnlyDir, getSnapshotName( self.meta, '/' ) ), self.meta, '/', [ 'lfn1' ] )
+    assertDiracSucceedsWith_equals( findFilesByMetadataCached( self.fcc, self.meta, '/',
+                                                               [ readOnlyDir, os.path.join( self.tmpdir, 'c' ) ] ),
+                                    [ 'lfn1' ], self )
+    self.assertFalse( self.fcc.findFilesByMetadata.called )
+
+  def test_find_disabled( self ):
+    for cacheDirs, ttl in [ ( [], 3600 ), ( [ self.tmpdir ], 0 ) ]:
+      assertDiracSucceeds( findFilesByMetadataCached( self.fcc, self.meta, '/', cacheDirs, ttl ), self )
+    assertEqualsImproved( self.fcc.findFilesByMetadata.call_count, 2, self )
+    assertEqualsImproved( os.listdir( self.tmpdir ), [], self )
+
+  def test_find_errors_not_cached( self ):
+    self.fcc.findFilesByMetadata.return_value = S_ERROR( 'catalog_down' )
+    assertDiracFailsWith( findFilesByMetadataCached( self.fcc, self.meta, '/', [ self.tmpdir ] ), 'catalog_down', self )
+    self.fcc.findFilesByMetadata.return_value = S_OK( [] )
+    assertDiracSucceedsWith_equals( findFilesByMetadataCached( self.fcc, self.meta, '/', [ self.tmpdir ] ), [], self )
+    assertEqualsImproved( os.listdir( self.tmpdir ), [], self )
+
+  def test_find_write_fails( self ):
+    with patch( '%s.writeSnapshot' % MODULE_NAME, new=Mock( return_value=S_ERROR( 'disk full' ) ) ):
+      assertDiracSucceedsWith_equals( findFilesByMetadataCached( self.fcc, self.meta, '/', [ self.tmpdir ] ),
+                                      self.lfns, self )
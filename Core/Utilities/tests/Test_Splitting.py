@@ -1,7 +1,7 @@
 """Test the Core Splitting Module"""
 
 import unittest
-from ILCDIRAC.Core.Utilities.Splitting import addJobIndexToFilename
+from ILCDIRAC.Core.Utilities.Splitting import addJobIndexToFilename, packFilesByEvents
 
 __RCSID__ = "$Id$"
 
@@ -40,3 +40,37 @@ class Splittingtest( unittest.TestCase ):
     fileIn = "/ilc/user/t/tester/some/folder/%n/output"
     jobIndex=123
     self.assertEqual( "/ilc/user/t/tester/some/folder/123/output", addJobIndexToFilename( fileIn, jobIndex ) )
+
+  def test_packFilesByEvents( self ):
+    jobs = packFilesByEvents( [ ( 'a', 60 ), ( 'b', 50 ), ( 'c', 40 ), ( 'd', 30 ) ], 100 )
+    self.assertEqual( [ ( job['InputData'], job['NumberOfEvents'], job['StartFrom'] ) for job in jobs ],
+                      [ ( [ 'a', 'd' ], 90, 0 ), ( [ 'b', 'c' ], 90, 0 ) ] )
+
+  def test_packFilesByEvents_respects_limit( self ):
+    eventsPerFile = [ ( 'f%d' % index, 60 ) for index in xrange( 3 ) ] + [ ( 'small', 10 ) ]
+    jobs = packFilesByEvents( eventsPerFile, 100 )
+    self.assertTrue( all( job['NumberOfEvents'] <= 100 for job in jobs ) )
+    self.assertEqual( sorted( lfn for job in jobs for lfn in job['InputData'] ), [ 'f0', 'f1', 'f2', 'small' ] )
+    self.assertEqual( len( jobs ), 3 )
+
+  def test_packFilesByEvents_balanced( self ):
+    eventsPerFile = [ ( 'f%d' % index, ( index * 37 ) % 100 + 1 ) for index in xrange( 1000 ) ]
+    jobs = packFilesByEvents( eventsPerFile, 1000 )
+    loads = [ job['NumberOfEvents'] for job in jobs ]
+    self.assertEqual( sum( loads ), sum( nbevts for _lfn, nbevts in eventsPerFile ) )
+    self.assertTrue( max( loads ) <= 1000 )
+    self.assertTrue( max( loads ) - min( loads ) <= 100 )
+
+  def test_packFilesByEvents_largefiles( self ):
+    jobs = packFilesByEvents( [ ( 'small', 20 ), ( 'big', 250 ) ], 100 )
+    self.assertEqual( [ ( job['InputData'], job['NumberOfEvents'] ) for job in jobs ],
+                      [ ( [ 'small' ], 20 ), ( [ 'big' ], 250 ) ] )
+    jobs = packFilesByEvents( [ ( 'small', 20 ), ( 'big', 250 ) ], 100, splitLargeFiles=True )
+    self.assertEqual( [ ( job['InputData'], job['NumberOfEvents'], job['StartFrom'] ) for job in jobs ],
+                      [ ( [ 'small' ], 20, 0 ), ( [ 'big' ], 84, 0 ), ( [ 'big' ], 83, 84 ),
+                        ( [ 'big' ], 83, 167 ) ] )
+
+  def test_packFilesByEvents_largefile_keeps_limit( self ):
+    jobs = packFilesByEvents( [ ( 'a', 250 ), ( 'b', 50 ), ( 'c', 50 ), ( 'd', 50 ) ], 100 )
+    self.assertEqual( [ ( job['InputData'], job['NumberOfEvents'] ) for job in jobs ],
+                      [ ( [ 'a' ], 250 ), ( [ 'b', 'd' ], 100 ), ( [ 'c' ], 50 ) ] )
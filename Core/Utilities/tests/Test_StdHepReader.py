@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Test the StdHepReader module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ILCDIRAC.Core.Utilities.StdHepReader import StdHepFile, KinematicCut, countEvents, splitFile, filterEvents
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved, assertDiracFailsWith, \
+  assertDiracSucceedsWith_equals
+
+__RCSID__ = "$Id$"
+
+TESTFILES = os.path.join( os.getenv( "DIRAC", "" ), "ILCDIRAC/Testfiles" )
+#: file in the version 1 format, 10000 single muons, begin and end run records
+MUON_FILE = os.path.join( TESTFILES, "Muon_50GeV_Fixed_cosTheta0.7.stdhep" )
+#: file in the version 2 format, 100 whizard events and a begin run record
+WHIZARD_FILE = os.path.join( TESTFILES, "qq_ln_gen_6701_975.stdhep" )
+
+class TestStdHepReader( unittest.TestCase ):
+  """ Test reading, splitting and selecting StdHep events
+  """
+
+  def setUp( self ):
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+
+  def tearDown( self ):
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
+
+  def blockIds( self, fileName ):
+    """ return the block ids of the records of a file """
+    with StdHepFile( fileName ) as stdhep:
+      return [ record.blockIds for record in stdhep.iterRecords() ]
+
+  def test_count( self ):
+    assertDiracSucceedsWith_equals( countEvents( MUON_FILE ), 10000, self )
+    assertDiracSucceedsWith_equals( countEvents( WHIZARD_FILE ), 100, self )
+
+  def test_hepevt( self ):
+    with StdHepFile( MUON_FILE ) as stdhep:
+      records = stdhep.iterRecords()
+      beginRun = next( records )
+      self.assertFalse( beginRun.isEvent() )
+      event = stdhep.getHepEvt( next( records ) )
+    assertEqualsImproved( ( event.status, event.pdg ), ( [ 1 ], [ 13 ] ), self )
+    self.assertAlmostEqual( event.momenta[0][3], 50., places = 3 )
+
+  def test_split( self ):
+    res = splitFile( WHIZARD_FILE, os.path.join( self.tmpdir, 'qq' ), 30 )
+    outputFiles = [ os.path.join( self.tmpdir, 'qq_%d.stdhep' % index ) for index in xrange( 1, 5 ) ]
+    assertDiracSucceedsWith_equals( res, dict( zip( outputFiles, [ 30, 30, 30, 10 ] ) ), self )
+    assertEqualsImproved( res['Value'].keys(), outputFiles, self )
+    for outputFile, numberOfEvents in res['Value'].items():
+      assertDiracSucceedsWith_equals( countEvents( outputFile ), numberOfEvents, self )
+      ## every file starts with the begin run record
+      assertEqualsImproved( self.blockIds( outputFile ), [ [ 106 ] ] + [ [ 101 ] ] * numberOfEvents, self )
+    with StdHepFile( outputFiles[1] ) as stdhep:
+      records = list( stdhep.iterRecords() )
+      assertEqualsImproved( stdhep.numberOfRecords, 31, self )
+      assertEqualsImproved( stdhep.getHepEvt( records[1] ).eventNumber, 31, self )
+
+  def test_split_max_events( self ):
+    res = splitFile( MUON_FILE, os.path.join( self.tmpdir, 'mu' ), 4000, maxEvents = 9000 )
+    assertEqualsImproved( res['Value'].values(), [ 4000, 4000, 1000 ], self )
+    blockIds = self.blockIds( os.path.join( self.tmpdir, 'mu_3.stdhep' ) )
+    assertEqualsImproved( ( len( blockIds ), blockIds[0], blockIds[-1] ), ( 1001, [ 106 ], [ 101 ] ), self )
+
+  def test_split_unchanged( self ):
+    res = splitFile( MUON_FILE, os.path.join( self.tmpdir, 'mu' ), 10000 )
+    with open( MUON_FILE, 'rb' ) as original, open( res['Value'].keys()[0], 'rb' ) as copy:
+      originalData, copyData = original.read(), copy.read()
+    ## only the expected number of events in the header is changed, the end run record is kept
+    assertEqualsImproved( len( copyData ), len( originalData ), self )
+    assertEqualsImproved( [ index for index in xrange( len( copyData ) ) if copyData[index] != originalData[index] ],
+                          [ 146, 147 ], self )
+
+  def test_split_fails( self ):
+    assertDiracFailsWith( splitFile( WHIZARD_FILE, 'qq', 0 ), 'must be positive', self )
+    notStdHep = os.path.join( self.tmpdir, 'file.stdhep' )
+    with open( notStdHep, 'w' ) as out:
+      out.write( 'not a stdhep file' )
+    assertDiracFailsWith( splitFile( notStdHep, os.path.join( self.tmpdir, 'out' ), 10 ), 'expected block 1', self )
+    truncated = os.path.join( self.tmpdir, 'truncated.stdhep' )
+    with open( WHIZARD_FILE, 'rb' ) as original, open( truncated, 'wb' ) as out:
+      out.write( original.read( 500000 ) )
+    assertDiracFailsWith( splitFile( truncated, os.path.join( self.tmpdir, 'out' ), 10 ), 'failed to split', self )
+    assertEqualsImproved( sorted( os.listdir( self.tmpdir ) ), [ 'file.stdhep', 'truncated.stdhep' ], self )
+
+  def test_filter( self ):
+    outputFile = os.path.join( self.tmpdir, 'selected.stdhep' )
+    res = filterEvents( MUON_FILE, outputFile, KinematicCut( pdgIds = [ -13 ], minEnergy = 60. ) )
+    assertDiracSucceedsWith_equals( res, dict( Read = 10000, Selected = 0 ), self )
+    assertEqualsImproved( self.blockIds( outputFile ), [ [ 106 ], [ 107 ] ], self )
+    res = filterEvents( MUON_FILE, outputFile, KinematicCut( pdgIds = [ 13 ], minEnergy = 40., minPt = 0.1 ),
+                        maxEvents = 100 )
+    assertDiracSucceedsWith_equals( res, dict( Read = 100, Selected = 100 ), self )
+    assertDiracSucceedsWith_equals( countEvents( outputFile ), 100, self )
+
+  def test_filter_cut( self ):
+    outputFile = os.path.join( self.tmpdir, 'selected.stdhep' )
+    cut = KinematicCut( pdgIds = [ 11 ], minEnergy = 100., maxAbsCosTheta = 0.95 )
+    res = filterEvents( WHIZARD_FILE, outputFile, cut )
+    selected = res['Value']['Selected']
+    self.assertTrue( 0 < selected < 100 )
+    with StdHepFile( outputFile ) as stdhep:
+      events = [ stdhep.getHepEvt( record ) for record in stdhep.iterRecords() if record.isEvent() ]
+    assertEqualsImproved( len( events ), selected, self )
+    self.assertTrue( all( cut( event ) for event in events ) )
+    self.assertFalse( KinematicCut( minParticles = 1000 )( events[0] ) )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestStdHepReader )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""Test the SteeringTemplate module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch, MagicMock as Mock
+
+from ILCDIRAC.Core.Utilities.PrepareOptionFiles import prepareXMLFile
+from ILCDIRAC.Core.Utilities.SteeringTemplate import SteeringTemplate, SteeringTemplateCache, slot
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved, assertDiracFailsWith, \
+  assertDiracSucceeds
+from DIRAC import S_OK
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.Core.Utilities.SteeringTemplate'
+TESTFILES = os.path.join( os.getenv( "DIRAC", "" ), "ILCDIRAC/Testfiles" )
+OVERLAY_FILES = [ 'file1.slcio', 'file&2.slcio' ]
+
+#pylint: disable=protected-access
+class TestSteeringTemplate( unittest.TestCase ):
+  """ Test the steering files written from templates
+  """
+
+  def setUp( self ):
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    self.cacheDir = os.path.join( self.tmpdir, 'cache' )
+    self.memoryPatch = patch.dict( SteeringTemplateCache._templates, clear = True )
+    self.memoryPatch.start()
+
+  def tearDown( self ):
+    self.memoryPatch.stop()
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
+
+  def prepare( self, outputName, inputXML, templateCache = None, **kwargs ):
+    """ run prepareXMLFile and return its result and the steering file written """
+    arguments = dict( inputGEAR = 'gear"File.xml', inputSLCIO = [ 'in1.slcio', 'in&2.slcio' ], numberofevts = 501,
+                      outputFile = '', outputREC = 'rec.slcio', outputDST = 'dst.slcio', debug = False,
+                      dd4hepGeoFile = '/cvmfs/detector.xml', overlayParam = [ ( 'gghad', 2.5, None ) ] )
+    arguments.update( kwargs )
+    outputFile = os.path.join( self.tmpdir, outputName )
+    with patch( "ILCDIRAC.Core.Utilities.MarlinXML.getOverlayFiles", new = Mock( return_value = OVERLAY_FILES ) ), \
+         patch( "ILCDIRAC.Core.Utilities.PrepareOptionFiles.getOverlayFiles",
+                new = Mock( return_value = OVERLAY_FILES ) ):
+      res = prepareXMLFile( outputFile, os.path.join( TESTFILES, inputXML ), templateCache = templateCache,
+                            **arguments )
+    if not res['OK']:
+      return res, None
+    with open( outputFile ) as steeringFile:
+      return res, steeringFile.read()
+
+  def assertSameOutput( self, inputXML, **kwargs ):
+    """ check that the template gives the same steering file as the tree, when compiled and from the cache """
+    _res, expected = self.prepare( 'tree.xml', inputXML, **kwargs )
+    for _ in xrange( 2 ):
+      res, output = self.prepare( 'template.xml', inputXML, SteeringTemplateCache( [ self.cacheDir ] ), **kwargs )
+      assertDiracSucceeds( res, self )
+      assertEqualsImproved( output, expected, self )
+      SteeringTemplateCache._templates.clear()
+
+  def test_same_output( self ):
+    self.assertSameOutput( 'marlininput.xml' )
+    self.assertSameOutput( 'marlininputild.xml', outputFile = 'out.slcio', numberofevts = 0, debug = True )
+    self.assertSameOutput( 'clicReconstruction.xml', inputGEAR = '', inputSLCIO = '', dd4hepGeoFile = None,
+                           overlayParam = [ ( 'gghad', 3, 'Overlay380GeV' ), ( 'pairs', 1, None ) ] )
+    self.assertSameOutput( 'marlininputildNoOver.xml', inputSLCIO = u'input_\xe9.slcio', overlayParam = None )
+    ## one template per steering file and shape of the parameters
+    assertEqualsImproved( len( os.listdir( self.cacheDir ) ), 4, self )
+
+  def test_values( self ):
+    templateCache = SteeringTemplateCache( [ self.cacheDir ] )
+    self.prepare( 'first.xml', 'clicReconstruction.xml', templateCache )
+    _res, output = self.prepare( 'second.xml', 'clicReconstruction.xml', templateCache, numberofevts = 42,
+                                 outputREC = 'other_rec.slcio' )
+    self.assertIn( '<parameter name="MaxRecordNumber" value="42" />', output )
+    self.assertIn( '<parameter name="LCIOOutputFile" type="string">other_rec.slcio</parameter>', output )
+    self.assertIn( 'file1.slcio\nfile&2.slcio', output )
+    self.assertNotIn( '@@', output )
+    ## the second job used the template of the first one
+    assertEqualsImproved( len( SteeringTemplateCache._templates ), 1, self )
+
+  def test_errors( self ):
+    res, _output = self.prepare( 'out.xml', 'marlinRecoProd.xml', SteeringTemplateCache(),
+                                 overlayParam = None )
+    assertDiracFailsWith( res, 'found active overlay processors', self )
+    with patch( "ILCDIRAC.Core.Utilities.PrepareOptionFiles.getOverlayFiles", new = Mock( return_value = [] ) ):
+      res = prepareXMLFile( os.path.join( self.tmpdir, 'out.xml' ), os.path.join( TESTFILES, 'marlininput.xml' ),
+                            'gear.xml', 'in.slcio', 10, '', '', '', False, overlayParam = [ ( 'gghad', 1, None ) ],
+                            templateCache = SteeringTemplateCache() )
+    assertDiracFailsWith( res, 'could not find any overlay files', self )
+    res = prepareXMLFile( 'out.xml', os.path.join( self.tmpdir, 'missing.xml' ), 'gear.xml', 'in.slcio', 10,
+                          '', '', '', False, templateCache = SteeringTemplateCache() )
+    assertDiracFailsWith( res, 'cannot read steering file', self )
+
+  def test_placeholders_in_file( self ):
+    steeringFile = os.path.join( self.tmpdir, 'steering.xml' )
+    with open( steeringFile, 'w' ) as steering:
+      steering.write( '<marlin><global><parameter name="Verbosity">%s</parameter></global></marlin>'
+                      % slot( 'GearXMLFile' ) )
+    res = prepareXMLFile( os.path.join( self.tmpdir, 'out.xml' ), steeringFile, 'gear.xml', 'in.slcio', 0,
+                          '', '', '', True, templateCache = SteeringTemplateCache( [ self.cacheDir ] ) )
+    assertDiracSucceeds( res, self )
+    with open( os.path.join( self.tmpdir, 'out.xml' ) ) as output:
+      self.assertIn( slot( 'GearXMLFile' ), output.read() )
+    self.assertFalse( os.path.exists( self.cacheDir ) )
+
+  def test_template( self ):
+    template = SteeringTemplate.fromXML( '<a b="%s">%s 731956284501</a>' % ( slot( 'B' ), slot( 'Text' ) ),
+                                         dict( Number = 731956284501 ) )
+    assertEqualsImproved( template.slots, [ ( 'B', True ), ( 'Text', False ), ( 'Number', False ) ], self )
+    template = SteeringTemplate.fromDict( template.toDict() )
+    assertEqualsImproved( template.render( dict( B = 1, Text = 'x', Number = 3 ),
+                                           lambda value, inAttribute: '%s%s' % ( value, inAttribute ) ),
+                          '<a b="1True">xFalse 3False</a>', self )
+    self.assertRaises( ValueError, SteeringTemplate.fromDict, dict( Version = 0 ) )
+
+  def test_cache_files( self ):
+    compileMock = Mock( return_value = S_OK( SteeringTemplate( [ 'a', 'b' ], [ ( 'X', False ) ] ) ) )
+    steeringFile = os.path.join( TESTFILES, 'marlininput.xml' )
+    templateName = SteeringTemplateCache( [] ).getTemplateName( open( steeringFile ).read(), [ 1 ] )
+    os.makedirs( self.cacheDir )
+    with open( os.path.join( self.cacheDir, templateName ), 'w' ) as brokenFile:
+      brokenFile.write( '{"Version": 1' )
+    readOnlyDir = os.path.join( self.tmpdir, 'readonly' )
+    res = SteeringTemplateCache( [ readOnlyDir, self.cacheDir ] ).getTemplate( steeringFile, [ 1 ], compileMock )
+    assertEqualsImproved( res['Value'].chunks, [ 'a', 'b' ], self )
+    ## the broken template is replaced, the template is taken from the read only location once it is there
+    shutil.copytree( self.cacheDir, readOnlyDir )
+    SteeringTemplateCache._templates.clear()
+    res = SteeringTemplateCache( [ readOnlyDir ] ).getTemplate( steeringFile, [ 1 ], compileMock )
+    assertEqualsImproved( res['Value'].slots, [ ( 'X', False ) ], self )
+    assertEqualsImproved( compileMock.call_count, 1, self )
+    with patch( '%s.os.rename' % MODULE_NAME, new = Mock( side_effect = OSError( 'no space' ) ) ):
+      assertDiracFailsWith( SteeringTemplateCache._writeTemplate( os.path.join( self.cacheDir, 'new.json' ),
+                                                                  res['Value'] ), 'no space', self )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestSteeringTemplate )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
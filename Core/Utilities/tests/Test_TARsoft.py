@@ -3,13 +3,18 @@
 
 import unittest
 import os
+import shutil
 import sys
-from mock import mock_open, patch, MagicMock as Mock
+import tarfile
+import tempfile
+import threading
+import time
+from mock import patch, MagicMock as Mock
 
 from DIRAC import S_OK, S_ERROR
 from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved, assertDiracFailsWith, \
   assertDiracSucceeds, assertDiracSucceedsWith_equals, assertMockCalls
-from ILCDIRAC.Tests.Utilities.FileUtils import FileUtil
+from ILCDIRAC.Core.Utilities.FileDigest import getFileDigests
 
 __RCSID__ = "$Id$"
 
@@ -25,8 +30,17 @@ class TestTARsoft( unittest.TestCase ): #pylint: disable=too-many-public-methods
     sys.modules['DIRAC.DataManagementSystem.Client.DataManager'] = dataman_import_mock
     global dataman_mock
     dataman_mock = Mock()
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+
+  def writeFile( self, content ):
+    """ write a file in the temporary directory and return its path """
+    fileName = os.path.join( self.tmpdir, 'tarball.tgz' )
+    with open( fileName, 'w' ) as out:
+      out.write( content )
+    return fileName
 
   def tearDown( self ):
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
     if self.dm_backup != -1:
       sys.modules['DIRAC.DataManagementSystem.Client.DataManager'] = self.dm_backup
     else:
@@ -53,69 +67,9 @@ class TestTARsoft( unittest.TestCase ): #pylint: disable=too-many-public-methods
       return realimport(name, globals, locals, fromlist, level)
     backup_import = builtins.__import__
     builtins.__import__ = myimport
-    from ILCDIRAC.Core.Utilities.TARsoft import createLock #pylint: disable=unused-variable
+    from ILCDIRAC.Core.Utilities.TARsoft import clearLock #pylint: disable=unused-variable
     builtins.__import__ = backup_import
 
-  def test_createlock( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import createLock
-    file_contents = [[]]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.open' % MODULE_NAME, mock_open(), create=True) as mo:
-      mo.side_effect = ( h for h in handles )
-      assertDiracSucceeds( createLock( 'testfile.py' ), self )
-      mo.assert_called_once_with( 'testfile.py', 'w' )
-      expected = [ [ 'Locking this directory\n' ] ]
-      self.assertEquals(len(file_contents), len(expected))
-      for (index, handle) in enumerate(handles):
-        cur_handle = handle.__enter__()
-        self.assertEquals(len(expected[index]), handle.__enter__.return_value.write.call_count)
-        for entry in expected[index]:
-          cur_handle.write.assert_any_call(entry)
-
-  def test_createlock_ioerr( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import createLock
-    with patch('%s.open' % MODULE_NAME, new=Mock(side_effect=IOError('some_test_open_error')), create=True):
-      assertDiracFailsWith( createLock('myfile.txt'),
-                            'not allowed to write here: ioerror some_test_open_error', self )
-
-  def test_check_lock_age_no_lock( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import checkLockAge
-    with patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=False)):
-      result = checkLockAge( 'mylockfile.txt' )
-      assertDiracSucceedsWith_equals( result, False, self )
-
-  def test_check_lock_age_stat_fails( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import checkLockAge
-    with patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=True)), \
-         patch('%s.os.stat' % MODULE_NAME, new=Mock(side_effect=OSError('some_test_stat_error'))), \
-         patch('%s.wasteCPUCycles' % MODULE_NAME, new=Mock(return_value=S_OK())):
-      result = checkLockAge( 'mylockfile.txt' )
-      assertDiracSucceedsWith_equals( result, False, self )
-
-  def test_check_lock_age_clear_lock_success( self ):
-    import time
-    from ILCDIRAC.Core.Utilities.TARsoft import checkLockAge
-    stat_mock = Mock()
-    stat_mock.st_atime = time.time() - 1801 # lastTouch old enough
-    with patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=True)), \
-         patch('%s.os.stat' % MODULE_NAME, new=Mock(return_value=stat_mock)), \
-         patch('%s.wasteCPUCycles' % MODULE_NAME, new=Mock(side_effect=[S_ERROR(), S_OK(), S_OK()])), \
-         patch('%s.clearLock' % MODULE_NAME, new=Mock(side_effect=[S_ERROR(), S_OK(True)])):
-      result = checkLockAge( 'mylockfile.txt' )
-      assertDiracSucceedsWith_equals( result, True, self )
-
-  def test_check_lock_age_timeout( self ):
-    import time
-    from ILCDIRAC.Core.Utilities.TARsoft import checkLockAge
-    stat_mock = Mock()
-    stat_mock.st_atime = time.time()
-    with patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=True)), \
-         patch('%s.os.stat' % MODULE_NAME, new=Mock(return_value=stat_mock)), \
-         patch('%s.wasteCPUCycles' % MODULE_NAME, new=Mock(return_value=S_OK())), \
-         patch('%s.clearLock' % MODULE_NAME, new=Mock(return_value=S_OK(True))):
-      result = checkLockAge( 'mylockfile.txt' )
-      assertDiracFailsWith( result, 'buggy lock, removed: True', self )
-
   def test_clear_lock( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import clearLock
     with patch('%s.os.unlink' % MODULE_NAME, new=Mock(return_value=True)):
@@ -215,14 +169,10 @@ class TestTARsoft( unittest.TestCase ): #pylint: disable=too-many-public-methods
 
   def test_md5_check( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import tarMd5Check
-    file_contents = [ ['849utj429foemfi84j92fno;(*ME(FOJN$EO&*R#BNOFMN(OJIm'] ]
+    tarball = self.writeFile( '849utj429foemfi84j92fno;(*ME(FOJN$EO&*R#BNOFMN(OJIm' )
     expected_hash = 'dab9783374461a26e100164747e84e63' # Precalculated
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.open' % MODULE_NAME, mock_open(), create=True) as mo:
-      mo.side_effect = (h for h in handles)
-      result = tarMd5Check( '/my/app/tarball.tgz', expected_hash )
-      mo.assert_called_once_with( '/my/app/tarball.tgz' )
-      assertDiracSucceeds( result, self )
+    with patch('%s.BLOCK_SIZE' % MODULE_NAME, new=7):
+      assertDiracSucceedsWith_equals( tarMd5Check( tarball, expected_hash ), expected_hash, self )
 
   def test_md5_check_io_err( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import tarMd5Check
@@ -234,19 +184,13 @@ class TestTARsoft( unittest.TestCase ): #pylint: disable=too-many-public-methods
 
   def test_md5_check_hash_wrong( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import tarMd5Check
-    file_contents = [ [ '2984jt4gomrfg8924jgnm', '1938jhfo9coiemc0m90pn@O*E&HQRF(*IONU)',
-                        ')(DCIFUJE*FIUEqf9oi1mnf)' ] ]
-    expected_hash = '0981u3jr9831rkjopk,f90381'
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.open' % MODULE_NAME, mock_open(), create=True) as mo:
-      mo.side_effect = (h for h in handles)
-      result = tarMd5Check( '/my/app/tarball.tgz', expected_hash )
-      mo.assert_called_once_with( '/my/app/tarball.tgz' )
-      assertDiracFailsWith( result, 'hash does not correspond', self )
+    tarball = self.writeFile( '2984jt4gomrfg8924jgnm1938jhfo9coiemc0m90pn@O*E&HQRF(*IONU)' )
+    assertDiracFailsWith( tarMd5Check( tarball, '0981u3jr9831rkjopk,f90381' ), 'hash does not correspond', self )
 
   def test_install_deps( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import installDependencies
     with patch('%s.resolveDeps' % MODULE_NAME, new=Mock(return_value=[{ 'app' : 'myappname1', 'version' : '203.0' }, { 'app' : 'myappname2', 'version' : '138.1' }])) as dep_mock, \
+         patch('%s.unpackPackages' % MODULE_NAME) as unpack_mock, \
          patch('%s.installInAnyArea' % MODULE_NAME) as install_mock:
       result = installDependencies( ( 'AppName', 'appvers' ), 'myconf', 'myareas' )
       assertDiracSucceeds( result, self )
@@ -254,6 +198,8 @@ class TestTARsoft( unittest.TestCase ): #pylint: disable=too-many-public-methods
                                        ( 'myareas', [ 'myappname2', '138.1' ], 'myconf' ) ],
                        self, only_these_calls = False )
       dep_mock.assert_called_once_with( 'myconf', 'appname', 'appvers' )
+      unpack_mock.assert_called_once_with( [ [ 'myappname1', '203.0' ], [ 'myappname2', '138.1' ] ], 'myconf',
+                                           'myareas' )
 
   def test_install_deps_nodeps( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import installDependencies
@@ -267,6 +213,7 @@ class TestTARsoft( unittest.TestCase ): #pylint: disable=too-many-public-methods
   def test_install_deps_installation_fails( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import installDependencies
     with patch('%s.resolveDeps' % MODULE_NAME, new=Mock(return_value=[{ 'app' : 'myappname1', 'version' : '203.0' }, { 'app' : 'myappname2', 'version' : '138.1' }])) as dep_mock, \
+         patch('%s.unpackPackages' % MODULE_NAME), \
          patch('%s.installInAnyArea' % MODULE_NAME, new=Mock(side_effect=[S_OK(), S_ERROR()])) as install_mock:
       result = installDependencies( ( 'AppName', 'appvers' ), 'myconf', 'myareas' )
       assertDiracFailsWith( result, "failed to install dependency: ['myappname2', '138.1']", self )
@@ -332,185 +279,109 @@ class TestTARsoft( unittest.TestCase ): #pylint: disable=too-many-public-methods
       result = getTarBallLocation( ('complicated_app', 'v201'), 'config', 'dummy_area' )
       assertDiracFailsWith( result, 'could not find tarballurl in cs', self )
 
+  def createInstallation( self, files, extraLines = None ):
+    """ create an installed folder with files and their md5_checksum.md5, return its name """
+    import hashlib
+    basefolder = os.path.join( self.tmpdir, 'myapp' )
+    os.mkdir( basefolder )
+    lines = [ 'd41d8cd98f00b204e9800998ecf8427e -', 'mychecksum ./md5_checksum.md5' ] + ( extraLines or [] )
+    for name, content in sorted( files.items() ):
+      path = os.path.join( basefolder, name )
+      if not os.path.isdir( os.path.dirname( path ) ):
+        os.makedirs( os.path.dirname( path ) )
+      with open( path, 'w' ) as out:
+        out.write( content )
+      lines.append( '%s ./%s' % ( hashlib.md5( content ).hexdigest(), name ) )
+    with open( os.path.join( basefolder, 'md5_checksum.md5' ), 'w' ) as out:
+      out.write( '\n'.join( lines ) + '\n' )
+    return 'myapp'
+
   def test_check( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import check
-    # Different treatment of with open() and open().read().....
-    file_contents = [ [ 'HelloWorld -', 'mychecksum md5_checksum.md5',
-                        'ef7493baf5582b41cd4fcaa25124c3d9 ./appfile1.txt',
-                        '6fe635186392d43f0ae5728e41a92f96 appfile2.ppt',
-                        'e10dab217514cf7f2166d87fb5d04d5c ./myapp/importantfile.bin',
-                        'a51999cbc7ee434ee95b33f1d18c7210 otherdir/main.py',
-                        'abc libstdc++.so', 'def myapp/libgcc_s.so.1', 'ignoreme ./other_dir/libc-2.5' ] ]
-    other_file_contents = [
-      'appfile1r0984u3jriumfilf42890tjr742tu', 'appfile29031i4rt498jnyfouf908j248f4298fn24iuyf',
-      'importf90ui4j9rf41f09j14fiun41 fp1,cmic13',
-      'MAIN()@KJR(*@KRE)+@MOUFRIN@FR*YB^ B* @HE)J @E( HG!V!UYNEJ)(!))))' ]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.os.chdir' % MODULE_NAME, new=Mock(return_value=True)) as chdir_mock, \
-         patch('%s.os.path.isfile' % MODULE_NAME, new=Mock(return_value=False)) as isfile_mock, \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=True)) as exists_mock, \
-         patch('%s.open' % MODULE_NAME, mock_open(), create=True) as mo:
-      mysideeff = [ handles[0] ]
-      for i in xrange(0, len(other_file_contents)):
-        other_read_mock = Mock()
-        other_read_mock.read.return_value = other_file_contents[i]
-        mysideeff.append( other_read_mock )
-      mo.side_effect = tuple( mysideeff )
-      result = check( ('appname', 'version'), 'mytestarea398', ['/my/basefolder', 'res_from_install[1]'] )
-      expected_open_calls = [ ( '/my/basefolder/md5_checksum.md5', 'r' ), '/my/basefolder/appfile1.txt',
-                              '/my/basefolder/appfile2.ppt', '/my/basefolder/myapp/importantfile.bin',
-                              '/my/basefolder/otherdir/main.py' ]
-      expected = [[]]
-      FileUtil.checkFileInteractions( self, mo, expected_open_calls, expected, handles )
-      assertDiracSucceedsWith_equals( result, [ '/my/basefolder' ], self )
-      chdir_mock.assert_called_once_with( 'mytestarea398' )
-      isfile_mock.assert_called_once_with( '/my/basefolder' )
-      assertMockCalls( exists_mock, [ '/my/basefolder/md5_checksum.md5', '/my/basefolder/appfile1.txt',
-                                      '/my/basefolder/appfile2.ppt', '/my/basefolder/myapp/importantfile.bin',
-                                      '/my/basefolder/otherdir/main.py' ], self )
+    basefolder = self.createInstallation( { 'appfile1.txt': 'appfile1r0984u3jriumfilf42890tjr742tu',
+                                            'myapp/importantfile.bin': 'importf90ui4j9rf41f09j14fiun41',
+                                            'otherdir/main.py': 'MAIN()' },
+                                          [ 'abc libstdc++.so', 'def myapp/libgcc_s.so.1', 'ignore ./lib/libc-2.5' ] )
+    with patch('%s.getFileDigests' % MODULE_NAME, side_effect=getFileDigests) as digest_mock:
+      result = check( ('appname', 'version'), self.tmpdir, [ basefolder, 'res_from_install[1]' ], 0 )
+      assertDiracSucceedsWith_equals( result, [ basefolder ], self )
+      assertEqualsImproved( sorted( digest_mock.call_args[0][0] ),
+                            [ os.path.join( self.tmpdir, 'myapp', name )
+                              for name in ( 'appfile1.txt', 'myapp/importantfile.bin', 'otherdir/main.py' ) ], self )
+      ## verified files are not hashed again
+      digest_mock.reset_mock()
+      assertDiracSucceeds( check( ('appname', 'version'), self.tmpdir, [ basefolder, '' ], 0 ), self )
+      self.assertFalse( digest_mock.called )
+      ## unless they changed
+      with open( os.path.join( self.tmpdir, 'myapp', 'otherdir', 'main.py' ), 'w' ) as out:
+        out.write( 'modified' )
+      result = check( ('appname', 'version'), self.tmpdir, [ basefolder, '' ], 0 )
+      assertDiracFailsWith( result, 'corrupted install: file %s/myapp/otherdir/main.py' % self.tmpdir, self )
+      assertEqualsImproved( digest_mock.call_args[0][0], [ os.path.join( self.tmpdir, 'myapp', 'otherdir', 'main.py' ) ],
+                            self )
+
+  def test_check_sample( self ):
+    from ILCDIRAC.Core.Utilities.TARsoft import check
+    basefolder = self.createInstallation( dict( ( 'file%d' % index, 'content%d' % index ) for index in range( 10 ) ) )
+    with patch('%s.getFileDigests' % MODULE_NAME, side_effect=getFileDigests) as digest_mock:
+      for _ in range( 3 ):
+        assertDiracSucceeds( check( ('appname', 'version'), self.tmpdir, [ basefolder, '' ], 4 ), self )
+    assertEqualsImproved( [ len( call[0][0] ) for call in digest_mock.call_args_list ], [ 4, 4, 2 ], self )
+    assertEqualsImproved( len( set( path for call in digest_mock.call_args_list for path in call[0][0] ) ), 10, self )
 
   def test_check_lcsim_jar( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import check
-    with patch('%s.os.path.isfile' % MODULE_NAME, new=Mock(return_value=True)) as isfile_mock, \
-         patch('%s.os.chdir' % MODULE_NAME, new=Mock(return_value=True)) as chdir_mock:
+    with patch('%s.os.path.isfile' % MODULE_NAME, new=Mock(return_value=True)) as isfile_mock:
       result = check( ('appname', 'version'), 'deep/area', ['mytestbasefolder', 'res_from_install[1]'] )
       assertDiracSucceedsWith_equals( result, ['mytestbasefolder'], self )
-      isfile_mock.assert_called_once_with( 'mytestbasefolder' )
-      chdir_mock.assert_called_once_with( 'deep/area' )
+      isfile_mock.assert_called_once_with( 'deep/area/mytestbasefolder' )
 
   def test_check_corrupt_checksum( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import check
-    # Different treatment of with open() and open().read().....
-    file_contents = [ ['HelloWorld -', 'mychecksum md5_checksum.md5',
-                       'ef7493baf5582b41cd4fcaa25124c3d9 ./appfile1.txt', 'CORRUPT_CHECKSUM appfile2.ppt',
-                       'e10dab217514cf7f2166d87fb5d04d5c ./myapp/importantfile.bin',
-                       'a51999cbc7ee434ee95b33f1d18c7210 otherdir/main.py', 'abc libstdc++.so',
-                       'def myapp/libgcc_s.so.1', 'ignoreme ./other_dir/libc-2.5' ] ]
-    other_file_contents = [ 'appfile1r0984u3jriumfilf42890tjr742tu',
-                            'appfile29031i4rt498jnyfouf908j248f4298fn24iuyf',
-                            'importf90ui4j9rf41f09j14fiun41 fp1,cmic13',
-                            'MAIN()@KJR(*@KRE)+@MOUFRIN@FR*YB^ B* @HE)J @E( HG!V!UYNEJ)(!))))' ]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.os.chdir' % MODULE_NAME, new=Mock(return_value=True)) as chdir_mock, \
-         patch('%s.os.path.isfile' % MODULE_NAME, new=Mock(return_value=False)) as isfile_mock, \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=True)) as exists_mock, \
-         patch('%s.open' % MODULE_NAME, mock_open(), create=True) as mo:
-      mysideeff = [ handles[0] ]
-      for i in xrange(0, len(other_file_contents)):
-        other_read_mock = Mock()
-        other_read_mock.read.return_value = other_file_contents[i]
-        mysideeff.append( other_read_mock )
-      mo.side_effect = tuple( mysideeff )
-      result = check( ('appname', 'version'), 'mytestarea398', ['/my/otherfolder', 'res_from_install[1]'] )
-      assertDiracFailsWith( result, 'corrupted install: file /my/otherfolder/appfile2.ppt', self )
-      chdir_mock.assert_called_once_with( 'mytestarea398' )
-      isfile_mock.assert_called_once_with( '/my/otherfolder' )
-      assertMockCalls( exists_mock, [ '/my/otherfolder/md5_checksum.md5', '/my/otherfolder/appfile1.txt',
-                                      '/my/otherfolder/appfile2.ppt' ], self )
+    basefolder = self.createInstallation( { 'appfile1.txt': 'appfile1', 'appfile2.ppt': 'appfile2' },
+                                          [ 'CORRUPT_CHECKSUM ./appfile2.ppt' ] )
+    result = check( ('appname', 'version'), self.tmpdir, [ basefolder, 'res_from_install[1]' ], 0 )
+    assertDiracFailsWith( result, 'corrupted install: file %s/myapp/appfile2.ppt' % self.tmpdir, self )
+    self.assertFalse( os.path.exists( os.path.join( self.tmpdir, 'myapp', '.md5_verified.json' ) ) )
 
   def test_check_no_checksum_file( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import check
-    with patch('%s.os.chdir' % MODULE_NAME, new=Mock(return_value=True)) as chdir_mock, \
-         patch('%s.os.path.isfile' % MODULE_NAME, new=Mock(return_value=False)) as isfile_mock, \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=False)) as exists_mock, \
-         patch('%s.gLogger.warn' % MODULE_NAME) as warn_mock:
-      result = check( ('appname', 'version'), 'mytestarea398', ['/base/', 'res_from_install[1]'] )
-      assertDiracSucceedsWith_equals( result, ['/base/'], self )
-      chdir_mock.assert_called_once_with( 'mytestarea398' )
-      isfile_mock.assert_called_once_with( '/base/' )
-      exists_mock.assert_called_once_with( '/base/md5_checksum.md5' )
+    with patch('%s.gLogger.warn' % MODULE_NAME) as warn_mock:
+      result = check( ('appname', 'version'), self.tmpdir, ['base', 'res_from_install[1]'] )
+      assertDiracSucceedsWith_equals( result, ['base'], self )
       warn_mock.assert_called_once_with( 'The application does not come with md5 checksum file:',
                                          ('appname', 'version') )
 
   def test_check_ioerr( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import check
-    # Different treatment of with open() and open().read().....
-    file_contents = [ [ 'ef7493baf5582b41cd4fcaa25124c3d9 ./appfile1.txt',
-                        '6fe635186392d43f0ae5728e41a92f96 appfile2.ppt',
-                        'e10dab217514cf7f2166d87fb5d04d5c ./myapp/importantfile.bin',
-                        'a51999cbc7ee434ee95b33f1d18c7210 otherdir/main.py', 'abc libstdc++.so',
-                        'def myapp/libgcc_s.so.1', 'ignoreme ./other_dir/libc-2.5' ] ]
-    other_file_contents = [ 'appfile1r0984u3jriumfilf42890tjr742tu', IOError('md5_read_err'),
-                            'importf90ui4j9rf41f09j14fiun41 fp1,cmic13',
-                            'MAIN()@KJR(*@KRE)+@MOUFRIN@FR*YB^ B* @HE)J @E( HG!V!UYNEJ)(!))))' ]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.os.chdir' % MODULE_NAME, new=Mock(return_value=True)) as chdir_mock, \
-         patch('%s.os.path.isfile' % MODULE_NAME, new=Mock(return_value=False)) as isfile_mock, \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=True)) as exists_mock, \
-         patch('%s.open' % MODULE_NAME, mock_open(), create=True) as mo:
-      mysideeff = [ handles[0] ]
-      for i in xrange(0, len(other_file_contents)):
-        other_read_mock = Mock()
-        if isinstance(other_file_contents[i], basestring):
-          other_read_mock.read.side_effect = [ other_file_contents[i] ]
-        else:
-          other_read_mock.read.side_effect = other_file_contents[i]
-        mysideeff.append( other_read_mock )
-      mo.side_effect = tuple( mysideeff )
-      result = check( ('appname', 'version'), 'mytestarea398', ['/my/basefolder', 'res_from_install[1]'] )
-      expected_open_calls = [ ( '/my/basefolder/md5_checksum.md5', 'r' ), '/my/basefolder/appfile1.txt',
-                              '/my/basefolder/appfile2.ppt' ]
-      expected = [[]]
-      assertDiracFailsWith( result, 'failed to compute md5 sum', self )
-      FileUtil.checkFileInteractions( self, mo, expected_open_calls, expected, handles )
-      chdir_mock.assert_called_once_with( 'mytestarea398' )
-      isfile_mock.assert_called_once_with( '/my/basefolder' )
-      assertMockCalls( exists_mock, [ '/my/basefolder/md5_checksum.md5', '/my/basefolder/appfile1.txt',
-                                      '/my/basefolder/appfile2.ppt' ], self )
+    basefolder = self.createInstallation( { 'appfile1.txt': 'appfile1' } )
+    with patch('%s.getFileDigests' % MODULE_NAME, new=Mock(return_value=S_ERROR('md5_read_err'))):
+      result = check( ('appname', 'version'), self.tmpdir, [ basefolder, 'res_from_install[1]' ], 0 )
+    assertDiracFailsWith( result, 'failed to compute md5 sum', self )
 
   def test_check_empty_checksum_file( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import check
-    file_contents = [[]]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.os.chdir' % MODULE_NAME, new=Mock(return_value=True)) as chdir_mock, \
-         patch('%s.os.path.isfile' % MODULE_NAME, new=Mock(return_value=False)) as isfile_mock, \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=True)) as exists_mock, \
-         patch('%s.open' % MODULE_NAME, mock_open(), create=True) as mo, \
-         patch('%s.gLogger.warn' % MODULE_NAME) as warn_mock:
-      mo.side_effect = (h for h in handles)
-      result = check( ('appname', 'version'), 'mytestarea398', ['/my/basefolder', 'res_from_install[1]'] )
-      expected_open_calls = [( '/my/basefolder/md5_checksum.md5', 'r' )]
-      expected = [[]]
-      FileUtil.checkFileInteractions( self, mo, expected_open_calls, expected, handles )
-      assertDiracSucceedsWith_equals( result, ['/my/basefolder'], self )
-      chdir_mock.assert_called_once_with( 'mytestarea398' )
-      self.assertFalse( warn_mock.called )
-      isfile_mock.assert_called_once_with( '/my/basefolder' )
-      exists_mock.assert_called_once_with( '/my/basefolder/md5_checksum.md5' )
+    basefolder = self.createInstallation( {} )
+    with patch('%s.gLogger.warn' % MODULE_NAME) as warn_mock:
+      result = check( ('appname', 'version'), self.tmpdir, [ basefolder, 'res_from_install[1]' ], 0 )
+    assertDiracSucceedsWith_equals( result, [ basefolder ], self )
+    self.assertFalse( warn_mock.called )
 
   def test_check_missing_file( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import check
-    # Different treatment of with open() and open().read().....
-    file_contents = [ ['HelloWorld -', 'mychecksum md5_checksum.md5',
-                       'ef7493baf5582b41cd4fcaa25124c3d9 ./appfile1.txt',
-                       '6fe635186392d43f0ae5728e41a92f96 appfile2.ppt',
-                       'e10dab217514cf7f2166d87fb5d04d5c ./myapp/importantfile.bin',
-                       'a51999cbc7ee434ee95b33f1d18c7210 otherdir/main.py', 'abc libstdc++.so',
-                       'def myapp/libgcc_s.so.1', 'ignoreme ./other_dir/libc-2.5' ] ]
-    other_file_contents = [ 'appfile1r0984u3jriumfilf42890tjr742tu',
-                            'appfile29031i4rt498jnyfouf908j248f4298fn24iuyf',
-                            'importf90ui4j9rf41f09j14fiun41 fp1,cmic13',
-                            'MAIN()@KJR(*@KRE)+@MOUFRIN@FR*YB^ B* @HE)J @E( HG!V!UYNEJ)(!))))' ]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.os.chdir' % MODULE_NAME, new=Mock(return_value=True)) as chdir_mock, \
-         patch('%s.os.path.isfile' % MODULE_NAME, new=Mock(return_value=False)) as isfile_mock, \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=[True, True, False])) as exists_mock, \
-         patch('%s.open' % MODULE_NAME, mock_open(), create=True) as mo:
-      mysideeff = [ handles[0] ]
-      for i in xrange(0, len(other_file_contents)):
-        other_read_mock = Mock()
-        other_read_mock.read.return_value = other_file_contents[i]
-        mysideeff.append( other_read_mock )
-      mo.side_effect = tuple( mysideeff )
-      result = check( ('appname', 'version'), 'mytestarea398', ['/hidden/dir', 'res_from_install[1]'] )
-      expected_open_calls = [ ( '/hidden/dir/md5_checksum.md5', 'r' ), '/hidden/dir/appfile1.txt' ]
-      expected = [[]]
-      FileUtil.checkFileInteractions( self, mo, expected_open_calls, expected, handles )
-      assertDiracFailsWith( result, 'incomplete install: the file /hidden/dir/appfile2.ppt is missing', self )
-      chdir_mock.assert_called_once_with( 'mytestarea398' )
-      isfile_mock.assert_called_once_with( '/hidden/dir' )
-      assertMockCalls( exists_mock, [ '/hidden/dir/md5_checksum.md5', '/hidden/dir/appfile1.txt',
-                                      '/hidden/dir/appfile2.ppt' ], self )
+    basefolder = self.createInstallation( { 'appfile1.txt': 'appfile1' }, [ 'abcdef ./appfile2.ppt' ] )
+    result = check( ('appname', 'version'), self.tmpdir, [ basefolder, 'res_from_install[1]' ], 0 )
+    assertDiracFailsWith( result, 'incomplete install: the file %s/myapp/appfile2.ppt is missing' % self.tmpdir,
+                          self )
+
+  def test_check_stamps_of_other_checksums( self ):
+    from ILCDIRAC.Core.Utilities.TARsoft import readVerifiedStamps, writeVerifiedStamps
+    folder = os.path.join( self.tmpdir, self.createInstallation( { 'appfile1.txt': 'appfile1' } ) )
+    checksumFile = os.path.join( folder, 'md5_checksum.md5' )
+    assertDiracSucceeds( writeVerifiedStamps( folder, checksumFile, { 'appfile1.txt': [ 8, 1.5 ] } ), self )
+    assertEqualsImproved( readVerifiedStamps( folder, checksumFile ), { 'appfile1.txt': [ 8, 1.5 ] }, self )
+    os.utime( checksumFile, ( 1, 1 ) )
+    assertEqualsImproved( readVerifiedStamps( folder, checksumFile ), {}, self )
 
   def test_configure_slic( self ):
     from ILCDIRAC.Core.Utilities.TARsoft import configure
@@ -868,226 +739,209 @@ class TestTARsoft( unittest.TestCase ): #pylint: disable=too-many-public-methods
       log_mock.assert_called_once_with(
         'Failed to clean useless tar balls, deal with it: mytestappName testv12' )
 
-  def test_install( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import install
-    extract_mock = Mock()
-    extract_mock.getmembers.return_value =  ['member0/file1.txt', 'member1']
-    with patch('%s.os.chdir' % MODULE_NAME) as chdir_mock, \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_OK(True))) as checklock_mock, \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=[False, True])) as exists_mock, \
-         patch('%s.createLock' % MODULE_NAME, new=Mock(return_value=S_OK())) as createlock_mock, \
-         patch('%s.deleteOld' % MODULE_NAME, new=Mock(return_value=S_OK())) as deleteold_mock, \
-         patch('%s.downloadFile' % MODULE_NAME, new=Mock(return_value=S_OK())) as download_mock, \
-         patch('%s.clearLock' % MODULE_NAME, new=Mock(return_value=S_OK())) as clearlock_mock, \
-         patch('%s.tarMd5Check' % MODULE_NAME, new=Mock(return_value=S_OK())) as md5check_mock, \
-         patch('%s.tarfile.is_tarfile' % MODULE_NAME, new=Mock(return_value=False)) as tarcheck_mock, \
-         patch('%s.os.listdir' % MODULE_NAME, new=Mock(side_effect=OSError(''))) as listdir_mock, \
-         patch('%s.os.rename' % MODULE_NAME) as rename_mock, \
-         patch('%s.os.getcwd' % MODULE_NAME, new=Mock(return_value='/my/cwd/test')), \
-         patch('%s.os.unlink' % MODULE_NAME) as remove_mock:
-      result = install(('appname', 'appvers'), 'myapptarbase.tar.gz', 'tarballURL', False, 'Mymd5sumTest',
-                       'mytestArea')
-      assertDiracSucceedsWith_equals( result, ['myapptarbase', 'myapptarbase.tar.gz'], self )
-      clearlock_mock.assert_called_once_with( 'myapptarbase.lock' )
-      listdir_mock.assert_called_once_with( 'myapptarbase' )
-      self.assertFalse( rename_mock.called )
-      self.assertFalse( remove_mock.called )
-      self.assertFalse( deleteold_mock.called )
-      createlock_mock.assert_called_once_with( 'myapptarbase.lock' )
-      download_mock.assert_called_once_with( 'tarballURL', 'myapptarbase.tar.gz', 'myapptarbase' )
-      tarcheck_mock.assert_called_once_with( 'myapptarbase.tar.gz' )
-      checklock_mock.assert_called_once_with( 'myapptarbase.lock' )
-      chdir_mock.assert_called_once_with( 'mytestArea' )
-      md5check_mock.assert_called_once_with( 'myapptarbase.tar.gz', 'Mymd5sumTest' )
-      assertMockCalls( exists_mock, [ 'myapptarbase', '/my/cwd/test/myapptarbase.tar.gz' ], self )
-
-  def test_install_checklockage_fails( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import install
-    with patch('%s.os.chdir' % MODULE_NAME), \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_ERROR('test_checklockage_failed'))):
-      result = install(('appname', 'appvers'), 'app_tar.tar.gz', 'tarballURL', True, 'md5sum', 'area')
-      assertDiracFailsWith( result, 'failed lock checks', self )
 
-  def test_install_createlock_fails( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import install
-    with patch('%s.os.chdir' % MODULE_NAME), \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=[False, True])), \
-         patch('%s.createLock' % MODULE_NAME, new=Mock(return_value=S_ERROR('test_createlock_failed_err'))):
-      result = install(('appname', 'appvers'), 'app_tar.tar.gz', 'tarballURL', True, 'md5sum', 'area')
-      assertDiracFailsWith( result, 'test_createlock_failed_err', self )
-
-  def test_install_already_installed( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import install
-    with patch('%s.os.chdir' % MODULE_NAME), \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_OK(False))), \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=True)):
-      result = install(('appname', 'appvers'), 'app_tar.tar.gz', 'tarballURL', False, 'md5sum', 'area')
-      assertDiracSucceedsWith_equals( result, ['app_tar', 'app_tar.tar.gz'], self )
+class TestTARsoftInstall( unittest.TestCase ):
+  """ Tests the installation with real files: tar ball store, locking and unpacking """
+
+  def setUp( self ):
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    self.area = os.path.join( self.tmpdir, 'area' )
+    os.mkdir( self.area )
+    self.downloads = []
+    self.tarballs = {}
+    self.downloadPatch = patch( '%s.downloadFile' % MODULE_NAME, new = self.download )
+    self.downloadPatch.start()
 
-  def test_install_delete_old_fails( self ):
+  def tearDown( self ):
+    self.downloadPatch.stop()
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
+
+  def download( self, _tarballURL, app_tar, _folder_name, destinationDir = '' ):
+    """ copy the tar ball prepared for app_tar, or the next one of the list """
+    self.downloads.append( app_tar )
+    tarballs = self.tarballs[ app_tar ]
+    source = tarballs.pop( 0 ) if len( tarballs ) > 1 else tarballs[ 0 ]
+    if source is None:
+      return S_ERROR( 'download_test_err' )
+    shutil.copy( source, os.path.join( destinationDir, os.path.basename( app_tar ) ) )
+    return S_OK()
+
+  def createTarBall( self, app_tar, files ):
+    """ create a tar ball containing files, a dict path: content, return its md5 sum """
+    from ILCDIRAC.Core.Utilities.TARsoft import md5File
+    source = os.path.join( self.tmpdir, 'source' )
+    shutil.rmtree( source, ignore_errors = True )
+    os.mkdir( source )
+    tarBallPath = tempfile.mktemp( dir = self.tmpdir )
+    tarBall = tarfile.open( tarBallPath, 'w:gz' )
+    for path, content in sorted( files.items() ):
+      fullPath = os.path.join( source, path )
+      if not os.path.isdir( os.path.dirname( fullPath ) ):
+        os.makedirs( os.path.dirname( fullPath ) )
+      if content is None:
+        os.mkdir( fullPath )
+      else:
+        with open( fullPath, 'w' ) as out:
+          out.write( content )
+      tarBall.add( fullPath, path )
+    tarBall.close()
+    self.tarballs.setdefault( app_tar, [] ).append( tarBallPath )
+    return md5File( tarBallPath )
+
+  def install( self, overwrite = False, md5sum = None, app = ( 'myapp', '1.0' ), app_tar = 'myapp1.0.tgz' ):
+    """ call install with the test area """
     from ILCDIRAC.Core.Utilities.TARsoft import install
-    with patch('%s.os.chdir' % MODULE_NAME), \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_OK(False))), \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=True)), \
-         patch('%s.createLock' % MODULE_NAME, new=Mock(return_value=S_OK())), \
-         patch('%s.deleteOld' % MODULE_NAME, new=Mock(return_value=S_ERROR('test_deleteold_file_error'))), \
-         patch('%s.clearLock' % MODULE_NAME, new=Mock(return_value=True)) as clearlock_mock:
-      result = install(('appname', 'appvers'), 'app_tar.tar.gz', 'tarballURL', True, 'md5sum', 'area')
-      assertDiracFailsWith( result, 'test_deleteold_file_error', self )
-      clearlock_mock.assert_called_once_with( 'app_tar.lock' )
+    return install( app, app_tar, 'http://url/', overwrite, md5sum, self.area )
+
+  def test_install( self ):
+    md5sum = self.createTarBall( 'myapp1.0.tgz', { 'myapp1.0/bin/exe': 'binary' } )
+    assertDiracSucceedsWith_equals( self.install( md5sum = md5sum ), [ 'myapp1.0', 'myapp1.0.tgz' ], self )
+    with open( os.path.join( self.area, 'myapp1.0', 'bin', 'exe' ) ) as exe:
+      assertEqualsImproved( exe.read(), 'binary', self )
+    assertEqualsImproved( sorted( os.listdir( self.area ) ), [ '.tarballs', 'myapp1.0' ], self )
+    assertEqualsImproved( os.listdir( os.path.join( self.area, '.tarballs' ) ), [ md5sum ], self )
+    ## already installed, no need to lock anything
+    with patch( '%s.acquireLock' % MODULE_NAME ) as lock_mock:
+      assertDiracSucceedsWith_equals( self.install( md5sum = md5sum ), [ 'myapp1.0', 'myapp1.0.tgz' ], self )
+    self.assertFalse( lock_mock.called )
+    ## a broken installation is repaired from the tar ball store
+    shutil.rmtree( os.path.join( self.area, 'myapp1.0' ) )
+    assertDiracSucceeds( self.install( md5sum = md5sum ), self )
+    self.assertTrue( os.path.exists( os.path.join( self.area, 'myapp1.0', 'bin', 'exe' ) ) )
+    assertEqualsImproved( self.downloads, [ 'myapp1.0.tgz' ], self )
+
+  def test_install_shared_store( self ):
+    md5sum = self.createTarBall( 'myapp1.0.tgz', { 'myapp1.0/bin/exe': 'binary' } )
+    with patch.dict( os.environ, { 'ILCDIRAC_TARBALL_STORE': os.path.join( self.tmpdir, 'store' ) } ):
+      assertDiracSucceeds( self.install( md5sum = md5sum ), self )
+      self.area = os.path.join( self.tmpdir, 'other_area' )
+      os.mkdir( self.area )
+      assertDiracSucceeds( self.install( md5sum = md5sum ), self )
+    self.assertTrue( os.path.exists( os.path.join( self.area, 'myapp1.0', 'bin', 'exe' ) ) )
+    assertEqualsImproved( self.downloads, [ 'myapp1.0.tgz' ], self )
+
+  def test_install_md5_retry( self ):
+    self.createTarBall( 'myapp1.0.tgz', { 'myapp1.0/corrupted': 'garbage' } )
+    md5sum = self.createTarBall( 'myapp1.0.tgz', { 'myapp1.0/bin/exe': 'binary' } )
+    assertDiracSucceeds( self.install( md5sum = md5sum ), self )
+    assertEqualsImproved( os.listdir( os.path.join( self.area, 'myapp1.0' ) ), [ 'bin' ], self )
+    assertEqualsImproved( len( self.downloads ), 2, self )
+
+  def test_install_md5_fails( self ):
+    self.createTarBall( 'myapp1.0.tgz', { 'myapp1.0/corrupted': 'garbage' } )
+    assertDiracFailsWith( self.install( md5sum = 'wrongmd5' ), 'md5 check failed', self )
+    assertEqualsImproved( os.listdir( self.area ), [ '.tarballs' ], self )
+    assertEqualsImproved( os.listdir( os.path.join( self.area, '.tarballs' ) ), [], self )
+    assertEqualsImproved( len( self.downloads ), 2, self )
+
+  def test_install_md5_unreadable( self ):
+    md5sum = self.createTarBall( 'myapp1.0.tgz', { 'myapp1.0/bin/exe': 'binary' } )
+    with patch( '%s.md5File' % MODULE_NAME, new=Mock( side_effect=IOError( 'cannot read' ) ) ):
+      assertDiracSucceeds( self.install( md5sum = md5sum ), self )
+    self.assertTrue( os.path.exists( os.path.join( self.area, 'myapp1.0', 'bin', 'exe' ) ) )
+    assertEqualsImproved( os.listdir( os.path.join( self.area, '.tarballs' ) ), [ 'unchecked_myapp1.0.tgz' ], self )
+    assertEqualsImproved( len( self.downloads ), 1, self )
 
   def test_install_download_fails( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import install
-    with patch('%s.os.chdir' % MODULE_NAME), \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_OK(False))), \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=False)), \
-         patch('%s.createLock' % MODULE_NAME, new=Mock(return_value=S_OK())), \
-         patch('%s.downloadFile' % MODULE_NAME, new=Mock(return_value=S_ERROR('test_download_file_error'))), \
-         patch('%s.clearLock' % MODULE_NAME, new=Mock(return_value=True)) as clearlock_mock:
-      result = install(('appname', 'appvers'), 'app_tar.tar.gz', 'tarballURL', False, 'md5sum', 'area')
-      assertDiracFailsWith( result, 'test_download_file_error', self )
-      clearlock_mock.assert_called_once_with( 'app_tar.lock' )
-
-  def test_install_downloaded_file_doesnt_exist( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import install
-    with patch('%s.os.chdir' % MODULE_NAME), \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_OK(False))), \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=False)) as exists_mock, \
-         patch('%s.createLock' % MODULE_NAME, new=Mock(return_value=S_OK())), \
-         patch('%s.downloadFile' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.clearLock' % MODULE_NAME, new=Mock(return_value=True)) as clearlock_mock, \
-         patch('%s.os.getcwd' % MODULE_NAME, new=Mock(return_value='/my/cwd/test')):
-      result = install(('appname', 'appvers'), 'app_tar.tar.gz', 'tarballURL', False, 'md5sum', 'area')
-      assertDiracFailsWith( result, 'failed to download software', self )
-      clearlock_mock.assert_called_once_with( 'app_tar.lock' )
-      assertMockCalls( exists_mock, [ 'app_tar', '/my/cwd/test/app_tar.tar.gz' ], self )
-
-  def test_install_md5check_cannot_remove_old_file( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import install
-    with patch('%s.os.chdir' % MODULE_NAME), \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_OK(False))), \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=[False, True])), \
-         patch('%s.createLock' % MODULE_NAME, new=Mock(return_value=S_OK())), \
-         patch('%s.downloadFile' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.clearLock' % MODULE_NAME, new=Mock(return_value=True)) as clearlock_mock, \
-         patch('%s.os.getcwd' % MODULE_NAME, new=Mock(return_value='/my/cwd/test')), \
-         patch('%s.tarMd5Check' % MODULE_NAME, new=Mock(return_value=S_ERROR('test_md5check_fails'))), \
-         patch('%s.deleteOld' % MODULE_NAME, new=Mock(return_value=S_ERROR('deleteold_test_error'))), \
-         patch('%s.os.unlink' % MODULE_NAME, new=Mock(side_effect=OSError('my_os_err_test'))), \
-         patch('%s.gLogger.error' % MODULE_NAME, new=Mock(return_value=True)) as log_mock:
-      result = install(('appname', 'appvers'), 'app_tar.tar.gz', 'tarballURL', False, 'md5sum', 'area')
-      assertDiracFailsWith( result, 'deleteold_test_error', self )
-      log_mock.assert_called_with('Failed to clean tar ball, something bad is happening')
-      clearlock_mock.assert_called_once_with( 'app_tar.lock' )
-
-  def test_install_md5check_download_file_fails( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import install
-    with patch('%s.os.chdir' % MODULE_NAME), \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_OK(False))), \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=[False, True])), \
-         patch('%s.createLock' % MODULE_NAME, new=Mock(return_value=S_OK())), \
-         patch('%s.downloadFile' % MODULE_NAME, new=Mock(side_effect=[S_OK(True), S_ERROR('download_file_test_err')])), \
-         patch('%s.clearLock' % MODULE_NAME, new=Mock(return_value=True)) as clearlock_mock, \
-         patch('%s.os.getcwd' % MODULE_NAME, new=Mock(return_value='/my/cwd/test')), \
-         patch('%s.tarMd5Check' % MODULE_NAME, new=Mock(return_value=S_ERROR('test_md5check_fails'))), \
-         patch('%s.deleteOld' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.os.unlink' % MODULE_NAME):
-      result = install(('appname', 'appvers'), 'app_tar.tar.gz', 'tarballURL', False, 'md5sum', 'area')
-      assertDiracFailsWith( result, 'download_file_test_err', self )
-      clearlock_mock.assert_called_once_with( 'app_tar.lock' )
-
-  def test_install_second_md5check_fails( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import install
-    with patch('%s.os.chdir' % MODULE_NAME), \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_OK(False))), \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=[False, True])), \
-         patch('%s.createLock' % MODULE_NAME, new=Mock(return_value=S_OK())), \
-         patch('%s.downloadFile' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.clearLock' % MODULE_NAME, new=Mock(return_value=True)) as clearlock_mock, \
-         patch('%s.os.getcwd' % MODULE_NAME, new=Mock(return_value='/my/cwd/test')), \
-         patch('%s.tarMd5Check' % MODULE_NAME, new=Mock(return_value=S_ERROR('test_md5check_fails'))), \
-         patch('%s.deleteOld' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.os.unlink' % MODULE_NAME):
-      result = install(('appname', 'appvers'), 'app_tar.tar.gz', 'tarballURL', False, 'md5sum', 'area')
-      assertDiracFailsWith( result, 'md5 check failed', self )
-      clearlock_mock.assert_called_once_with( 'app_tar.lock' )
-
-  def test_install_tarfile_extract_fails( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import install
+    self.tarballs[ 'myapp1.0.tgz' ] = [ None ]
+    assertDiracFailsWith( self.install( md5sum = 'md5' ), 'download_test_err', self )
+    assertEqualsImproved( os.listdir( self.area ), [ '.tarballs' ], self )
+
+  def test_install_no_md5( self ):
+    self.createTarBall( 'myapp1.0.tgz', { 'myapp1.0/bin/exe': 'binary' } )
+    assertDiracSucceeds( self.install( md5sum = '' ), self )
+    self.assertTrue( os.path.exists( os.path.join( self.area, 'myapp1.0', 'bin', 'exe' ) ) )
+
+  def test_install_overwrite( self ):
+    md5sum = self.createTarBall( 'myapp1.0.tgz', { 'myapp1.0/bin/exe': 'binary' } )
+    os.makedirs( os.path.join( self.area, 'myapp1.0', 'old' ) )
+    assertDiracSucceeds( self.install( overwrite = True, md5sum = md5sum ), self )
+    assertEqualsImproved( os.listdir( os.path.join( self.area, 'myapp1.0' ) ), [ 'bin' ], self )
+    ## only installed once per job
+    os.mkdir( os.path.join( self.area, 'myapp1.0', 'new' ) )
+    assertDiracSucceeds( self.install( overwrite = True, md5sum = md5sum ), self )
+    assertEqualsImproved( sorted( os.listdir( os.path.join( self.area, 'myapp1.0' ) ) ), [ 'bin', 'new' ], self )
+
+  def test_install_slic( self ):
+    md5sum = self.createTarBall( 'slic.tgz', { 'SlicBase/packages/slic/v1/README': 'slic' } )
+    assertDiracSucceedsWith_equals( self.install( md5sum = md5sum, app = ( 'slic', 'v2' ), app_tar = 'slic.tgz' ),
+                                    [ 'slicv2', 'slic.tgz' ], self )
+    self.assertTrue( os.path.exists( os.path.join( self.area, 'slicv2', 'packages', 'slic', 'v1', 'README' ) ) )
+    self.assertFalse( os.path.exists( os.path.join( self.area, 'SlicBase' ) ) )
+
+  def test_install_jar( self ):
+    jar = os.path.join( self.tmpdir, 'lcsim.jar' )
+    with open( jar, 'w' ) as out:
+      out.write( 'not a tar ball' )
+    self.tarballs[ 'lcsim.jar' ] = [ jar ]
+    assertDiracSucceedsWith_equals( self.install( md5sum = '', app = ( 'lcsim', '1' ), app_tar = 'lcsim.jar' ),
+                                    [ 'lcsim.jar', 'lcsim.jar' ], self )
+    self.assertTrue( os.path.isfile( os.path.join( self.area, 'lcsim.jar' ) ) )
+
+  def test_install_empty_folder( self ):
+    md5sum = self.createTarBall( 'myapp1.0.tgz', { 'myapp1.0': None } )
+    assertDiracFailsWith( self.install( md5sum = md5sum ), 'folder myapp1.0 is empty', self )
+    self.assertFalse( os.path.exists( os.path.join( self.area, 'myapp1.0' ) ) )
+
+  def test_install_extract_fails( self ):
     from tarfile import TarError
-    untar_me_mock = Mock()
-    untar_me_mock.extractall.side_effect=TarError('custom_tar_test_err')
-    with patch('%s.os.chdir' % MODULE_NAME), \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_OK(False))), \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=[False, True])), \
-         patch('%s.createLock' % MODULE_NAME, new=Mock(return_value=S_OK())), \
-         patch('%s.downloadFile' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.clearLock' % MODULE_NAME, new=Mock(return_value=True)) as clearlock_mock, \
-         patch('%s.os.getcwd' % MODULE_NAME, new=Mock(return_value='/my/cwd/test')), \
-         patch('%s.tarMd5Check' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.deleteOld' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.os.unlink' % MODULE_NAME), \
-         patch('%s.tarfile.is_tarfile' % MODULE_NAME, new=Mock(return_value=True)) as istar_mock, \
-         patch('%s.tarfile.open' % MODULE_NAME, new=Mock(return_value=untar_me_mock)) as tar_open_mock:
-      result = install(('appname', 'appvers'), 'app_tar.tar.gz', 'tarballURL', False, 'md5sum', 'area')
-      assertDiracFailsWith(
-        result, 'Could not extract tar ball app_tar.tar.gz because of custom_tar_test_err, cannot continue ',
-        self )
-      clearlock_mock.assert_called_once_with( 'app_tar.lock' )
-      istar_mock.assert_called_once_with( 'app_tar.tar.gz' )
-      tar_open_mock.assert_called_once_with( 'app_tar.tar.gz' )
-
-  def test_install_tarfile_isslic_rename_fails( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import install
-    untar_member0 = Mock()
-    untar_member0.name = 'member0/file1.txt'
-    untar_me_mock = Mock()
-    untar_me_mock.getmembers.return_value = [untar_member0, 'member1']
-    with patch('%s.os.chdir' % MODULE_NAME), \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_OK(False))), \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=[False, True])), \
-         patch('%s.createLock' % MODULE_NAME, new=Mock(return_value=S_OK())), \
-         patch('%s.downloadFile' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.clearLock' % MODULE_NAME, new=Mock(return_value=True)) as clearlock_mock, \
-         patch('%s.os.getcwd' % MODULE_NAME, new=Mock(return_value='/my/cwd/test')), \
-         patch('%s.tarMd5Check' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.deleteOld' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.os.unlink' % MODULE_NAME), \
-         patch('%s.tarfile.is_tarfile' % MODULE_NAME, new=Mock(return_value=True)), \
-         patch('%s.tarfile.open' % MODULE_NAME, new=Mock(return_value=untar_me_mock)), \
-         patch('%s.os.rename' % MODULE_NAME, new=Mock(side_effect=OSError('test_cannot_rename_err'))) as rename_mock:
-      result = install(('appname', 'appvers'), 'slic.tar.gz', 'tarballURL', False, 'md5sum', 'area')
-      assertDiracFailsWith( result, 'Could not rename slic directory', self )
-      clearlock_mock.assert_called_once_with( 'slic.lock' )
-      rename_mock.assert_called_once_with( 'member0', 'slic' )
-      self.assertTrue( untar_me_mock.extractall.called )
-
-  def test_install_tarfile_isslic_listdir_empty( self ):
-    from ILCDIRAC.Core.Utilities.TARsoft import install
-    untar_member0 = Mock()
-    untar_member0.name = 'member0/file1.txt'
-    untar_me_mock = Mock()
-    untar_me_mock.getmembers.return_value = [untar_member0, 'member1']
-    with patch('%s.os.chdir' % MODULE_NAME), \
-         patch('%s.checkLockAge' % MODULE_NAME, new=Mock(return_value=S_OK(False))), \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=[False, True])), \
-         patch('%s.createLock' % MODULE_NAME, new=Mock(return_value=S_OK())), \
-         patch('%s.downloadFile' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.clearLock' % MODULE_NAME, new=Mock(return_value=True)) as clearlock_mock, \
-         patch('%s.os.getcwd' % MODULE_NAME, new=Mock(return_value='/my/cwd/test')), \
-         patch('%s.tarMd5Check' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.deleteOld' % MODULE_NAME, new=Mock(return_value=S_OK(True))), \
-         patch('%s.os.unlink' % MODULE_NAME), \
-         patch('%s.tarfile.is_tarfile' % MODULE_NAME, new=Mock(return_value=True)), \
-         patch('%s.tarfile.open' % MODULE_NAME, new=Mock(return_value=untar_me_mock)), \
-         patch('%s.os.rename' % MODULE_NAME, new=Mock(return_value=True)) as rename_mock, \
-         patch('%s.os.listdir' % MODULE_NAME, new=Mock(return_value=[])) as listdir_mock:
-      result = install(('appname', 'appvers'), 'slic.tar.gz', 'tarballURL', False, 'md5sum', 'area')
-      assertDiracFailsWith( result, 'folder ', self )
-      clearlock_mock.assert_called_once_with( 'slic.lock' )
-      rename_mock.assert_called_once_with( 'member0', 'slic' )
-      self.assertTrue( untar_me_mock.extractall.called )
-      listdir_mock.assert_called_once_with( 'slic' )
+    md5sum = self.createTarBall( 'myapp1.0.tgz', { 'myapp1.0/bin/exe': 'binary' } )
+    with patch( '%s.tarfile.TarFile.extractall' % MODULE_NAME, new = Mock( side_effect = TarError( 'tar_test_err' ) ) ):
+      assertDiracFailsWith( self.install( md5sum = md5sum ), 'could not extract tar ball myapp1.0', self )
+    assertEqualsImproved( os.listdir( self.area ), [ '.tarballs' ], self )
+
+  def test_install_removes_unfinished( self ):
+    md5sum = self.createTarBall( 'myapp1.0.tgz', { 'myapp1.0/bin/exe': 'binary' } )
+    os.makedirs( os.path.join( self.area, '.myapp1.0.tmpXYZ', 'myapp1.0' ) )
+    assertDiracSucceeds( self.install( md5sum = md5sum ), self )
+    assertEqualsImproved( sorted( os.listdir( self.area ) ), [ '.tarballs', 'myapp1.0' ], self )
+
+  def test_clean_store( self ):
+    from ILCDIRAC.Core.Utilities.TARsoft import cleanTarBallStore
+    store = os.path.join( self.tmpdir, 'store' )
+    os.mkdir( store )
+    for name in ( 'old', 'new' ):
+      with open( os.path.join( store, name ), 'w' ) as out:
+        out.write( name )
+    os.utime( os.path.join( store, 'old' ), ( 1, 1 ) )
+    assertDiracSucceedsWith_equals( cleanTarBallStore( store ), 1, self )
+    assertEqualsImproved( os.listdir( store ), [ 'new' ], self )
+
+  def test_lock( self ):
+    from ILCDIRAC.Core.Utilities.TARsoft import acquireLock, releaseLock
+    lockname = os.path.join( self.area, 'myapp.lock' )
+    res = acquireLock( lockname )
+    assertDiracSucceeds( res, self )
+    acquired = []
+    def waitForLock():
+      lockRes = acquireLock( lockname )
+      acquired.append( time.time() )
+      releaseLock( lockname, lockRes['Value'] )
+    thread = threading.Thread( target = waitForLock )
+    thread.start()
+    time.sleep( 0.2 )
+    self.assertEqual( acquired, [] )
+    released = time.time()
+    releaseLock( lockname, res['Value'] )
+    thread.join()
+    self.assertLess( acquired[ 0 ] - released, 1 )
+    self.assertFalse( os.path.exists( lockname ) )
+
+  def test_unpack_packages( self ):
+    from ILCDIRAC.Core.Utilities.TARsoft import unpackPackages
+    running = []
+    maxRunning = []
+    def slowInstall( app, *_args ):
+      running.append( app )
+      maxRunning.append( len( running ) )
+      time.sleep( 0.1 )
+      running.remove( app )
+      return S_OK()
+    apps = [ [ 'app%d' % index, '1.0' ] for index in range( 3 ) ]
+    with patch( '%s.getTarBallLocation' % MODULE_NAME, new = Mock( return_value = S_OK( [ 'a.tgz', 'url', False, '' ] ) ) ), \
+         patch( '%s.install' % MODULE_NAME, new = Mock( side_effect = slowInstall ) ) as install_mock:
+      assertDiracSucceeds( unpackPackages( apps, 'myconf', [ 'myarea' ] ), self )
+    self.assertGreater( max( maxRunning ), 1 )
+    assertEqualsImproved( sorted( call[0][0] for call in install_mock.call_args_list ), apps, self )
 
 MODULE_NAME = 'ILCDIRAC.Core.Utilities.TARsoft'
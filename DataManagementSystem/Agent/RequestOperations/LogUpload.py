@@ -4,15 +4,25 @@
 Uploads log files to the LogSE that were uploaded to a GridSE as a failover
 mechanism. Removes log files from the GridSE
 
+The waiting files of the operation are replicated in parallel by up to MaxThreads threads, MaxThreads can be
+set in the CS section of the handler. When the GridSE holding the file and the LogSE share a third party
+protocol the file is replicated directly between them, otherwise it goes through the local cache.
+The time and the number of bytes of every replication are reported to gMonitor, the size of the files created
+without it is taken from the catalog.
+
 Adapted from LHCbDirac.
 
 """
 
 import os
+import time
 
 from DIRAC                                                      import S_OK, S_ERROR
 from DIRAC.FrameworkSystem.Client.MonitoringClient              import gMonitor
 from DIRAC.RequestManagementSystem.private.OperationHandlerBase import OperationHandlerBase
+from DIRAC.Resources.Storage.StorageElement                     import StorageElement
+
+from ILCDIRAC.Core.Utilities.Concurrency                        import starmapConcurrently
 
 __RCSID__ = "$Id$"
 
@@ -20,6 +30,8 @@ class LogUpload( OperationHandlerBase ):
   """
   LogUpload operation handler
   """
+  #: number of files replicated in parallel
+  MaxThreads = 8
 
   def __init__( self, operation = None, csPath = None ):
     """c'tor
@@ -37,6 +49,10 @@ class LogUpload( OperationHandlerBase ):
                                "RequestExecutingAgent", "Files/min", gMonitor.OP_SUM )
     gMonitor.registerActivity( "LogUploadFail", "Replications failed",
                                "RequestExecutingAgent", "Files/min", gMonitor.OP_SUM )
+    gMonitor.registerActivity( "LogUploadTime", "Time per replication",
+                               "RequestExecutingAgent", "Seconds", gMonitor.OP_MEAN )
+    gMonitor.registerActivity( "LogUploadBytes", "Replicated bytes",
+                               "RequestExecutingAgent", "Bytes/min", gMonitor.OP_SUM )
     self.workDirectory = os.environ.get( 'LOGUPLOAD_CACHE', os.environ.get( 'AGENT_WORKDIRECTORY', '/tmp/LogUpload' ) )
 
   def __call__( self ):
@@ -77,18 +93,33 @@ class LogUpload( OperationHandlerBase ):
     # # get waiting files
     waitingFiles = self.getWaitingFilesList()
 
-    # # loop over files
+    if not waitingFiles:
+      return S_OK()
+
+    self.setFileSizes( waitingFiles )
+
+    # # find the SEs the files can be copied from with third party transfers
+    sourceSEs = self.getSourceSEs( [ opFile.LFN for opFile in waitingFiles ], targetSE )
+    thirdPartySEs = set( sourceSE for sourceSE in set( sourceSEs.values() )
+                         if self.isThirdPartyPossible( sourceSE, targetSE ) )
+    argsList = []
     for opFile in waitingFiles:
+      sourceSE = sourceSEs.get( opFile.LFN )
+      argsList.append( ( opFile.LFN, targetSE, sourceSE if sourceSE in thirdPartySEs else None ) )
+
+    startTime = time.time()
+    results = starmapConcurrently( self.replicateLog, argsList, self.MaxThreads )
+    totalTime = time.time() - startTime
+
+    # # loop over files
+    uploadedBytes = 0
+    for opFile, ( logUpload, replicationTime ) in zip( waitingFiles, results ):
       # # get LFN
       lfn = opFile.LFN
-      self.log.info( "processing file %s" % lfn )
+      self.log.info( "processed file %s in %.1f seconds" % ( lfn, replicationTime ) )
       gMonitor.addMark( "LogUploadAtt", 1 )
+      gMonitor.addMark( "LogUploadTime", replicationTime )
 
-      destinationFolder = '/'.join( lfn.split( '/' )[0:-1] )
-      destinationSubFolder = "%03d" % ( int(( os.path.basename( lfn ) ).split( '_' )[1].split( '.' )[0]) / 1000)
-      destination = destinationFolder + '/' + destinationSubFolder
-
-      logUpload = self.dm.replicate( lfn, targetSE, destPath = destination, localCache = self.workDirectory )
       if not logUpload["OK"]:
         gMonitor.addMark( "LogUploadFail", 1 )
 #         self.dataLoggingClient().addFileRecord( lfn, "LogUploadFail", targetSE, "", "LogUpload" )
@@ -102,13 +133,71 @@ class LogUpload( OperationHandlerBase ):
 
       if lfn in logUpload['Value']:
         gMonitor.addMark( "LogUploadOK", 1 )
+        gMonitor.addMark( "LogUploadBytes", opFile.Size or 0 )
+        uploadedBytes += opFile.Size or 0
 #         self.dataLoggingClient().addFileRecord( lfn, "LogUpload", targetSE, "", "LogUpload" )
         opFile.Status = 'Done'
         self.log.info( "Uploaded %s to %s" % ( lfn, targetSE ) )
 
+    self.log.info( "Replicated %d files, %.1f MB in %.1f seconds (%.2f MB/s)" %
+                   ( len( waitingFiles ), uploadedBytes / 1024. / 1024., totalTime,
+                     uploadedBytes / 1024. / 1024. / max( totalTime, 1e-3 ) ) )
     return S_OK()
 
 
+  def setFileSizes( self, opFiles ):
+    """ set the size of the files without size from the catalog metadata, the size is only used for monitoring """
+    lfns = [ opFile.LFN for opFile in opFiles if not opFile.Size ]
+    if not lfns:
+      return
+    res = self.fc.getFileMetadata( lfns )
+    if not res['OK']:
+      self.log.warn( "Failed to get the size of the files:", res['Message'] )
+      return
+    for opFile in opFiles:
+      metadata = res['Value']['Successful'].get( opFile.LFN )
+      if metadata and not opFile.Size:
+        opFile.Size = metadata.get( 'Size' ) or 0
+
+  def getSourceSEs( self, lfns, targetSE ):
+    """ returns the dictionary lfn: SE holding a replica of the file that is not the targetSE,
+        for the files whose replicas could be found """
+    res = self.dm.getActiveReplicas( lfns )
+    if not res['OK']:
+      self.log.warn( "Failed to get the replicas, files go through the local cache:", res['Message'] )
+      return {}
+    sourceSEs = {}
+    for lfn, replicas in res['Value']['Successful'].items():
+      otherSEs = sorted( seName for seName in replicas if seName != targetSE )
+      if otherSEs:
+        sourceSEs[lfn] = otherSEs[0]
+    return sourceSEs
+
+  def isThirdPartyPossible( self, sourceSE, targetSE ):
+    """ check if the targetSE and the sourceSE have a protocol in common for third party transfers """
+    res = StorageElement( targetSE ).negociateProtocolWithOtherSE( sourceSE )
+    if not res['OK']:
+      self.log.verbose( "Cannot negotiate protocols between %s and %s:" % ( sourceSE, targetSE ), res['Message'] )
+      return False
+    return bool( res['Value'] )
+
+  def replicateLog( self, lfn, targetSE, sourceSE = None ):
+    """ replicate the log file to the targetSE, directly from the sourceSE if given, otherwise through the
+        local cache
+
+    :returns: tuple of the result of the replication and the time it took
+    """
+    destinationFolder = '/'.join( lfn.split( '/' )[0:-1] )
+    destinationSubFolder = "%03d" % ( int(( os.path.basename( lfn ) ).split( '_' )[1].split( '.' )[0]) / 1000)
+    destination = destinationFolder + '/' + destinationSubFolder
+
+    startTime = time.time()
+    if sourceSE:
+      logUpload = self.dm.replicate( lfn, targetSE, sourceSE = sourceSE, destPath = destination )
+    else:
+      logUpload = self.dm.replicate( lfn, targetSE, destPath = destination, localCache = self.workDirectory )
+    return logUpload, time.time() - startTime
+
   def setOperation( self, operation ): #pylint: disable=useless-super-delegation
     """ operation and request setter
 
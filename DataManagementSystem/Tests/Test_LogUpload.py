@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Test the LogUpload RequestOperation"""
+
+import time
+import unittest
+
+from mock import patch, call, MagicMock as Mock
+
+from DIRAC import S_OK, S_ERROR
+from ILCDIRAC.DataManagementSystem.Agent.RequestOperations.LogUpload import LogUpload
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved, assertDiracFailsWith, \
+  assertDiracSucceeds
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.DataManagementSystem.Agent.RequestOperations.LogUpload'
+
+LFN_DIR = '/ilc/prod/clic/500gev/Z_uds/ILD/REC/00012345/LOG/000'
+
+def replicateMock( lfn, _targetSE, **kwargs ):
+  """ replicate the files, the first one slower than the others, the second one fails """
+  if lfn.endswith( '_1000.tar' ):
+    time.sleep( 0.05 )
+  if lfn.endswith( '_1001.tar' ):
+    return S_ERROR( 'Transfer failed' )
+  return S_OK( { lfn : kwargs } )
+
+#pylint: disable=protected-access
+@patch( '%s.gMonitor' % MODULE_NAME, new = Mock() )
+class TestLogUpload( unittest.TestCase ):
+  """ Test the replication of the log files """
+
+  def setUp( self ):
+    with patch( '%s.OperationHandlerBase.__init__' % MODULE_NAME, new = Mock( return_value = None ) ):
+      self.handler = LogUpload()
+    self.handler.log = Mock()
+    self.handler.dm = Mock()
+    self.handler.fc = Mock()
+    self.handler.operation = Mock()
+    self.handler.operation.targetSE = 'LogSE'
+    self.handler.operation.targetSEList = [ 'LogSE' ]
+    self.handler.workDirectory = '/tmp/LogUpload'
+    self.files = [ Mock( LFN = '%s/prod_%s.tar' % ( LFN_DIR, index ), Size = 0, Attempt = 0, Error = '',
+                         Status = 'Waiting' ) for index in range( 1000, 1004 ) ]
+    self.files[1].Size = 2048
+    self.handler.getWaitingFilesList = Mock( return_value = self.files )
+    self.handler.rssSEStatus = Mock( return_value = S_OK( True ) )
+    self.handler.fc.getFileMetadata.return_value = S_OK( { 'Successful' : { self.files[0].LFN : { 'Size' : 1024 },
+                                                                           self.files[2].LFN : {} },
+                                                           'Failed' : { self.files[3].LFN : 'No such file' } } )
+    self.handler.dm.getActiveReplicas.return_value = S_OK( {
+      'Successful' : { self.files[0].LFN : { 'LogSE' : 'pfn', 'DISK-SE' : 'pfn' },
+                       self.files[1].LFN : { 'TAPE-SE' : 'pfn' },
+                       self.files[2].LFN : { 'LogSE' : 'pfn' } },
+      'Failed' : { self.files[3].LFN : 'No replicas' } } )
+    self.handler.dm.replicate.side_effect = replicateMock
+    self.seMock = Mock()
+    self.seMock.negociateProtocolWithOtherSE.side_effect = lambda sourceSE: S_OK( [ 'root' ] ) \
+      if sourceSE == 'DISK-SE' else S_OK( [] )
+
+  def test_call( self ):
+    with patch( '%s.StorageElement' % MODULE_NAME, new = Mock( return_value = self.seMock ) ):
+      assertDiracSucceeds( self.handler(), self )
+    ## the results are matched to the files in the order of the files, not in the order they finish
+    assertEqualsImproved( [ opFile.Status for opFile in self.files ], [ 'Done', 'Waiting', 'Done', 'Done' ], self )
+    assertEqualsImproved( ( self.files[1].Attempt, self.files[1].Error ), ( 1, 'Transfer failed' ), self )
+    assertEqualsImproved( self.handler.operation.Error, 'Transfer failed', self )
+    ## only the files with a replica on a SE with a common protocol are replicated directly
+    destination = '%s/001' % LFN_DIR
+    replicateCalls = sorted( self.handler.dm.replicate.mock_calls, key = lambda replicateCall: replicateCall[1][0] )
+    assertEqualsImproved( replicateCalls, [
+      call( self.files[0].LFN, 'LogSE', sourceSE = 'DISK-SE', destPath = destination ),
+      call( self.files[1].LFN, 'LogSE', destPath = destination, localCache = '/tmp/LogUpload' ),
+      call( self.files[2].LFN, 'LogSE', destPath = destination, localCache = '/tmp/LogUpload' ),
+      call( self.files[3].LFN, 'LogSE', destPath = destination, localCache = '/tmp/LogUpload' ) ], self )
+    ## the sizes of the files without size are taken from the catalog
+    self.handler.fc.getFileMetadata.assert_called_once_with( [ self.files[0].LFN, self.files[2].LFN,
+                                                               self.files[3].LFN ] )
+    assertEqualsImproved( [ opFile.Size for opFile in self.files ], [ 1024, 2048, 0, 0 ], self )
+
+  def test_call_serial( self ):
+    self.handler.MaxThreads = 1
+    self.handler.dm.getActiveReplicas.return_value = S_ERROR( 'catalog down' )
+    self.handler.fc.getFileMetadata.return_value = S_ERROR( 'catalog down' )
+    assertDiracSucceeds( self.handler(), self )
+    assertEqualsImproved( [ opFile.Status for opFile in self.files ], [ 'Done', 'Waiting', 'Done', 'Done' ], self )
+    for replicateCall in self.handler.dm.replicate.mock_calls:
+      self.assertNotIn( 'sourceSE', replicateCall[2] )
+    assertEqualsImproved( [ opFile.Size for opFile in self.files ], [ 0, 2048, 0, 0 ], self )
+
+  def test_call_failures( self ):
+    self.handler.dm.replicate.side_effect = [ S_ERROR( 'No such file or directory' ), S_ERROR( 'Timeout' ),
+                                              S_OK( { 'other_lfn' : {} } ), S_OK( { self.files[3].LFN : {} } ) ]
+    self.handler.MaxThreads = 1
+    with patch( '%s.StorageElement' % MODULE_NAME, new = Mock( return_value = self.seMock ) ):
+      assertDiracSucceeds( self.handler(), self )
+    assertEqualsImproved( [ opFile.Status for opFile in self.files ], [ 'Failed', 'Waiting', 'Waiting', 'Done' ],
+                          self )
+    assertEqualsImproved( [ opFile.Attempt for opFile in self.files ], [ 1, 1, 0, 0 ], self )
+
+  def test_call_wrong_target( self ):
+    self.handler.operation.targetSEList = [ 'LogSE', 'OtherSE' ]
+    self.handler.operation.__iter__ = Mock( return_value = iter( self.files ) )
+    assertDiracFailsWith( self.handler(), 'should contain only one target', self )
+    assertEqualsImproved( set( opFile.Status for opFile in self.files ), set( [ 'Failed' ] ), self )
+    self.assertFalse( self.handler.dm.replicate.called )
+
+  def test_call_target_banned( self ):
+    self.handler.rssSEStatus.return_value = S_OK( False )
+    assertDiracFailsWith( self.handler(), 'banned for writing', self )
+    self.assertFalse( self.handler.dm.replicate.called )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestLogUpload )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
@@ -17,6 +17,10 @@ For all above cases the following procedure should be used to achieve 100%:
 
 Depending on what is the status of the job, input and outputfiles we do different things.
 
+The requests, JDLs and file existence of all the jobs of a transformation are obtained before running the checks:
+requests are read for ChunkSize jobs at once, the existence of the files is checked in chunks of ChunkSize LFNs,
+and the JDLs are fetched in parallel, with up to MaxThreads calls at the same time.
+
 Send notification about changes
 
 """
@@ -27,6 +31,7 @@ import itertools
 
 from DIRAC                                                     import S_OK, S_ERROR
 from DIRAC.Core.Base.AgentModule                               import AgentModule
+from DIRAC.Core.Utilities.List                                 import breakListIntoChunks
 
 from DIRAC.WorkloadManagementSystem.Client.JobMonitoringClient import JobMonitoringClient
 from DIRAC.Resources.Catalog.FileCatalogClient import FileCatalogClient
@@ -34,6 +39,7 @@ from DIRAC.TransformationSystem.Client.TransformationClient import Transformatio
 from DIRAC.RequestManagementSystem.Client.ReqClient import ReqClient
 from DIRAC.FrameworkSystem.Client.NotificationClient import NotificationClient
 
+from ILCDIRAC.Core.Utilities.Concurrency import mapConcurrently
 from ILCDIRAC.ILCTransformationSystem.Utilities.TransformationInfo import TransformationInfo
 from ILCDIRAC.ILCTransformationSystem.Utilities.JobInfo import TaskInfoException
 from ILCDIRAC.Interfaces.API.DiracILC import DiracILC
@@ -238,6 +244,8 @@ class DataRecoveryAgent( AgentModule ):
                 }
     self.jobCache = defaultdict( lambda: (0, 0) )
     self.printEveryNJobs = self.am_getOption( 'PrintEvery', 200 )
+    self.chunkSize = self.am_getOption( 'ChunkSize', 1000 )
+    self.maxThreads = self.am_getOption( 'MaxThreads', 8 )
     ##Notification
     self.notesToSend = ""
     self.addressTo = self.am_getOption( 'MailTo', ["andre.philippe.sailer@cern.ch"] )
@@ -260,6 +268,8 @@ class DataRecoveryAgent( AgentModule ):
     self.addressTo = self.am_getOption( 'MailTo', ["andre.philippe.sailer@cern.ch"] )
     self.addressFrom = self.am_getOption( 'MailFrom', "ilcdirac-admin@cern.ch" )
     self.printEveryNJobs = self.am_getOption( 'PrintEvery', 200 )
+    self.chunkSize = self.am_getOption( 'ChunkSize', 1000 )
+    self.maxThreads = self.am_getOption( 'MaxThreads', 8 )
 
     return S_OK()
   #############################################################################
@@ -345,10 +355,95 @@ class DataRecoveryAgent( AgentModule ):
         do['Actions'](job, tInfo)
         return
 
+  def __readRequests( self, jobList ):
+    """read the requests of the jobs in chunks
+
+    :returns: tuple of the jobs for which the requests were read and the merged result of readRequestsForJobs
+    """
+    chunks = breakListIntoChunks( jobList, self.chunkSize )
+    results = mapConcurrently( lambda chunk: self.reqClient.readRequestsForJobs( [ job.jobID for job in chunk ] ),
+                               chunks, self.maxThreads )
+    readJobs = []
+    requests = { 'Successful': {}, 'Failed': {} }
+    for chunk, result in zip( chunks, results ):
+      if not result['OK']:
+        self.log.error( "Failed to read requests for %d jobs" % len( chunk ), result['Message'] )
+        continue
+      readJobs.extend( chunk )
+      requests['Successful'].update( result['Value']['Successful'] )
+    return readJobs, requests
+
+  def __checkFilesExistence( self, lfns ):
+    """check the existence of the files in chunks
+
+    :returns: tuple of the set of LFNs which could not be checked and the merged result of fcClient.exists
+    """
+    chunks = breakListIntoChunks( lfns, self.chunkSize )
+    results = mapConcurrently( self.fcClient.exists, chunks, self.maxThreads )
+    uncheckedLFNs = set()
+    statuses = { 'Successful': {}, 'Failed': {} }
+    for chunk, result in zip( chunks, results ):
+      if not result['OK']:
+        self.log.error( "Failed to check existence of %d files" % len( chunk ), result['Message'] )
+        uncheckedLFNs.update( chunk )
+        continue
+      statuses['Successful'].update( result['Value']['Successful'] )
+      statuses['Failed'].update( result['Value']['Failed'] )
+    return uncheckedLFNs, statuses
+
+  def prefetchJobInformation( self, jobList ):
+    """get the requests, JDLs and the existence of the files of all the jobs
+
+    :param list jobList: JobInfo objects
+    :returns: set of jobIDs for which all the information was obtained, the other jobs have to be checked
+              one by one
+    """
+    startTime = time.time()
+    readJobs, requests = self.__readRequests( jobList )
+
+    def getJobInformation( job ):
+      """check the requests of the job and get its JDL if there are no pending requests"""
+      try:
+        job.checkRequests( self.reqClient, requests )
+        if not job.pendingRequest:
+          job.getJobInformation( self.diracILC )
+      except RuntimeError as e:
+        self.log.error( "+++++ Failure for job: %d " % job.jobID )
+        self.log.error( "+++++ Exception: ", str(e) )
+        return False
+      return True
+
+    results = mapConcurrently( getJobInformation, readJobs, self.maxThreads )
+    jobsWithInfo = [ job for job, result in zip( readJobs, results ) if result ]
+    jobsToCheck = [ job for job in jobsWithInfo if not job.pendingRequest ]
+
+    ## keep the files of a job together, so that a failed chunk affects as few jobs as possible
+    lfns = []
+    seenLFNs = set()
+    for job in jobsToCheck:
+      for lfn in job.getLFNs():
+        if lfn not in seenLFNs:
+          seenLFNs.add( lfn )
+          lfns.append( lfn )
+    uncheckedLFNs, statuses = self.__checkFilesExistence( lfns )
+
+    prefetched = set( job.jobID for job in jobsWithInfo if job.pendingRequest )
+    for job in jobsToCheck:
+      if uncheckedLFNs.intersection( job.getLFNs() ):
+        continue
+      job.checkFileExistance( self.fcClient, statuses )
+      prefetched.add( job.jobID )
+
+    self.log.notice( "Got information for %d/%d jobs in %3.1fs" % ( len( prefetched ), len( jobList ),
+                                                                    time.time() - startTime ) )
+    return prefetched
+
   def checkAllJobs( self, jobs, tInfo, tasksDict=None, lfnTaskDict=None ):
     """run over all jobs and do checks"""
     fileJobDict = defaultdict(list)
     counter = 0
+    self.log.notice( "Getting information for all the jobs" )
+    prefetched = self.prefetchJobInformation( jobs.values() )
     startTime = time.time()
     nJobs = len(jobs)
     self.log.notice( "Running over all the jobs" )
@@ -358,12 +453,14 @@ class DataRecoveryAgent( AgentModule ):
         self.log.notice( "%d/%d: %3.1fs " % (counter, nJobs, float(time.time() - startTime) ) )
       while True:
         try:
-          job.checkRequests( self.reqClient )
+          if job.jobID not in prefetched:
+            job.checkRequests( self.reqClient )
           if job.pendingRequest:
             self.log.warn( "Job has Pending requests:\n%s" % job )
             break
-          job.getJobInformation( self.diracILC )
-          job.checkFileExistance( self.fcClient )
+          if job.jobID not in prefetched:
+            job.getJobInformation( self.diracILC )
+            job.checkFileExistance( self.fcClient )
           if tasksDict and lfnTaskDict:
             try:
               job.getTaskInfo( tasksDict, lfnTaskDict )
@@ -379,6 +476,7 @@ class DataRecoveryAgent( AgentModule ):
           self.log.error( "+++++ Failure for job: %d " % job.jobID )
           self.log.error( "+++++ Exception: ", str(e) )
           ## runs these again because of RuntimeError
+          prefetched.discard( job.jobID )
 
   def printSummary( self ):
     """print summary of changes"""
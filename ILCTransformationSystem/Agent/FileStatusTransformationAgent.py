@@ -17,13 +17,19 @@ FileStatusTransformation Agent performs the following actions:
 * Available means the file exists in File Catalog and also exists physically on Storage Elements
 * Not Available means the file doesn't exist in File Catalog or one or more replicas are lost on the Storage Elements
 
+The files of all statuses are fetched with a single query. The request statuses, the replicas in the File Catalog
+and the existence on the Storage Elements are obtained in chunks of ChunkSize items, with up to MaxThreads calls
+running in parallel. The time spent and the number of calls made in every stage are logged for each transformation.
+
 """
 
 import json
+import time
 from collections import defaultdict
 
 from DIRAC import S_OK, S_ERROR
 from DIRAC.Core.Base.AgentModule import AgentModule
+from DIRAC.Core.Utilities.List import breakListIntoChunks
 from DIRAC.Core.Utilities.PrettyPrint import printTable
 
 from DIRAC.FrameworkSystem.Client.NotificationClient import NotificationClient
@@ -32,6 +38,8 @@ from DIRAC.RequestManagementSystem.Client.ReqClient import ReqClient
 from DIRAC.Resources.Catalog.FileCatalogClient import FileCatalogClient
 from DIRAC.Resources.Storage.StorageElement import StorageElement
 
+from ILCDIRAC.Core.Utilities.Concurrency import mapConcurrently, starmapConcurrently
+
 __RCSID__ = "$Id$"
 
 AGENT_NAME = 'ILCTransformation/FileStatusTransformationAgent'
@@ -63,8 +71,12 @@ class FileStatusTransformationAgent(AgentModule):
     self.addressFrom = "ilcdirac-admin@cern.ch"
     self.emailSubject = "FileStatusTransformationAgent"
 
+    self.chunkSize = 1000
+    self.maxThreads = 4
+
     self.accounting = defaultdict(list)
     self.errors = []
+    self.stageStats = {}
 
     self.fcClient = FileCatalogClient()
     self.tClient = TransformationClient()
@@ -92,6 +104,9 @@ class FileStatusTransformationAgent(AgentModule):
     self.addressTo = self.am_getOption('MailTo', ["andre.philippe.sailer@cern.ch", "hamza.zafar@cern.ch"])
     self.addressFrom = self.am_getOption('MailFrom', "ilcdirac-admin@cern.ch")
 
+    self.chunkSize = self.am_getOption('ChunkSize', 1000)
+    self.maxThreads = self.am_getOption('MaxThreads', 4)
+
     self.transformationFileStatuses = filter(self.checkFileStatusFuncExists, self.transformationFileStatuses)
     self.accounting.clear()
 
@@ -143,6 +158,19 @@ class FileStatusTransformationAgent(AgentModule):
     self.log.error(errStr, varMsg)
     self.errors.append(errStr + varMsg)
 
+  def recordStage(self, stage, startTime, calls=1):
+    """ adds the time elapsed since startTime and the number of calls to the statistics of a stage """
+    stats = self.stageStats.setdefault(stage, {'Time': 0.0, 'Calls': 0})
+    stats['Time'] += time.time() - startTime
+    stats['Calls'] += calls
+
+  def logStageStatistics(self, transID, cycleTime):
+    """ logs the time spent and the number of calls made in every stage, then resets the statistics """
+    self.log.notice("Processed Transformation ID %s in %.1f seconds" % (transID, cycleTime))
+    for stage, stats in sorted(self.stageStats.iteritems()):
+      self.log.notice("Stage %s: %d calls in %.1f seconds" % (stage, stats['Calls'], stats['Time']))
+    self.stageStats = {}
+
   def execute(self):
     """ main execution loop of Agent """
 
@@ -222,19 +250,41 @@ class FileStatusTransformationAgent(AgentModule):
     return S_OK(result)
 
   def getRequestStatus(self, transID, taskIDs):
-    """ returns request statuses for a given list of task IDs """
-    res = self.tClient.getTransformationTasks(condDict={'TransformationID': transID, 'TaskID': taskIDs})
-    if not res['OK']:
-      self.log.error('Failure to get Transformation Tasks for Transformation ID:', transID)
-      return res
+    """ returns request statuses for a given list of task IDs, the tasks are fetched in chunks """
+    chunks = breakListIntoChunks(sorted(set(taskID for taskID in taskIDs if taskID is not None)), self.chunkSize)
+    startTime = time.time()
+    results = mapConcurrently(
+        lambda chunk: self.tClient.getTransformationTasks(condDict={'TransformationID': transID, 'TaskID': chunk}),
+        chunks, self.maxThreads)
+    self.recordStage('GetTransformationTasks', startTime, len(chunks))
 
-    result = res['Value']
     requestStatus = {}
-    for task in result:
-      requestStatus[task['TaskID']] = {'RequestStatus': task['ExternalStatus'], 'RequestID': long(task['ExternalID'])}
+    for res in results:
+      if not res['OK']:
+        self.log.error('Failure to get Transformation Tasks for Transformation ID:', transID)
+        return res
+
+      for task in res['Value']:
+        requestStatus[task['TaskID']] = {'RequestStatus': task['ExternalStatus'],
+                                         'RequestID': long(task['ExternalID'])}
 
     return S_OK(requestStatus)
 
+  def getTransformationFilesByStatus(self, transID):
+    """ returns the transformation files of all the treated statuses, grouped by status """
+    startTime = time.time()
+    res = self.tClient.getTransformationFiles(condDict={'TransformationID': transID,
+                                                        'Status': self.transformationFileStatuses})
+    self.recordStage('GetTransformationFiles', startTime)
+    if not res['OK']:
+      return res
+
+    filesByStatus = defaultdict(list)
+    for transFile in res['Value']:
+      filesByStatus[transFile['Status']].append(transFile)
+
+    return S_OK(filesByStatus)
+
   def getDataTransformationType(self, transID):
     """ returns transformation types Replication/Moving/Unknown for a given transformation """
     res = self.tClient.getTransformationParameters(transID, 'Body')
@@ -276,7 +326,9 @@ class FileStatusTransformationAgent(AgentModule):
 
     if lfnStatuses:
       if self.enabled:
+        startTime = time.time()
         res = self.tClient.setFileStatusForTransformation(transID, newLFNsStatus=lfnStatuses, force=True)
+        self.recordStage('SetFileStatus', startTime)
         if not res['OK']:
           self.logError('Failed to set statuses for LFNs ', "%s" % res['Message'])
           return res
@@ -288,18 +340,16 @@ class FileStatusTransformationAgent(AgentModule):
                                         'AvailableOnTarget': transFile['AvailableOnTarget']})
     return S_OK()
 
-  def selectFailedRequests(self, transFile):
-    """ returns True if transformation file has a failed request otherwise returns False """
-    res = self.getRequestStatus(transFile['TransformationID'], transFile['TaskID'])
+  def selectFailedRequests(self, transID, transFiles):
+    """ returns the transformation files which have a failed request """
+    res = self.getRequestStatus(transID, [transFile['TaskID'] for transFile in transFiles])
     if not res['OK']:
-      self.log.error('Failure to get Request Status for Assigned File')
-      return False
+      self.log.error('Failure to get Request Status for Assigned Files', res['Message'])
+      return []
     result = res['Value']
 
-    if result[transFile['TaskID']]['RequestStatus'] == 'Failed':
-      return True
-
-    return False
+    return [transFile for transFile in transFiles
+            if result.get(transFile['TaskID'], {}).get('RequestStatus') == 'Failed']
 
   def retryStrategyForFiles(self, transID, transFiles):
     """ returns retryStrategy Reset Request if a request is found in RMS, otherwise returns set file status to unused"""
@@ -308,13 +358,26 @@ class FileStatusTransformationAgent(AgentModule):
     if not res['OK']:
       return res
     result = res['Value']
+
+    # look for the requests of all tasks in parallel
+    requestIDs = sorted(set(result[taskID]['RequestID'] for taskID in taskIDs if taskID in result))
+    startTime = time.time()
+    requests = mapConcurrently(lambda requestID: self.reqClient.getRequest(requestID=requestID), requestIDs,
+                               self.maxThreads)
+    self.recordStage('GetRequest', startTime, len(requestIDs))
+    requests = dict(zip(requestIDs, requests))
+
     retryStrategy = defaultdict(dict)
     for taskID in taskIDs:
       if taskID is None:
         self.log.error("Task ID is None", "Transformation: %s\n Files: %r " % (transID, transFiles))
         retryStrategy[None]['Strategy'] = SET_UNUSED
         continue
-      res = self.reqClient.getRequest(requestID=result[taskID]['RequestID'])
+      if taskID not in result:
+        self.log.notice('Task %s not found setting file status to unused' % taskID)
+        retryStrategy[taskID]['Strategy'] = SET_UNUSED
+        continue
+      res = requests[result[taskID]['RequestID']]
       if not res['OK']:
         self.log.notice('Request %s does not exist setting file status to unused' % result[taskID]['RequestID'])
         retryStrategy[taskID]['Strategy'] = SET_UNUSED
@@ -400,7 +463,9 @@ class FileStatusTransformationAgent(AgentModule):
 
       requestID = retryStrategy[transFile['TaskID']]['RequestID']
       if self.enabled:
+        startTime = time.time()
         res = self.reqClient.resetFailedRequest(requestID, allR=True)
+        self.recordStage('ResetRequest', startTime)
         if not res['OK']:
           self.logError('Failed to reset request ', 'ReqID: %s Error: %s' % (requestID, res['Message']))
           continue
@@ -411,7 +476,9 @@ class FileStatusTransformationAgent(AgentModule):
 
         setFilesAssigned.append(transFile)
 
+        startTime = time.time()
         res = self.tClient.setTaskStatus(transID, transFile['TaskID'], 'Waiting')
+        self.recordStage('SetTaskStatus', startTime)
         if not res['OK']:
           self.logError('Failure to set Waiting status for Task ID: ', "%s %s" % (transFile['TaskID'], res['Message']))
           continue
@@ -444,25 +511,30 @@ class FileStatusTransformationAgent(AgentModule):
 
   def existsInFC(self, storageElements, lfns):
     """ checks if files have replicas registered in File Catalog for all given storageElements """
-    res = self.fcClient.getReplicas(lfns)
-    if not res['OK']:
-      return res
+    chunks = breakListIntoChunks(lfns, self.chunkSize)
+    startTime = time.time()
+    results = mapConcurrently(self.fcClient.getReplicas, chunks, self.maxThreads)
+    self.recordStage('GetReplicas', startTime, len(chunks))
 
     result = {}
     result['Successful'] = {}
     result['Failed'] = {}
     setOfSEs = set(storageElements)
 
-    for lfn, msg in res['Value']['Failed'].iteritems():
-      if msg == 'No such file or directory':
-        result['Successful'][lfn] = False
-      else:
-        result['Failed'][lfn] = msg
+    for res in results:
+      if not res['OK']:
+        return res
 
-    # check if all replicas are registered in FC
-    filesFoundInFC = res['Value']['Successful']
-    for lfn, replicas in filesFoundInFC.iteritems():
-      result['Successful'][lfn] = setOfSEs.issubset(replicas.keys())
+      for lfn, msg in res['Value']['Failed'].iteritems():
+        if msg == 'No such file or directory':
+          result['Successful'][lfn] = False
+        else:
+          result['Failed'][lfn] = msg
+
+      # check if all replicas are registered in FC
+      filesFoundInFC = res['Value']['Successful']
+      for lfn, replicas in filesFoundInFC.iteritems():
+        result['Successful'][lfn] = setOfSEs.issubset(replicas.keys())
 
     return S_OK(result)
 
@@ -477,8 +549,13 @@ class FileStatusTransformationAgent(AgentModule):
       return S_OK(result)
 
     voName = lfns[0].split('/')[1]
-    for se in storageElements:
-      res = StorageElement(se, vo=voName).exists(lfns)
+    seChunks = [(se, chunk) for se in storageElements for chunk in breakListIntoChunks(lfns, self.chunkSize)]
+    startTime = time.time()
+    results = starmapConcurrently(lambda se, chunk: StorageElement(se, vo=voName).exists(chunk), seChunks,
+                                  self.maxThreads)
+    self.recordStage('StorageElementExists', startTime, len(seChunks))
+
+    for (se, _chunk), res in zip(seChunks, results):
       if not res['OK']:
         return res
       for lfn, status in res['Value']['Successful'].iteritems():
@@ -488,7 +565,7 @@ class FileStatusTransformationAgent(AgentModule):
         if not status:
           result['Successful'][lfn] = False
 
-      result['Failed'][se] = res['Value']['Failed']
+      result['Failed'].setdefault(se, {}).update(res['Value']['Failed'])
 
     return S_OK(result)
 
@@ -536,41 +613,53 @@ class FileStatusTransformationAgent(AgentModule):
     actions[RETRY] = []
     actions[SET_DELETED] = []
 
-    for status in self.transformationFileStatuses:
-      res = self.tClient.getTransformationFiles(condDict={'TransformationID': transID, 'Status': status})
-      if not res['OK']:
-        errStr = 'Failure to get Transformation Files, Status: %s Transformation ID: %s Message: %s' % (status,
-                                                                                                        transID,
-                                                                                                        res['Message'])
-        self.logError(errStr)
-        continue
+    cycleStart = time.time()
+    res = self.getTransformationFilesByStatus(transID)
+    if not res['OK']:
+      errStr = 'Failure to get Transformation Files, Statuses: %s Transformation ID: %s Message: %s' % (
+          self.transformationFileStatuses, transID, res['Message'])
+      self.logError(errStr)
+      filesByStatus = {}
+    else:
+      filesByStatus = res['Value']
 
-      transFiles = res['Value']
-      if not transFiles:
+    for status in self.transformationFileStatuses:
+      if not filesByStatus.get(status):
         self.log.notice("No Transformation Files found with status %s for Transformation ID %d" % (status, transID))
-        continue
 
-      self.log.notice("Processing Transformation Files with status %s for TransformationID %d " % (status, transID))
+    if filesByStatus.get('Assigned'):
+      filesByStatus['Assigned'] = self.selectFailedRequests(transID, filesByStatus['Assigned'])
 
-      if status == 'Assigned':
-        transFiles = filter(self.selectFailedRequests, transFiles)
+    lfns = [transFile['LFN'] for status in self.transformationFileStatuses
+            for transFile in filesByStatus.get(status, [])]
 
-      lfns = [transFile['LFN'] for transFile in transFiles]
+    if lfns:
+      self.checkTransformationFiles(actions, filesByStatus, lfns, sourceSE, targetSEs, transType)
 
-      if not lfns:
-        continue
+    self.applyActions(transID, actions)
+    self.logStageStatistics(transID, time.time() - cycleStart)
+    self.sendNotification(transID, transType, sourceSE, targetSEs)
 
-      res = self.exists(sourceSE, lfns)
-      if not res['OK']:
-        continue
+    return S_OK()
 
-      resultSourceSe = res['Value']['Successful']
+  def checkTransformationFiles(self, actions, filesByStatus, lfns, sourceSE, targetSEs, transType):
+    """ determines the availability of the files of all statuses and collects the actions to apply """
+    res = self.exists(sourceSE, lfns)
+    if not res['OK']:
+      return res
+    resultSourceSe = res['Value']['Successful']
 
-      res = self.exists(targetSEs, lfns)
-      if not res['OK']:
+    res = self.exists(targetSEs, lfns)
+    if not res['OK']:
+      return res
+    resultTargetSEs = res['Value']['Successful']
+
+    for status in self.transformationFileStatuses:
+      transFiles = filesByStatus.get(status)
+      if not transFiles:
         continue
-      resultTargetSEs = res['Value']['Successful']
 
+      self.log.notice("Processing %d Transformation Files with status %s" % (len(transFiles), status))
       for transFile in transFiles:
         lfn = transFile['LFN']
         transFile['AvailableOnSource'] = resultSourceSe[lfn]
@@ -580,7 +669,4 @@ class FileStatusTransformationAgent(AgentModule):
       checkFiles = getattr(self, checkFilesFuncName)
       checkFiles(actions, transFiles, transType)
 
-    self.applyActions(transID, actions)
-    self.sendNotification(transID, transType, sourceSE, targetSEs)
-
     return S_OK()
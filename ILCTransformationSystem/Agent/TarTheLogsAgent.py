@@ -2,12 +2,21 @@
 This agent takes care of uploading production logs for Inactive productions.
 
 Get the files by walking the tree from the BaseLogPath option (in the CS, under the Agents sections). 
-Puts them in tar files that are created in the BasePath(same as BaseLogPath)/LogsTar folder, created if needed.
-Deletes the logs once the tar file exists.
-Uploads them to the ArchivalSE: defined in Operations, under Transformations/ArchivalSE
-Deletes the tar files.
+The logs of a production are split into chunks of consecutive tasks, limited by the MaxTasksPerTar and
+MaxTarSize (in MB) options. Every chunk is put in a tar file that is created in the BasePath/LogsTars/<prod>
+folder, created if needed. Up to MaxThreads chunks are compressed and uploaded in parallel.
+The checksum of the tar file is computed while it is written, and the tar file is uploaded to the ArchivalSE:
+defined in Operations, under Transformations/ArchivalSE
+The logs and the tar file are only deleted once the checksum of the uploaded file matches.
 The LFN path is given in the CS, Operations, under Transformations/BaseLogLFN
 
+The state of every chunk is kept in a manifest file per production, so that an interrupted run is resumed
+at the next cycle without tarring or uploading the same logs twice.
+
+The log directories are found with a persistent :class:`~ILCDIRAC.ILCTransformationSystem.Utilities.LogInventory`,
+stored in the InventoryFile, which only lists again the directories that changed since the last cycle.
+The status of all productions with logs is obtained in batches, and only the stopped productions are archived.
+
 
 :since: Nov 2, 2013
 :author: sposs
@@ -18,15 +27,50 @@ from DIRAC.Core.Base.AgentModule                                import AgentModu
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations        import Operations
 from DIRAC.TransformationSystem.Client.TransformationClient     import TransformationClient
 from DIRAC.Resources.Storage.StorageElement                     import StorageElementItem as StorageElement
+from DIRAC.Core.Utilities.Adler                                 import compareAdler, fileAdler, intAdlerToHex
+from DIRAC.Core.Utilities.ReturnValues                          import returnSingleResult
+from DIRAC.Core.Utilities.List                                  import breakListIntoChunks
+
+from ILCDIRAC.Core.Utilities.Concurrency                        import starmapConcurrently
+from ILCDIRAC.ILCTransformationSystem.Utilities.LogInventory    import LogInventory, getEntrySize
 
 from DIRAC import S_OK, S_ERROR, gLogger
 
-import os, tarfile, subprocess
+import os, tarfile, subprocess, json, shutil, tempfile, threading, zlib
 
 __RCSID__ = "$Id$"
 
 ACTIVE_STATUS = ["Active", 'Completing']
 
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+## states of a chunk in the manifest, in the order they are reached
+CREATED = "Created"
+UPLOADED = "Uploaded"
+DONE = "Done"
+
+class ChecksumWriter( object ):
+  '''
+  File object wrapper computing the Adler32 checksum of everything written through it
+  '''
+  def __init__( self, fileObj, name ):
+    self.fileObj = fileObj
+    self.name = name
+    self.adler = 1
+
+  def write( self, data ):
+    """ update the checksum and write the data """
+    self.adler = zlib.adler32( data, self.adler )
+    self.fileObj.write( data )
+
+  def flush( self ):
+    """ flush the underlying file """
+    self.fileObj.flush()
+
+  def checksum( self ):
+    """ returns the Adler32 checksum of the data written so far as hex string """
+    return intAdlerToHex( self.adler )
+
 class TarTheProdLogsAgent( AgentModule ):
   '''
   Tar the prod logs, and send them to whatever storage element you want
@@ -46,6 +90,13 @@ class TarTheProdLogsAgent( AgentModule ):
     self.ops = None
     self.storageElement = None
     self.baselfn = ""
+    self.tarsDir = ""
+    self.maxThreads = 4
+    self.maxTarSize = 2000 * 1024 * 1024
+    self.maxTasksPerTar = 1000
+    self.compressionLevel = 6
+    self.manifestLock = threading.Lock()
+    self.inventory = None
 
   def initialize(self):
     """Sets defaults
@@ -60,6 +111,18 @@ class TarTheProdLogsAgent( AgentModule ):
     if not self.baselogpath:
       return S_ERROR("Missing mandatory option BaseLogPath")
 
+    self.tarsDir = os.path.join(self.basepath, "LogsTars")
+    self.maxThreads = self.am_getOption("MaxThreads", self.maxThreads)
+    self.maxTarSize = self.am_getOption("MaxTarSize", self.maxTarSize / 1024 / 1024) * 1024 * 1024
+    self.maxTasksPerTar = self.am_getOption("MaxTasksPerTar", self.maxTasksPerTar)
+    self.compressionLevel = self.am_getOption("CompressionLevel", self.compressionLevel)
+
+    inventoryFile = self.am_getOption("InventoryFile", os.path.join(self.basepath, "LogInventory.json.gz"))
+    self.inventory = LogInventory(self.baselogpath, inventoryFile)
+    res = self.inventory.load()
+    if not res['OK']:
+      self.log.warn("Starting from an empty inventory:", res['Message'])
+
     self.ops = Operations()
 
     dest_se = self.ops.getValue("Transformations/ArchiveSE", "")
@@ -85,44 +148,37 @@ class TarTheProdLogsAgent( AgentModule ):
       self.log.error("Failed to clean up previous run:", res["Message"])
       return res
     
-    res = self.getDirectories()
+    res = self.inventory.update()
     if not res["OK"]:
       return res
-    
-    res = self.getProductionIDs(res["Value"])
+    res = self.inventory.save()
+    if not res["OK"]:
+      self.log.error("Failed to save the inventory:", res["Message"])
+
+    productions = self.inventory.getProductions()
+    res = self.getStoppedProductions(sorted(productions))
     if not res["OK"]:
       return res
-    
-    prods = res['Value']
-    for prod, files in prods.items():
-      res = self.transIsStopped(prod)
-      if not res['OK']:
-        continue
-      if not res["Value"]:
-        continue
-      
-      res = self.createTarBallAndCleanTheLogs(prod, files)
+    stoppedProds = res['Value']
+    self.log.info("%d productions with logs, %d of them stopped" % (len(productions), len(stoppedProds)))
+
+    prods, sizes = self.inventory.getLogFiles(set(stoppedProds))
+    for prod, files in sorted(prods.items()):
+      self.log.info("Production %s: tasks %s to %s, %d entries, %d MB" %
+                    (prod, productions[prod]['FirstTask'], productions[prod]['LastTask'],
+                     productions[prod]['Entries'], productions[prod]['Size'] / 1024 / 1024))
+      res = self.archiveProduction(prod, files, sizes)
       if not res["OK"]:
-        self.log.error("Could not get the tar ball:", res["Message"])
-        continue
-      
-      tarBall = res["Value"]
-      res = self.uploadToStorage(prod, tarBall)
-      if not res["OK"]:
-        self.log.error("Failed putting the file to storage:", res["Message"])
-      else:
-        res = self.cleanTarBall(tarBall)
-        if not res["OK"]:
-          self.log.error("Failed removing the Tar Ball", res["Message"])
-          
+        self.log.error("Failed to archive the logs of production %s:" % prod, res["Message"])
       
     return S_OK()
   
   def cleanupPrevious(self):
-    """ Look for previously created tar files, and try to upload them again.
+    """ Resume the chunks of the manifests that are not done yet, and upload again the tar files
+    that are not in any manifest.
     Also, create the work dir
     """
-    logs_dir = os.path.join(self.basepath, "LogsTars")
+    logs_dir = self.tarsDir
     if not os.path.isdir(logs_dir):
       try:
         os.mkdir(logs_dir)
@@ -133,70 +189,226 @@ class TarTheProdLogsAgent( AgentModule ):
       if not len(files):
         continue
       prod = root.rstrip("/").split("/")[-1]
+      manifest = self.readManifest(prod)
+      pending = [(prod, manifest, tarName, chunk['Entries']) for tarName, chunk in sorted(manifest['Chunks'].items())
+                 if chunk['Status'] != DONE]
+      for res in starmapConcurrently(self.archiveChunk, pending, self.maxThreads):
+        if not res['OK']:
+          self.log.error("Failed to resume the tar ball of production %s:" % prod, res['Message'])
+
       for tfile in files:
+        if tfile == MANIFEST_NAME or tfile in manifest['Chunks'] or tfile.startswith("."):
+          continue
         tarballpath = os.path.join(root, tfile)
         res = self.uploadToStorage(prod, tarballpath)
         if not res['OK']:
-          self.log.error("Failed to upload again %s to the SE")
+          self.log.error("Failed to upload again %s to the SE:" % tarballpath, res['Message'])
           continue
         res = self.cleanTarBall(tarballpath)
         if not res["OK"]:
-          self.log.error("Failed to remove the tar ball")
+          self.log.error("Failed to remove the tar ball", res['Message'])
             
     return S_OK()
-  
-  def getDirectories(self):
-    """ List the directories below the base
+
+  def getManifestPath(self, prod):
+    """ returns the path of the manifest of the production """
+    return os.path.join(self.tarsDir, str(prod), MANIFEST_NAME)
+
+  def readManifest(self, prod):
+    """ Read the manifest of the production, {'Version': 1, 'Chunks': {tarName: chunk}}, where chunk contains
+    the Status, the Entries in the tar ball, the Checksum of the tar ball and the LFN it was uploaded to.
+    A missing or invalid manifest gives an empty one.
     """
-    final_dirs = {}
-    for root, dirs, dummy_files in os.walk(self.baselogpath):
-      if root.split("/")[-1] == "LOG" and len(dirs) > 1:
-        logDirs = sorted(dirs) ## sort them so we can remove the last one
-        del logDirs[-1]
-        final_dirs[root]=logDirs
-
-    return S_OK(final_dirs)
-
-  def getProductionIDs(self, directories_and_files):
-    """ Given input directories, get the prods_dict {prod:files}, where files is sorted per taskID
-    This is used for he tar ball naming.
+    manifest = dict(Version=MANIFEST_VERSION, Chunks={})
+    manifestPath = self.getManifestPath(prod)
+    if not os.path.exists(manifestPath):
+      return manifest
+    try:
+      with open(manifestPath) as manifestFile:
+        content = json.load(manifestFile)
+    except (IOError, OSError, ValueError) as e:
+      self.log.error("Cannot read the manifest %s:" % manifestPath, str(e))
+      return manifest
+    if content.get('Version') != MANIFEST_VERSION:
+      self.log.warn("Ignoring manifest with version %s:" % content.get('Version'), manifestPath)
+      return manifest
+    for tarName, chunk in content.get('Chunks', {}).items():
+      chunk['Entries'] = [str(entry) for entry in chunk['Entries']]
+      manifest['Chunks'][str(tarName)] = chunk
+    return manifest
+
+  def updateManifest(self, prod, manifest, tarName, chunk):
+    """ Set the chunk of the tar ball in the manifest and write it to disk. The file is replaced atomically,
+    so an interrupted run never leaves a partial manifest.
     """
-    prods_dict = {}
-    for path, files in directories_and_files.items():
-      f_list = []
-      for logfile in files:
-        f_name = os.path.join(path, logfile)
-        prodid = int(logfile.split("_")[2])
-        if prodid not in prods_dict:
-          prods_dict[prodid] = []
-        f_list.append(f_name)
-        
-      prods_dict[prodid] = sorted(f_list, key = self.__sortbyJob )
-    
+    manifestPath = self.getManifestPath(prod)
+    with self.manifestLock:
+      manifest['Chunks'][tarName] = chunk
+      try:
+        if not os.path.isdir(os.path.dirname(manifestPath)):
+          os.makedirs(os.path.dirname(manifestPath))
+        tmpHandle, tmpName = tempfile.mkstemp(dir=os.path.dirname(manifestPath), prefix=".tmp_manifest_")
+        with os.fdopen(tmpHandle, "w") as manifestFile:
+          json.dump(manifest, manifestFile, indent=1, sort_keys=True)
+        os.rename(tmpName, manifestPath)
+      except (IOError, OSError) as e:
+        return S_ERROR("Cannot write the manifest %s: %s" % (manifestPath, str(e)))
+    return S_OK()
+
+  def archiveProduction(self, prod, prodFiles, sizes=None):
+    """ Split the logs of the production in chunks and tar, upload and clean them in parallel.
+    Logs that are part of a chunk of the manifest that is not done yet are left to :func:`cleanupPrevious`.
+    """
+    manifest = self.readManifest(prod)
+    pending = set(entry for chunk in manifest['Chunks'].values() if chunk['Status'] != DONE
+                  for entry in chunk['Entries'])
+    chunks = self.getChunks(prod, [logFile for logFile in prodFiles if logFile not in pending], sizes,
+                            usedNames=manifest['Chunks'])
+    self.log.info("Archiving the logs of production %s in %d tar balls" % (prod, len(chunks)))
+
+    results = starmapConcurrently(self.archiveChunk, [(prod, manifest, tarName, entries)
+                                                      for tarName, entries in chunks], self.maxThreads)
+    failed = [res['Message'] for res in results if not res['OK']]
+    if failed:
+      return S_ERROR("%d of %d tar balls failed, first error: %s" % (len(failed), len(results), failed[0]))
+    return S_OK(len(results))
+
+  def getChunks(self, prod, prodFiles, sizes=None, usedNames=()):
+    """ Split the logs, sorted by taskID, in consecutive chunks of at most maxTasksPerTar entries and
+    maxTarSize bytes (a single larger entry gets its own chunk). The sizes that are not given are computed.
+    The names of the tar balls are different from the usedNames, e.g. the chunks of the manifest.
+
+    :returns: list of (tarName, entries)
+    """
+    chunks = []
+    current, currentSize = [], 0
+    for logFile in prodFiles:
+      size = sizes[logFile] if sizes and logFile in sizes else getEntrySize(logFile)
+      if current and (len(current) >= self.maxTasksPerTar or currentSize + size > self.maxTarSize):
+        chunks.append(current)
+        current, currentSize = [], 0
+      current.append(logFile)
+      currentSize += size
+    if current:
+      chunks.append(current)
+    usedNames = set(usedNames)
+    namedChunks = []
+    for entries in chunks:
+      tarName = self.getTarBallName(prod, entries, usedNames)
+      usedNames.add(tarName)
+      namedChunks.append((tarName, entries))
+    return namedChunks
+
+  def getTarBallName(self, prod, entries, usedNames=()):
+    """ The file name contains the first and last taskID included. Allows easy finding of the right tar ball.
+    If the name is already used, e.g. by the logs of tasks that were run again, a sequence number is added.
+    """
+    first, last = self.__sortbyJob(entries[0]), self.__sortbyJob(entries[-1])
+    tarName = "%s_%s_to_%s_logs.tgz" % (prod, first, last)
+    sequence = 1
+    while tarName in usedNames:
+      sequence += 1
+      tarName = "%s_%s_to_%s_logs_%d.tgz" % (prod, first, last, sequence)
+    return tarName
+
+  def archiveChunk(self, prod, manifest, tarName, entries):
+    """ Bring the chunk to the Done state: create the tar ball, upload it and verify its checksum, then remove
+    the logs and the tar ball. Every step is recorded in the manifest, and the steps already done are skipped.
+
+    :returns: S_OK with the LFN of the tar ball
+    """
+    tarBall = os.path.join(self.tarsDir, str(prod), tarName)
+    chunk = manifest['Chunks'].get(tarName)
+
+    if chunk is None or (chunk['Status'] == CREATED and not os.path.exists(tarBall)):
+      res = self.createTarBall(tarBall, entries)
+      if not res['OK']:
+        return res
+      chunk = dict(Status=CREATED, Entries=entries, Checksum=res['Value'], LFN='')
+      res = self.updateManifest(prod, manifest, tarName, chunk)
+      if not res['OK']:
+        return res
 
-    return S_OK(prods_dict)
+    if chunk['Status'] == CREATED:
+      res = self.uploadToStorage(prod, tarBall, chunk['Checksum'])
+      if not res['OK']:
+        return res
+      chunk = dict(chunk, Status=UPLOADED, LFN=res['Value'])
+      res = self.updateManifest(prod, manifest, tarName, chunk)
+      if not res['OK']:
+        return res
+
+    if chunk['Status'] == UPLOADED:
+      res = self.removeLogs(chunk['Entries'])
+      if not res['OK']:
+        return res
+      res = self.cleanTarBall(tarBall)
+      if not res['OK']:
+        return res
+      chunk = dict(chunk, Status=DONE)
+      res = self.updateManifest(prod, manifest, tarName, chunk)
+      if not res['OK']:
+        return res
+
+    return S_OK(chunk['LFN'])
+
+  def createTarBall(self, tarBall, entries):
+    """ Create the tar ball containing the entries. It is written under a temporary name and renamed when
+    complete, the Adler32 checksum is computed on the fly.
+
+    :returns: S_OK with the checksum of the tar ball
+    """
+    tmpName = os.path.join(os.path.dirname(tarBall), "." + os.path.basename(tarBall))
+    try:
+      if not os.path.isdir(os.path.dirname(tarBall)):
+        os.makedirs(os.path.dirname(tarBall))
+      with open(tmpName, "wb") as outFile:
+        writer = ChecksumWriter(outFile, tarBall)
+        tarFile = tarfile.open(mode="w:gz", fileobj=writer, compresslevel=self.compressionLevel)
+        for entry in entries:
+          tarFile.add(entry)
+        tarFile.close()
+      os.rename(tmpName, tarBall)
+    except Exception, e:
+      if os.path.exists(tmpName):
+        os.unlink(tmpName)
+      return S_ERROR("Failed to create %s with %s" % (tarBall, str(e)))
+    return S_OK(writer.checksum())
+
+  def removeLogs(self, entries):
+    """ Remove the log files and directories that are in an uploaded tar ball """
+    try:
+      for entry in entries:
+        if os.path.isdir(entry) and not os.path.islink(entry):
+          shutil.rmtree(entry)
+        elif os.path.lexists(entry):
+          os.remove(entry)
+    except OSError, x:
+      return S_ERROR("Failed to remove the logs with %s" % str(x))
+    return S_OK()
   
   def __sortbyJob(self, f_name):
     """ returns the taskID given a file name. Used for the sorting above
     """
     return int(f_name.split("_")[-2])
   
-  def transIsStopped(self, prod):
-    """ Check from the TS if the prod is Active or not
+  def getStoppedProductions(self, prods):
+    """ Get from the TS, in batches, the productions that are neither Active nor Completing.
+    Productions that are unknown to the TS are not returned.
     """
-    res = self.transclient.getTransformation(prod)
-    if not res['OK']:
-      return res
-    
-    trans = res["Value"]
-    if trans["Status"] in ACTIVE_STATUS:
-      return S_OK(False)
-    #meaning the prods are neither Active nor Completing
-    return S_OK(True)
-  
+    stopped = []
+    for prodChunk in breakListIntoChunks(prods, 100):
+      res = self.transclient.getTransformations(condDict={'TransformationID': prodChunk}, limit=len(prodChunk))
+      if not res['OK']:
+        return res
+      stopped.extend(trans['TransformationID'] for trans in res['Value'] if trans['Status'] not in ACTIVE_STATUS)
+    return S_OK(stopped)
+
   def cleanTarBall(self, tarballpath):
     """ Physically remove the tar ball that was created to free disk space
     """
+    if not os.path.exists(tarballpath):
+      return S_OK()
     try:
       os.unlink(tarballpath)
     except OSError, x:
@@ -205,53 +417,68 @@ class TarTheProdLogsAgent( AgentModule ):
       self.log.error("The tar ball still exists while it should have be removed: ", tarballpath)
     return S_OK()
   
-  def uploadToStorage(self, prod, tarballpath):
-    """ Put the file to the Storage Element
+  def getRemoteMetadata(self, lfn):
+    """ returns S_OK with the metadata of the file on the storage element, S_OK(None) if it does not exist
     """
-    ##FIXME: I don't think this does the right thing at the moment
-    final_lfn_path = self.baselfn+"/"+prod
-    res = self.storageElement.isFile(final_lfn_path)
-    if not res["OK"]:
+    res = returnSingleResult(self.storageElement.exists(lfn))
+    if not res['OK']:
       return res
-    counter = 0
+    if not res['Value']:
+      return S_OK(None)
+    return returnSingleResult(self.storageElement.getFileMetadata(lfn))
+
+  @staticmethod
+  def isSameFile(metadata, checksum, size):
+    """ check that the file on the storage element is the local file: by its checksum, or by its size if the
+    storage element does not give checksums
+    """
+    if metadata.get('Checksum'):
+      return compareAdler(metadata['Checksum'], checksum)
+    return metadata.get('Size') == size
+
+  def uploadToStorage(self, prod, tarballpath, checksum=None):
+    """ Put the file to the Storage Element and check that the checksum of the uploaded file matches.
+    A file with the same name and checksum that is already on the Storage Element is not uploaded again.
+    The size is compared instead of the checksum if the Storage Element does not give checksums.
+
+    :returns: S_OK with the LFN of the uploaded file
+    """
+    if checksum is None:
+      checksum = fileAdler(tarballpath)
+    size = os.path.getsize(tarballpath)
+    final_lfn_path = os.path.join(self.baselfn, str(prod))
     tarballbasename = os.path.basename(tarballpath)[:-4]
-    lfn = final_lfn_path +"/" + tarballbasename + "_%i.tgz" % counter
-    while lfn in res['Value']["Successful"]:
-      counter = counter + 1
+    counter = 0
+    while True:
       lfn = final_lfn_path + "/" + tarballbasename + "_%i.tgz" % counter
-      res = self.storageElement.isFile(lfn)
-    
-    
+      res = self.getRemoteMetadata(lfn)
+      if not res['OK']:
+        return res
+      if res['Value'] is None:
+        break
+      if self.isSameFile(res['Value'], checksum, size):
+        self.log.info("Tar ball already on the storage", lfn)
+        return S_OK(lfn)
+      counter = counter + 1
+
     fileDict = {lfn : tarballpath}
     self.log.info( "putFile", fileDict )
-    res = self.storageElement.putFile( fileDict )
-    if res['OK']:
-      if res['Value']['Failed']:
-        self.log.error( "putFile", res['Value']['Failed'] )
-    else:
+    res = returnSingleResult(self.storageElement.putFile( fileDict ))
+    if not res['OK']:
       self.log.error( "putFile", res['Message'] )
-      
-    return S_OK()
-
-  def createTarBallAndCleanTheLogs(self, prod, prodFiles):
-    """ Create and return the path to the tar ball containing all the prod files
-    The file name contains the first and last taskID included. Allows easy finding of
-    the right tar ball.
-    """
-    starttaskid = int(prodFiles[0].split("_")[-2])
-    lasttaskid = int(prodFiles[-1].split("_")[-2])
-    name = os.path.join(self.baselogpath, prod, prod+"_"+ starttaskid + "_to_"+ lasttaskid +"_logs.tgz")
-    try: 
-      tarFile = tarfile.open( name, "w:gz" )
-      for fd in prodFiles:
-        tarFile.add( fd )
-      tarFile.close()
-      for fd in prodFiles:
-        os.remove( fd )
-    except Exception, e:
-      return S_ERROR("Failed with %s" % str(e))
-    return S_OK(name)
+      return res
 
+    res = self.getRemoteMetadata(lfn)
+    if not res['OK']:
+      return res
+    if not res['Value']:
+      return S_ERROR("File %s not found after the upload" % lfn)
+    if not self.isSameFile(res['Value'], checksum, size):
+      return S_ERROR("Checksum mismatch for %s: local %s %s bytes, remote %s %s bytes" %
+                     (lfn, checksum, size, res['Value'].get('Checksum'), res['Value'].get('Size')))
+    if not res['Value'].get('Checksum'):
+      self.log.verbose("No checksum on the storage, the size of the file was compared", lfn)
+    return S_OK(lfn)
 
   def tarTheFolders(self, listOfFolders, outputFileName ):
     """ make a tarBall out of the list of folders"""
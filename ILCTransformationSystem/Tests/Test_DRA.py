@@ -746,6 +746,47 @@ class TestDRA( unittest.TestCase ):
     self.dra.checkAllJobs( mockJobs, tInfoMock, taskDict, lfnTaskDict = True )
     self.dra.log.notice.assert_any_call( MatchStringWith( "Failing job hard" ) )
 
+  def test_prefetchJobInformation( self ):
+    """test for DataRecoveryAgent prefetchJobInformation ..........................................."""
+    mockJobs = []
+    for i in xrange(5):
+      job = self.getTestMock( nameID=i )
+      job.jobID = i
+      job.getLFNs = Mock( return_value=[ "/input/file%d" % i, "/output/file%d" % i ] )
+      mockJobs.append( job )
+    mockJobs[1].pendingRequest = True
+    mockJobs[2].getJobInformation = Mock( side_effect=RuntimeError( "NoJDL" ) )
+    self.dra.chunkSize = 2
+    self.dra.reqClient.readRequestsForJobs.side_effect = lambda jobIDs: \
+      S_ERROR( "RMS down" ) if 4 in jobIDs else S_OK( { "Successful": {}, "Failed": {} } )
+    self.dra.fcClient.exists.side_effect = lambda lfns: \
+      S_ERROR( "FC down" ) if "/input/file3" in lfns else S_OK( { "Successful": dict.fromkeys( lfns, True ),
+                                                                   "Failed": {} } )
+    prefetched = self.dra.prefetchJobInformation( mockJobs )
+    ## 0 complete, 1 pending request, 2 no JDL, 3 existence check failed, 4 requests not read
+    self.assertEqual( prefetched, set( [ 0, 1 ] ) )
+    self.assertEqual( self.dra.reqClient.readRequestsForJobs.call_count, 3 )
+    self.assertEqual( self.dra.fcClient.exists.call_count, 2 )
+    mockJobs[0].checkFileExistance.assert_called_once_with( self.dra.fcClient, ANY )
+    self.assertFalse( mockJobs[1].getJobInformation.called )
+    self.assertFalse( mockJobs[1].checkFileExistance.called )
+    self.assertFalse( mockJobs[3].checkFileExistance.called )
+    self.assertFalse( mockJobs[4].checkRequests.called )
+    self.dra.log.error.assert_any_call( MatchStringWith( "+++++ Exception" ), "NoJDL" )
+
+    ## jobs with all information are not fetched again by checkAllJobs
+    from ILCDIRAC.ILCTransformationSystem.Utilities.TransformationInfo import TransformationInfo
+    tInfoMock = Mock( name = "tInfoMock", spec=TransformationInfo )
+    for job in mockJobs:
+      job.reset_mock()
+    mockJobs[2].getJobInformation = Mock()
+    self.dra.checkAllJobs( dict( ( job.jobID, job ) for job in mockJobs ), tInfoMock )
+    mockJobs[0].checkRequests.assert_called_once_with( self.dra.reqClient, ANY )
+    mockJobs[0].getJobInformation.assert_called_once_with( self.dra.diracILC )
+    mockJobs[2].checkFileExistance.assert_called_once_with( self.dra.fcClient, ANY )
+    mockJobs[3].checkFileExistance.assert_called_once_with( self.dra.fcClient )
+    mockJobs[4].checkRequests.assert_called_once_with( self.dra.reqClient )
+
   def test_execute( self ):
     """test for DataRecoveryAgent execute .........................................................."""
     self.dra.treatProduction = Mock()
@@ -257,6 +257,42 @@ class TestFSTAgent(unittest.TestCase):
     self.assertEquals(result[taskID]['RequestStatus'], 'Failed')
     self.assertEquals(result[taskID]['RequestID'], 123)
 
+  def test_get_request_status_chunks(self):
+    """ Test getRequestStatus fetches the tasks in chunks and merges the results """
+    self.fstAgent.chunkSize = 2
+    self.fstAgent.tClient.getTransformationTasks.side_effect = lambda condDict: S_OK(
+        [{'TaskID': taskID, 'ExternalStatus': 'Done', 'ExternalID': taskID + 100} for taskID in condDict['TaskID']])
+    res = self.fstAgent.getRequestStatus(self.fakeTransID, [3, 1, None, 2, 1])
+    self.assertTrue(res['OK'])
+    self.assertEquals(sorted(res['Value']), [1, 2, 3])
+    self.assertEquals(res['Value'][3]['RequestID'], 103)
+    self.assertEquals(len(self.fstAgent.tClient.getTransformationTasks.mock_calls), 2)
+    self.assertEquals(self.fstAgent.stageStats['GetTransformationTasks']['Calls'], 2)
+
+  def test_get_transformation_files_by_status(self):
+    """ Test getTransformationFilesByStatus gets the files of all statuses in one call """
+    self.fstAgent.transformationFileStatuses = ['Assigned', 'Problematic']
+    self.fstAgent.tClient.getTransformationFiles.return_value = S_ERROR()
+    self.assertFalse(self.fstAgent.getTransformationFilesByStatus(self.fakeTransID)['OK'])
+
+    self.fstAgent.tClient.getTransformationFiles.return_value = S_OK([{'LFN': '/ilc/file1', 'Status': 'Assigned'},
+                                                                      {'LFN': '/ilc/file2', 'Status': 'Problematic'},
+                                                                      {'LFN': '/ilc/file3', 'Status': 'Assigned'}])
+    res = self.fstAgent.getTransformationFilesByStatus(self.fakeTransID)['Value']
+    self.assertEquals([transFile['LFN'] for transFile in res['Assigned']], ['/ilc/file1', '/ilc/file3'])
+    self.assertEquals([transFile['LFN'] for transFile in res['Problematic']], ['/ilc/file2'])
+    self.fstAgent.tClient.getTransformationFiles.assert_called_with(
+        condDict={'TransformationID': self.fakeTransID, 'Status': ['Assigned', 'Problematic']})
+
+  def test_stage_statistics(self):
+    """ Test the statistics of the stages are accumulated and reset after logging """
+    self.fstAgent.recordStage('GetReplicas', 0, 2)
+    self.fstAgent.recordStage('GetReplicas', 0, 3)
+    self.assertEquals(self.fstAgent.stageStats['GetReplicas']['Calls'], 5)
+    self.assertTrue(self.fstAgent.stageStats['GetReplicas']['Time'] > 0)
+    self.fstAgent.logStageStatistics(self.fakeTransID, 1.0)
+    self.assertEquals(self.fstAgent.stageStats, {})
+
   def test_set_file_status(self):
     """ Test for setFileStatus function """
     transFiles = []
@@ -317,6 +353,28 @@ class TestFSTAgent(unittest.TestCase):
     self.assertFalse(res['Successful'][fileAllRepLost])
     self.assertFalse(res['Successful'][fileRemoved])
 
+  def test_exists_in_FC_chunks(self):
+    """ Test existsInFC queries the File Catalog in chunks and merges the results """
+    se1 = 'CERN-SRM'
+    files = ['/ilc/file/file%d' % index for index in xrange(5)]
+
+    def getReplicas(lfns):
+      """ the last file does not exist """
+      return S_OK({'Successful': {lfn: {se1: lfn} for lfn in lfns if lfn != files[-1]},
+                   'Failed': {lfn: 'No such file or directory' for lfn in lfns if lfn == files[-1]}})
+
+    self.fstAgent.chunkSize = 2
+    self.fstAgent.fcClient.getReplicas.side_effect = getReplicas
+    res = self.fstAgent.existsInFC([se1], files)['Value']
+    self.assertEquals(res['Successful'], dict({lfn: True for lfn in files[:-1]}, **{files[-1]: False}))
+    self.assertEquals(res['Failed'], {})
+    self.assertEquals(len(self.fstAgent.fcClient.getReplicas.mock_calls), 3)
+
+    self.fstAgent.fcClient.getReplicas.side_effect = [S_OK({'Successful': {}, 'Failed': {}}), S_ERROR('fc down'),
+                                                      S_OK({'Successful': {}, 'Failed': {}})]
+    self.fstAgent.maxThreads = 1
+    self.assertFalse(self.fstAgent.existsInFC([se1], files)['OK'])
+
   def test_exists_on_storage_element(self):
     """ Test if the existsOnSE function correctly determines if a file
         exists on all provided Storage Elements or not """
@@ -363,6 +421,16 @@ class TestFSTAgent(unittest.TestCase):
     self.assertFalse(res['Successful'][fileOneRepLost])
     self.assertTrue(len(res['Failed']), 1)
 
+    # every storage element is asked for every chunk of files
+    self.fstAgent.chunkSize = 3
+    SeModule.StorageElementItem.exists.reset_mock()
+    SeModule.StorageElementItem.exists.side_effect = lambda lfns: S_OK({'Successful': dict.fromkeys(lfns, True),
+                                                                        'Failed': {}})
+    res = self.fstAgent.existsOnSE(storageElements, files)['Value']
+    self.assertEquals(res['Successful'], dict.fromkeys(files, True))
+    self.assertEquals(res['Failed'], {se1: {}, se2: {}})
+    self.assertEquals(len(SeModule.StorageElementItem.exists.mock_calls), 4)
+
   def test_exists(self):
     """ Tests if the exists function correctly determines if a file exists in File Catalog and Storage Elements """
 
@@ -422,22 +490,23 @@ class TestFSTAgent(unittest.TestCase):
     self.assertFalse(res[fileRemoved])
 
   def test_select_failed_requests(self):
-    """ Test if selectFailedRequests function returns True if transfile has a failed request """
+    """ Test if selectFailedRequests function returns only the transfiles which have a failed request """
 
     transFileWithFailedReq = {'TransformationID': 400103, 'TaskID': 0, 'LFN': '/ilc/file1'}
     transFileWithDoneReq = {'TransformationID': 400103, 'TaskID': 1, 'LFN': '/ilc/file2'}
+    transFileWithoutTask = {'TransformationID': 400103, 'TaskID': 2, 'LFN': '/ilc/file3'}
+    transFiles = [transFileWithFailedReq, transFileWithDoneReq, transFileWithoutTask]
 
     self.fstAgent.tClient.getTransformationTasks.return_value = S_ERROR()
-    res = self.fstAgent.selectFailedRequests(transFileWithFailedReq)
-    self.assertFalse(res)
+    res = self.fstAgent.selectFailedRequests(400103, transFiles)
+    self.assertEquals(res, [])
 
-    self.fstAgent.tClient.getTransformationTasks.return_value = S_OK([self.failedTask])
-    res = self.fstAgent.selectFailedRequests(transFileWithFailedReq)
-    self.assertTrue(res)
-
-    self.fstAgent.tClient.getTransformationTasks.return_value = S_OK([self.doneTask])
-    res = self.fstAgent.selectFailedRequests(transFileWithDoneReq)
-    self.assertFalse(res)
+    self.fstAgent.tClient.getTransformationTasks.reset_mock()
+    self.fstAgent.tClient.getTransformationTasks.return_value = S_OK([self.failedTask, self.doneTask])
+    res = self.fstAgent.selectFailedRequests(400103, transFiles)
+    self.assertEquals(res, [transFileWithFailedReq])
+    self.fstAgent.tClient.getTransformationTasks.assert_called_once_with(
+        condDict={'TransformationID': 400103, 'TaskID': [0, 1, 2]})
 
   def test_retry_strategy_for_files(self):
     """ Test if the request exists then retry strategy is resetting the request otherwise set the file to unused """
@@ -459,12 +528,22 @@ class TestFSTAgent(unittest.TestCase):
 
     # no request exists for first trans file and one request exists for second trans file
     self.fstAgent.reqClient.getRequest = MagicMock()
-    self.fstAgent.reqClient.getRequest.side_effect = [S_ERROR('Request does not exist'), S_OK('Request exists')]
+    self.fstAgent.reqClient.getRequest.side_effect = lambda requestID: (S_OK('Request exists') if requestID == 2
+                                                                        else S_ERROR('Request does not exist'))
 
     res = self.fstAgent.retryStrategyForFiles(self.fakeTransID, transFiles)['Value']
 
     self.assertEquals(res[taskIDfile1]['Strategy'], FST.SET_UNUSED)
     self.assertEquals(res[taskIDfile2]['Strategy'], FST.RESET_REQUEST)
+    self.assertEquals(res[taskIDfile2]['RequestID'], 2)
+
+    # the request of a task is only looked up once, tasks not found are set to unused
+    self.fstAgent.reqClient.getRequest.reset_mock()
+    transFiles.append({'TransformationID': self.fakeTransID, 'TaskID': taskIDfile2, 'LFN': '/ilc/file3'})
+    transFiles.append({'TransformationID': self.fakeTransID, 'TaskID': 3, 'LFN': '/ilc/file4'})
+    res = self.fstAgent.retryStrategyForFiles(self.fakeTransID, transFiles)['Value']
+    self.assertEquals(len(self.fstAgent.reqClient.getRequest.mock_calls), 2)
+    self.assertEquals(res[3]['Strategy'], FST.SET_UNUSED)
 
   def test_retry_files(self):
     """ Test for retryFiles function """
@@ -542,7 +621,7 @@ class TestFSTAgent(unittest.TestCase):
     transFiles = [fileNotAvailableOnSrc, fileNotAvailableOnDst, fileAvailable, fileNotAvailable]
 
     # all trans files have failed requests
-    self.fstAgent.selectFailedRequests = MagicMock(return_value={tFile['TaskID']: True for tFile in transFiles})
+    self.fstAgent.selectFailedRequests = MagicMock(side_effect=lambda transID, tFiles: tFiles)
 
     # no assosiated request in rms
     self.fstAgent.retryStrategyForFiles = MagicMock(return_value=S_OK(
@@ -550,27 +629,39 @@ class TestFSTAgent(unittest.TestCase):
 
     self.fstAgent.exists = MagicMock()
 
-    # all file statuses should be processed even if getTransformationFiles returns an error for some status
+    def getTransformationFiles(condDict):
+      """ all trans files have the first requested status """
+      for tFile in transFiles:
+        tFile['Status'] = condDict['Status'][0]
+      return S_OK(transFiles)
+
+    # the files of all statuses are fetched with a single call, no action is taken if it fails
     self.fstAgent.transformationFileStatuses = ['Assigned', 'Problematic']
     self.fstAgent.tClient.getTransformationFiles.return_value = S_ERROR()
     self.fstAgent.processTransformation(self.fakeTransID, self.sourceSE, self.targetSE, FST.REPLICATION_TRANS)
-    self.assertEquals(len(self.fstAgent.tClient.getTransformationFiles.mock_calls), 2)
+    self.assertEquals(len(self.fstAgent.tClient.getTransformationFiles.mock_calls), 1)
+    self.fstAgent.setFileStatus.assert_not_called()
+    self.fstAgent.sendNotification.assert_called_once_with(self.fakeTransID, FST.REPLICATION_TRANS,
+                                                           self.sourceSE, self.targetSE)
 
-    # all file statuses should be processed even if no transformation files are found for some status
+    # nothing is checked if no transformation files are found
     self.fstAgent.tClient.getTransformationFiles.reset_mock()
     self.fstAgent.tClient.getTransformationFiles.return_value = S_OK([])
     self.fstAgent.processTransformation(self.fakeTransID, self.sourceSE, self.targetSE, FST.REPLICATION_TRANS)
-    self.assertEquals(len(self.fstAgent.tClient.getTransformationFiles.mock_calls), 2)
+    self.assertEquals(len(self.fstAgent.tClient.getTransformationFiles.mock_calls), 1)
+    self.fstAgent.exists.assert_not_called()
+    self.fstAgent.selectFailedRequests.assert_not_called()
 
-    # all file statuses should be processed even if we get a failure to determine if transformation files
-    # with some status exists in FileCatalog and StorageElements
+    # no action is taken if we get a failure to determine if transformation files exist
+    # in FileCatalog and StorageElements
     self.fstAgent.tClient.getTransformationFiles.reset_mock()
-    self.fstAgent.tClient.getTransformationFiles.return_value = S_OK(transFiles)
+    self.fstAgent.tClient.getTransformationFiles.side_effect = getTransformationFiles
     self.fstAgent.exists.return_value = S_ERROR()
     self.fstAgent.processTransformation(self.fakeTransID, self.sourceSE, self.targetSE, FST.REPLICATION_TRANS)
-    self.assertEquals(len(self.fstAgent.tClient.getTransformationFiles.mock_calls), 2)
+    self.assertEquals(len(self.fstAgent.tClient.getTransformationFiles.mock_calls), 1)
+    self.assertEquals(len(self.fstAgent.exists.mock_calls), 1)
+    self.fstAgent.setFileStatus.assert_not_called()
 
-    self.fstAgent.tClient.getTransformationFiles.return_value = S_OK(transFiles)
     self.fstAgent.exists.side_effect = self._exists
     self.fstAgent.transformationFileStatuses = ['Assigned']
 
@@ -479,6 +479,14 @@ class TestJI( unittest.TestCase ):
       self.jbi.checkRequests( reqClient )
     self.assertIn( "Failed to check Requests" , str(cme.exception) )
 
+    ## requests already read for many jobs
+    reqMock = Mock()
+    reqClient = Mock( name="reqMock", spec=DIRAC.RequestManagementSystem.Client.ReqClient.ReqClient )
+    reqClient.getRequestStatus.return_value = S_OK( 'Waiting' )
+    self.jbi.checkRequests( reqClient, { "Successful": { 1234: reqMock, 1235: reqMock } } )
+    self.assertTrue( self.jbi.pendingRequest )
+    self.assertFalse( reqClient.readRequestsForJobs.called )
+
   def test_checkFileExistance( self ):
     """ILCTransformation.Utilities.JobInfo.checkFileExistance......................................."""
     fcMock = Mock( name="fcMock", spec=DIRAC.Resources.Catalog.FileCatalogClient.FileCatalogClient )
@@ -511,6 +519,18 @@ class TestJI( unittest.TestCase ):
       self.jbi.checkFileExistance( fcMock )
     self.assertIn( "Failed to check existance: No FC", str(cme.exception) )
 
+    ## existence already checked for many files
+    self.setUp()
+    fcMock.exists.reset_mock()
+    self.jbi.inputFile = "inputFile"
+    self.jbi.outputFiles = ["outputFile1", "outputFile2"]
+    self.assertEqual( self.jbi.getLFNs(), ["inputFile", "outputFile1", "outputFile2"] )
+    self.jbi.checkFileExistance( fcMock, { "Successful": { "inputFile": False, "outputFile1": True,
+                                                           "outputFile2": True, "otherFile": True } } )
+    self.assertFalse( self.jbi.inputFileExists )
+    self.assertEqual( self.jbi.outputFileStatus, ["Exists", "Exists"] )
+    self.assertFalse( fcMock.exists.called )
+
 
   def test__str__( self ):
     """ILCTransformation.Utilities.JobInfo.__str__.................................................."""
@@ -0,0 +1,107 @@
+"""Test the LogInventory"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from ILCDIRAC.ILCTransformationSystem.Utilities.LogInventory import LogInventory, parseLogName
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.ILCTransformationSystem.Utilities.LogInventory'
+
+
+class TestLogInventory( unittest.TestCase ):
+  """Test the incremental inventory of the log directories"""
+
+  def setUp( self ):
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    self.basePath = os.path.join( self.tmpdir, 'prod' )
+    self.inventoryFile = os.path.join( self.tmpdir, 'inventory.json.gz' )
+    self.logDir1 = os.path.join( self.basePath, 'clic', 'sim', 'LOG' )
+    self.logDir2 = os.path.join( self.basePath, 'ilc', 'rec', 'LOG' )
+    for task in xrange( 1, 4 ):
+      self.addLog( self.logDir1, 1234, task )
+    for task in xrange( 7, 9 ):
+      self.addLog( self.logDir2, 2345, task )
+    os.makedirs( os.path.join( self.basePath, 'clic', 'sim', 'DST' ) )
+
+  def tearDown( self ):
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
+
+  @staticmethod
+  def addLog( logDir, prod, task ):
+    """create the log directory of a task"""
+    entry = os.path.join( logDir, 'prod_log_%d_%08d_job' % ( prod, task ) )
+    os.makedirs( entry )
+    with open( os.path.join( entry, 'std.out' ), 'w' ) as out:
+      out.write( 'x' * 10 * task )
+    return entry
+
+  def test_parse( self ):
+    self.assertEqual( parseLogName( 'prod_log_1234_00000012_job' ), ( 1234, 12 ) )
+    self.assertRaises( ValueError, parseLogName, 'prod_1234' )
+    self.assertRaises( ValueError, parseLogName, 'prod_log_abc_00000012_job' )
+
+  def test_update( self ):
+    inventory = LogInventory( self.basePath, self.inventoryFile )
+    self.assertEqual( inventory.update()['Value'], 8 )
+    self.assertEqual( sorted( inventory.logDirs ), sorted( [ self.logDir1, self.logDir2 ] ) )
+    self.assertEqual( inventory.getProductions(),
+                      { 1234: dict( FirstTask = 1, LastTask = 2, Size = 30, Entries = 2,
+                                    MTime = inventory.getProductions()[ 1234 ][ 'MTime' ] ),
+                        2345: dict( FirstTask = 7, LastTask = 7, Size = 70, Entries = 1,
+                                    MTime = inventory.getProductions()[ 2345 ][ 'MTime' ] ) } )
+    prodFiles, sizes = inventory.getLogFiles( set( [ 1234 ] ) )
+    self.assertEqual( prodFiles, { 1234: [ os.path.join( self.logDir1, 'prod_log_1234_00000001_job' ),
+                                           os.path.join( self.logDir1, 'prod_log_1234_00000002_job' ) ] } )
+    self.assertEqual( sorted( sizes.values() ), [ 10, 20 ] )
+
+  def test_incremental( self ):
+    inventory = LogInventory( self.basePath, self.inventoryFile )
+    inventory.update()
+    self.assertTrue( inventory.save()['OK'] )
+
+    inventory = LogInventory( self.basePath, self.inventoryFile )
+    self.assertTrue( inventory.load()['OK'] )
+    with patch( '%s.getEntrySize' % MODULE_NAME ) as sizeMock:
+      self.assertEqual( inventory.update()['Value'], 0 )
+    self.assertFalse( sizeMock.called )
+
+    ## only the changed LOG directory is listed, only the new entry is measured
+    self.addLog( self.logDir2, 2345, 9 )
+    os.utime( self.logDir2, ( 1, 1 ) )
+    with patch( '%s.getEntrySize' % MODULE_NAME, return_value = 5 ) as sizeMock:
+      self.assertEqual( inventory.update()['Value'], 1 )
+    sizeMock.assert_called_once_with( os.path.join( self.logDir2, 'prod_log_2345_00000009_job' ) )
+    self.assertEqual( inventory.getProductions()[ 2345 ][ 'LastTask' ], 8 )
+
+    ## removed directories disappear from the inventory
+    shutil.rmtree( os.path.join( self.basePath, 'clic' ) )
+    os.utime( self.basePath, ( 1, 1 ) )
+    inventory.update()
+    self.assertEqual( sorted( inventory.getProductions() ), [ 2345 ] )
+    self.assertEqual( sorted( inventory.directories ), sorted( [ self.basePath, os.path.join( self.basePath, 'ilc' ),
+                                                                 os.path.join( self.basePath, 'ilc', 'rec' ) ] ) )
+
+  def test_load_invalid( self ):
+    inventory = LogInventory( self.basePath, self.inventoryFile )
+    self.assertTrue( inventory.load()['OK'] )
+    inventory.update()
+    inventory.save()
+    self.assertFalse( LogInventory( self.tmpdir, self.inventoryFile ).load()['OK'] )
+    with open( self.inventoryFile, 'w' ) as out:
+      out.write( 'garbage' )
+    res = inventory.load()
+    self.assertFalse( res['OK'] )
+    self.assertIn( 'Cannot read inventory', res['Message'] )
+
+  def test_update_missing_base( self ):
+    self.assertFalse( LogInventory( os.path.join( self.tmpdir, 'none' ), self.inventoryFile ).update()['OK'] )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestLogInventory )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
@@ -0,0 +1,228 @@
+""" Test TarTheLogsAgent """
+
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from mock import MagicMock
+
+import ILCDIRAC.ILCTransformationSystem.Agent.TarTheLogsAgent as TTL
+from ILCDIRAC.ILCTransformationSystem.Agent.TarTheLogsAgent import TarTheProdLogsAgent, CREATED, DONE
+from ILCDIRAC.ILCTransformationSystem.Utilities.LogInventory import LogInventory
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC import gLogger
+from DIRAC.Core.Utilities.Adler import fileAdler
+
+__RCSID__ = "$Id$"
+
+
+class FakeStorage( object ):
+  """ storage element keeping the checksum and size of the uploaded files """
+
+  def __init__( self ):
+    self.files = {}
+    self.sizes = {}
+    self.contents = {}
+    self.corrupt = False
+    self.withChecksum = True
+
+  def exists( self, lfn ):
+    return S_OK( dict( Successful = { lfn: lfn in self.files }, Failed = {} ) )
+
+  def getFileMetadata( self, lfn ):
+    metadata = dict( Checksum = self.files[ lfn ] if self.withChecksum else '', Size = self.sizes.get( lfn ) )
+    return S_OK( dict( Successful = { lfn: metadata }, Failed = {} ) )
+
+  def putFile( self, fileDict ):
+    for lfn, localPath in fileDict.items():
+      self.files[ lfn ] = '00000001' if self.corrupt else fileAdler( localPath )
+      self.sizes[ lfn ] = os.path.getsize( localPath ) + ( 1 if self.corrupt else 0 )
+      with tarfile.open( localPath ) as tarFile:
+        self.contents[ lfn ] = sorted( os.path.basename( name ) for name in tarFile.getnames() )
+    return S_OK( dict( Successful = dict.fromkeys( fileDict, True ), Failed = {} ) )
+
+
+class TestTarTheLogsAgent( unittest.TestCase ):
+  """ Test the tarring and upload of the logs """
+
+  def setUp( self ):
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    TTL.AgentModule = MagicMock()
+    self.agent = TarTheProdLogsAgent()
+    self.agent.log = gLogger
+    self.agent.baselfn = '/ilc/prod/logs'
+    self.agent.tarsDir = os.path.join( self.tmpdir, 'LogsTars' )
+    self.agent.maxTasksPerTar = 2
+    self.agent.maxThreads = 2
+    self.storage = FakeStorage()
+    self.agent.storageElement = self.storage
+
+    logDir = os.path.join( self.tmpdir, 'LOG' )
+    os.makedirs( logDir )
+    self.logFiles = []
+    for task in xrange( 1, 6 ):
+      logFile = os.path.join( logDir, 'prod_log_1234_%08d_log' % task )
+      with open( logFile, 'w' ) as out:
+        out.write( 'log of task %d\n' % task * 100 )
+      self.logFiles.append( logFile )
+
+  def tearDown( self ):
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
+
+  def getManifest( self ):
+    with open( self.agent.getManifestPath( 1234 ) ) as manifestFile:
+      return json.load( manifestFile )
+
+  def test_chunks( self ):
+    chunks = self.agent.getChunks( 1234, self.logFiles )
+    self.assertEqual( [ name for name, _ in chunks ], [ '1234_1_to_2_logs.tgz',
+                                                        '1234_3_to_4_logs.tgz',
+                                                        '1234_5_to_5_logs.tgz' ] )
+    self.agent.maxTasksPerTar = 10
+    self.agent.maxTarSize = 2 * os.path.getsize( self.logFiles[ 0 ] )
+    self.assertEqual( [ len( entries ) for _, entries in self.agent.getChunks( 1234, self.logFiles ) ], [ 2, 2, 1 ] )
+    self.agent.maxTarSize = 1
+    self.assertEqual( len( self.agent.getChunks( 1234, self.logFiles ) ), 5 )
+
+  def test_archive_production( self ):
+    res = self.agent.archiveProduction( 1234, self.logFiles )
+    self.assertTrue( res['OK'], res.get( 'Message' ) )
+    self.assertEqual( res['Value'], 3 )
+    self.assertEqual( self.storage.contents[ '/ilc/prod/logs/1234/1234_3_to_4_logs_0.tgz' ],
+                      [ 'prod_log_1234_00000003_log', 'prod_log_1234_00000004_log' ] )
+    self.assertFalse( any( os.path.exists( logFile ) for logFile in self.logFiles ) )
+    self.assertEqual( os.listdir( os.path.join( self.agent.tarsDir, '1234' ) ), [ TTL.MANIFEST_NAME ] )
+    chunks = self.getManifest()[ 'Chunks' ]
+    self.assertEqual( set( chunk[ 'Status' ] for chunk in chunks.values() ), set( [ DONE ] ) )
+    self.assertEqual( chunks[ '1234_5_to_5_logs.tgz' ][ 'LFN' ],
+                      '/ilc/prod/logs/1234/1234_5_to_5_logs_0.tgz' )
+
+  def test_archive_tasks_run_again( self ):
+    self.assertEqual( self.agent.archiveProduction( 1234, self.logFiles[ :2 ] ), S_OK( 1 ) )
+    ## the logs of the same tasks again, the chunk of the same name is done already
+    for logFile in self.logFiles[ :2 ]:
+      with open( logFile, 'w' ) as out:
+        out.write( 'log of the task run again\n' )
+    self.assertEqual( self.agent.archiveProduction( 1234, self.logFiles[ :2 ] ), S_OK( 1 ) )
+    self.assertFalse( any( os.path.exists( logFile ) for logFile in self.logFiles[ :2 ] ) )
+    chunks = self.getManifest()[ 'Chunks' ]
+    self.assertEqual( sorted( chunks ), [ '1234_1_to_2_logs.tgz', '1234_1_to_2_logs_2.tgz' ] )
+    self.assertEqual( set( chunk[ 'Status' ] for chunk in chunks.values() ), set( [ DONE ] ) )
+    self.assertEqual( sorted( self.storage.files ), [ '/ilc/prod/logs/1234/1234_1_to_2_logs_0.tgz',
+                                                      '/ilc/prod/logs/1234/1234_1_to_2_logs_2_0.tgz' ] )
+
+  def test_checksum_mismatch_and_resume( self ):
+    self.storage.corrupt = True
+    res = self.agent.archiveProduction( 1234, self.logFiles )
+    self.assertFalse( res['OK'] )
+    self.assertIn( 'Checksum mismatch', res['Message'] )
+    self.assertTrue( all( os.path.exists( logFile ) for logFile in self.logFiles ) )
+    chunks = self.getManifest()[ 'Chunks' ]
+    self.assertEqual( set( chunk[ 'Status' ] for chunk in chunks.values() ), set( [ CREATED ] ) )
+
+    ## logs that are in a pending tar ball are not put in a new one
+    self.agent.createTarBall = MagicMock( side_effect = self.agent.createTarBall )
+    self.assertEqual( self.agent.archiveProduction( 1234, self.logFiles ), S_OK( 0 ) )
+    self.assertFalse( self.agent.createTarBall.called )
+
+    ## the next cycle resumes from the existing tar balls, corrupt files are not overwritten
+    self.storage.corrupt = False
+    self.assertTrue( self.agent.cleanupPrevious()['OK'] )
+    self.assertFalse( self.agent.createTarBall.called )
+    self.assertFalse( any( os.path.exists( logFile ) for logFile in self.logFiles ) )
+    chunks = self.getManifest()[ 'Chunks' ]
+    self.assertEqual( set( chunk[ 'Status' ] for chunk in chunks.values() ), set( [ DONE ] ) )
+    self.assertEqual( chunks[ '1234_1_to_2_logs.tgz' ][ 'LFN' ],
+                      '/ilc/prod/logs/1234/1234_1_to_2_logs_1.tgz' )
+
+  def test_upload_already_there( self ):
+    tarBall = os.path.join( self.tmpdir, '1234_1_to_1_logs.tgz' )
+    res = self.agent.createTarBall( tarBall, self.logFiles[ :1 ] )
+    self.assertEqual( res, S_OK( fileAdler( tarBall ) ) )
+    lfn = '/ilc/prod/logs/1234/1234_1_to_1_logs_0.tgz'
+    self.storage.files[ lfn ] = res['Value']
+    self.storage.putFile = MagicMock()
+    self.assertEqual( self.agent.uploadToStorage( 1234, tarBall ), S_OK( lfn ) )
+    self.assertFalse( self.storage.putFile.called )
+
+  def test_upload_without_checksum( self ):
+    self.storage.withChecksum = False
+    res = self.agent.archiveProduction( 1234, self.logFiles )
+    self.assertTrue( res['OK'], res.get( 'Message' ) )
+    self.assertEqual( sorted( self.storage.files ), [ '/ilc/prod/logs/1234/1234_1_to_2_logs_0.tgz',
+                                                      '/ilc/prod/logs/1234/1234_3_to_4_logs_0.tgz',
+                                                      '/ilc/prod/logs/1234/1234_5_to_5_logs_0.tgz' ] )
+
+  def test_upload_already_there_without_checksum( self ):
+    self.storage.withChecksum = False
+    tarBall = os.path.join( self.tmpdir, '1234_1_to_1_logs.tgz' )
+    self.agent.createTarBall( tarBall, self.logFiles[ :1 ] )
+    lfn = '/ilc/prod/logs/1234/1234_1_to_1_logs_0.tgz'
+    self.storage.files[ lfn ] = ''
+    self.storage.sizes[ lfn ] = os.path.getsize( tarBall )
+    self.storage.putFile = MagicMock()
+    self.assertEqual( self.agent.uploadToStorage( 1234, tarBall ), S_OK( lfn ) )
+    self.assertFalse( self.storage.putFile.called )
+
+  def test_upload_without_checksum_mismatch( self ):
+    self.storage.withChecksum = False
+    self.storage.corrupt = True
+    tarBall = os.path.join( self.tmpdir, '1234_1_to_1_logs.tgz' )
+    self.agent.createTarBall( tarBall, self.logFiles[ :1 ] )
+    res = self.agent.uploadToStorage( 1234, tarBall )
+    self.assertFalse( res['OK'] )
+    self.assertIn( 'Checksum mismatch', res['Message'] )
+
+  def test_upload_fails( self ):
+    tarBall = os.path.join( self.tmpdir, '1234_1_to_1_logs.tgz' )
+    self.agent.createTarBall( tarBall, self.logFiles[ :1 ] )
+    self.storage.putFile = MagicMock( return_value = S_ERROR( 'SE down' ) )
+    self.assertEqual( self.agent.uploadToStorage( 1234, tarBall ), S_ERROR( 'SE down' ) )
+
+  def test_create_fails( self ):
+    res = self.agent.createTarBall( os.path.join( self.tmpdir, 'out.tgz' ), [ '/no/such/log' ] )
+    self.assertFalse( res['OK'] )
+    self.assertEqual( sorted( os.listdir( self.tmpdir ) ), [ 'LOG' ] )
+
+  def test_stopped_productions( self ):
+    self.agent.transclient = MagicMock()
+    self.agent.transclient.getTransformations.side_effect = [
+        S_OK( [ dict( TransformationID = prod, Status = status )
+                for prod, status in zip( xrange( 1, 101 ), [ 'Active', 'Completing', 'Stopped', 'Archived' ] * 25 ) ] ),
+        S_OK( [ dict( TransformationID = 101, Status = 'Completed' ) ] ) ]
+    res = self.agent.getStoppedProductions( range( 1, 103 ) )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( res['Value'], [ prod for prod in xrange( 1, 101 ) if prod % 4 in ( 3, 0 ) ] + [ 101 ] )
+    self.assertEqual( self.agent.transclient.getTransformations.call_count, 2 )
+    self.agent.transclient.getTransformations.assert_called_with( condDict = { 'TransformationID': [ 101, 102 ] },
+                                                                  limit = 2 )
+    self.agent.transclient.getTransformations.side_effect = None
+    self.agent.transclient.getTransformations.return_value = S_ERROR( 'TS down' )
+    self.assertEqual( self.agent.getStoppedProductions( [ 1 ] ), S_ERROR( 'TS down' ) )
+
+  def test_execute( self ):
+    ## the LOG directory entries, the last one is still being filled and is not archived
+    for logFile in self.logFiles:
+      os.remove( logFile )
+      os.makedirs( logFile )
+      with open( os.path.join( logFile, 'std.out' ), 'w' ) as out:
+        out.write( 'output' )
+    self.agent.inventory = LogInventory( self.tmpdir, os.path.join( self.tmpdir, 'inventory.json.gz' ) )
+    self.agent.transclient = MagicMock()
+    self.agent.transclient.getTransformations.return_value = S_OK( [ dict( TransformationID = 1234,
+                                                                           Status = 'Stopped' ) ] )
+    self.assertTrue( self.agent.execute()['OK'] )
+    self.agent.transclient.getTransformations.assert_called_once_with( condDict = { 'TransformationID': [ 1234 ] },
+                                                                       limit = 1 )
+    self.assertEqual( sorted( self.storage.files ), [ '/ilc/prod/logs/1234/1234_1_to_2_logs_0.tgz',
+                                                      '/ilc/prod/logs/1234/1234_3_to_4_logs_0.tgz' ] )
+    self.assertEqual( os.listdir( os.path.join( self.tmpdir, 'LOG' ) ), [ 'prod_log_1234_00000005_log' ] )
+    self.assertTrue( os.path.exists( os.path.join( self.tmpdir, 'inventory.json.gz' ) ) )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestTarTheLogsAgent )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
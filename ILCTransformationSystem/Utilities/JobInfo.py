@@ -96,16 +96,24 @@ class JobInfo( object ):
     self.taskFileID = taskDict['FileID']
     self.errorCount = taskDict['ErrorCount']
 
-  def checkFileExistance( self, fcClient ):
-    """check if input and outputfile still exist"""
+  def getLFNs( self ):
+    """return the input and output files of the job"""
     lfns = []
     if self.inputFile:
       lfns = [self.inputFile]
-    lfns = lfns + self.outputFiles
-    reps = fcClient.exists( lfns )
-    if not reps['OK']:
-      raise RuntimeError( "Failed to check existance: %s" % reps['Message'] )
-    statuses = reps['Value']
+    return lfns + self.outputFiles
+
+  def checkFileExistance( self, fcClient, statuses=None ):
+    """check if input and outputfile still exist
+
+    :param fcClient: FileCatalogClient used if the statuses are not given
+    :param dict statuses: result of fcClient.exists for (at least) the files of this job
+    """
+    if statuses is None:
+      reps = fcClient.exists( self.getLFNs() )
+      if not reps['OK']:
+        raise RuntimeError( "Failed to check existance: %s" % reps['Message'] )
+      statuses = reps['Value']
     success = statuses['Successful']
     if self.inputFile:
       self.inputFileExists = True if (self.inputFile in success and success[self.inputFile]) else False
@@ -117,13 +125,19 @@ class JobInfo( object ):
       else:
         self.outputFileStatus.append("Unknown")
       
-  def checkRequests( self, reqClient ):
-    """check if there are pending Requests"""
-    result = reqClient.readRequestsForJobs( [self.jobID] )
-    if not result['OK']:
-      raise RuntimeError( "Failed to check Requests: %s " % result['Message'] )
-    if self.jobID in result['Value']['Successful']:
-      request = result['Value']['Successful'][self.jobID]
+  def checkRequests( self, reqClient, requests=None ):
+    """check if there are pending Requests
+
+    :param reqClient: ReqClient
+    :param dict requests: result of reqClient.readRequestsForJobs for (at least) this job, read if not given
+    """
+    if requests is None:
+      result = reqClient.readRequestsForJobs( [self.jobID] )
+      if not result['OK']:
+        raise RuntimeError( "Failed to check Requests: %s " % result['Message'] )
+      requests = result['Value']
+    if self.jobID in requests['Successful']:
+      request = requests['Successful'][self.jobID]
       requestID = request.RequestID
       dbStatus = reqClient.getRequestStatus( requestID ).get( 'Value', 'Unknown' )
       self.pendingRequest = dbStatus not in ("Done","Canceled")
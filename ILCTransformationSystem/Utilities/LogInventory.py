@@ -0,0 +1,205 @@
+"""
+Persistent inventory of the production log directories.
+
+The log area holds millions of entries, walking it completely on every cycle is too slow. The inventory keeps the
+modification time of every directory above the ``LOG`` directories, and the production, task, size and modification
+time of every entry of the ``LOG`` directories. When the inventory is updated only the directories whose
+modification time changed are listed again, and the entries of the ``LOG`` directories are never descended into.
+
+The inventory is stored as a gzipped JSON file, replaced atomically.
+
+:since: Oct 17, 2026
+"""
+
+import gzip
+import json
+import os
+import tempfile
+
+from DIRAC import S_OK, S_ERROR, gLogger
+
+__RCSID__ = "$Id$"
+
+LOG = gLogger.getSubLogger('LogInventory')
+
+#: version of the inventory format, inventories with another version are ignored
+INVENTORY_VERSION = 1
+#: name of the directories containing the logs of the tasks
+LOG_DIR_NAME = 'LOG'
+
+
+def parseLogName(name):
+  """Return the production and task ID of a log entry.
+
+  :param str name: name of the entry, e.g. ``<...>_<...>_<prodID>_<taskID>_<...>``
+  :returns: tuple of production and task ID
+  :raises ValueError: if the name does not contain the IDs
+  """
+  parts = name.split('_')
+  if len(parts) < 4:
+    raise ValueError('Not a log name: %s' % name)
+  return int(parts[2]), int(parts[-2])
+
+
+def getEntrySize(path):
+  """Return the size in bytes of the file, or of all the files below the directory."""
+  if not os.path.isdir(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+  size = 0
+  for root, _dirs, files in os.walk(path):
+    for fileName in files:
+      filePath = os.path.join(root, fileName)
+      if not os.path.islink(filePath):
+        size += os.path.getsize(filePath)
+  return size
+
+
+class LogInventory(object):
+  """Index of the log entries below a base path, updated incrementally."""
+
+  def __init__(self, basePath, inventoryFile):
+    """
+    :param str basePath: directory below which the ``LOG`` directories are searched
+    :param str inventoryFile: path of the file the inventory is stored in
+    """
+    self.basePath = basePath
+    self.inventoryFile = inventoryFile
+    #: directories above the LOG directories, path: {'MTime': mtime, 'Subdirs': [names]}
+    self.directories = {}
+    #: LOG directories, path: {'MTime': mtime, 'Entries': {name: {'Prod', 'Task', 'Size', 'MTime'}}}
+    self.logDirs = {}
+
+  def load(self):
+    """Read the inventory from its file, a missing or invalid file leaves the inventory empty.
+
+    :returns: S_OK, S_ERROR if the file exists but cannot be used
+    """
+    if not os.path.exists(self.inventoryFile):
+      return S_OK()
+    try:
+      with gzip.open(self.inventoryFile, 'rb') as inventoryFile:
+        inventory = json.load(inventoryFile)
+    except (IOError, OSError, ValueError) as err:
+      return S_ERROR('Cannot read inventory %s: %s' % (self.inventoryFile, err))
+    if inventory.get('Version') != INVENTORY_VERSION or inventory.get('BasePath') != self.basePath:
+      return S_ERROR('Inventory %s does not match version %s and base path %s' %
+                     (self.inventoryFile, INVENTORY_VERSION, self.basePath))
+    self.directories = dict((str(path), dict(MTime=info['MTime'], Subdirs=[str(name) for name in info['Subdirs']]))
+                            for path, info in inventory['Directories'].items())
+    self.logDirs = dict((str(path), dict(MTime=info['MTime'],
+                                         Entries=dict((str(name), entry) for name, entry in info['Entries'].items())))
+                        for path, info in inventory['LogDirs'].items())
+    return S_OK()
+
+  def save(self):
+    """Write the inventory to its file, the file is replaced atomically."""
+    inventory = dict(Version=INVENTORY_VERSION, BasePath=self.basePath,
+                     Directories=self.directories, LogDirs=self.logDirs)
+    inventoryDir = os.path.dirname(self.inventoryFile) or '.'
+    try:
+      if not os.path.isdir(inventoryDir):
+        os.makedirs(inventoryDir)
+      tmpHandle, tmpName = tempfile.mkstemp(dir=inventoryDir, prefix='.tmp_inventory_')
+      os.close(tmpHandle)
+      with gzip.open(tmpName, 'wb') as inventoryFile:
+        json.dump(inventory, inventoryFile, separators=(',', ':'))
+      os.rename(tmpName, self.inventoryFile)
+    except (IOError, OSError) as err:
+      return S_ERROR('Cannot write inventory %s: %s' % (self.inventoryFile, err))
+    return S_OK()
+
+  def update(self):
+    """Bring the inventory up to date with the file system. Directories that disappeared are dropped, only the
+    directories whose modification time changed are listed.
+
+    :returns: S_OK with the number of directories that were listed
+    """
+    if not os.path.isdir(self.basePath):
+      return S_ERROR('Log directory %s does not exist' % self.basePath)
+    directories = {}
+    logDirs = {}
+    listed = 0
+    toVisit = [self.basePath]
+    while toVisit:
+      path = toVisit.pop()
+      try:
+        mtime = os.stat(path).st_mtime
+        if os.path.basename(path) == LOG_DIR_NAME:
+          known = self.logDirs.get(path)
+          if known is None or known['MTime'] != mtime:
+            known = dict(MTime=mtime, Entries=self.__listLogDir(path, known['Entries'] if known else {}))
+            listed += 1
+          logDirs[path] = known
+          continue
+        known = self.directories.get(path)
+        if known is None or known['MTime'] != mtime:
+          known = dict(MTime=mtime, Subdirs=sorted(name for name in os.listdir(path)
+                                                   if os.path.isdir(os.path.join(path, name))))
+          listed += 1
+      except OSError as err:
+        LOG.warn('Cannot list directory %s:' % path, str(err))
+        continue
+      directories[path] = known
+      toVisit.extend(os.path.join(path, name) for name in known['Subdirs'])
+    self.directories = directories
+    self.logDirs = logDirs
+    LOG.info('Listed %d of %d directories' % (listed, len(directories) + len(logDirs)))
+    return S_OK(listed)
+
+  @staticmethod
+  def __listLogDir(path, knownEntries):
+    """Return the entries of the LOG directory, the size of the entries that did not change is not computed again."""
+    entries = {}
+    for name in os.listdir(path):
+      entryPath = os.path.join(path, name)
+      if not os.path.isdir(entryPath):
+        continue
+      try:
+        prod, task = parseLogName(name)
+      except ValueError:
+        LOG.verbose('Ignoring', entryPath)
+        continue
+      mtime = os.stat(entryPath).st_mtime
+      known = knownEntries.get(name)
+      if known is not None and known['MTime'] == mtime:
+        entries[name] = known
+      else:
+        entries[name] = dict(Prod=prod, Task=task, Size=getEntrySize(entryPath), MTime=mtime)
+    return entries
+
+  def __archivableEntries(self):
+    """Yield (path, entry) of all entries, except the last one of each LOG directory which is still being filled."""
+    for logDir, info in self.logDirs.items():
+      for name in sorted(info['Entries'])[:-1]:
+        yield os.path.join(logDir, name), info['Entries'][name]
+
+  def getProductions(self):
+    """Return the summary of the logs that can be archived.
+
+    :returns: dictionary prodID: {'FirstTask', 'LastTask', 'Size', 'Entries', 'MTime'}
+    """
+    productions = {}
+    for _path, entry in self.__archivableEntries():
+      summary = productions.setdefault(entry['Prod'], dict(FirstTask=entry['Task'], LastTask=entry['Task'],
+                                                           Size=0, Entries=0, MTime=entry['MTime']))
+      summary['FirstTask'] = min(summary['FirstTask'], entry['Task'])
+      summary['LastTask'] = max(summary['LastTask'], entry['Task'])
+      summary['Size'] += entry['Size']
+      summary['Entries'] += 1
+      summary['MTime'] = max(summary['MTime'], entry['MTime'])
+    return productions
+
+  def getLogFiles(self, prods=None):
+    """Return the logs that can be archived.
+
+    :param list prods: production IDs to consider, all if None
+    :returns: tuple of the dictionary prodID: paths sorted by taskID, and the dictionary path: size
+    """
+    prodFiles = {}
+    sizes = {}
+    for path, entry in self.__archivableEntries():
+      if prods is not None and entry['Prod'] not in prods:
+        continue
+      prodFiles.setdefault(entry['Prod'], []).append((entry['Task'], path))
+      sizes[path] = entry['Size']
+    return dict((prod, [path for _task, path in sorted(files)]) for prod, files in prodFiles.items()), sizes
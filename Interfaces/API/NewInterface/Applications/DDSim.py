@@ -44,6 +44,7 @@ class DDSim( DDInterfaceMixin, LCApplication ):
     self.startFrom = 0
     self.randomSeed = -1
     self.detectorModel = ''
+    self.zeroCopyLog = False
     super(DDSim, self).__init__( paramdict )
     ##Those 5 need to come after default constructor
     self._modulename = 'DDSimAnalysis'
@@ -78,6 +79,28 @@ class DDSim( DDInterfaceMixin, LCApplication ):
     self._checkArgs( { 'startfrom' : types.IntType } )
     self.startFrom = startfrom
 
+  def setZeroCopyLog(self, zeroCopyLog = True):
+    """ Optional: Let the shell append the output of DDSim to the log file, only the lines with the event
+    numbers go through the job, which saves CPU for very verbose logs
+
+    :param bool zeroCopyLog: append the output to the log file in the shell
+    """
+    self._checkArgs( { 'zeroCopyLog' : types.BooleanType } )
+    self.zeroCopyLog = zeroCopyLog
+
+  def _getSpecificAppParameters(self, stepdef):
+    """ Overload of LCApplication._getSpecificAppParameters, adds the ZeroCopyLog step parameter
+    """
+    stepdef.addParameter(Parameter("ZeroCopyLog", False, "bool", "", "", False, False,
+                                   "Append the output to the log file in the shell"))
+    return super(DDSim, self)._getSpecificAppParameters(stepdef)
+
+  def _setSpecificAppParameters(self, stepinst):
+    """ Overload of LCApplication._setSpecificAppParameters
+    """
+    stepinst.setValue("ZeroCopyLog", self.zeroCopyLog)
+    return super(DDSim, self)._setSpecificAppParameters(stepinst)
+
 
   def _userjobmodules(self, stepdefinition):
     res1 = self._setApplicationModuleAndParameters(stepdefinition)
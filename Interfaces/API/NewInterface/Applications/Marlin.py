@@ -57,6 +57,7 @@ class Marlin( DDInterfaceMixin, LCApplication ):
     self.gearFile = ''
     self.processorsToUse = []
     self.processorsToExclude = []
+    self.zeroCopyLog = False
     super(Marlin, self).__init__( paramdict )
     ##Those 5 need to come after default constructor
     self._modulename = 'MarlinAnalysis'
@@ -138,6 +139,28 @@ class Marlin( DDInterfaceMixin, LCApplication ):
     self._checkArgs( { 'processorlist' : types.ListType } )
     self.processorsToExclude = processorlist
 
+  def setZeroCopyLog(self, zeroCopyLog = True):
+    """ Optional: Let the shell append the output of Marlin to the log file, only the lines with the event
+    numbers go through the job, which saves CPU for very verbose logs
+
+    :param bool zeroCopyLog: append the output to the log file in the shell
+    """
+    self._checkArgs( { 'zeroCopyLog' : types.BooleanType } )
+    self.zeroCopyLog = zeroCopyLog
+
+  def _getSpecificAppParameters(self, stepdef):
+    """ Overload of LCApplication._getSpecificAppParameters, adds the ZeroCopyLog step parameter
+    """
+    stepdef.addParameter(Parameter("ZeroCopyLog", False, "bool", "", "", False, False,
+                                   "Append the output to the log file in the shell"))
+    return super(Marlin, self)._getSpecificAppParameters(stepdef)
+
+  def _setSpecificAppParameters(self, stepinst):
+    """ Overload of LCApplication._setSpecificAppParameters
+    """
+    stepinst.setValue("ZeroCopyLog", self.zeroCopyLog)
+    return super(Marlin, self)._setSpecificAppParameters(stepinst)
+
   def _userjobmodules(self, stepdefinition):
     res1 = self._setApplicationModuleAndParameters(stepdefinition)
     res2 = self._setUserJobFinalization(stepdefinition)
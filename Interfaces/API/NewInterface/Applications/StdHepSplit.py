@@ -27,6 +27,7 @@ class StdHepSplit(LCUtilityApplication):
   def __init__(self, paramdict = None):
     self.numberOfEventsPerFile = 0
     self.maxRead = 0
+    self.nativeSplit = False
     super(StdHepSplit, self).__init__( paramdict )
     if not self.version:
       self.version = 'V2'
@@ -56,6 +57,14 @@ class StdHepSplit(LCUtilityApplication):
     self._checkArgs( { 'maxRead' : types.IntType } )
     self.maxRead = maxRead
 
+  def setNativeSplit(self, nativeSplit = True):
+    """ split the file in the job itself instead of running hepsplit, see
+    :func:`~ILCDIRAC.Core.Utilities.StdHepReader.splitFile`
+
+    :param bool nativeSplit: split without hepsplit if True
+    """
+    self._checkArgs( { 'nativeSplit' : types.BooleanType } )
+    self.nativeSplit = nativeSplit
 
 
   def checkProductionMetaData(self, metaDict ):
@@ -74,6 +83,7 @@ class StdHepSplit(LCUtilityApplication):
     m1 = self._createModuleDefinition()
     m1.addParameter( Parameter( "debug",            False,  "bool", "", "", False, False, "debug mode"))
     m1.addParameter( Parameter( "maxRead", 0, "int", "", "", False, False, "max events to read"))
+    m1.addParameter( Parameter( "nativeSplit", False, "bool", "", "", False, False, "split without hepsplit"))
     m1.addParameter( Parameter( "nbEventsPerSlice",     0,   "int", "", "", False, False,
                                 "Number of events per output file"))
     return m1
@@ -82,6 +92,7 @@ class StdHepSplit(LCUtilityApplication):
     moduleinstance.setValue('debug',            self.debug)
     moduleinstance.setValue('nbEventsPerSlice', self.numberOfEventsPerFile)
     moduleinstance.setValue('maxRead',          self.maxRead)
+    moduleinstance.setValue('nativeSplit',      self.nativeSplit)
 
   def _userjobmodules(self, stepdefinition):
     res1 = self._setApplicationModuleAndParameters(stepdefinition)
@@ -5,6 +5,7 @@ Test DDSim module
 """
 
 import inspect
+import sys
 import unittest
 from mock import create_autospec, patch, MagicMock as Mock
 
@@ -50,6 +51,24 @@ class DDSimTestCase( unittest.TestCase ):
     self.dds.setStartFrom( 'adgiuj' )
     self.assertIn( '_checkArgs', self.dds._errorDict )
 
+  def test_setzerocopylog( self ):
+    assertEqualsImproved( self.dds.zeroCopyLog, False, self )
+    self.dds.setZeroCopyLog()
+    self.assertFalse( self.dds._errorDict )
+    assertEqualsImproved( self.dds.zeroCopyLog, True, self )
+    self.dds.setZeroCopyLog( 'yes' )
+    self.assertIn( '_checkArgs', self.dds._errorDict )
+
+  def test_zerocopylog_stepparameter( self ):
+    self.dds.setZeroCopyLog()
+    stepdef_mock = Mock()
+    with patch.object( sys.modules[ MODULE_NAME ], 'Parameter' ) as param_mock:
+      assertDiracSucceeds( self.dds._getSpecificAppParameters( stepdef_mock ), self )
+    self.assertIn( 'ZeroCopyLog', [ paramCall[1][0] for paramCall in param_mock.mock_calls if paramCall[0] == '' ] )
+    stepinst_mock = Mock()
+    assertDiracSucceeds( self.dds._setSpecificAppParameters( stepinst_mock ), self )
+    stepinst_mock.setValue.assert_any_call( 'ZeroCopyLog', True )
+
   def test_resolvelinkedparams( self ):
     step_mock = Mock()
     input_mock = Mock()
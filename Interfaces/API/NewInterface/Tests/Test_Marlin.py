@@ -5,6 +5,7 @@ Test Marlin module
 """
 
 import inspect
+import sys
 import unittest
 from mock import patch, MagicMock as Mock
 
@@ -48,6 +49,24 @@ class MarlinTestCase( unittest.TestCase ):
     self.mar.setProcessorsToExclude( [ 'proc1', 'proc2' ] )
     self.assertFalse( self.mar._errorDict )
 
+  def test_setzerocopylog( self ):
+    assertEqualsImproved( self.mar.zeroCopyLog, False, self )
+    self.mar.setZeroCopyLog()
+    self.assertFalse( self.mar._errorDict )
+    assertEqualsImproved( self.mar.zeroCopyLog, True, self )
+    self.mar.setZeroCopyLog( 'yes' )
+    self.assertIn( '_checkArgs', self.mar._errorDict )
+
+  def test_zerocopylog_stepparameter( self ):
+    self.mar.setZeroCopyLog()
+    stepdef_mock = Mock()
+    with patch.object( sys.modules[ MODULE_NAME ], 'Parameter' ) as param_mock:
+      assertDiracSucceeds( self.mar._getSpecificAppParameters( stepdef_mock ), self )
+    self.assertIn( 'ZeroCopyLog', [ paramCall[1][0] for paramCall in param_mock.mock_calls if paramCall[0] == '' ] )
+    stepinst_mock = Mock()
+    assertDiracSucceeds( self.mar._setSpecificAppParameters( stepinst_mock ), self )
+    stepinst_mock.setValue.assert_any_call( 'ZeroCopyLog', True )
+
   def test_userjobmodules( self ):
     module_mock = Mock()
     assertDiracSucceeds( self.mar._userjobmodules( module_mock ), self )
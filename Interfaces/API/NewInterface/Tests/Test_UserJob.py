@@ -179,6 +179,19 @@ class UserJobTestCase( unittest.TestCase ):
       self.log_mock.info.assert_called_with( info_message )
       mock_parametric.assert_any_call( 'NumberOfEvents', [1, 2], 'NbOfEvts' )
 
+  @patch("%s.UserJob._toInt" % MODULE_NAME, new=Mock(return_value=1))
+  @patch("%s.UserJob._checkJobConsistency" % MODULE_NAME, new=Mock(return_value=True))
+  @patch("%s.UserJob._splitByDataAndEvents" % MODULE_NAME,
+         new=Mock(return_value=["InputData", [["a"], ["b"]], 'ParametricInputData',
+                                ('NumberOfEvents', [1, 2], 'NbOfEvts'), ('StartFrom', [0, 1], 'StartFrom')]))
+  def test_split_bydataandevents( self ):
+    self.ujo.splittingOption = "byDataAndEvents"
+    with patch("%s.UserJob.setParameterSequence" % MODULE_NAME) as mock_parametric:
+      assertDiracSucceeds( self.ujo._split(), self )
+      mock_parametric.assert_any_call( "InputData", [["a"], ["b"]], 'ParametricInputData' )
+      mock_parametric.assert_any_call( 'NumberOfEvents', [1, 2], 'NbOfEvts' )
+      mock_parametric.assert_any_call( 'StartFrom', [0, 1], 'StartFrom' )
+
   @patch("%s.UserJob._toInt" % MODULE_NAME, new=Mock(return_value=1))
   @patch("%s.UserJob._checkJobConsistency" % MODULE_NAME, new=Mock(return_value=True))
   @patch("%s.UserJob._atomicSubmission" % MODULE_NAME, new=Mock(return_value=("Atomic", [], False)))
@@ -277,6 +290,52 @@ class UserJobTestCase( unittest.TestCase ):
     self.assertFalse( self.ujo._splitByData() )
     self.log_mock.error.assert_called_once()
 
+  def test_splitbydataandevents( self ):
+    self.ujo._data = [ '/data/a', '/data/b', '/data/c', '/data/big' ]
+    self.ujo.eventsPerJob = 100
+    self.ujo._splitLargeFiles = True
+    self.ujo.applicationlist = [ Mock( appname = 'ddsim' ) ]
+    nbevts = { '/data/a' : 60, '/data/b' : 40, '/data/c' : 30, '/data/big' : 150 }
+    with patch('%s.getNumberOfEventsPerFile' % MODULE_NAME, new=Mock(return_value=S_OK(nbevts))):
+      assertEqualsImproved( self.ujo._splitByDataAndEvents(),
+                            [ "InputData", [ [ '/data/a' ], [ '/data/b', '/data/c' ], [ '/data/big' ], [ '/data/big' ] ],
+                              'ParametricInputData', ( 'NumberOfEvents', [ 60, 70, 75, 75 ], 'NbOfEvts' ),
+                              ( 'StartFrom', [ 0, 0, 0, 75 ], 'StartFrom' ) ], self )
+
+  def test_splitbydataandevents_largefiles_unsupported( self ):
+    self.ujo._data = [ '/data/a', '/data/big' ]
+    self.ujo.eventsPerJob = 100
+    self.ujo._splitLargeFiles = True
+    self.ujo.applicationlist = [ Mock( appname = 'ddsim' ), Mock( appname = 'marlin' ) ]
+    with patch('%s.getNumberOfEventsPerFile' % MODULE_NAME, new=Mock(return_value=S_OK({}))) as nbevts_mock:
+      self.assertFalse( self.ujo._splitByDataAndEvents() )
+    self.assertFalse( nbevts_mock.called )
+    self.log_mock.error.assert_called_once_with( 'Job splitting: splitLargeFiles needs applications supporting '
+                                                 'StartFrom (ddsim, mokka, slic), not', 'marlin' )
+    self.ujo.splittingOption = 'byDataAndEvents'
+    with patch("%s.UserJob._checkJobConsistency" % MODULE_NAME, new=Mock(return_value=True)):
+      assertDiracFailsWith( self.ujo._split(), "_splitBySomething() failed", self )
+
+  def test_splitbydataandevents_cputime( self ):
+    self.ujo._data = [ '/data/a', '/data/b' ]
+    self.ujo.eventsPerJob = 100
+    self.ujo._maxCPUTime = 1000
+    self.ujo._cpuTimePerEvent = 20
+    with patch('%s.getNumberOfEventsPerFile' % MODULE_NAME,
+               new=Mock(return_value=S_OK({ '/data/a' : 30, '/data/b' : 30 }))):
+      assertEqualsImproved( self.ujo._splitByDataAndEvents()[1], [ [ '/data/a' ], [ '/data/b' ] ], self )
+
+  def test_splitbydataandevents_fails( self ):
+    self.ujo._data = [ '/data/a', '/data/b' ]
+    self.assertFalse( self.ujo._splitByDataAndEvents() )
+    self.ujo._data = [ '/data/a', '/data/b' ]
+    self.ujo.eventsPerJob = 100
+    with patch('%s.getNumberOfEventsPerFile' % MODULE_NAME, new=Mock(return_value=S_ERROR('no_meta'))):
+      self.assertFalse( self.ujo._splitByDataAndEvents() )
+    with patch('%s.getNumberOfEventsPerFile' % MODULE_NAME, new=Mock(return_value=S_OK({ '/data/a' : 3 }))):
+      self.assertFalse( self.ujo._splitByDataAndEvents() )
+    assertEqualsImproved( self.log_mock.error.call_count, 3, self )
+
   def test_splitbydata_incorrectparameter( self ):
     self.ujo._data = ["/path/to/data1","/path/to/data2"]
     self.ujo.numberOfFilesPerJob = 3
@@ -347,6 +406,24 @@ class UserJobTestCase( unittest.TestCase ):
     assertEqualsImproved( self.ujo.numberOfJobs, 42, self )
     assertEqualsImproved( self.ujo.splittingOption, "byEvents", self )
 
+  def test_setsplitInputdatabyevents( self ):
+    self.ujo.setSplitInputDataByEvents( "/path/to/data1", eventsPerJob=200, maxCPUTime=3600, cpuTimePerEvent=2.5,
+                                        splitLargeFiles=True )
+    assertEqualsImproved( self.ujo._data, [ "/path/to/data1" ], self )
+    assertEqualsImproved( ( self.ujo.eventsPerJob, self.ujo._maxCPUTime, self.ujo._cpuTimePerEvent,
+                            self.ujo._splitLargeFiles ), ( 200, 3600, 2.5, True ), self )
+    assertEqualsImproved( self.ujo.splittingOption, "byDataAndEvents", self )
+
+  def test_setsplitInputdatabyevents_startfrom( self ):
+    self.ujo.setSplitInputDataByEvents( "/path/to/data1", eventsPerJob=200, splitLargeFiles=True )
+    parameter = self.ujo.workflow.findParameter( 'StartFrom' )
+    assertEqualsImproved( ( parameter.getType(), parameter.getValue() ), ( 'int', 0 ), self )
+    ## dirac-jobexec sets the value of the job from the StartFrom sequence given on its command line
+    parameter.setValue( '400' )
+    ## the workflow parameters are the workflow_commons of the modules
+    workflowCommons = dict( ( par.getName(), par.getValue() ) for par in self.ujo.workflow.parameters )
+    assertEqualsImproved( workflowCommons['StartFrom'], 400, self )
+
   def test_setsplitInputdata( self ):
     input_data = ["/path/to/data1","/path/to/data2"]
     self.ujo.setSplitInputData( input_data )
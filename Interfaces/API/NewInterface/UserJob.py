@@ -22,9 +22,14 @@ from DIRAC.Core.Utilities.List import breakListIntoChunks
 
 from ILCDIRAC.Interfaces.API.NewInterface.Job import Job
 from ILCDIRAC.Interfaces.API.DiracILC import DiracILC
+from ILCDIRAC.Core.Utilities.InputFilesUtilities import getNumberOfEventsPerFile
+from ILCDIRAC.Core.Utilities.Splitting import packFilesByEvents
 
 __RCSID__ = "$Id$"
 
+#: applications skipping the first StartFrom events of their input file, needed to split large files
+START_FROM_APPLICATIONS = ('ddsim', 'mokka', 'slic')
+
 class UserJob(Job):
   """ User job class. To be used by users, not for production.
   """
@@ -44,6 +49,9 @@ class UserJob(Job):
     self.eventsPerJob = None
     self.numberOfFilesPerJob = 1
     self._startJobIndex = 0
+    self._maxCPUTime = None
+    self._cpuTimePerEvent = None
+    self._splitLargeFiles = False
 
   def submit(self, diracinstance = None, mode = "wms"):
     """ Submit call: when your job is defined, and all applications are set, you need to call this to
@@ -250,9 +258,11 @@ class UserJob(Job):
   # * _checkJobConsistency
   # * setSplitEvents
   # * setSplitInputData
+  # * setSplitInputDataByEvents
   # * setSplitDoNotAlterOutputFilename
   # * _split
   # * _splitByData
+  # * _splitByDataAndEvents
   # * _splitByEvents
   # * _toInt
   #
@@ -301,6 +311,43 @@ class UserJob(Job):
 
     self.splittingOption = "byData"
 
+  def setSplitInputDataByEvents( self, lfns, eventsPerJob=None, maxCPUTime=None, cpuTimePerEvent=None,
+                                 splitLargeFiles=False ):
+    """sets split parameters for doing splitting over input data, so that all jobs process about the same number
+    of events
+
+    The number of events of each file is taken from the NumberOfEvents metadata in the FileCatalog. The files are
+    grouped so that no job gets more than eventsPerJob events, or more events than fit in maxCPUTime.
+
+    Example usage:
+
+    >>> job = UserJob()
+    >>> job.setSplitInputDataByEvents( listOfLFNs, eventsPerJob=1000, splitLargeFiles=True )
+
+    :param lfns: Logical File Names
+    :type lfns: list of LFNs
+    :param int eventsPerJob: The maximum number of events processed by a single job
+    :param int maxCPUTime: CPU time budget of a job in seconds, used together with cpuTimePerEvent
+    :param float cpuTimePerEvent: CPU time in seconds needed to process one event
+    :param bool splitLargeFiles: if *True* files with more events than fit in a job are processed by several
+        jobs, each skipping the events of the previous ones. All applications of the job must support the
+        StartFrom parameter: :mod:`~ILCDIRAC.Interfaces.API.NewInterface.Applications.DDSim`,
+        :mod:`~ILCDIRAC.Interfaces.API.NewInterface.Applications.Mokka` or
+        :mod:`~ILCDIRAC.Interfaces.API.NewInterface.Applications.SLIC`
+
+    """
+    self._data = lfns if isinstance(lfns, list) else [lfns]
+    self.eventsPerJob = eventsPerJob
+    self._maxCPUTime = maxCPUTime
+    self._cpuTimePerEvent = cpuTimePerEvent
+    self._splitLargeFiles = splitLargeFiles
+
+    self._addParameter( self.workflow, 'NbOfEvts', 'JDL', -1, 'Number of Events' )
+    ## set for each job from the StartFrom sequence, compared as a number by the modules
+    self._addParameter( self.workflow, 'StartFrom', 'int', 0, 'Number of events to skip' )
+
+    self.splittingOption = "byDataAndEvents"
+
   def setSplitDoNotAlterOutputFilename( self, value=True):
     """if this option is set the output data lfns will _not_ include the JobIndex
 
@@ -328,6 +375,7 @@ class UserJob(Job):
     # FIXME: move somewhere more prominent
     self._switch = { "byEvents": self._splitByEvents,
                      "byData": self._splitByData,
+                     "byDataAndEvents": self._splitByDataAndEvents,
                      None: self._atomicSubmission,
                    }
 
@@ -349,6 +397,8 @@ class UserJob(Job):
    
     if sequenceType != "Atomic":
       self.setParameterSequence(sequenceType, sequenceList, addToWorkflow)
+      for extraType, extraList, extraAddToWorkflow in sequence[3:]:
+        self.setParameterSequence(extraType, extraList, extraAddToWorkflow)
       self.setParameterSequence('JobIndexList',
                                 range(self._startJobIndex, len(sequenceList) + self._startJobIndex),
                                 addToWorkflow='JobIndex')
@@ -436,6 +486,64 @@ class UserJob(Job):
 
     return ["InputData", self._data , 'ParametricInputData']
 
+  #############################################################################
+  def _splitByDataAndEvents(self):
+    """a job is submitted per group of input data, with about the same number of events in each job.
+
+    :return: parameter name and parameter values for setParameterSequence(), followed by the tuples
+             for the NumberOfEvents and StartFrom sequences
+    :rtype: list of (str, list, bool/str)
+
+    """
+
+    # reset split attribute to avoid infinite loop
+    self.splittingOption = None
+
+    self.log.info("Job splitting: Splitting 'byDataAndEvents' method...")
+
+    if not self._data:
+      errorMessage = "Job splitting: missing input data"
+      self.log.error(errorMessage)
+      return False
+
+    eventsPerJob = self.eventsPerJob
+    if self._maxCPUTime and self._cpuTimePerEvent:
+      eventsInCPUTime = int(self._maxCPUTime / self._cpuTimePerEvent)
+      eventsPerJob = min(eventsPerJob, eventsInCPUTime) if eventsPerJob else eventsInCPUTime
+    if not eventsPerJob or eventsPerJob < 1:
+      errorMessage = "Job splitting: 'eventsPerJob' or a CPU time budget allowing at least one event is needed"
+      self.log.error(errorMessage)
+      return False
+
+    if self._splitLargeFiles:
+      ## the other applications would process the first events of the file in every job
+      unsupported = [app.appname for app in self.applicationlist if app.appname not in START_FROM_APPLICATIONS]
+      if unsupported:
+        self.log.error("Job splitting: splitLargeFiles needs applications supporting StartFrom (%s), not" %
+                       ", ".join(START_FROM_APPLICATIONS), ", ".join(unsupported))
+        return False
+
+    res = getNumberOfEventsPerFile(self._data)
+    if not res['OK']:
+      self.log.error("Job splitting: Failed to get the number of events of the input data", res['Message'])
+      return False
+    missing = [lfn for lfn in self._data if lfn not in res['Value']]
+    if missing:
+      self.log.error("Job splitting: No NumberOfEvents in the FileCatalog for %d files, e.g." % len(missing),
+                     missing[0])
+      return False
+
+    jobs = packFilesByEvents([(lfn, res['Value'][lfn]) for lfn in self._data], eventsPerJob, self._splitLargeFiles)
+    self._data = [job['InputData'] for job in jobs]
+    eventsList = [job['NumberOfEvents'] for job in jobs]
+
+    self.log.info("Job splitting: submission consists of %d job(s) with %d to %d events" %
+                  (len(jobs), min(eventsList), max(eventsList)))
+
+    return ["InputData", self._data, 'ParametricInputData',
+            ('NumberOfEvents', eventsList, 'NbOfEvts'),
+            ('StartFrom', [job['StartFrom'] for job in jobs], 'StartFrom')]
+
   #############################################################################
   def _splitByEvents(self):
     """a job is submitted per subset of events.
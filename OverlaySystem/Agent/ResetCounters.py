@@ -15,40 +15,69 @@ from ILCDIRAC.OverlaySystem.Client.OverlaySystemClient         import OverlaySys
 AGENT_NAME = 'Overlay/ResetCounters'
 
 class ResetCounters ( AgentModule ):
-  """ Reset the number of jobs at all sites: some sites are not updated properly, so 
+  """ Reset the number of jobs at all sites: some sites are not updated properly, so
   once in a while it's needed to restore the correct number of jobs.
   It does not need to be exact, but enough to clear some of the jobs.
+
+  The jobs of all sites are counted with a single query, and only the sites whose number of jobs changed since
+  the previous cycle are sent to the service. Every FullUpdateCycles cycles all sites are sent.
   """
   def initialize(self):
     """ Initialize the agent.
     """
     self.am_setOption( "PollingTime", 60 )
+    self.fullUpdateCycles = self.am_getOption( "FullUpdateCycles", 10 )
     self.ovc = OverlaySystemClient()
     self.jobmon = JobMonitoringClient()
+    self.lastCounters = {}
+    self.cycle = 0
     return S_OK()
-  
+
+  def getJobsAtSites( self, sites ):
+    """ Count the running jobs getting overlay files at the given sites with one query
+
+    :returns: S_OK with dictionary {site: nbjobs}
+    """
+    attribdict = {"Site" : sites, "Status" : 'Running', "ApplicationStatus": 'Getting overlay files'}
+    res = self.jobmon.getCounters( ['Site'], attribdict, '' )
+    if not res['OK']:
+      return res
+    sitedict = dict.fromkeys( sites, 0 )
+    for attributes, count in res['Value']:
+      sitedict[attributes['Site']] = count
+    return S_OK( sitedict )
+
   def execute(self):
     """ This is called by the Agent Reactor
     """
     res = self.ovc.getSites()
     if not res['OK']:
       return res
-    sitedict = {}
     sites = res['Value']
+    if not sites:
+      return S_OK()
     gLogger.info("Will update info for sites %s" % sites)
-    for site in sites:
-      attribdict = {"Site" : site, "ApplicationStatus": 'Getting overlay files'}
-      res = self.jobmon.getCurrentJobCounters(attribdict)
-      if not res['OK']:
-        continue
-      if 'Running' in res['Value']:
-        sitedict[site] = res['Value']['Running']
-      else:
-        sitedict[site] = 0
-    gLogger.info("Setting new values %s" % sitedict)    
+    res = self.getJobsAtSites( sites )
+    if not res['OK']:
+      gLogger.error( "Failed to get the number of jobs at the sites", res['Message'] )
+      return res
+    counters = res['Value']
+
+    if self.cycle % self.fullUpdateCycles == 0:
+      sitedict = counters
+    else:
+      sitedict = dict( ( site, nbjobs ) for site, nbjobs in counters.items()
+                       if self.lastCounters.get( site ) != nbjobs )
+    self.cycle += 1
+    if not sitedict:
+      gLogger.info("No change in the number of jobs")
+      return S_OK()
+
+    gLogger.info("Setting new values %s" % sitedict)
     res = self.ovc.setJobsAtSites(sitedict)
     if not res['OK']:
       gLogger.error(res['Message'])
       return res
-    
+    self.lastCounters = counters
+
     return S_OK()
@@ -0,0 +1,61 @@
+"""
+Tests for the ResetCounters agent
+
+"""
+import unittest
+from mock import patch, MagicMock as Mock
+
+from ILCDIRAC.OverlaySystem.Agent.ResetCounters import ResetCounters
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertDiracFailsWith, assertDiracSucceeds, \
+  assertDiracSucceedsWith_equals
+from DIRAC import S_OK, S_ERROR
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.OverlaySystem.Agent.ResetCounters'
+
+class TestResetCounters( unittest.TestCase ):
+  """Tests of the ResetCounters agent"""
+  def setUp( self ):
+    with patch('%s.AgentModule.__init__' % MODULE_NAME, new=Mock(return_value=None)), \
+         patch('%s.OverlaySystemClient' % MODULE_NAME), \
+         patch('%s.JobMonitoringClient' % MODULE_NAME):
+      self.agent = ResetCounters()
+      self.agent.am_setOption = Mock()
+      self.agent.am_getOption = Mock(return_value=3)
+      assertDiracSucceeds( self.agent.initialize(), self )
+    self.agent.ovc.getSites.return_value = S_OK( [ 'siteA', 'siteB', 'siteC' ] )
+    self.agent.ovc.setJobsAtSites.return_value = S_OK()
+
+  def test_getjobsatsites( self ):
+    self.agent.jobmon.getCounters.return_value = S_OK( [ ( { 'Site' : 'siteA' }, 4 ), ( { 'Site' : 'siteC' }, 1 ) ] )
+    assertDiracSucceedsWith_equals( self.agent.getJobsAtSites( [ 'siteA', 'siteB', 'siteC' ] ),
+                                    { 'siteA' : 4, 'siteB' : 0, 'siteC' : 1 }, self )
+    self.agent.jobmon.getCounters.assert_called_once_with(
+      [ 'Site' ], { 'Site' : [ 'siteA', 'siteB', 'siteC' ], 'Status' : 'Running',
+                    'ApplicationStatus' : 'Getting overlay files' }, '' )
+
+  def test_execute_only_changes( self ):
+    self.agent.jobmon.getCounters.side_effect = [ S_OK( [ ( { 'Site' : 'siteA' }, 4 ) ] ),
+                                                  S_OK( [ ( { 'Site' : 'siteA' }, 4 ), ( { 'Site' : 'siteB' }, 2 ) ] ),
+                                                  S_OK( [ ( { 'Site' : 'siteA' }, 4 ), ( { 'Site' : 'siteB' }, 2 ) ] ),
+                                                  S_OK( [ ( { 'Site' : 'siteA' }, 4 ), ( { 'Site' : 'siteB' }, 2 ) ] ) ]
+    for _ in xrange(4):
+      assertDiracSucceeds( self.agent.execute(), self )
+    self.assertEqual( self.agent.ovc.setJobsAtSites.call_args_list,
+                      [ ( ( { 'siteA' : 4, 'siteB' : 0, 'siteC' : 0 }, ), {} ),
+                        ( ( { 'siteB' : 2 }, ), {} ),
+                        ( ( { 'siteA' : 4, 'siteB' : 2, 'siteC' : 0 }, ), {} ) ] )
+
+  def test_execute_set_fails( self ):
+    self.agent.jobmon.getCounters.return_value = S_OK( [] )
+    self.agent.ovc.setJobsAtSites.return_value = S_ERROR( 'service_down' )
+    assertDiracFailsWith( self.agent.execute(), 'service_down', self )
+    self.agent.ovc.setJobsAtSites.return_value = S_OK()
+    assertDiracSucceeds( self.agent.execute(), self )
+    self.agent.ovc.setJobsAtSites.assert_called_with( { 'siteA' : 0, 'siteB' : 0, 'siteC' : 0 } )
+
+  def test_execute_query_fails( self ):
+    self.agent.jobmon.getCounters.return_value = S_ERROR( 'jobdb_down' )
+    assertDiracFailsWith( self.agent.execute(), 'jobdb_down', self )
+    self.assertFalse( self.agent.ovc.setJobsAtSites.called )
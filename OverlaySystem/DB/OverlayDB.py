@@ -1,4 +1,8 @@
 """ DB for Overlay System
+
+The authoritative counters live in the memory of the Overlay service
+(:class:`~ILCDIRAC.OverlaySystem.Service.SlotCounters.SlotCounters`), this DB only persists them:
+the state is loaded once when the service starts and the changes are written back in batches.
 """
 __RCSID__ = "$Id$"
 
@@ -10,7 +14,7 @@ class OverlayDB ( DB ):
   """ DB for OverlaySystem
   """
   def __init__( self ):
-    """ 
+    """
     """
     self.ops = Operations()
     self.dbname = 'OverlayDB'
@@ -21,7 +25,14 @@ class OverlayDB ( DB ):
                                                        },
                                             'PrimaryKey' : 'Site',
                                             'Indexes': {'Index':['Site']}
-                                          }
+                                          },
+                          "OverlayLeases" : { 'Fields' : { 'LeaseID' : "BIGINT NOT NULL",
+                                                           'Site' : "VARCHAR(255) NOT NULL",
+                                                           'Expires' : "DATETIME NOT NULL"
+                                                         },
+                                              'PrimaryKey' : 'LeaseID',
+                                              'Indexes': {'SiteIndex':['Site'], 'ExpiresIndex':['Expires']}
+                                            }
                         }
                       )
     limits = self.ops.getValue("/Overlay/MaxConcurrentRunning", 200)
@@ -47,121 +58,75 @@ class OverlayDB ( DB ):
       return res['Value']
     gLogger.warn( "Failed to get MySQL connection", res['Message'] )
     return connection
-  
-  def _checkSite(self, site, connection = False ):
-    """ Check the number of jobs running at a given site.
+
+  def __escapeSites( self, sites ):
+    """ Return dictionary of site names to escaped site names
+    """
+    escaped = {}
+    for site in sites:
+      res = self._escapeString( site )
+      if not res['OK']:
+        return res
+      escaped[site] = res['Value']
+    return S_OK( escaped )
+
+### Loading and saving the state of the service
+
+  def loadState( self, connection = False ):
+    """ Read the number of jobs at each site and the leases
+
+    :returns: S_OK with dictionary with keys Counters ({site: nbjobs}) and Leases ({leaseID: (site, expires)}),
+              where expires is in seconds since the epoch
     """
     connection = self.__getConnection( connection )
-    
-    req = "SELECT NumberOfJobs FROM OverlayData WHERE Site='%s';" % (site)
-    res = self._query( req, connection )
+    res = self._query( "SELECT Site, NumberOfJobs FROM OverlayData;", connection )
     if not res['OK']:
-      return S_ERROR("Could not get site")
-    if len(res['Value']):
-      return res
-    else:
-      return S_ERROR("Could not find any site %s"%(site))
-    
-  def _addSite(self, site, connection = False ):
-    """ Add a new site to the DB
-    """ 
-    connection = self.__getConnection( connection )
-    req = "INSERT INTO OverlayData (Site,NumberOfJobs) VALUES ('%s',1);" % site
-    res = self._update( req, connection )
+      return S_ERROR( "Could not get sites: %s" % res['Message'] )
+    counters = dict( ( row[0], int( row[1] ) ) for row in res['Value'] )
+    res = self._query( "SELECT LeaseID, Site, UNIX_TIMESTAMP(Expires) FROM OverlayLeases;", connection )
     if not res['OK']:
-      return res
-    return res
+      return S_ERROR( "Could not get leases: %s" % res['Message'] )
+    leases = dict( ( int( row[0] ), ( row[1], int( row[2] ) ) ) for row in res['Value'] )
+    return S_OK( dict( Counters = counters, Leases = leases ) )
 
-  def _limitForSite(self, site):
-    """ Get the current limit of jobs for a given site.
-    """
-    if site in self.limits.keys():
-      return self.limits[site]   
-    return self.limits['default']
+  def saveState( self, counters, newLeases, deletedLeases, connection = False ):
+    """ Write the changes of the state in at most three statements, using a single connection
 
-  def _addNewJob(self, site, nbjobs, connection = False ):
-    """ Add a new running job in the DB
-    """
-    connection = self.__getConnection( connection )
-    nbjobs += 1  
-    req = "UPDATE OverlayData SET NumberOfJobs=%s WHERE Site='%s';" % (nbjobs, site)
-    self._update( req, connection )
-    return S_OK()
+    The statements are not run in one transaction: after a failure the same changes are saved again, so adding a
+    lease that is already there updates it instead of failing, and deleting a lease that is not there is a no-op.
 
-### Methods to fix the site
-  def getSites(self, connection = False):
-    """ Return the list of sites known to the service
+    :param dict counters: {site: nbjobs} for the sites whose number of jobs changed
+    :param dict newLeases: {leaseID: (site, expires)} of the leases created since the last save
+    :param list deletedLeases: IDs of the leases released or expired since the last save
     """
     connection = self.__getConnection( connection )
-    req = 'SELECT Site From OverlayData;'
-    res = self._query( req, connection )
+    res = self.__escapeSites( set( counters ) | set( site for site, _expires in newLeases.values() ) )
     if not res['OK']:
-      return S_ERROR("Could not get sites")
-    sites = []
-    for row in res['Value']:
-      sites.append(row[0])
-    return S_OK(sites)
+      return res
+    escaped = res['Value']
 
-  def setJobsAtSites(self, sitedict, connection = False):
-    """ As name suggests: set the number of jobs running at the site.
-    """
-    connection = self.__getConnection( connection )
-    for site, nbjobs in sitedict.items():
-      req = "UPDATE OverlayData SET NumberOfJobs=%i WHERE Site='%s';" % (int(nbjobs), site)
+    if counters:
+      values = ",".join( "(%s,%d)" % ( escaped[site], int( nbjobs ) ) for site, nbjobs in counters.items() )
+      req = "INSERT INTO OverlayData (Site,NumberOfJobs) VALUES %s " \
+            "ON DUPLICATE KEY UPDATE NumberOfJobs=VALUES(NumberOfJobs);" % values
       res = self._update( req, connection )
       if not res['OK']:
-        return S_ERROR("Could not set number of jobs at site %s" % site)
-      
-    return S_OK()
-### Useful methods for the users
-  
-  def getJobsAtSite(self, site, connection = False ):
-    """ Get the number of jobs currently run
-    """
-    connection = self.__getConnection( connection )   
-    nbjobs = 0
-    res = self._checkSite(site, connection)
-    if not res['OK']:
-      return S_OK(nbjobs)
-    nbjobs = res['Value'][0][0]
-    return S_OK(nbjobs)
-
-### Important methods
-  
-  def canRun(self, site, connection = False ):
-    """ Can the job run at that site?
-    """
-    connection = self.__getConnection( connection )
-    res = self._checkSite(site, connection)
-    nbjobs = 0
-    if not res['OK']:
-      self._addSite(site, connection)
-      nbjobs = 1
-    else:
-      nbjobs = res['Value'][0][0]
-    if nbjobs < self._limitForSite(site):
-      res = self._addNewJob(site, nbjobs, connection)
+        return S_ERROR( "Could not set number of jobs at sites: %s" % res['Message'] )
+
+    if newLeases:
+      values = ",".join( "(%d,%s,FROM_UNIXTIME(%d))" % ( int( leaseID ), escaped[site], int( expires ) )
+                         for leaseID, ( site, expires ) in newLeases.items() )
+      req = "INSERT INTO OverlayLeases (LeaseID,Site,Expires) VALUES %s " \
+            "ON DUPLICATE KEY UPDATE Site=VALUES(Site),Expires=VALUES(Expires);" % values
+      res = self._update( req, connection )
       if not res['OK']:
-        return res
-      return S_OK(True)
-    else:
-      return S_OK(False)
-  
-  def jobDone(self, site, connection = False ):
-    """ Remove a job from the DB, should not remove a job from the DB 
-        if the Site does not exist, but this should never happen
-    """
-    connection = self.__getConnection( connection )
-    res = self._checkSite(site, connection)
-    if not res['OK']:
-      return res
-    nbjobs = res['Value'][0][0]
-    if nbjobs == 1:
-      return S_OK()
-    nbjobs -= 1
-    req = "UPDATE OverlayData SET NumberOfJobs=%s WHERE Site='%s';" % (nbjobs, site)
-    res = self._update( req, connection )
-    if not res['OK']:
-      return res   
-    return S_OK()    
-  
\ No newline at end of file
+        return S_ERROR( "Could not add leases: %s" % res['Message'] )
+
+    if deletedLeases:
+      req = "DELETE FROM OverlayLeases WHERE LeaseID IN (%s);" % ",".join( str( int( leaseID ) )
+                                                                         for leaseID in deletedLeases )
+      res = self._update( req, connection )
+      if not res['OK']:
+        return S_ERROR( "Could not remove leases: %s" % res['Message'] )
+
+    return S_OK()
@@ -0,0 +1,58 @@
+""" SQLite stand-in for the OverlayDB
+
+Provides the same loadState/saveState interface as :class:`~ILCDIRAC.OverlaySystem.DB.OverlayDB.OverlayDB`
+without a MySQL server, for tests and for running the Overlay service locally.
+"""
+__RCSID__ = "$Id$"
+
+import sqlite3
+import threading
+
+from DIRAC                                                             import gLogger, S_OK, S_ERROR
+
+class OverlaySQLiteDB( object ):
+  """ SQLite implementation of the persistence of the Overlay service
+  """
+  def __init__( self, path = ':memory:', limits = None ):
+    """
+    :param str path: file of the SQLite database, by default the DB only lives in memory
+    :param dict limits: maximum number of concurrent jobs per site, the key 'default' is used for other sites
+    """
+    self.logger = gLogger.getSubLogger( 'OverlaySQLiteDB' )
+    self.limits = { 'default' : 200 }
+    self.limits.update( limits or {} )
+    self.lock = threading.Lock()
+    self.connection = sqlite3.connect( path, check_same_thread = False )
+    with self.connection:
+      self.connection.execute( "CREATE TABLE IF NOT EXISTS OverlayData "
+                               "(Site VARCHAR(255) PRIMARY KEY NOT NULL, NumberOfJobs INTEGER DEFAULT 0);" )
+      self.connection.execute( "CREATE TABLE IF NOT EXISTS OverlayLeases "
+                               "(LeaseID INTEGER PRIMARY KEY NOT NULL, Site VARCHAR(255) NOT NULL, "
+                               "Expires INTEGER NOT NULL);" )
+
+  def loadState( self ):
+    """ Read the number of jobs at each site and the leases, see :func:`OverlayDB.loadState`
+    """
+    try:
+      with self.lock:
+        counters = dict( self.connection.execute( "SELECT Site, NumberOfJobs FROM OverlayData;" ).fetchall() )
+        leases = dict( ( leaseID, ( site, expires ) ) for leaseID, site, expires in
+                       self.connection.execute( "SELECT LeaseID, Site, Expires FROM OverlayLeases;" ).fetchall() )
+    except sqlite3.Error as err:
+      return S_ERROR( "Could not load state: %s" % err )
+    return S_OK( dict( Counters = counters, Leases = leases ) )
+
+  def saveState( self, counters, newLeases, deletedLeases ):
+    """ Write the changes of the state in one transaction, see :func:`OverlayDB.saveState`
+    """
+    try:
+      with self.lock, self.connection:
+        self.connection.executemany( "INSERT OR REPLACE INTO OverlayData (Site, NumberOfJobs) VALUES (?, ?);",
+                                     counters.items() )
+        self.connection.executemany( "INSERT OR REPLACE INTO OverlayLeases (LeaseID, Site, Expires) VALUES (?, ?, ?);",
+                                     [ ( leaseID, site, expires ) for leaseID, ( site, expires ) in newLeases.items() ] )
+        self.connection.executemany( "DELETE FROM OverlayLeases WHERE LeaseID=?;",
+                                     [ ( leaseID, ) for leaseID in deletedLeases ] )
+    except sqlite3.Error as err:
+      return S_ERROR( "Could not save state: %s" % err )
+    return S_OK()
@@ -2,11 +2,13 @@
 Tests for OverlayDB
 
 """
+import re
+import time
 import unittest
 from mock import patch, MagicMock as Mock
 
 from ILCDIRAC.Tests.Utilities.GeneralUtils import assertDiracFailsWith, assertDiracSucceeds, \
-  assertDiracSucceedsWith_equals, assertMockCalls
+  assertDiracSucceedsWith_equals, assertMockCalls, assertEqualsImproved
 from DIRAC import S_OK, S_ERROR
 
 __RCSID__ = "$Id$"
@@ -31,116 +33,95 @@ class TestOverlayDB( unittest.TestCase ):
          patch.object(OverlayDB, '_createTables', new=Mock()), \
          patch.object(DB, '__init__', new=Mock()):
       self.odb = OverlayDB()
+    self.odb._escapeString = Mock(side_effect=lambda value: S_OK("'%s'" % value))
 
-  def test_getsites( self ):
-    con_mock = Mock()
-    with patch('%s.OverlayDB._getConnection' % MODULE_NAME, new=Mock(return_value=S_OK(con_mock))), \
-         patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_OK([ ('some_row',), ('other_row', )]))) as query_mock:
-      assertDiracSucceedsWith_equals( self.odb.getSites(), [ 'some_row', 'other_row' ], self )
-      query_mock.assert_called_once_with( 'SELECT Site From OverlayData;', con_mock )
+  def test_limits( self ):
+    assertEqualsImproved( self.odb.limits, { 'default' : 10, 'testSite1' : 2, 'myOtherSite' : 2 }, self )
 
-  def test_getsites_query_fails( self ):
+  def test_loadstate( self ):
     con_mock = Mock()
-    with patch('%s.OverlayDB._getConnection' % MODULE_NAME, new=Mock(return_value=S_OK(con_mock))), \
-         patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_ERROR('test_query_fails'))):
-      assertDiracFailsWith( self.odb.getSites(), 'Could not get sites', self )
-
-  def test_getsites_nosites_available( self ):
+    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(side_effect=[
+        S_OK( [ ( 'some_site', 3L ), ( 'other_site', 0L ) ] ), S_OK( [ ( 17L, 'some_site', 1500000000L ) ] ) ] )) as query_mock:
+      assertDiracSucceedsWith_equals( self.odb.loadState( con_mock ),
+                                      { 'Counters' : { 'some_site' : 3, 'other_site' : 0 },
+                                        'Leases' : { 17 : ( 'some_site', 1500000000 ) } }, self )
+      assertMockCalls( query_mock, [ ( 'SELECT Site, NumberOfJobs FROM OverlayData;', con_mock ),
+                                     ( 'SELECT LeaseID, Site, UNIX_TIMESTAMP(Expires) FROM OverlayLeases;', con_mock ) ],
+                       self )
+
+  def test_loadstate_query_fails( self ):
+    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(side_effect=[ S_OK( [] ), S_ERROR( 'lease_err' ) ])):
+      assertDiracFailsWith( self.odb.loadState( Mock() ), 'could not get leases: lease_err', self )
+    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_ERROR( 'site_err' ))):
+      assertDiracFailsWith( self.odb.loadState( Mock() ), 'could not get sites: site_err', self )
+
+  def test_savestate( self ):
     con_mock = Mock()
-    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_OK([]))):
-      assertDiracSucceedsWith_equals( self.odb.getSites( con_mock ), [], self )
-
-  def test_getsites_connection_fails( self ):
-    with patch('%s.OverlayDB._getConnection' % MODULE_NAME, new=Mock(return_value=S_ERROR())), \
-         patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_ERROR('noconnection'))):
-      assertDiracFailsWith( self.odb.getSites(), 'Could not get sites', self )
-
-  def test_setjobsatsites( self ):
-    con_mock = Mock()
-    with patch('%s.OverlayDB._update' % MODULE_NAME, new=Mock(return_value=S_OK())) as update_mock:
-      assertDiracSucceeds( self.odb.setJobsAtSites( { 'MyTestSite1' : 1487, 'other_site' : '138', 'large_testsite' : 40913.2 }, con_mock ), self )
+    with patch('%s.OverlayDB._update' % MODULE_NAME, new=Mock(return_value=S_OK(1))) as update_mock:
+      assertDiracSucceeds( self.odb.saveState( { 'MyTestSite1' : 1487 }, { 42 : ( 'other_site', 1500000000 ) },
+                                               set( [ 12 ] ), con_mock ), self )
       assertMockCalls( update_mock, [
-        ( "UPDATE OverlayData SET NumberOfJobs=1487 WHERE Site='MyTestSite1';", con_mock ),
-        ( "UPDATE OverlayData SET NumberOfJobs=138 WHERE Site='other_site';", con_mock ),
-        ( "UPDATE OverlayData SET NumberOfJobs=40913 WHERE Site='large_testsite';", con_mock ) ], self )
-
-  def test_setjobsatsites_nothingtodo( self ):
-    assertDiracSucceeds( self.odb.setJobsAtSites( {}, Mock() ), self )
-
-  def test_setjobsatsites_update_fails( self ):
-    def replace_update( request ):
-      """ Mocks the return value of the _update method """
-      if 'other_site' in request:
-        return S_ERROR()
-      return S_OK()
-    with patch('%s.OverlayDB._update' % MODULE_NAME, new=Mock(side_effect=lambda request, _ : replace_update( request ))):
-      assertDiracFailsWith( self.odb.setJobsAtSites( { 'MyTestSite1' : 1487, 'other_site' : '138', 'large_testsite' : 40913.2 }, Mock() ), 'could not set number of jobs at site', self )
-
-  def test_getjobsatsite( self ):
-    con_mock = Mock()
-    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_OK([ [ 123 ] ]))) as query_mock:
-      assertDiracSucceedsWith_equals( self.odb.getJobsAtSite( 'myTest_Site1', con_mock ), 123, self )
-      query_mock.assert_called_once_with( "SELECT NumberOfJobs FROM OverlayData WHERE Site='myTest_Site1';", con_mock )
-
-  def test_getjobsatsite_query_fails( self ):
-    con_mock = Mock()
-    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_ERROR())):
-      assertDiracSucceedsWith_equals( self.odb.getJobsAtSite( 'myTest_Site1', con_mock ), 0, self )
-
-  def test_getjobsatsite_no_site_found( self ):
-    con_mock = Mock()
-    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_OK([]))):
-      assertDiracSucceedsWith_equals( self.odb.getJobsAtSite( 'nonexistent_site_testme', con_mock ), 0, self )
-
-  def test_canrun_toomanyjobs( self ):
-    con_mock = Mock()
-    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_OK([[2]]))) as query_mock:
-      assertDiracSucceedsWith_equals( self.odb.canRun( 'testSite1', con_mock ), False, self )
-      query_mock.assert_called_once_with( "SELECT NumberOfJobs FROM OverlayData WHERE Site='testSite1';",
-                                          con_mock )
-
-  def test_canrun_add_to_new_site( self ):
-    con_mock = Mock()
-    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_ERROR())), \
-         patch('%s.OverlayDB._update' % MODULE_NAME, new=Mock(return_value=S_OK())) as update_mock:
-      assertDiracSucceedsWith_equals( self.odb.canRun( 'tenJobSite', con_mock ), True, self )
-      assertMockCalls( update_mock,
-                       [ ( "INSERT INTO OverlayData (Site,NumberOfJobs) VALUES ('tenJobSite',1);", con_mock ),
-                         ( "UPDATE OverlayData SET NumberOfJobs=2 WHERE Site='tenJobSite';", con_mock ) ], self )
-
-  def test_canrun_addsite_fails( self ):
-    con_mock = Mock()
-    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_ERROR())), \
-         patch('%s.OverlayDB._update' % MODULE_NAME, new=Mock(side_effect=[S_ERROR('update_test_err'), S_OK()])) as update_mock:
-      assertDiracSucceedsWith_equals( self.odb.canRun( 'tenJobSite', con_mock ), True, self )
-      assertMockCalls( update_mock,
-                       [ ( "INSERT INTO OverlayData (Site,NumberOfJobs) VALUES ('tenJobSite',1);", con_mock ),
-                         ( "UPDATE OverlayData SET NumberOfJobs=2 WHERE Site='tenJobSite';", con_mock ) ], self )
-
-  def test_jobdone( self ):
-    con_mock = Mock()
-    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_OK([[148]]))) as query_mock, \
-         patch('%s.OverlayDB._update' % MODULE_NAME, new=Mock(return_value=S_OK())) as update_mock:
-      assertDiracSucceeds( self.odb.jobDone( 'my_TestSite1', con_mock ), self )
-      query_mock.assert_called_once_with( "SELECT NumberOfJobs FROM OverlayData WHERE Site='my_TestSite1';",
-                                          con_mock )
-      update_mock.assert_called_once_with( "UPDATE OverlayData SET NumberOfJobs=147 WHERE Site='my_TestSite1';",
-                                           con_mock )
-
-  def test_jobdone_checksite_fails( self ):
-    con_mock = Mock()
-    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_ERROR())):
-      assertDiracFailsWith( self.odb.jobDone( 'my_TestSite1', con_mock ), 'Could not get site', self )
-
-  def test_jobdone_nojobs( self ):
-    con_mock = Mock()
-    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_OK([[1]]))) as query_mock:
-      assertDiracSucceeds( self.odb.jobDone( 'my_TestSite1', con_mock ), self )
-      query_mock.assert_called_once_with( "SELECT NumberOfJobs FROM OverlayData WHERE Site='my_TestSite1';",
-                                          con_mock )
-
-  def test_jobdone_update_fails( self ):
-    con_mock = Mock()
-    with patch('%s.OverlayDB._query' % MODULE_NAME, new=Mock(return_value=S_OK([[148]]))), \
-         patch('%s.OverlayDB._update' % MODULE_NAME, new=Mock(return_value=S_ERROR('update_test_err'))):
-      assertDiracFailsWith( self.odb.jobDone( 'my_TestSite1', con_mock ), 'update_test_err', self )
+        ( "INSERT INTO OverlayData (Site,NumberOfJobs) VALUES ('MyTestSite1',1487) "
+          "ON DUPLICATE KEY UPDATE NumberOfJobs=VALUES(NumberOfJobs);", con_mock ),
+        ( "INSERT INTO OverlayLeases (LeaseID,Site,Expires) VALUES (42,'other_site',FROM_UNIXTIME(1500000000)) "
+          "ON DUPLICATE KEY UPDATE Site=VALUES(Site),Expires=VALUES(Expires);", con_mock ),
+        ( "DELETE FROM OverlayLeases WHERE LeaseID IN (12);", con_mock ) ], self )
+
+  def test_savestate_nothingtodo( self ):
+    with patch('%s.OverlayDB._update' % MODULE_NAME, new=Mock(return_value=S_OK(1))) as update_mock:
+      assertDiracSucceeds( self.odb.saveState( {}, {}, set(), Mock() ), self )
+      self.assertFalse( update_mock.called )
+
+  def test_savestate_update_fails( self ):
+    with patch('%s.OverlayDB._update' % MODULE_NAME, new=Mock(side_effect=[ S_OK(1), S_ERROR('lease_update_err') ])):
+      assertDiracFailsWith( self.odb.saveState( { 'site' : 1 }, { 42 : ( 'site', 1500000000 ) }, set(), Mock() ),
+                            'could not add leases: lease_update_err', self )
+
+  def test_savestate_delete_fails( self ):
+    with patch('%s.OverlayDB._update' % MODULE_NAME,
+               new=Mock(side_effect=[ S_OK(1), S_OK(1), S_ERROR('delete_err') ])) as update_mock:
+      assertDiracFailsWith( self.odb.saveState( { 'site' : 1 }, { 42 : ( 'site', 1500000000 ) }, set( [ 12 ] ),
+                                                Mock() ), 'could not remove leases: delete_err', self )
+      assertEqualsImproved( len( update_mock.mock_calls ), 3, self )
+
+  def test_savestate_retry_after_delete_fails( self ):
+    """ the lease insert of a failed save was written, saving it again must not fail on the existing rows """
+    from ILCDIRAC.OverlaySystem.Service.SlotCounters import SlotCounters
+    leaseTable = set( [ 12 ] )
+    failures = [ S_ERROR( 'delete_err' ) ]
+    def updateMock( req, _connection ):
+      """ keep the lease IDs of the statements, the first delete fails """
+      if req.startswith( 'INSERT INTO OverlayLeases' ):
+        leaseIDs = set( int( leaseID ) for leaseID in re.findall( r"\((\d+),'", req ) )
+        if leaseIDs & leaseTable and 'ON DUPLICATE KEY UPDATE' not in req:
+          return S_ERROR( 'Duplicate entry' )
+        leaseTable.update( leaseIDs )
+      elif req.startswith( 'DELETE FROM OverlayLeases' ):
+        if failures:
+          return failures.pop()
+        leaseIDs = re.search( r'IN \((.*)\)', req ).group( 1 ).split( ',' )
+        leaseTable.difference_update( int( leaseID ) for leaseID in leaseIDs )
+      return S_OK( 1 )
+    self.odb._getConnection = Mock( return_value = S_OK( Mock() ) )
+    self.odb.loadState = Mock( return_value = S_OK( { 'Counters' : { 'site' : 1 },
+                                                      'Leases' : { 12 : ( 'site', int( time.time() ) + 3600 ) } } ) )
+    counters = SlotCounters( self.odb, self.odb.limits )
+    assertDiracSucceeds( counters.load(), self )
+    kept = counters.acquireLease( 'site', 3600 )['Value']
+    released = counters.acquireLease( 'site', 3600 )['Value']
+    counters.releaseLease( 12 )
+    with patch('%s.OverlayDB._update' % MODULE_NAME, new=Mock(side_effect=updateMock)):
+      assertDiracFailsWith( counters.flush(), 'could not remove leases: delete_err', self )
+      assertEqualsImproved( leaseTable, set( [ 12, kept, released ] ), self )
+      ## released after the failed save, the written lease must still be deleted
+      counters.releaseLease( released )
+      assertDiracSucceeds( counters.flush(), self )
+      assertEqualsImproved( leaseTable, set( [ kept ] ), self )
+      assertDiracSucceeds( counters.flush(), self )
+      assertEqualsImproved( leaseTable, set( [ kept ] ), self )
+
+  def test_savestate_escape_fails( self ):
+    self.odb._escapeString = Mock(return_value=S_ERROR('escape_err'))
+    with patch('%s.OverlayDB._update' % MODULE_NAME, new=Mock(return_value=S_OK(1))) as update_mock:
+      assertDiracFailsWith( self.odb.saveState( { 'site' : 1 }, {}, set(), Mock() ), 'escape_err', self )
+      self.assertFalse( update_mock.called )
@@ -1,25 +1,40 @@
 """ Services for Overlay System
+
+The counters are kept in memory by :class:`~ILCDIRAC.OverlaySystem.Service.SlotCounters.SlotCounters`,
+and written to the OverlayDB every FlushPeriod seconds.
 """
 
-from types import StringTypes, DictType
+from types import StringTypes, DictType, IntType, LongType
 
-from DIRAC                                              import S_OK
+from DIRAC                                              import S_OK, gConfig
 from DIRAC.Core.DISET.RequestHandler                    import RequestHandler
+from DIRAC.Core.Utilities.ThreadScheduler               import gThreadScheduler
 
 from ILCDIRAC.OverlaySystem.DB.OverlayDB                import OverlayDB
+from ILCDIRAC.OverlaySystem.Service.SlotCounters        import SlotCounters
 
 __RCSID__ = "$Id$"
 
 #pylint: disable=unused-argument,no-self-use, global-statement
 
-# This is a global instance of the OverlayDB class
-OVERLAY_DB = False
+# This is a global instance of the SlotCounters class
+SLOT_COUNTERS = False
+
+#: upper limit for the time a call to waitForSlot blocks
+MAX_WAIT_TIME = 600
 
 def initializeOverlayHandler( serviceInfo ):
   """ Global initialize for the Overlay service handler
   """
-  global OVERLAY_DB
-  OVERLAY_DB = OverlayDB()
+  global SLOT_COUNTERS
+  overlayDB = OverlayDB()
+  maxWaiting = gConfig.getValue( "%s/MaxWaitingCalls" % serviceInfo['serviceSectionPath'], 10 )
+  SLOT_COUNTERS = SlotCounters( overlayDB, overlayDB.limits, maxWaiting )
+  res = SLOT_COUNTERS.load()
+  if not res['OK']:
+    return res
+  flushPeriod = gConfig.getValue( "%s/FlushPeriod" % serviceInfo['serviceSectionPath'], 10 )
+  gThreadScheduler.addPeriodicTask( flushPeriod, SLOT_COUNTERS.flush )
   return S_OK()
 
 class OverlayHandler(RequestHandler):
@@ -29,31 +44,53 @@ class OverlayHandler(RequestHandler):
   def export_canRun(self, site):
     """ Check if current job can access the data
     """
-    return OVERLAY_DB.canRun(site)
+    return SLOT_COUNTERS.canRun(site)
 
   types_jobDone = [StringTypes]
   def export_jobDone(self, site):
-    """ report that a given job is done downloading the 
+    """ report that a given job is done downloading the
     files at a given site
     """
-    return OVERLAY_DB.jobDone(site)
-  
+    return SLOT_COUNTERS.jobDone(site)
+
+  types_acquireLease = [StringTypes, (IntType, LongType)]
+  def export_acquireLease(self, site, duration):
+    """ Take a slot at the site for at most duration seconds, returns the lease ID or 0 if no slot is free
+    """
+    return SLOT_COUNTERS.acquireLease(site, duration)
+
+  types_releaseLease = [(IntType, LongType)]
+  def export_releaseLease(self, leaseID):
+    """ Give back the slot held by the lease
+    """
+    return SLOT_COUNTERS.releaseLease(leaseID)
+
+  types_waitForSlot = [StringTypes, (IntType, LongType), (IntType, LongType)]
+  def export_waitForSlot(self, site, timeout, duration):
+    """ Wait at most timeout seconds (capped at MAX_WAIT_TIME) for a free slot at the site.
+
+    The call wakes up as soon as a slot is given back, so the jobs do not have to poll the service. Each waiting
+    call holds a thread of the service, at most MaxWaitingCalls calls wait, the others return at once.
+
+    :returns: S_OK with the lease ID, or 0 if no slot became free in time
+    """
+    return SLOT_COUNTERS.waitForSlot(site, min(timeout, MAX_WAIT_TIME), duration)
+
   types_getJobsAtSite =  [StringTypes]
   def export_getJobsAtSite(self, site):
     """ Get the jobs running at a given site
     """
-    return OVERLAY_DB.getJobsAtSite(site)
-  
+    return SLOT_COUNTERS.getJobsAtSite(site)
+
   types_getSites = []
   def export_getSites(self):
     """ Get all sites registered
     """
-    return OVERLAY_DB.getSites()
-  
+    return SLOT_COUNTERS.getSites()
+
   types_setJobsAtSites = [ DictType ]
   def export_setJobsAtSites(self, sitedict):
-    """ Set the number of jobs running at each site: 
+    """ Set the number of jobs running at each site:
     called from the ResetCounter agent
     """
-    return OVERLAY_DB.setJobsAtSites(sitedict)
-  
\ No newline at end of file
+    return SLOT_COUNTERS.setJobsAtSites(sitedict)
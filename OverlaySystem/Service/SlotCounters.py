@@ -0,0 +1,245 @@
+""" In-memory slot bookkeeping of the Overlay service
+
+The number of jobs getting overlay files at each site, and the leases handed out to them, are kept in the memory
+of the service, so answering a job does not need a DB round trip. The state is loaded from the DB when the service
+starts and the changes are written back periodically in batches (write-behind) by :func:`SlotCounters.flush`.
+
+The counters are only consistent if a single instance of the Overlay service is running.
+"""
+
+import threading
+import time
+
+from DIRAC                                              import S_OK, S_ERROR, gLogger
+
+__RCSID__ = "$Id$"
+
+class SlotCounters( object ):
+  """ Authoritative per-site counters of the Overlay service
+
+  The free slots of each site form its token bucket: a lease takes a token and gives it back when it is released
+  or when it expires, so slots held by crashed jobs are freed without the ResetCounters agent.
+  All public methods are atomic.
+  """
+  def __init__( self, store, limits, maxWaiting = 10 ):
+    """
+    :param store: persistence with loadState and saveState methods, e.g.
+                  :class:`~ILCDIRAC.OverlaySystem.DB.OverlayDB.OverlayDB` or
+                  :class:`~ILCDIRAC.OverlaySystem.DB.OverlaySQLiteDB.OverlaySQLiteDB`
+    :param dict limits: maximum number of concurrent jobs per site, the key 'default' is used for other sites
+    :param int maxWaiting: maximum number of calls to waitForSlot blocking at the same time
+    """
+    self.log = gLogger.getSubLogger( 'SlotCounters' )
+    self.store = store
+    self.limits = limits
+    self.lock = threading.RLock()
+    #: notified whenever a slot is given back, to wake up the waiting jobs
+    self.slotFreed = threading.Condition( self.lock )
+    self.maxWaiting = maxWaiting
+    self._waiting = 0
+    self.counters = {}
+    self.leases = {}
+    self.nextLeaseID = 1
+    self._flushLock = threading.Lock()
+    self._dirtySites = set()
+    self._newLeases = {}
+    self._deletedLeases = set()
+    #: leases of a failed save, they may already be in the store and are deleted there when released
+    self._requeuedLeases = set()
+
+  def load( self ):
+    """ Read the state from the store, replaces the current state
+    """
+    res = self.store.loadState()
+    if not res['OK']:
+      return res
+    with self.lock:
+      self.counters = dict( res['Value']['Counters'] )
+      self.leases = dict( res['Value']['Leases'] )
+      # lease IDs are not reused after a restart, as long as less than 1000 leases per second are handed out
+      self.nextLeaseID = max( [ int( time.time() * 1000 ) ] + [ leaseID + 1 for leaseID in self.leases ] )
+      self._dirtySites = set()
+      self._newLeases = {}
+      self._deletedLeases = set()
+      self._requeuedLeases = set()
+    self.log.info( "Loaded %s sites and %s leases" % ( len( self.counters ), len( self.leases ) ) )
+    return S_OK()
+
+  def flush( self ):
+    """ Write the changes since the last flush to the store
+
+    If the store fails, the changes are kept and written with the next flush. Part of them may have been written
+    already, so the leases are deleted from the store if they are released before the next flush.
+    """
+    with self._flushLock:
+      with self.lock:
+        counters = dict( ( site, self.counters[site] ) for site in self._dirtySites )
+        newLeases = self._newLeases
+        deletedLeases = self._deletedLeases
+        self._dirtySites = set()
+        self._newLeases = {}
+        self._deletedLeases = set()
+      if not counters and not newLeases and not deletedLeases:
+        return S_OK()
+
+      res = self.store.saveState( counters, newLeases, deletedLeases )
+      if not res['OK']:
+        self.log.error( "Failed to save the overlay counters, will retry", res['Message'] )
+        with self.lock:
+          self._dirtySites.update( counters )
+          for leaseID, lease in newLeases.items():
+            ## a lease released since is only deleted, its insert may have been written
+            if leaseID not in self._deletedLeases:
+              self._newLeases[leaseID] = lease
+              self._requeuedLeases.add( leaseID )
+          self._deletedLeases.update( deletedLeases )
+        return res
+      with self.lock:
+        self._requeuedLeases.difference_update( newLeases )
+    self.log.verbose( "Saved %s sites, %s new and %s deleted leases" % ( len( counters ), len( newLeases ),
+                                                                       len( deletedLeases ) ) )
+    return S_OK()
+
+  #####################################################################
+  # Private methods, the lock must be held
+
+  def _limitForSite( self, site ):
+    """ Get the current limit of jobs for a given site.
+    """
+    return self.limits.get( site, self.limits['default'] )
+
+  def _setJobs( self, site, nbjobs ):
+    """ Change the number of jobs at the site and remember to save it
+    """
+    self.counters[site] = nbjobs
+    self._dirtySites.add( site )
+
+  def _takeSlot( self, site ):
+    """ Take a slot at the site if one is free
+    """
+    nbjobs = self.counters.get( site, 0 )
+    if nbjobs >= self._limitForSite( site ):
+      return False
+    self._setJobs( site, nbjobs + 1 )
+    return True
+
+  def _freeSlot( self, site, minimum = 0 ):
+    """ Give back a slot at the site, the counter is not decreased below `minimum`
+    """
+    nbjobs = self.counters.get( site, 0 )
+    if nbjobs > minimum:
+      self._setJobs( site, nbjobs - 1 )
+      self.slotFreed.notifyAll()
+
+  def _removeLease( self, leaseID ):
+    """ Remove the lease and give back its slot
+    """
+    site, _expires = self.leases.pop( leaseID )
+    if self._newLeases.pop( leaseID, None ) is None or leaseID in self._requeuedLeases:
+      self._deletedLeases.add( leaseID )
+    self._requeuedLeases.discard( leaseID )
+    self._freeSlot( site )
+    return site
+
+  def _releaseExpiredLeases( self, site ):
+    """ Give back the slots of the expired leases of the site
+    """
+    now = time.time()
+    expired = [ leaseID for leaseID, ( leaseSite, expires ) in self.leases.items()
+                if leaseSite == site and expires < now ]
+    for leaseID in expired:
+      self._removeLease( leaseID )
+    if expired:
+      self.log.info( "Released %s expired leases at %s" % ( len( expired ), site ) )
+
+  #####################################################################
+  # Public methods
+
+  def canRun( self, site ):
+    """ Take a slot at the site without lease, S_OK(True) if a slot was free
+    """
+    with self.lock:
+      self._releaseExpiredLeases( site )
+      return S_OK( self._takeSlot( site ) )
+
+  def jobDone( self, site ):
+    """ Give back a slot taken by canRun
+    """
+    with self.lock:
+      if site not in self.counters:
+        return S_ERROR( "Could not find any site %s" % site )
+      self._freeSlot( site, minimum = 1 )
+    return S_OK()
+
+  def acquireLease( self, site, duration ):
+    """ Take a slot at the site for at most `duration` seconds
+
+    :returns: S_OK with the lease ID, or 0 if no slot is free
+    """
+    with self.lock:
+      self._releaseExpiredLeases( site )
+      if not self._takeSlot( site ):
+        return S_OK( 0 )
+      leaseID = self.nextLeaseID
+      self.nextLeaseID += 1
+      self.leases[leaseID] = ( site, int( time.time() + duration ) )
+      self._newLeases[leaseID] = self.leases[leaseID]
+    return S_OK( leaseID )
+
+  def releaseLease( self, leaseID ):
+    """ Give back the slot held by the lease
+
+    :returns: S_OK with the site of the lease, or False if the lease does not exist (anymore)
+    """
+    with self.lock:
+      if leaseID not in self.leases:
+        return S_OK( False )
+      return S_OK( self._removeLease( leaseID ) )
+
+  def waitForSlot( self, site, timeout, duration ):
+    """ Wait at most `timeout` seconds for a free slot at the site and take a lease on it
+
+    The call wakes up as soon as a slot is given back. Expired leases are checked at least every 30 seconds.
+    Each waiting call holds a thread of the service: if `maxWaiting` calls are already waiting, the call returns
+    at once.
+
+    :returns: S_OK with the lease ID, or 0 if no slot became free in time
+    """
+    deadline = time.time() + max( timeout, 0 )
+    with self.lock:
+      res = self.acquireLease( site, duration )
+      if res['Value'] or self._waiting >= self.maxWaiting:
+        return res
+      self._waiting += 1
+      try:
+        while True:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            return S_OK( 0 )
+          self.slotFreed.wait( min( remaining, 30 ) )
+          res = self.acquireLease( site, duration )
+          if res['Value']:
+            return res
+      finally:
+        self._waiting -= 1
+
+  def getJobsAtSite( self, site ):
+    """ Get the number of jobs currently getting overlay files at the site
+    """
+    with self.lock:
+      return S_OK( self.counters.get( site, 0 ) )
+
+  def getSites( self ):
+    """ Return the list of sites known to the service
+    """
+    with self.lock:
+      return S_OK( self.counters.keys() )
+
+  def setJobsAtSites( self, sitedict ):
+    """ Set the number of jobs running at the sites
+    """
+    with self.lock:
+      for site, nbjobs in sitedict.items():
+        self._setJobs( site, int( nbjobs ) )
+      self.slotFreed.notifyAll()
+    return S_OK()
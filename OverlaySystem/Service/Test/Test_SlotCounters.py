@@ -0,0 +1,142 @@
+"""
+Tests for SlotCounters, using the SQLite stand-in of the OverlayDB
+
+"""
+import threading
+import time
+import unittest
+from mock import patch, MagicMock as Mock
+
+from ILCDIRAC.OverlaySystem.DB.OverlaySQLiteDB import OverlaySQLiteDB
+from ILCDIRAC.OverlaySystem.Service.SlotCounters import SlotCounters
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertDiracFailsWith, assertDiracSucceeds, \
+  assertDiracSucceedsWith_equals, assertEqualsImproved
+from DIRAC import S_ERROR
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.OverlaySystem.Service.SlotCounters'
+
+class TestSlotCounters( unittest.TestCase ):
+  """Tests of SlotCounters"""
+  def setUp( self ):
+    self.store = OverlaySQLiteDB( limits = { 'default' : 3, 'smallSite' : 1 } )
+    self.counters = SlotCounters( self.store, self.store.limits )
+    assertDiracSucceeds( self.counters.load(), self )
+
+  def reload( self ):
+    """ flush and return new counters object reading the same store """
+    assertDiracSucceeds( self.counters.flush(), self )
+    counters = SlotCounters( self.store, self.store.limits )
+    assertDiracSucceeds( counters.load(), self )
+    return counters
+
+  def test_canrun_limit( self ):
+    for _ in xrange(3):
+      assertDiracSucceedsWith_equals( self.counters.canRun( 'bigSite' ), True, self )
+    assertDiracSucceedsWith_equals( self.counters.canRun( 'bigSite' ), False, self )
+    assertDiracSucceedsWith_equals( self.counters.canRun( 'smallSite' ), True, self )
+    assertDiracSucceedsWith_equals( self.counters.canRun( 'smallSite' ), False, self )
+    assertDiracSucceedsWith_equals( self.counters.getJobsAtSite( 'bigSite' ), 3, self )
+
+  def test_canrun_concurrent( self ):
+    results = []
+    def takeSlot():
+      """ take a slot from a thread """
+      results.append( self.counters.canRun( 'bigSite' )['Value'] )
+    threads = [ threading.Thread( target = takeSlot ) for _ in xrange(20) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    assertEqualsImproved( results.count( True ), 3, self )
+
+  def test_jobdone( self ):
+    assertDiracFailsWith( self.counters.jobDone( 'unknownSite' ), 'could not find any site', self )
+    self.counters.canRun( 'bigSite' )
+    self.counters.canRun( 'bigSite' )
+    assertDiracSucceeds( self.counters.jobDone( 'bigSite' ), self )
+    assertDiracSucceeds( self.counters.jobDone( 'bigSite' ), self )
+    assertDiracSucceedsWith_equals( self.counters.getJobsAtSite( 'bigSite' ), 1, self )
+
+  def test_lease( self ):
+    leaseID = self.counters.acquireLease( 'smallSite', 3600 )['Value']
+    self.assertTrue( leaseID )
+    assertDiracSucceedsWith_equals( self.counters.acquireLease( 'smallSite', 3600 ), 0, self )
+    assertDiracSucceedsWith_equals( self.counters.releaseLease( leaseID ), 'smallSite', self )
+    assertDiracSucceedsWith_equals( self.counters.releaseLease( leaseID ), False, self )
+    self.assertTrue( self.counters.acquireLease( 'smallSite', 3600 )['Value'] )
+
+  def test_lease_expires( self ):
+    leaseID = self.counters.acquireLease( 'smallSite', -1 )['Value']
+    self.assertTrue( leaseID )
+    newLeaseID = self.counters.acquireLease( 'smallSite', 3600 )['Value']
+    self.assertTrue( newLeaseID )
+    self.assertNotEqual( leaseID, newLeaseID )
+    assertDiracSucceedsWith_equals( self.counters.getJobsAtSite( 'smallSite' ), 1, self )
+
+  def test_waitforslot( self ):
+    leaseID = self.counters.acquireLease( 'smallSite', 3600 )['Value']
+    timer = threading.Timer( 0.2, self.counters.releaseLease, ( leaseID, ) )
+    timer.start()
+    start = time.time()
+    newLeaseID = self.counters.waitForSlot( 'smallSite', 20, 3600 )['Value']
+    timer.join()
+    self.assertTrue( newLeaseID )
+    self.assertLess( time.time() - start, 10 )
+
+  def test_waitforslot_timeout( self ):
+    self.counters.acquireLease( 'smallSite', 3600 )
+    assertDiracSucceedsWith_equals( self.counters.waitForSlot( 'smallSite', 0.1, 3600 ), 0, self )
+
+  def test_waitforslot_maxwaiting( self ):
+    self.counters.maxWaiting = 1
+    self.counters.acquireLease( 'smallSite', 3600 )
+    waiter = threading.Thread( target = self.counters.waitForSlot, args = ( 'smallSite', 0.5, 3600 ) )
+    waiter.start()
+    time.sleep( 0.1 )
+    start = time.time()
+    assertDiracSucceedsWith_equals( self.counters.waitForSlot( 'smallSite', 20, 3600 ), 0, self )
+    self.assertLess( time.time() - start, 0.3 )
+    waiter.join()
+    assertEqualsImproved( self.counters._waiting, 0, self ) #pylint: disable=protected-access
+
+  def test_flush_and_reload( self ):
+    self.counters.canRun( 'bigSite' )
+    keptLease = self.counters.acquireLease( 'smallSite', 3600 )['Value']
+    releasedLease = self.counters.acquireLease( 'bigSite', 3600 )['Value']
+    self.counters.releaseLease( releasedLease )
+    counters = self.reload()
+    assertEqualsImproved( counters.counters, { 'bigSite' : 1, 'smallSite' : 1 }, self )
+    assertEqualsImproved( counters.leases.keys(), [ keptLease ], self )
+    self.assertGreater( counters.nextLeaseID, keptLease )
+    assertDiracSucceedsWith_equals( counters.releaseLease( keptLease ), 'smallSite', self )
+    self.counters = counters
+    counters = self.reload()
+    assertEqualsImproved( counters.leases, {}, self )
+    assertEqualsImproved( counters.counters['smallSite'], 0, self )
+
+  def test_flush_fails_keeps_changes( self ):
+    self.counters.canRun( 'bigSite' )
+    leaseID = self.counters.acquireLease( 'smallSite', 3600 )['Value']
+    with patch.object( self.store, 'saveState', new=Mock(return_value=S_ERROR('db_down')) ):
+      assertDiracFailsWith( self.counters.flush(), 'db_down', self )
+    counters = self.reload()
+    assertEqualsImproved( counters.counters, { 'bigSite' : 1, 'smallSite' : 1 }, self )
+    assertEqualsImproved( counters.leases.keys(), [ leaseID ], self )
+
+  def test_flush_fails_lease_released( self ):
+    leaseID = self.counters.acquireLease( 'smallSite', 3600 )['Value']
+    with patch.object( self.store, 'saveState', new=Mock(return_value=S_ERROR('db_down')) ):
+      assertDiracFailsWith( self.counters.flush(), 'db_down', self )
+    self.counters.releaseLease( leaseID )
+    assertEqualsImproved( self.counters._deletedLeases, set( [ leaseID ] ), self ) #pylint: disable=protected-access
+    counters = self.reload()
+    assertEqualsImproved( counters.leases, {}, self )
+    assertEqualsImproved( counters.counters, { 'smallSite' : 0 }, self )
+
+  def test_setjobsatsites( self ):
+    self.counters.canRun( 'bigSite' )
+    assertDiracSucceeds( self.counters.setJobsAtSites( { 'bigSite' : 0, 'newSite' : '2' } ), self )
+    assertEqualsImproved( sorted( self.counters.getSites()['Value'] ), [ 'bigSite', 'newSite' ], self )
+    assertEqualsImproved( self.reload().counters, { 'bigSite' : 0, 'newSite' : 2 }, self )
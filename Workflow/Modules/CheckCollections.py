@@ -6,11 +6,8 @@ Module to check the file contents
 
 import os
 
-from string import Template
-
 from DIRAC                                                import S_OK, S_ERROR, gLogger
-from DIRAC.Core.Utilities.Subprocess                      import shellCall
-from ILCDIRAC.Core.Utilities.PrepareLibs                  import removeLibc
+from ILCDIRAC.Core.Utilities.LCIOReader                   import scanFiles, DEFAULT_PROCESSES
 from ILCDIRAC.Workflow.Modules.ModuleBase                 import ModuleBase
 
 __RCSID__ = "$Id$"
@@ -32,9 +29,12 @@ class CheckCollections(ModuleBase):
 
     self.InputFile    = []
     self.collections  = None
+    #: number of files read at the same time, the number of processors of the job if it requests several
+    self.maxProcesses = DEFAULT_PROCESSES
 
   def execute(self):
-    """ Run the thing
+    """ Count the events of every input file and check that every event contains the collections,
+    see :func:`~ILCDIRAC.Core.Utilities.LCIOReader.scanFiles`
     """
     # Get input variables
 
@@ -45,88 +45,10 @@ class CheckCollections(ModuleBase):
     if not self.platform:
       result = S_ERROR( 'No ILC platform selected' )
 
-    if 'LCIO' not in os.environ:
-      self.log.error("Environment variable LCIO was not defined, cannot do anything")
-      result = S_ERROR("Environment variable LCIO was not defined, cannot do anything")
-
     if not result['OK']:
-      self.log.error("Failed to resolve the input parameters:", self.result["Message"])
+      self.log.error("Failed to resolve the input parameters:", result["Message"])
       return result
 
-    removeLibc( os.path.join( os.environ["LCIO"], "lib" ) )
-
-    # Setting up script
-
-    LD_LIBRARY_PATH = os.path.join( "$LCIO", "lib" )
-    if 'LD_LIBRARY_PATH' in os.environ:
-      LD_LIBRARY_PATH += ":" + os.environ['LD_LIBRARY_PATH']
-
-    PATH = "$LCIO/bin"
-    if 'PATH' in os.environ:
-      PATH += ":" + os.environ['PATH']
-
-    scriptContent = Template('''
-#!/bin/sh
-
-#------------------------------------------------------------------------------#
-# Dynamically generated script by CheckCollections module                      #
-#------------------------------------------------------------------------------#
-
-declare -x LD_LIBRARY_PATH=$LD_LIBRARY_PATH_
-declare -x PATH=$PATH_
-
-python <<PYTHONSCRIPT
-
-import sys, subprocess
-
-exitStatus = 0
-
-for file in $files:
-
-    cmdResult      = subprocess.Popen( ["lcio", "count", file], stdout=subprocess.PIPE ).communicate()[ 0 ]
-    numberOfEvents = int( cmdResult.strip().split()[1] )
-
-    cmdAnajobResult = subprocess.Popen( ["anajob", file], stdout=subprocess.PIPE ).communicate()[ 0 ]
-
-    for collection in $collections:
-
-        cmdResult           = subprocess.Popen( ["grep", "-c", collection], stdin=subprocess.PIPE, stdout=subprocess.PIPE ).communicate( cmdAnajobResult )[ 0 ]
-        numberOfCollections = int( cmdResult.strip() )
-
-        if numberOfEvents != numberOfCollections:
-
-            print 'Inconsistency in %s: %i events vs %i collections (%s)' % ( file, numberOfEvents, numberOfCollections, collection )
-
-            exitStatus = 1
-            #sys.exit( exitStatus )
-
-sys.exit( exitStatus )
-
-PYTHONSCRIPT
-
-declare -x appstatus=$$?
-exit $$appstatus
-
-''')
-
-    scriptContent = scriptContent.substitute( LD_LIBRARY_PATH_ = LD_LIBRARY_PATH,
-                                              PATH_            = PATH,
-                                              files            = self.InputFile,
-                                              collections      = self.collections
-                                            )
-
-    # Write script to file
-
-    scriptPath = 'CheckCollections_%s_Run_%s' % ( self.applicationVersion, self.STEP_NUMBER )
-
-    if os.path.exists(scriptPath):
-      os.remove(scriptPath)
-
-    script = open( scriptPath, 'w' )
-    script.write( scriptContent )
-    script.close()
-
-
     # Setup log file for application stdout
 
     if os.path.exists( self.applicationLog ):
@@ -134,23 +56,26 @@ exit $$appstatus
 
     # Run code
 
-    os.chmod( scriptPath, 0755 )
-
-    command = '"./%s"' % ( scriptPath )
-
     self.setApplicationStatus( 'CheckCollections %s step %s' % ( self.applicationVersion, self.STEP_NUMBER ) )
     self.stdError = ''
 
-    self.result = shellCall( 0,
-                             command,
-                             callbackFunction = self.redirectLogOutput,
-                             bufferLimit = 20971520
-                           )
+    res = scanFiles( self.InputFile, self.maxProcesses )
+    if not res['OK']:
+      self.redirectLogOutput( 1, res['Message'] )
+      return self.finalStatusReport( 1 )
 
     # Check results
 
-    resultTuple = self.result['Value']
-    status      = resultTuple[0]
+    status = 0
+    for fileName, content in res['Value'].iteritems():
+      numberOfEvents = content['Events']
+      self.redirectLogOutput( 0, '%s: %i events' % ( fileName, numberOfEvents ) )
+      for collection in self.collections:
+        numberOfCollections = content['Collections'].get( collection, 0 )
+        if numberOfEvents != numberOfCollections:
+          self.redirectLogOutput( 0, 'Inconsistency in %s: %i events vs %i collections (%s)' %
+                                  ( fileName, numberOfEvents, numberOfCollections, collection ) )
+          status = 1
 
     self.log.info( "Status after the application execution is %s" % str( status ) )
 
@@ -171,6 +96,13 @@ exit $$appstatus
     if len( self.collections ) == 0:
       return S_ERROR( 'No list of collections defined to check for.' )
 
+    try:
+      numberOfProcessors = int( self.workflow_commons.get( 'NumberOfProcessors', 0 ) )
+    except ValueError:
+      numberOfProcessors = 0
+    if numberOfProcessors > 1:
+      self.maxProcesses = numberOfProcessors
+
     #
 
     return S_OK('Parameters resolved')
@@ -152,7 +152,7 @@ class DDSimAnalysis(DD4hepMixin, ModuleBase):
     script.append('#####################################################################')
     script.append('# Dynamically generated script to run a production or analysis job. #')
     script.append('#####################################################################')
-    script.append('source %s' % envScriptPath)
+    script.append(self.getEnvironmentCommand(envScriptPath))
     script.append('echo =========')
 
     ## for user provided libraries
@@ -177,6 +177,7 @@ class DDSimAnalysis(DD4hepMixin, ModuleBase):
 
     os.chmod(scriptName, 0755)
     comm = 'bash "./%s"' % scriptName
+    comm = self.getLogCommand(comm)
     self.setApplicationStatus('DDSim %s step %s' % (self.applicationVersion, self.STEP_NUMBER))
     self.stdError = ''
     self.result = shellCall(0, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
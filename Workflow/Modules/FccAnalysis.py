@@ -256,7 +256,7 @@ class FccAnalysis(ModuleBase):
     # Set environment and execute the application
     shebang = "#!/bin/bash"
 
-    setEnvironmentScript = 'source %s' % self.environmentScript
+    setEnvironmentScript = self.getEnvironmentCommand(self.environmentScript)
     bashScriptText = [shebang, setEnvironmentScript, command]
 
     self.log.debug("Application command : %s" % command)
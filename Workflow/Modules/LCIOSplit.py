@@ -10,6 +10,7 @@ import os
 from DIRAC                                                import S_OK, S_ERROR, gLogger
 from DIRAC.Core.Utilities.Subprocess                      import shellCall
 
+from ILCDIRAC.Core.Utilities.LogParsers                   import LCIOSplitLogParser
 from ILCDIRAC.Core.Utilities.PrepareLibs                  import removeLibc
 from ILCDIRAC.Core.Utilities.resolvePathsAndNames         import getProdFilename, resolveIFpaths
 from ILCDIRAC.Workflow.Modules.ModuleBase                 import ModuleBase
@@ -145,6 +146,8 @@ exit $?
 
     self.setApplicationStatus( 'LCIOSplit %s step %s' % ( self.applicationVersion, self.STEP_NUMBER ) )
     self.stdError = ''
+    baseinputfilename = os.path.basename(runonslcio).split(".slcio")[0]
+    parser = self.addLogParser( LCIOSplitLogParser( baseinputfilename ) )
 
     result = shellCall( 0,
                         command,
@@ -159,26 +162,22 @@ exit $?
       self.log.error("Cannot access log file, cannot proceed")
       return S_ERROR("Failed reading the log file")
 
-    baseinputfilename = os.path.basename(runonslcio).split(".slcio")[0]
     output_file_base_name = ''
     if self.OutputFile:
       output_file_base_name = self.OutputFile.split('.slcio')[0]
     self.log.info("Will rename all files using '%s' as base." % output_file_base_name)
+    if not parser.linesParsed:
+      ## the output did not go through redirectLogOutput
+      with open(self.applicationLog,"r") as logf:
+        parser.parseLines(logf)
     numberofeventsdict = {}
-    fname = ''
-    with open(self.applicationLog,"r") as logf:
-      for line in logf:
-        line = line.rstrip()
-        if line.count(baseinputfilename):
-          #First, we need to rename those guys
-          current_file = os.path.basename(line).replace(".slcio", "")
-          current_file_extension = current_file.replace(baseinputfilename, "")
-          newfile = output_file_base_name + current_file_extension + ".slcio"
-          os.rename(line, newfile)
-          fname = newfile
-          numberofeventsdict[fname] = 0
-        elif line.count("events"):
-          numberofeventsdict[fname] = int(line.split()[0])
+    for splitfile, nbevents in parser.numberOfEvents.items():
+      #First, we need to rename those guys
+      current_file = os.path.basename(splitfile).replace(".slcio", "")
+      current_file_extension = current_file.replace(baseinputfilename, "")
+      newfile = output_file_base_name + current_file_extension + ".slcio"
+      os.rename(splitfile, newfile)
+      numberofeventsdict[newfile] = nbevents
 
     self.log.verbose("Number of eventsdict dict: %s" % numberofeventsdict)   
 
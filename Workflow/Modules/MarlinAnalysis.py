@@ -17,8 +17,10 @@ from DIRAC.Core.Utilities.Subprocess                      import shellCall
 from DIRAC                                                import S_OK, S_ERROR, gLogger
 
 from ILCDIRAC.Workflow.Modules.ModuleBase                 import ModuleBase
-from ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation import getSoftwareFolder, getEnvironmentScript
+from ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation import getSoftwareFolder, getEnvironmentScript, \
+  getLocalAreaLocation
 from ILCDIRAC.Core.Utilities.PrepareOptionFiles           import prepareXMLFile, getNewLDLibs
+from ILCDIRAC.Core.Utilities.SteeringTemplate             import SteeringTemplateCache
 from ILCDIRAC.Core.Utilities.resolvePathsAndNames         import resolveIFpaths, getProdFilename
 from ILCDIRAC.Core.Utilities.PrepareLibs                  import removeLibc
 from ILCDIRAC.Core.Utilities.FindSteeringFileDir          import getSteeringFileDirName
@@ -197,6 +199,7 @@ class MarlinAnalysis(DD4hepMixin, ModuleBase):
                          self.debug,
                          dd4hepGeoFile=compactFile,
                          overlayParam=overlayParam,
+                         templateCache=self._getSteeringTemplateCache(),
                         )
     if not res['OK']:
       self.log.error('Something went wrong with XML generation because %s' % res['Message'])
@@ -231,77 +234,53 @@ class MarlinAnalysis(DD4hepMixin, ModuleBase):
 
     return self.finalStatusReport(status) 
 
+  def _getSteeringTemplateCache(self):
+    """ Return the cache of the compiled steering files, None if /Marlin/SteeringTemplates/Enabled is False.
+
+    The templates are searched in /Marlin/SteeringTemplates/Locations (e.g. in the shared area), then in
+    /Marlin/SteeringTemplates/Directory, which defaults to the SteeringTemplates folder of the local area.
+    """
+    if not self.ops.getValue("/Marlin/SteeringTemplates/Enabled", True):
+      return None
+    cacheDirs = list(self.ops.getValue("/Marlin/SteeringTemplates/Locations", []))
+    cacheDir = self.ops.getValue("/Marlin/SteeringTemplates/Directory", "")
+    if not cacheDir:
+      localArea = getLocalAreaLocation()
+      cacheDir = os.path.join(localArea, 'SteeringTemplates') if localArea else ''
+    cacheDirs.append(cacheDir)
+    return SteeringTemplateCache(cacheDirs)
+
   def prepareMARLIN_DLL(self, env_script_path):
     """ Prepare the run time environment: MARLIN_DLL in particular.
     """
-    #to fix the MARLIN_DLL, we need to get it first
-    with open("temp.sh",'w') as script:
-      script.write("#!/bin/bash\n")
-      lines = []
-      lines.append('source %s > /dev/null' % env_script_path)
-      lines.append('echo $MARLIN_DLL')
-      script.write("\n".join(lines))
-    os.chmod("temp.sh", 0755)
-    res = shellCall(0, "./temp.sh")
+    #to fix the MARLIN_DLL, we need to get it first, from the environment of the software
+    res = self.getEnvironmentSnapshot(env_script_path)
     if not res['OK']:
-      self.log.error("Could not get the MARLIN_DLL env")
+      self.log.error("Could not get the MARLIN_DLL env", res['Message'])
       return S_ERROR("Failed getting the MARLIN_DLL")
-    marlindll = res["Value"][1].rstrip()
-    marlindll = marlindll.rstrip(":")
-    try:
-      os.remove('temp.sh')
-    except EnvironmentError, e:
-      self.log.warn("Failed to delete the temp file", str(e))
-
+    marlindll = res['Value'].apply(os.environ).get('MARLIN_DLL', '').strip().rstrip(":")
     if not marlindll:
       return S_ERROR("Empty MARLIN_DLL env variable!")
     #user libs
-    userlib = ""
-    
+    userlibs = []
     if os.path.exists("./lib/marlin_dll"):
-      for library in glob.glob("./lib/marlin_dll/*.so"):
-        userlib = userlib + library + ":"
-        
-    userlib = userlib.rstrip(":")
-    
-    temp = marlindll.split(':')
-    temp2 = userlib.split(":")
-    lib1d = {}
-    libuser = {}
-    for lib in temp:
-      lib1d[os.path.basename(lib)] = lib
-    for lib in temp2:
-      libuser[os.path.basename(lib)] = lib
-
-    for lib1, path1 in lib1d.items():
-      if lib1 in libuser:
-        self.log.verbose("Duplicated lib found, removing %s" % path1)
-        try:
-          temp.remove(path1)
-        except ValueError:
-          pass
-      
-    marlindll = "%s:%s" % (":".join(temp), userlib) #Here we concatenate the default MarlinDLL with the user's stuff
-    finallist = []
-    items = marlindll.split(":")
+      userlibs = glob.glob("./lib/marlin_dll/*.so")
+    userNames = set(os.path.basename(lib) for lib in userlibs)
+    defaultlibs = []
+    for lib in marlindll.split(':'):
+      if os.path.basename(lib) in userNames:
+        self.log.verbose("Duplicated lib found, removing %s" % lib)
+      elif lib:
+        defaultlibs.append(lib)
+    #Here we concatenate the default MarlinDLL with the user's stuff
+    finallist = defaultlibs + userlibs
     #Care for user defined list of processors, useful when someone does not want to run the full reco
     if self.ProcessorListToUse:
-      for processor in self.ProcessorListToUse:
-        for item in items:
-          if item.count(processor):
-            finallist.append(item)
-    else:
-      finallist = items
-    items = finallist
+      finallist = [lib for processor in self.ProcessorListToUse for lib in finallist if processor in lib]
     #Care for user defined excluded list of processors, useful when someone does not want to run the full reco
     if self.ProcessorListToExclude:
-      for item in items:
-        for processor in self.ProcessorListToExclude:
-          if item.count(processor):
-            finallist.remove(item)
-    else:
-      finallist = items
-
+      finallist = [lib for lib in finallist
+                   if not any(processor in lib for processor in self.ProcessorListToExclude)]
 
     ## LCFIPlus links with LCFIVertex, LCFIVertex needs to go first in the MARLIN_DLL
     plusPos = 0
@@ -331,7 +310,7 @@ class MarlinAnalysis(DD4hepMixin, ModuleBase):
     script.write('#####################################################################\n')
     script.write('# Dynamically generated script to run a production or analysis job. #\n')
     script.write('#####################################################################\n')
-    script.write("source %s\n" % env_script_path)
+    script.write("%s\n" % self.getEnvironmentCommand(env_script_path))
     script.write("declare -x MARLIN_DLL=%s\n" % marlin_dll)
     ## needed for lcgeo detector components for example
     if os.path.exists("./lib/"):
@@ -386,6 +365,7 @@ fi
 
     os.chmod(scriptName, 0755)
     comm = 'sh -c "./%s"' % (scriptName)
+    comm = self.getLogCommand(comm)
     self.setApplicationStatus('%s %s step %s' % (self.applicationName, self.applicationVersion, self.STEP_NUMBER))
     self.stdError = ''
     res = shellCall(0, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)    
@@ -9,10 +9,9 @@ Stolen by S. Poss from LHCbSystem.Workflow.Modules
 """
 
 import os
-import re
 import shutil
 import string
-import sys
+import time
 import urllib
 from collections import defaultdict
 from pprint import pformat
@@ -20,23 +19,28 @@ from random import choice
 
 from DIRAC                                                import S_OK, S_ERROR, gLogger
 from DIRAC.Core.Security.ProxyInfo                        import getProxyInfoAsString
-from DIRAC.Core.Utilities.Adler                           import fileAdler
 from DIRAC.Core.Utilities.Subprocess                      import shellCall
 from DIRAC.TransformationSystem.Client.FileReport         import FileReport
 from DIRAC.WorkloadManagementSystem.Client.JobReport      import JobReport
-from DIRAC.Core.Utilities.File                            import makeGuid
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations  import Operations
 from DIRAC.RequestManagementSystem.Client.Request         import Request
 from DIRAC.RequestManagementSystem.private.RequestValidator   import RequestValidator
 from DIRAC.RequestManagementSystem.Client.Operation       import Operation
 from DIRAC.RequestManagementSystem.Client.File            import File
 
-from ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation import getSoftwareFolder, checkCVMFS
+from ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation import getSoftwareFolder, checkCVMFS, \
+  getLocalAreaLocation
+from ILCDIRAC.Core.Utilities.EnvironmentCache             import EnvironmentCache, captureEnvironment
+from ILCDIRAC.Core.Utilities.FileDigest                   import getFileDigests
 from ILCDIRAC.Core.Utilities.FindSteeringFileDir          import getSteeringFileDir
 from ILCDIRAC.Core.Utilities.InputFilesUtilities          import getNumberOfEvents
+from ILCDIRAC.Core.Utilities.LogSink                      import LogSink
 
 __RCSID__ = "$Id$"
 
+#: the progress of the application is reported as job parameter at most that often, in seconds
+PROGRESS_INTERVAL = 300
+
 def generateRandomString(length=8, chars = string.letters + string.digits):
   """Return random string of 8 chars, used by :mod:`~ILCDIRAC.Workflow.Modules.PythiaAnalysis` and :mod:`~ILCDIRAC.Workflow.Modules.MokkaAnalysis`
   """
@@ -62,6 +66,10 @@ class ModuleBase(object):
 
     self.ops = Operations()
 
+    self._logSink = LogSink()
+    self._parsingStart = 0
+    self._lastProgress = 0
+    self.zeroCopyLog = False
     self.platform = ''
     self.applicationLog = ''
     self.applicationVersion = ''
@@ -295,39 +303,25 @@ class ModuleBase(object):
        This also assumes the files are in the current working directory.
     :return: S_OK with File Metadata, S_ERROR
     """
-    #Retrieve the POOL File GUID(s) for any final output files
-    self.log.info('Will search for POOL GUIDs for: %s' %(', '.join(candidateFiles.keys())))
-    pfnGUIDs = {}
-    generated = []
-    for fname in candidateFiles.keys():
-      guid = makeGuid(fname)
-      pfnGUIDs[fname] = guid
-      generated.append(fname)
-    pfnGUID = S_OK(pfnGUIDs)
-    pfnGUID['generated'] = generated
-    #pfnGUID = getGUID(candidateFiles.keys())
-    #if not pfnGUID['OK']:
-    #  self.log.error('PoolXMLFile failed to determine POOL GUID(s) for output file list, these will be generated by \
-    #                   the DataManager',pfnGUID['Message'])
-    #  for fileName in candidateFiles.keys():
-    #    candidateFiles[fileName]['guid']=''
-    #if pfnGUID['generated']:
-    self.log.debug('Generated GUID(s) for the following files ', ', '.join(pfnGUID['generated']))
-    #else:
-    #  self.log.info('GUIDs found for all specified POOL files: %s' %(string.join(candidateFiles.keys(),', ')))
-
-    for pfn, guid in pfnGUID['Value'].items():
-      candidateFiles[pfn]['GUID'] = guid
+    #Compute GUID and checksum of all output files, each file is read only once
+    self.log.info('Will compute GUIDs and checksums for: %s' %(', '.join(candidateFiles.keys())))
+    resDigests = getFileDigests(candidateFiles.keys())
+    if not resDigests['OK']:
+      self.log.error('Failed to compute checksums of output files', resDigests['Message'])
+      return resDigests
+    digests = resDigests['Value']
 
     #Get all additional metadata about the file necessary for requests
     final = {}
     for fileName, metadata in candidateFiles.items():
+      digest = digests[fileName]
+      metadata['GUID'] = digest['GUID']
       fileDict = {}
       fileDict['LFN'] = metadata['lfn']
-      fileDict['Size'] = os.path.getsize(fileName)
-      fileDict['Addler'] = fileAdler(fileName)
-      fileDict['ADLER32'] = fileAdler(fileName)
-      fileDict['Checksum'] = fileAdler(fileName)
+      fileDict['Size'] = digest['Size']
+      fileDict['Addler'] = digest['Adler32']
+      fileDict['ADLER32'] = digest['Adler32']
+      fileDict['Checksum'] = digest['Adler32']
       fileDict['ChecksumType'] = "ADLER32"
       fileDict['GUID'] = metadata['GUID']
       fileDict['Status'] = "Waiting"
@@ -396,6 +390,8 @@ class ModuleBase(object):
 
     self.applicationLog = self.step_commons.get('applicationLog', self.applicationLog)
 
+    self.zeroCopyLog = self.step_commons.get('ZeroCopyLog', self.zeroCopyLog)
+
     self.extraCLIarguments = urllib.unquote(self.step_commons.get('ExtraCLIArguments', self.extraCLIarguments))
 
     self.SteeringFile = self.step_commons.get('SteeringFile', self.SteeringFile)
@@ -598,6 +594,28 @@ class ModuleBase(object):
     self.log.notice("Request After: %s" %request)
     return S_OK()
 
+  @property
+  def applicationLog(self):
+    """ Name of the log file of the application. The lines buffered by :func:`redirectLogOutput` are written
+    to it before the name is given out, so the log is complete when the module looks at it.
+    """
+    self._logSink.close()
+    return self._logSink.logFile
+
+  @applicationLog.setter
+  def applicationLog(self, logFile):
+    self._logSink.setLogFile(logFile)
+
+  @property
+  def stdError(self):
+    """ The last lines the application wrote to stderr, see :data:`~ILCDIRAC.Core.Utilities.LogSink.MAX_ERROR_LINES`
+    """
+    return self._logSink.getErrors()
+
+  @stdError.setter
+  def stdError(self, errors):
+    self._logSink.setErrors(errors)
+
   def redirectLogOutput(self, fd, message):
     """Catch the output from the application
     print ``message`` to stdout and to the :attr:`self.applicationLog` file
@@ -606,40 +624,92 @@ class ModuleBase(object):
     * If it is an empty list, an empty string, or an empty string in a list print nothing
     * If it is a string or a list of strings print only matching strings
 
-    :param file fd: file descriptor ???
+    The log file stays open and buffered until :attr:`self.applicationLog` is used again.
+
+    :param int fd: 0 for stdout, 1 for stderr
     :param string message: message string
     :returns: None
     """
-    sys.stdout.flush()
-    if not message:
-      return
-    if fd == 1:
-      self.stdError += message
-
-    if isinstance(self.eventstring, basestring):
-      self.eventstring = [self.eventstring]
-
-    if self.eventstring is None:
-      print message
-
-    elif self.eventstring and self.eventstring[0]:
-      for mystring in self.eventstring:
-        if re.search(re.escape(mystring), message):
-          print message
-          break
-
-    if not self.applicationLog:
-      self.log.error("Application Log file not defined")
-      return
-
-    with open(self.applicationLog, 'a') as log:
-      if self.excludeAllButEventString and self.eventstring is not None and len(self.eventstring) and len(self.eventstring[0]):
-        for mystring in self.eventstring:
-          if re.search(re.escape(mystring), message):
-            log.write(message+'\n')
-            break
-      elif not self.excludeAllButEventString:
-        log.write(message+'\n')
+    self._logSink.setFilter(self.eventstring, self.excludeAllButEventString)
+    self._logSink.write(fd, message)
+    if self._logSink.parsers and time.time() - self._lastProgress > PROGRESS_INTERVAL:
+      self.reportProgress()
+
+  def addLogParser(self, parser):
+    """ Give the output lines of the application to the parser while it runs, see
+    :mod:`~ILCDIRAC.Core.Utilities.LogParsers`. Its progress is reported regularly as job parameter.
+
+    :param parser: :class:`~ILCDIRAC.Core.Utilities.LogParsers.LogParser` instance
+    :returns: the parser
+    """
+    self._logSink.addParser(parser)
+    self._parsingStart = self._lastProgress = time.time()
+    return parser
+
+  def reportProgress(self):
+    """ Set the number of events processed so far and the event rate as job parameter """
+    now = time.time()
+    self._lastProgress = now
+    events = sum(progress for progress in (parser.getProgress() for parser in self._logSink.parsers)
+                 if progress is not None)
+    rate = float(events) / max(now - self._parsingStart, 1e-3)
+    return self.setJobParameter('%s progress' % self.applicationName,
+                                '%d events, %.2f events/s' % (events, rate))
+
+  def getLogCommand(self, command):
+    """ Return the command to run with :func:`redirectLogOutput` as callback
+
+    With the ZeroCopyLog step parameter, e.g. from :func:`Marlin.setZeroCopyLog
+    <ILCDIRAC.Interfaces.API.NewInterface.Applications.Marlin.Marlin.setZeroCopyLog>`, the output of the command is
+    appended to the log file by the shell, only the lines to print go through :func:`redirectLogOutput`, unless
+    log parsers were added.
+    """
+    if not self.zeroCopyLog or self._logSink.parsers:
+      ## the log parsers need all lines
+      return command
+    self._logSink.setFilter(self.eventstring, self.excludeAllButEventString)
+    return self._logSink.getTeeCommand(command)
+
+  def getEnvironmentSnapshot(self, envScriptPath):
+    """ Return S_OK with the :class:`~ILCDIRAC.Core.Utilities.EnvironmentCache.EnvironmentSnapshot` of the script
+
+    The snapshots are searched in /Software/EnvironmentCache/Locations (e.g. in the shared area), then in
+    /Software/EnvironmentCache/Directory, which defaults to the EnvironmentSnapshots folder of the local area.
+    If /Software/EnvironmentCache/Enabled is False the script is sourced every time.
+    """
+    if not self.ops.getValue("/Software/EnvironmentCache/Enabled", True):
+      return captureEnvironment(envScriptPath)
+    cacheDirs = list(self.ops.getValue("/Software/EnvironmentCache/Locations", []))
+    cacheDir = self.ops.getValue("/Software/EnvironmentCache/Directory", "")
+    if not cacheDir:
+      localArea = getLocalAreaLocation()
+      cacheDir = os.path.join(localArea, 'EnvironmentSnapshots') if localArea else ''
+    cacheDirs.append(cacheDir)
+    return EnvironmentCache(cacheDirs).getSnapshot(envScriptPath)
+
+  def getEnvironmentCommand(self, envScriptPath):
+    """ Return the shell command setting up the environment of the script for the application
+
+    With the environment cache enabled, the command sources a script exporting the variables of the snapshot of
+    the environment script, written in the working directory. Otherwise, or if the snapshot cannot be made, the
+    command sources the environment script itself.
+    """
+    sourceScript = 'source %s' % envScriptPath
+    if not os.path.isfile(envScriptPath) or not self.ops.getValue("/Software/EnvironmentCache/Enabled", True):
+      return sourceScript
+    res = self.getEnvironmentSnapshot(envScriptPath)
+    if not res['OK']:
+      self.log.warn('No environment snapshot, sourcing the script:', res['Message'])
+      return sourceScript
+    ## the steps running the same application and version share the environment
+    restoreScript = os.path.join(os.getcwd(), '%s_%s_Environment.sh' % (self.applicationName, self.applicationVersion))
+    try:
+      with open(restoreScript, 'w') as script:
+        script.write('\n'.join(res['Value'].getScript() + ['']))
+    except (IOError, OSError) as err:
+      self.log.warn('Failed to write the environment, sourcing the script:', str(err))
+      return sourceScript
+    return 'source %s' % restoreScript
 
   def addRemovalRequests(self, lfnList):
     """Create removalRequests for lfns in lfnList and add it to the common request"""
@@ -233,7 +233,7 @@ class MokkaAnalysis(ModuleBase):
     script.write('#####################################################################\n')
     script.write('# Dynamically generated script to run a production or analysis job. #\n')
     script.write('#####################################################################\n')
-    script.write("source %s\n" % env_script_path)
+    script.write("%s\n" % self.getEnvironmentCommand(env_script_path))
     if os.path.exists("./lib"):
       script.write('declare -x LD_LIBRARY_PATH=./lib:$LD_LIBRARY_PATH\n' )
     script.write('echo =============================\n')
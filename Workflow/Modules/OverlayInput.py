@@ -9,27 +9,47 @@ Get the overlay files
 
 import glob
 import os
+import Queue
 import random
 import subprocess
+import threading
 import time
 from math import ceil
+from multiprocessing.pool import ThreadPool
 
 import DIRAC
 from DIRAC.DataManagementSystem.Client.DataManager           import DataManager
 from DIRAC.Resources.Catalog.FileCatalogClient               import FileCatalogClient
 from DIRAC.Core.DISET.RPCClient                              import RPCClient
+from DIRAC.Core.Utilities.ReturnValues                       import returnSingleResult
 from DIRAC.Core.Utilities.Subprocess                         import shellCall
+from DIRAC.Resources.Storage.StorageElement                  import StorageElementItem as StorageElement
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations     import Operations
 from DIRAC                                                   import S_OK, S_ERROR, gLogger
 
 from ILCDIRAC.Workflow.Modules.ModuleBase                    import ModuleBase
 from ILCDIRAC.Core.Utilities.WasteCPU                        import wasteCPUCycles
 from ILCDIRAC.Core.Utilities.OverlayFiles                    import energyWithLowerCaseUnit
+from ILCDIRAC.Core.Utilities.OverlayFileListCache            import findFilesByMetadataCached, DEFAULT_TTL
+from ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation    import getLocalAreaLocation
 from ILCDIRAC.Core.Utilities.Configuration import getOptionValue
 
 
 __RCSID__ = "$Id$"
 
+#: script written by the site specific getters, the download threads add their name
+OVERLAY_SCRIPT = 'overlayinput.sh'
+#: records the overlay files completely obtained, to resume an interrupted download
+OVERLAY_PROGRESS_FILE = 'overlay_progress.txt'
+#: time in seconds a single waitForSlot call to the Overlay service blocks
+SLOT_WAIT_TIME = 600
+#: time in seconds before asking again for a slot when the service had no thread left to wait, doubled after every
+#: such attempt up to MAX_SLOT_RETRY_TIME
+SLOT_RETRY_TIME = 30
+MAX_SLOT_RETRY_TIME = 600
+#: time in seconds after which the job stops waiting for a slot and fails
+MAX_SLOT_WAIT = 5 * 3600
+
 
 def allowedBkg( bkg, energy = None, detector = None, detectormodel = None, machine = 'clic_cdr' ):
   """ Check is supplied bkg is allowed
@@ -85,6 +105,7 @@ class OverlayInput (ModuleBase):
     self.machine = 'clic_cdr'
     self.pathToOverlayFiles = ''
     self.processorName = ''
+    self._threadData = threading.local()
 
   def applicationSpecificInputs(self):
 
@@ -205,14 +226,32 @@ class OverlayInput (ModuleBase):
       meta['ProdID'] = self.prodid
     self.log.info("Using %s as metadata" % (meta))
 
-    return self.fcc.findFilesByMetadata(meta)
+    return self.__findFilesByMetadata(meta)
 
 
   def __getFilesFromPath(self):
     """ Get the list of files from the FileCatalog via the user specified path.
     """
     meta = {}
-    return self.fcc.findFilesByMetadata(meta, self.pathToOverlayFiles)
+    return self.__findFilesByMetadata(meta, self.pathToOverlayFiles)
+
+  def __findFilesByMetadata(self, meta, path='/'):
+    """ Query the FileCatalog, or read the answer from the file list cache shared by the jobs of the node.
+
+    The snapshots are searched in /Overlay/FileListCache/Locations (e.g. on CVMFS), then in
+    /Overlay/FileListCache/Directory, which defaults to the OverlayFileLists folder of the local area.
+    """
+    ttl = self.ops.getValue("/Overlay/FileListCache/TTL", DEFAULT_TTL)
+    if ttl <= 0:
+      return self.fcc.findFilesByMetadata(meta, path)
+    cacheDirs = list(self.ops.getValue("/Overlay/FileListCache/Locations", []))
+    cacheDir = self.ops.getValue("/Overlay/FileListCache/Directory", "")
+    if not cacheDir:
+      localArea = getLocalAreaLocation()
+      cacheDir = os.path.join(localArea, 'OverlayFileLists') if localArea else ''
+    if cacheDir:
+      cacheDirs.append(cacheDir)
+    return findFilesByMetadataCached(self.fcc, meta, path, cacheDirs, ttl)
 
   def __getFilesFromLyon(self, meta):
     """ List the files present at Lyon, not used.
@@ -310,40 +349,42 @@ class OverlayInput (ModuleBase):
 #      jobpropdict['Site']=self.site
 #      max_concurrent_running = res['Value']
     self.__disableWatchDog()
-    overlaymon = RPCClient('Overlay/Overlay', timeout=60)
+    overlaymon = RPCClient('Overlay/Overlay', timeout=SLOT_WAIT_TIME + 60)
     ##Now need to check that there are not that many concurrent jobs getting the overlay at the same time
+    ##The service answers as soon as a slot is free, and the slot is given back automatically when the lease expires
+    leaseDuration = self.ops.getValue("/Overlay/LeaseDuration", 7200)
     error_count = 0
     count = 0
+    retryTime = SLOT_RETRY_TIME
+    startWait = time.time()
     while 1:
       if error_count > 10 :
         self.log.error('OverlayDB returned too many errors')
         return S_ERROR('Failed to get number of concurrent overlay jobs')
-      #jobMonitor = RPCClient('WorkloadManagement/JobMonitoring',timeout=60)
-      #res = jobMonitor.getCurrentJobCounters(jobpropdict)
-      #if not res['OK']:
-      #  error_count += 1
-      #  time.sleep(60)
-      #  continue
-      #running = 0
-      #if 'Running' in res['Value']:
-      #  running = res['Value']['Running']
-
-      res = overlaymon.canRun(self.site)
+
+      callStart = time.time()
+      res = overlaymon.waitForSlot(self.site, SLOT_WAIT_TIME, leaseDuration)
       if not res['OK']:
         error_count += 1
         time.sleep(60)
         continue
       error_count = 0
-      #if running < max_concurrent_running:
       if res['Value']:
+        leaseID = res['Value']
         break
       else:
         count += 1
-        if count > 300:
+        if time.time() - startWait > MAX_SLOT_WAIT:
           return S_ERROR("Waited too long: 5h, so marking job as failed")
-        if count % 10 == 0 :
-          self.setApplicationStatus("Overlay standby number %s" % count)
-        time.sleep(60)
+        self.setApplicationStatus("Overlay standby number %s" % count)
+        if time.time() - callStart >= SLOT_WAIT_TIME / 2:
+          ##The service waited for us, ask again at once
+          retryTime = SLOT_RETRY_TIME
+          continue
+        ##The service answered at once, too many jobs are waiting already. The waiting jobs get the freed slots,
+        ##the jitter spreads the retries of the jobs started together
+        time.sleep(random.uniform(0.5, 1.5) * retryTime)
+        retryTime = min(2 * retryTime, MAX_SLOT_RETRY_TIME)
 
     self.__enableWatchDog()
 
@@ -351,36 +392,62 @@ class OverlayInput (ModuleBase):
 
     self.log.info('Will obtain %s files for overlay' % totnboffilestoget)
 
-    os.mkdir("./overlayinput_" + self.metaEventType)
-    os.chdir("./overlayinput_" + self.metaEventType)
+    overlayDir = "./overlayinput_" + self.metaEventType
+    if not os.path.exists(overlayDir):
+      os.mkdir(overlayDir)
+    os.chdir(overlayDir)
+
+    max_fail_allowed = self.ops.getValue("/Overlay/MaxFailedAllowed", 20)
+    parallelDownloads = self.ops.getValue("/Overlay/Sites/%s/ParallelDownloads" % self.site,
+                                          self.ops.getValue("/Overlay/ParallelDownloads", 1))
+    if parallelDownloads > 1:
+      self.log.info('Using %s parallel transfers to get the overlay files' % parallelDownloads)
+      resGet = self.__getFilesParallel(totnboffilestoget, parallelDownloads, max_fail_allowed)
+    else:
+      resGet = self.__getFilesSerial(totnboffilestoget, max_fail_allowed)
+    fail = not resGet['OK']
+
+    ## Remove all scripts remaining
+    scripts = glob.glob("*.sh")
+    for script in scripts:
+      os.remove(script)
+      
+    ##Print the file list
+    mylist = os.listdir(os.getcwd())
+    self.log.info("List of Overlay files:")
+    self.log.info("\n".join(mylist))
+    os.chdir(self.curdir)
+    res = overlaymon.releaseLease(leaseID)
+    if not res['OK']:
+      self.log.error("Could not declare the job as finished getting the files")
+    if fail:
+      self.log.error("Did not manage to get all files needed, too many errors")
+      return S_ERROR("Failed to get files")
+    self.log.info('Got all files needed.')
+    return S_OK()
+
+  def __getFilesSerial(self, nbFilesToGet, maxFailAllowed):
+    """ Download the overlay files one after the other, wasting CPU time between two files.
+    """
+    nbfiles = len(self.lfns)
     filesobtained = []
-    usednumbers = []
-    fail = False
+    usednumbers = set()
     fail_count = 0
 
-    max_fail_allowed = self.ops.getValue("/Overlay/MaxFailedAllowed", 20)
-    while not len(filesobtained) == totnboffilestoget:
-      if fail_count > max_fail_allowed:
-        fail = True
-        break
+    while not len(filesobtained) == nbFilesToGet:
+      if fail_count > maxFailAllowed:
+        return S_ERROR("Failed to get files")
 
       fileindex = random.randrange(nbfiles)
       if fileindex not in usednumbers:
-          
-        usednumbers.append(fileindex)
+
+        usednumbers.add(fileindex)
 
         triedDataManager = False
 
-        if self.site == 'LCG.CERN.ch':
-          res = self.getEOSFile(self.lfns[fileindex])
-        elif self.site == 'LCG.IN2P3-CC.fr':
-          res = self.getLyonFile(self.lfns[fileindex])
-        elif self.site == 'LCG.UKI-LT2-IC-HEP.uk':
-          res = self.getImperialFile(self.lfns[fileindex])
-        elif  self.site == 'LCG.RAL-LCG2.uk':
-          res = self.getRALFile(self.lfns[fileindex])
-        elif  self.site == 'LCG.KEK.jp':
-          res = self.getKEKFile(self.lfns[fileindex])
+        siteGetter = self.__getSiteGetter()
+        if siteGetter:
+          res = siteGetter(self.lfns[fileindex])
         else:
           self.__disableWatchDog()
           res = self.datMan.getFile(self.lfns[fileindex])
@@ -395,15 +462,14 @@ class OverlayInput (ModuleBase):
           self.log.warn('Could not obtain %s' % self.lfns[fileindex])
           fail_count += 1
           continue
-        
+
         filesobtained.append(self.lfns[fileindex])
-        print "files now",filesobtained
+        self.log.verbose("Files now: %s" % filesobtained)
       ##If no file could be obtained, need to make sure the job fails  
       if len(usednumbers) == nbfiles and not filesobtained:
-        fail = True
-        break
+        return S_ERROR("Failed to get files")
 
-      if len(filesobtained) < totnboffilestoget:
+      if len(filesobtained) < nbFilesToGet:
         ##Now wait for a random time around 3 minutes
         ###Actually, waste CPU time !!!
         self.log.verbose("Waste happily some CPU time (on average 3 minutes)")
@@ -411,24 +477,136 @@ class OverlayInput (ModuleBase):
         if not res['OK']:
           self.log.error("Could not waste as much CPU time as wanted, but whatever!")
 
-    ## Remove all scripts remaining
-    scripts = glob.glob("*.sh")
-    for script in scripts:
-      os.remove(script)
-      
-    ##Print the file list
-    mylist = os.listdir(os.getcwd())
-    self.log.info("List of Overlay files:")
-    self.log.info("\n".join(mylist))
-    os.chdir(self.curdir)
-    res = overlaymon.jobDone(self.site)
-    if not res['OK']:
-      self.log.error("Could not declare the job as finished getting the files")
-    if fail:
-      self.log.error("Did not manage to get all files needed, too many errors")
+    return S_OK(filesobtained)
+
+  def __getFilesParallel(self, nbFilesToGet, nParallel, maxFailAllowed):
+    """ Download the overlay files with up to `nParallel` concurrent transfers.
+
+    The files are drawn at random without replacement, a failed transfer is retried from the other replicas
+    of the file. Obtained files are recorded in a progress file, so that a restarted step only downloads the
+    files it does not have yet.
+    """
+    filesobtained = self.__readOverlayProgress()
+    if len(filesobtained) >= nbFilesToGet:
+      self.log.info('All %s overlay files were obtained by a previous attempt' % len(filesobtained))
+      return S_OK(filesobtained)
+
+    nbfiles = len(self.lfns)
+    nbCandidates = min(nbfiles, nbFilesToGet + maxFailAllowed + len(filesobtained) + 1)
+    alreadyObtained = set(filesobtained)
+    candidates = [self.lfns[index] for index in random.sample(xrange(nbfiles), nbCandidates)
+                  if self.lfns[index] not in alreadyObtained]
+
+    results = Queue.Queue()
+    pool = ThreadPool(nParallel)
+    inFlight = 0
+    fail_count = 0
+    try:
+      while len(filesobtained) < nbFilesToGet:
+        while candidates and inFlight < nParallel and len(filesobtained) + inFlight < nbFilesToGet:
+          pool.apply_async(self.__getOverlayFile, (candidates.pop(),), callback=results.put)
+          inFlight += 1
+        if not inFlight:
+          break
+        lfn, res = results.get()
+        inFlight -= 1
+        if not res['OK']:
+          self.log.warn('Could not obtain %s' % lfn, res['Message'])
+          fail_count += 1
+          if fail_count > maxFailAllowed:
+            break
+          continue
+        filesobtained.append(lfn)
+        with open(OVERLAY_PROGRESS_FILE, 'a') as progressFile:
+          progressFile.write("%s\n" % lfn)
+        self.log.verbose('Obtained %s of %s overlay files' % (len(filesobtained), nbFilesToGet))
+    finally:
+      pool.close()
+      pool.join()
+
+    if len(filesobtained) < nbFilesToGet:
       return S_ERROR("Failed to get files")
-    self.log.info('Got all files needed.')
-    return S_OK()
+    return S_OK(filesobtained)
+
+  def __getSiteGetter(self):
+    """ Return the method getting the overlay files with the site specific protocol, None for the other sites
+    """
+    return {'LCG.CERN.ch': self.getEOSFile,
+            'LCG.IN2P3-CC.fr': self.getLyonFile,
+            'LCG.UKI-LT2-IC-HEP.uk': self.getImperialFile,
+            'LCG.RAL-LCG2.uk': self.getRALFile,
+            'LCG.KEK.jp': self.getKEKFile,
+           }.get(self.site)
+
+  def __getScriptName(self):
+    """ Return the name of the script of the site specific getters, each download thread has its own
+    """
+    return getattr(self._threadData, 'scriptName', OVERLAY_SCRIPT)
+
+  def __getOverlayFile(self, lfn):
+    """ Get one overlay file into the current directory, with the site specific getter if there is one, then
+    trying all replicas until one transfer succeeds.
+
+    Called from the worker threads, so it never raises.
+
+    :returns: tuple of lfn and S_OK/S_ERROR
+    """
+    localFile = os.path.basename(lfn)
+    try:
+      siteGetter = self.__getSiteGetter()
+      if siteGetter:
+        self._threadData.scriptName = "%s_%s" % (threading.current_thread().name, OVERLAY_SCRIPT)
+        res = siteGetter(lfn)
+        if os.path.exists(self._threadData.scriptName):
+          os.remove(self._threadData.scriptName)
+        if res['OK'] and os.path.exists(localFile):
+          return lfn, S_OK(localFile)
+        self.log.warn('Site specific transfer of %s failed, trying the replicas' % lfn)
+        if os.path.exists(localFile):
+          os.remove(localFile)
+      res = self.datMan.getActiveReplicas(lfn)
+      if not res['OK'] or lfn not in res['Value']['Successful']:
+        ## let the DataManager pick the replica
+        res = returnSingleResult(self.datMan.getFile(lfn))
+        if res['OK'] and os.path.exists(localFile):
+          return lfn, S_OK(localFile)
+        if os.path.exists(localFile):
+          os.remove(localFile)
+        return lfn, S_ERROR("DataManager: %s" % res.get('Message', 'file not found after transfer'))
+      seNames = list(res['Value']['Successful'][lfn])
+      random.shuffle(seNames)
+      errors = []
+      for seName in seNames:
+        res = returnSingleResult(StorageElement(seName).getFile(lfn, localPath=os.getcwd()))
+        if res['OK'] and os.path.exists(localFile):
+          return lfn, S_OK(localFile)
+        errors.append("%s: %s" % (seName, res.get('Message', 'file not found after transfer')))
+        if os.path.exists(localFile):
+          os.remove(localFile)
+      return lfn, S_ERROR("; ".join(errors))
+    except Exception as exc: #pylint: disable=broad-except
+      return lfn, S_ERROR("Exception while getting %s: %r" % (lfn, exc))
+
+  def __readOverlayProgress(self):
+    """ Return the overlay files obtained by a previous attempt of this step.
+
+    Overlay files that are not listed in the progress file were not completely transferred and are removed.
+    """
+    filesobtained = []
+    if os.path.exists(OVERLAY_PROGRESS_FILE):
+      with open(OVERLAY_PROGRESS_FILE) as progressFile:
+        for lfn in progressFile.read().splitlines():
+          lfn = lfn.strip()
+          if lfn and lfn not in filesobtained and os.path.exists(os.path.basename(lfn)):
+            filesobtained.append(lfn)
+    completedFiles = set(os.path.basename(lfn) for lfn in filesobtained)
+    for localFile in os.listdir(os.getcwd()):
+      if localFile.endswith('.slcio') and localFile not in completedFiles:
+        self.log.info('Removing incomplete overlay file', localFile)
+        os.remove(localFile)
+    if filesobtained:
+      self.log.info('Found %s overlay files from a previous attempt' % len(filesobtained))
+    return filesobtained
 
   def getCASTORFile(self, lfn):
     """ USe xrdcp or rfcp to get the files from castor
@@ -443,9 +621,10 @@ class OverlayInput (ModuleBase):
 
     basename = os.path.basename(lfile)
 
-    if os.path.exists("overlayinput.sh"):
-      os.unlink("overlayinput.sh")
-    with open("overlayinput.sh","w") as script:
+    scriptName = self.__getScriptName()
+    if os.path.exists(scriptName):
+      os.unlink(scriptName)
+    with open(scriptName,"w") as script:
       script.write('#!/bin/sh \n')
       script.write('###############################\n')
       script.write('# Dynamically generated scrip #\n')
@@ -463,8 +642,8 @@ if [ ! -s %s ]; then
 fi\n""" % (basename, lfile))
       script.write('declare -x appstatus=$?\n')
       script.write('exit $appstatus\n')
-    os.chmod("overlayinput.sh", 0755)
-    comm = 'sh -c "./overlayinput.sh"'
+    os.chmod(scriptName, 0755)
+    comm = 'sh -c "./%s"' % scriptName
     self.result = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
 
     localfile = os.path.basename(lfile)
@@ -483,9 +662,10 @@ fi\n""" % (basename, lfile))
       lfile = lfn
     self.log.info("Getting %s" % lfile)
 
-    if os.path.exists("overlayinput.sh"):
-      os.unlink("overlayinput.sh")
-    with open("overlayinput.sh","w") as script:
+    scriptName = self.__getScriptName()
+    if os.path.exists(scriptName):
+      os.unlink(scriptName)
+    with open(scriptName,"w") as script:
       script.write('#!/bin/sh \n')
       script.write('################################\n')
       script.write('# Dynamically generated script #\n')
@@ -495,8 +675,8 @@ fi\n""" % (basename, lfile))
       script.write("xrdcp -s root://eospublic.cern.ch/%s ./ \n" % lfile.rstrip() )
       script.write('declare -x appstatus=$?\n')
       script.write('exit $appstatus\n')
-    os.chmod("overlayinput.sh", 0755)
-    comm = 'sh -c "./overlayinput.sh"'
+    os.chmod(scriptName, 0755)
+    comm = 'sh -c "./%s"' % scriptName
     self.result = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
 
     localfile = os.path.basename(lfile)
@@ -518,9 +698,10 @@ fi\n""" % (basename, lfile))
     #comm = []
     #comm.append("cp $X509_USER_PROXY /tmp/x509up_u%s"%os.getuid())
 
-    if os.path.exists("overlayinput.sh"):
-      os.unlink("overlayinput.sh")
-    with open("overlayinput.sh", "w") as script:
+    scriptName = self.__getScriptName()
+    if os.path.exists(scriptName):
+      os.unlink(scriptName)
+    with open(scriptName, "w") as script:
       script.write('#!/bin/sh \n')
       script.write('###############################\n')
       script.write('# Dynamically generated scrip #\n')
@@ -535,8 +716,8 @@ fi\n""" % (basename, lfile))
 #fi\n"""%(basename,lfile))
       script.write('declare -x appstatus=$?\n')
       script.write('exit $appstatus\n')
-    os.chmod("overlayinput.sh", 0755)
-    comm = 'sh -c "./overlayinput.sh"'
+    os.chmod(scriptName, 0755)
+    comm = 'sh -c "./%s"' % scriptName
     self.result = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
 
     localfile = os.path.basename(lfile)
@@ -557,9 +738,10 @@ fi\n""" % (basename, lfile))
     ###Don't check for CPU time as other wise, job can get killed
     self.__disableWatchDog()
 
-    if os.path.exists("overlayinput.sh"):
-      os.unlink("overlayinput.sh")
-    with open("overlayinput.sh","w") as script:
+    scriptName = self.__getScriptName()
+    if os.path.exists(scriptName):
+      os.unlink(scriptName)
+    with open(scriptName,"w") as script:
       script.write('#!/bin/sh \n')
       script.write('###############################\n')
       script.write('# Dynamically generated scrip #\n')
@@ -572,8 +754,8 @@ fi\n""" % (basename, lfile))
 #fi\n"""%(basename,lfile))
       script.write('declare -x appstatus=$?\n')
       script.write('exit $appstatus\n')
-    os.chmod("overlayinput.sh", 0755)
-    comm = 'sh -c "./overlayinput.sh"'
+    os.chmod(scriptName, 0755)
+    comm = 'sh -c "./%s"' % scriptName
     self.result = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
 
     localfile = os.path.basename(lfile)
@@ -618,9 +800,10 @@ fi\n""" % (basename, lfile))
 #      print res
     basename = os.path.basename(lfile)
 
-    if os.path.exists("overlayinput.sh"):
-      os.unlink("overlayinput.sh")
-    with open("overlayinput.sh","w") as script:
+    scriptName = self.__getScriptName()
+    if os.path.exists(scriptName):
+      os.unlink(scriptName)
+    with open(scriptName,"w") as script:
       script.write('#!/bin/sh \n')
       script.write('###############################\n')
       script.write('# Dynamically generated scrip #\n')
@@ -628,8 +811,8 @@ fi\n""" % (basename, lfile))
       script.write("/usr/bin/rfcp 'rfio://cgenstager.ads.rl.ac.uk:9002?svcClass=ilcTape&path=%s' %s\n" % (lfile, basename))
       script.write('declare -x appstatus=$?\n')
       script.write('exit $appstatus\n')
-    os.chmod("overlayinput.sh", 0755)
-    comm = 'sh -c "./overlayinput.sh"'
+    os.chmod(scriptName, 0755)
+    comm = 'sh -c "./%s"' % scriptName
     self.result = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
 
     localfile = os.path.basename(lfile)
@@ -646,9 +829,10 @@ fi\n""" % (basename, lfile))
     self.log.info("Getting %s" % lfile)
     self.__disableWatchDog()
 
-    if os.path.exists("overlayinput.sh"):
-      os.unlink("overlayinput.sh")
-    with open("overlayinput.sh", "w") as script:
+    scriptName = self.__getScriptName()
+    if os.path.exists(scriptName):
+      os.unlink(scriptName)
+    with open(scriptName, "w") as script:
       script.write('#!/bin/sh \n')
       script.write('###############################\n')
       script.write('# Dynamically generated scrip #\n')
@@ -657,8 +841,8 @@ fi\n""" % (basename, lfile))
       script.write('declare -x appstatus=$?\n')
       script.write('exit $appstatus\n')
 
-    os.chmod("overlayinput.sh", 0755)
-    comm = 'sh -c "./overlayinput.sh"'
+    os.chmod(scriptName, 0755)
+    comm = 'sh -c "./%s"' % scriptName
     self.result = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
 
     localfile = os.path.basename(lfile)
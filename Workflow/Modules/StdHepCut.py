@@ -13,6 +13,7 @@ from ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation import getSoftwareFold
 from DIRAC.Core.Utilities.Subprocess                      import shellCall
 from ILCDIRAC.Core.Utilities.PrepareOptionFiles           import getNewLDLibs
 from ILCDIRAC.Core.Utilities.FindSteeringFileDir          import getSteeringFileDirName
+from ILCDIRAC.Core.Utilities.LogParsers                   import StdHepCutLogParser
 from ILCDIRAC.Core.Utilities.resolvePathsAndNames         import getProdFilename
 
 import os, shutil
@@ -109,6 +110,7 @@ class StdHepCut(ModuleBase):
     comm = 'sh -c "./%s"' % (self.scriptName)    
     self.setApplicationStatus('%s %s step %s' % (self.applicationName, self.applicationVersion, self.STEP_NUMBER))
     self.stdError = ''
+    parser = self.addLogParser(StdHepCutLogParser())
     self.result = shellCall(0, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
     #self.result = {'OK':True,'Value':(0,'Disabled Execution','')}
     resultTuple = self.result['Value']
@@ -123,18 +125,13 @@ class StdHepCut(ModuleBase):
     # stdError = resultTuple[2]
     self.log.info( "Status after the application execution is %s" % str( status ) )
 
-    nbevtswritten = -1
-    nbevtspassing = 0
-    nbevtsread = 0
-    with open(self.applicationLog, 'r') as logf:
-      for line in logf:
-        line = line.rstrip()
-        if line.count('Events kept'):
-          nbevtswritten = int(line.split()[-1])
-        if line.count('Events passing cuts'):
-          nbevtspassing = int(line.split()[-1])
-        if line.count('Events total'):
-          nbevtsread = int(line.split()[-1])
+    if not parser.linesParsed:
+      ## the output did not go through redirectLogOutput
+      with open(self.applicationLog, 'r') as logf:
+        parser.parseLines(logf)
+    nbevtswritten = parser.eventsWritten
+    nbevtspassing = parser.eventsPassing
+    nbevtsread = parser.eventsRead
     if nbevtswritten > 0 and nbevtspassing > 0 and nbevtsread > 0:
       cut_eff = 1. * nbevtspassing / nbevtsread
       self.log.info('Selection cut efficiency : %s%%' % (100 * cut_eff))
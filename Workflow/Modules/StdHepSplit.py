@@ -11,7 +11,9 @@ from DIRAC                                                import S_OK, S_ERROR,
 from DIRAC.Core.Utilities.Subprocess                      import shellCall
 
 from ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation import getSoftwareFolder
+from ILCDIRAC.Core.Utilities.LogParsers                   import StdHepSplitLogParser
 from ILCDIRAC.Core.Utilities.PrepareOptionFiles           import getNewLDLibs
+from ILCDIRAC.Core.Utilities.StdHepReader                 import splitFile
 from ILCDIRAC.Core.Utilities.resolvePathsAndNames         import getProdFilename, resolveIFpaths
 from ILCDIRAC.Workflow.Modules.ModuleBase                 import ModuleBase
 
@@ -37,6 +39,7 @@ class StdHepSplit(ModuleBase):
     self.OutputFile = []
     self.log.info("%s initialized" % ( self.__str__() ))
     self.maxRead = 0
+    self.nativeSplit = False
 
   def applicationSpecificInputs(self):
     """ Resolve LCIO concatenate specific parameters, called from ModuleBase
@@ -105,6 +108,57 @@ class StdHepSplit(ModuleBase):
     
     self.log.info("Will rename all files using '%s' as base." % prefix)
 
+    if self.nativeSplit:
+      res = self.splitNatively(runonstdhep, prefix)
+    else:
+      res = self.runHepSplit(runonstdhep, prefix)
+    if not res['OK']:
+      return res
+    status, numberofeventsdict = res['Value']
+
+    self.log.verbose("numberofeventsdict dict: %s" % numberofeventsdict)   
+
+    ##Now update the workflow_commons dict with the relation between filename and number of events: 
+    #needed for the registerOutputData
+    self.workflow_commons['file_number_of_event_relation'] = numberofeventsdict
+    if self.listoutput:
+      outputlist = []
+      for of in numberofeventsdict:
+        item = {}
+        item['outputFile'] = of
+        item['outputPath'] = self.listoutput['outputPath']
+        item['outputDataSE'] = self.listoutput['outputDataSE']
+        outputlist.append(item)
+      self.step_commons['listoutput'] = outputlist
+      
+    #Not only the step_commons must be updated  
+    if 'ProductionOutputData' in self.workflow_commons:
+      proddata = self.workflow_commons['ProductionOutputData'].split(";")
+      finalproddata = []
+      this_split_data = ''
+      for item in proddata:
+        if not item.count(prefix):
+          finalproddata.append(item)
+        else:
+          this_split_data = item
+      path = os.path.dirname(this_split_data)
+      for of in numberofeventsdict:
+        finalproddata.append(os.path.join(path, of))
+      self.workflow_commons['ProductionOutputData'] = ";".join(finalproddata)  
+    
+    self.log.info( "Status after the application execution is %s" % str( status ) )
+    if status == 2:
+      self.log.info("Reached end of input file")
+      status = 0
+      
+    self.listDir()  
+    return self.finalStatusReport(status)
+
+  def runHepSplit(self, runonstdhep, prefix):
+    """ Split the file with the hepsplit application
+
+    :returns: S_OK with the status of hepsplit and the dictionary of the output files and their number of events
+    """
     # Setting up script
     res = getSoftwareFolder(self.platform, "stdhepsplit", self.applicationVersion)
     if not res['OK']:
@@ -169,6 +223,7 @@ exit $?
 
     self.setApplicationStatus( 'StdHepSplit %s step %s' % ( self.applicationVersion, self.STEP_NUMBER ) )
     self.stdError = ''
+    parser = self.addLogParser( StdHepSplitLogParser() )
 
     self.result = shellCall( 0,
                              command,
@@ -183,54 +238,22 @@ exit $?
       self.log.error("Cannot access log file, cannot proceed")
       return S_ERROR("Failed reading the log file")
 
-    with open(self.applicationLog, "r") as logf:
-      numberofeventsdict = {}
-      fname = ''
-      for line in logf:
-        line = line.rstrip()
-        if line.count('Open output file'):
-          fname = line.split()[-1].rstrip().rstrip("\0")
-          numberofeventsdict[fname] = 0
-        elif line.count("Record") and not line.count('Output Begin Run') :
-          #print line
-          val = line.split("=")[1].rstrip().lstrip()
-          if val != '0':
-            numberofeventsdict[fname] = int(val)
+    if not parser.linesParsed:
+      ## the output did not go through redirectLogOutput
+      with open(self.applicationLog, "r") as logf:
+        parser.parseLines(logf)
+    return S_OK((status, parser.numberOfEvents))
 
-    self.log.verbose("numberofeventsdict dict: %s" % numberofeventsdict)   
+  def splitNatively(self, runonstdhep, prefix):
+    """ Split the file in the job, without the hepsplit application, see
+    :func:`~ILCDIRAC.Core.Utilities.StdHepReader.splitFile`
 
-    ##Now update the workflow_commons dict with the relation between filename and number of events: 
-    #needed for the registerOutputData
-    self.workflow_commons['file_number_of_event_relation'] = numberofeventsdict
-    if self.listoutput:
-      outputlist = []
-      for of in numberofeventsdict:
-        item = {}
-        item['outputFile'] = of
-        item['outputPath'] = self.listoutput['outputPath']
-        item['outputDataSE'] = self.listoutput['outputDataSE']
-        outputlist.append(item)
-      self.step_commons['listoutput'] = outputlist
-      
-    #Not only the step_commons must be updated  
-    if 'ProductionOutputData' in self.workflow_commons:
-      proddata = self.workflow_commons['ProductionOutputData'].split(";")
-      finalproddata = []
-      this_split_data = ''
-      for item in proddata:
-        if not item.count(prefix):
-          finalproddata.append(item)
-        else:
-          this_split_data = item
-      path = os.path.dirname(this_split_data)
-      for of in numberofeventsdict:
-        finalproddata.append(os.path.join(path, of))
-      self.workflow_commons['ProductionOutputData'] = ";".join(finalproddata)  
-    
-    self.log.info( "Status after the application execution is %s" % str( status ) )
-    if status == 2:
-      self.log.info("Reached end of input file")
-      status = 0
-      
-    self.listDir()  
-    return self.finalStatusReport(status)
+    :returns: S_OK with the status 0 and the dictionary of the output files and their number of events
+    """
+    self.setApplicationStatus( 'StdHepSplit native step %s' % self.STEP_NUMBER )
+    res = splitFile( runonstdhep, prefix, self.nbEventsPerSlice, maxEvents = self.maxRead )
+    if not res['OK']:
+      self.log.error( "Failed to split the file:", res['Message'] )
+      self.setApplicationStatus( 'StdHepSplit: failed to split the file' )
+      return res
+    return S_OK( ( 0, dict( res['Value'] ) ) )
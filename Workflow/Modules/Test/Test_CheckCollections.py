@@ -0,0 +1,90 @@
+"""
+Unit tests for the CheckCollections module
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch, MagicMock as Mock
+
+from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved, assertDiracFailsWith, \
+  assertDiracSucceeds
+from ILCDIRAC.Workflow.Modules.CheckCollections import CheckCollections
+from DIRAC import S_OK, S_ERROR
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.Workflow.Modules.CheckCollections'
+
+#pylint: disable=protected-access
+class CheckCollectionsTestCase( unittest.TestCase ):
+  """ Contains tests for the CheckCollections class"""
+
+  def setUp( self ):
+    """set up the objects"""
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    self.chc = CheckCollections()
+    self.chc.platform = 'TestPlatV1'
+    self.chc.InputFile = [ 'file1.slcio', 'file2.slcio' ]
+    self.chc.collections = [ 'PandoraPFOs', 'MCParticle' ]
+    self.chc.applicationLog = os.path.join( self.tmpdir, 'checkcollections.log' )
+
+  def tearDown( self ):
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
+
+  def logLines( self ):
+    """ return the lines of the log of the module """
+    with open( self.chc.applicationLog ) as logFile:
+      return logFile.read().splitlines()
+
+  def test_applicationspecificinputs( self ):
+    self.chc.applicationLog = ''
+    self.chc.InputFile = [ '/some/dir/file1.slcio', 'file2.slcio' ]
+    assertDiracSucceeds( self.chc.applicationSpecificInputs(), self )
+    assertEqualsImproved( self.chc.InputFile, [ 'file1.slcio', 'file2.slcio' ], self )
+    assertEqualsImproved( self.chc.applicationLog, 'CheckCollections__Run_.log', self )
+    assertEqualsImproved( self.chc.maxProcesses, 2, self )
+    self.chc.collections = []
+    assertDiracFailsWith( self.chc.applicationSpecificInputs(), 'no list of collections', self )
+
+  def test_applicationspecificinputs_processors( self ):
+    self.chc.workflow_commons = dict( NumberOfProcessors = '4' )
+    assertDiracSucceeds( self.chc.applicationSpecificInputs(), self )
+    assertEqualsImproved( self.chc.maxProcesses, 4, self )
+    self.chc.maxProcesses = 2
+    self.chc.workflow_commons = dict( NumberOfProcessors = 1 )
+    assertDiracSucceeds( self.chc.applicationSpecificInputs(), self )
+    assertEqualsImproved( self.chc.maxProcesses, 2, self )
+
+  def test_execute_no_platform( self ):
+    self.chc.platform = None
+    with patch('%s.CheckCollections.resolveInputVariables' % MODULE_NAME, new=Mock(return_value=S_OK())):
+      assertDiracFailsWith( self.chc.execute(), 'no ilc platform selected', self )
+
+  def test_execute( self ):
+    content = { 'file1.slcio' : dict( Events = 3, Collections = dict( PandoraPFOs = 3, MCParticle = 3 ) ),
+                'file2.slcio' : dict( Events = 2, Collections = dict( MCParticle = 2, Other = 1 ) ) }
+    with patch('%s.CheckCollections.resolveInputVariables' % MODULE_NAME, new=Mock(return_value=S_OK())), \
+         patch('%s.scanFiles' % MODULE_NAME, new=Mock(return_value=S_OK(content))) as scan_mock:
+      assertDiracFailsWith( self.chc.execute(), 'checkcollections exited with status 1', self )
+      scan_mock.assert_called_once_with( [ 'file1.slcio', 'file2.slcio' ], 2 )
+    self.assertIn( 'Inconsistency in file2.slcio: 2 events vs 0 collections (PandoraPFOs)', self.logLines() )
+    assertEqualsImproved( len( [ line for line in self.logLines() if 'Inconsistency' in line ] ), 1, self )
+
+  def test_execute_consistent( self ):
+    content = { 'file1.slcio' : dict( Events = 3, Collections = dict( PandoraPFOs = 3, MCParticle = 3 ) ) }
+    with patch('%s.CheckCollections.resolveInputVariables' % MODULE_NAME, new=Mock(return_value=S_OK())), \
+         patch('%s.scanFiles' % MODULE_NAME, new=Mock(return_value=S_OK(content))):
+      assertDiracSucceeds( self.chc.execute(), self )
+    assertEqualsImproved( self.logLines(), [ 'file1.slcio: 3 events' ], self )
+
+  def test_execute_scan_fails( self ):
+    with patch('%s.CheckCollections.resolveInputVariables' % MODULE_NAME, new=Mock(return_value=S_OK())), \
+         patch('%s.scanFiles' % MODULE_NAME, new=Mock(return_value=S_ERROR('Failed to read file1.slcio'))):
+      assertDiracFailsWith( self.chc.execute(), 'checkcollections exited with status 1', self )
+    self.assertIn( 'Failed to read file1.slcio', self.chc.stdError )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( CheckCollectionsTestCase )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
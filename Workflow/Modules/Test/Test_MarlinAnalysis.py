@@ -6,10 +6,10 @@ import unittest
 import os
 from mock import mock_open, patch, MagicMock as Mock
 from ILCDIRAC.Workflow.Modules.MarlinAnalysis import MarlinAnalysis
+from ILCDIRAC.Core.Utilities.EnvironmentCache import EnvironmentSnapshot
 from ILCDIRAC.Tests.Utilities.GeneralUtils import assertInImproved, \
   assertEqualsImproved, assertDiracFailsWith, assertDiracSucceeds, \
   assertDiracSucceedsWith, assertDiracSucceedsWith_equals, assertMockCalls
-from ILCDIRAC.Tests.Utilities.FileUtils import FileUtil
 from DIRAC import S_OK, S_ERROR
 
 __RCSID__ = "$Id$"
@@ -391,6 +391,16 @@ class MarlinAnalysisPatchTestCase( MarlinAnalysisFixture, unittest.TestCase ):
       mock_copy.assert_called_with('testdir/PandoraSettings.xml',
                                    '%s/PandoraSettings.xml' % os.getcwd())
 
+  def test_getsteeringtemplatecache( self ):
+    options = { '/Marlin/SteeringTemplates/Locations' : [ '/cvmfs/templates' ] }
+    self.marAna.ops = Mock()
+    self.marAna.ops.getValue.side_effect = lambda option, default: options.get( option, default )
+    with patch("%s.getLocalAreaLocation" % MODULE_NAME, new=Mock(return_value='/local/area')):
+      assertEqualsImproved( self.marAna._getSteeringTemplateCache().cacheDirs,
+                            [ '/cvmfs/templates', '/local/area/SteeringTemplates' ], self )
+    options[ '/Marlin/SteeringTemplates/Enabled' ] = False
+    self.assertIsNone( self.marAna._getSteeringTemplateCache() )
+
   @patch("%s.getSoftwareFolder" % MODULE_NAME, new=Mock(return_value=S_ERROR('')))
   def test_getenvscript_getsoftwarefolderfails( self ):
     self.assertFalse(self.marAna.getEnvScript(None, None, None)['OK'])
@@ -438,167 +448,66 @@ class MarlinAnalysisPrepareDLLCase( MarlinAnalysisFixture, unittest.TestCase ):
   ''' Tests for the prepareMARLIN_DLL method
   '''
 
-  def test_preparemarlindll( self ):
-    exists_dict = { './lib/marlin_dll' : True }
-    def replace_exists( path ):
-      return exists_dict[path]
-    file_contents = [[]]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.open' % MODULE_NAME, mock_open()) as open_mock, \
-         patch('%s.os.chmod' % MODULE_NAME) as chmod_mock, \
-         patch('%s.shellCall' % MODULE_NAME, new=Mock(return_value=S_OK([ 0, 'MARlin_DLL/path: ', 'other_return_value_from_shell' ]))) as shell_mock, \
-         patch('%s.os.remove' % MODULE_NAME, new=Mock(side_effect=[ True ])) as remove_mock, \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=replace_exists)) as exists_mock, \
-         patch('%s.glob.glob' % MODULE_NAME, new=Mock(return_value=[ 'mytestlibrary.so', 'secondLibrary.veryUseful.so' ])) as glob_mock:
-      open_mock.side_effect = (h for h in handles)
+  def prepareDLL( self, marlindll, userlibs, libDirExists = True ):
+    """ run prepareMARLIN_DLL with the MARLIN_DLL set by the environment script and the user libraries """
+    snapshot = EnvironmentSnapshot( dict( MARLIN_DLL = marlindll ) )
+    with patch('%s.MarlinAnalysis.getEnvironmentSnapshot' % MODULE_NAME, new=Mock(return_value=S_OK(snapshot))) as snapshot_mock, \
+         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=libDirExists)) as exists_mock, \
+         patch('%s.glob.glob' % MODULE_NAME, new=Mock(return_value=userlibs)) as glob_mock:
       result = self.marAna.prepareMARLIN_DLL( 'some_path' )
-      open_mock.assert_called_once_with( 'temp.sh', 'w' )
-      assertMockCalls( handles[0].__enter__().write,
-                       ['#!/bin/bash\n', 'source some_path > /dev/null\necho $MARLIN_DLL'], self)
-      assertEqualsImproved( len( handles ), 1, self )
-      chmod_mock.assert_called_once_with( 'temp.sh', 0755 )
-      shell_mock.assert_called_once_with( 0, './temp.sh' )
-      remove_mock.assert_called_once_with( 'temp.sh' )
+      snapshot_mock.assert_called_once_with( 'some_path' )
       exists_mock.assert_called_once_with( './lib/marlin_dll' )
-      glob_mock.assert_called_once_with( './lib/marlin_dll/*.so' )
-      assertDiracSucceedsWith( result, 'MARlin_DLL/path:mytestlibrary.so:secondLibrary.veryUseful.so',
-                               self )
-
-  def test_preparemarlindll_shellcall_fails( self ):
-    file_contents = [[]]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.open' % MODULE_NAME, mock_open()) as open_mock, \
-         patch('%s.os.chmod' % MODULE_NAME) as chmod_mock, \
-         patch('%s.shellCall' % MODULE_NAME, new=Mock(return_value=S_ERROR('some_test_err'))) as shell_mock:
-      open_mock.side_effect = (h for h in handles)
-      result = self.marAna.prepareMARLIN_DLL( 'some_path' )
-      open_mock.assert_called_once_with( 'temp.sh', 'w' )
-      assertMockCalls( handles[0].__enter__().write,
-                       ['#!/bin/bash\n', 'source some_path > /dev/null\necho $MARLIN_DLL'], self)
-      assertEqualsImproved( len( handles ), 1, self )
-      chmod_mock.assert_called_once_with( 'temp.sh', 0755 )
-      shell_mock.assert_called_once_with( 0, './temp.sh' )
-      assertDiracFailsWith( result, 'failed getting the marlin_dll', self )
+      if libDirExists:
+        glob_mock.assert_called_once_with( './lib/marlin_dll/*.so' )
+      else:
+        self.assertFalse( glob_mock.called )
+    return result
+
+  def test_preparemarlindll( self ):
+    result = self.prepareDLL( 'MARlin_DLL/path: ', [ 'mytestlibrary.so', 'secondLibrary.veryUseful.so' ] )
+    assertDiracSucceedsWith_equals( result, 'MARlin_DLL/path:mytestlibrary.so:secondLibrary.veryUseful.so', self )
+
+  def test_preparemarlindll_snapshot_fails( self ):
+    with patch('%s.MarlinAnalysis.getEnvironmentSnapshot' % MODULE_NAME, new=Mock(return_value=S_ERROR('some_test_err'))):
+      assertDiracFailsWith( self.marAna.prepareMARLIN_DLL( 'some_path' ), 'failed getting the marlin_dll', self )
 
   def test_preparemarlindll_empty_marlindll( self ):
-    file_contents = [[]]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.open' % MODULE_NAME, mock_open()) as open_mock, \
-         patch('%s.os.chmod' % MODULE_NAME) as chmod_mock, \
-         patch('%s.shellCall' % MODULE_NAME, new=Mock(return_value=S_OK( [0, '', 'other_value'] ))) as shell_mock, \
-         patch('%s.os.remove' % MODULE_NAME, new=Mock(side_effect=EnvironmentError('something?'))) :
-      open_mock.side_effect = (h for h in handles)
-      result = self.marAna.prepareMARLIN_DLL( 'some_path' )
-      open_mock.assert_called_once_with( 'temp.sh', 'w' )
-      assertMockCalls( handles[0].__enter__().write,
-                       ['#!/bin/bash\n', 'source some_path > /dev/null\necho $MARLIN_DLL'], self)
-      assertEqualsImproved( len( handles ), 1, self )
-      chmod_mock.assert_called_once_with( 'temp.sh', 0755 )
-      shell_mock.assert_called_once_with( 0, './temp.sh' )
-      assertDiracFailsWith( result, 'empty marlin_dll env var', self )
+    snapshot = EnvironmentSnapshot( unsetVariables = [ 'MARLIN_DLL' ] )
+    with patch('%s.MarlinAnalysis.getEnvironmentSnapshot' % MODULE_NAME, new=Mock(return_value=S_OK(snapshot))), \
+         patch.dict( os.environ, { 'MARLIN_DLL' : 'previous/lib.so' } ):
+      assertDiracFailsWith( self.marAna.prepareMARLIN_DLL( 'some_path' ), 'empty marlin_dll env var', self )
+
+  def test_preparemarlindll_extended( self ):
+    snapshot = EnvironmentSnapshot( extendedVariables = dict( MARLIN_DLL = [ 'default/lib1.so:', ':default/lib2.so' ] ) )
+    with patch('%s.MarlinAnalysis.getEnvironmentSnapshot' % MODULE_NAME, new=Mock(return_value=S_OK(snapshot))), \
+         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=False)), \
+         patch.dict( os.environ, { 'MARLIN_DLL' : 'previous/lib.so' } ):
+      assertDiracSucceedsWith_equals( self.marAna.prepareMARLIN_DLL( 'some_path' ),
+                                      'default/lib1.so:previous/lib.so:default/lib2.so', self )
+
+  def test_preparemarlindll_userlib_replaces_default( self ):
+    result = self.prepareDLL( 'default/libA.so:default/libB.so::default/libA.so', [ './lib/marlin_dll/libA.so' ] )
+    assertDiracSucceedsWith_equals( result, 'default/libB.so:./lib/marlin_dll/libA.so', self )
 
   def test_preparemarlindll_procstoinclude( self ):
     self.marAna.ProcessorListToUse = [ 'secondLibrary.veryUseful.so' ]
-    exists_dict = { './lib/marlin_dll' : True }
-    def replace_exists( path ):
-      return exists_dict[path]
-    file_contents = [[]]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.open' % MODULE_NAME, mock_open()) as open_mock, \
-         patch('%s.os.chmod' % MODULE_NAME) as chmod_mock, \
-         patch('%s.shellCall' % MODULE_NAME, new=Mock(return_value=S_OK([ 0, 'MARlin_DLL/path', 'other_return_value_from_shell' ]))) as shell_mock, \
-         patch('%s.os.remove' % MODULE_NAME, new=Mock(side_effect=[ True ])) as remove_mock, \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=replace_exists)) as exists_mock, \
-         patch('%s.glob.glob' % MODULE_NAME, new=Mock(return_value=[ 'mytestlibrary.so', 'secondLibrary.veryUseful.so', 'MARlin_DLL/path' ])) as glob_mock:
-      open_mock.side_effect = (h for h in handles)
-      result = self.marAna.prepareMARLIN_DLL( 'some_path' )
-      open_mock.assert_called_once_with( 'temp.sh', 'w' )
-      assertMockCalls( handles[0].__enter__().write,
-                       ['#!/bin/bash\n', 'source some_path > /dev/null\necho $MARLIN_DLL'], self)
-      assertEqualsImproved( len( handles ), 1, self )
-      chmod_mock.assert_called_once_with( 'temp.sh', 0755 )
-      shell_mock.assert_called_once_with( 0, './temp.sh' )
-      remove_mock.assert_called_once_with( 'temp.sh' )
-      exists_mock.assert_called_once_with( './lib/marlin_dll' )
-      glob_mock.assert_called_once_with( './lib/marlin_dll/*.so' )
-      assertDiracSucceedsWith( result, 'secondLibrary.veryUseful.so', self )
+    result = self.prepareDLL( 'MARlin_DLL/path', [ 'mytestlibrary.so', 'secondLibrary.veryUseful.so', 'MARlin_DLL/path' ] )
+    assertDiracSucceedsWith_equals( result, 'secondLibrary.veryUseful.so', self )
 
   def test_preparemarlindll_procstoexclude( self ):
     self.marAna.ProcessorListToExclude = [ 'secondLibrary.veryUseful.so' ]
-    exists_dict = { './lib/marlin_dll' : True }
-    def replace_exists( path ):
-      return exists_dict[path]
-    file_contents = [[]]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.open' % MODULE_NAME, mock_open()) as open_mock, \
-         patch('%s.os.chmod' % MODULE_NAME) as chmod_mock, \
-         patch('%s.shellCall' % MODULE_NAME, new=Mock(return_value=S_OK([ 0, 'MARlin_DLL/path', 'other_return_value_from_shell' ]))) as shell_mock, \
-         patch('%s.os.remove' % MODULE_NAME, new=Mock(side_effect=[ True ])) as remove_mock, \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=replace_exists)) as exists_mock, \
-         patch('%s.glob.glob' % MODULE_NAME, new=Mock(return_value=[ 'mytestlibrary.so', 'secondLibrary.veryUseful.so' ])) as glob_mock:
-      open_mock.side_effect = (h for h in handles)
-      result = self.marAna.prepareMARLIN_DLL( 'some_path' )
-      open_mock.assert_called_once_with( 'temp.sh', 'w' )
-      assertMockCalls( handles[0].__enter__().write,
-                       ['#!/bin/bash\n', 'source some_path > /dev/null\necho $MARLIN_DLL'], self)
-      assertEqualsImproved( len( handles ), 1, self )
-      chmod_mock.assert_called_once_with( 'temp.sh', 0755 )
-      shell_mock.assert_called_once_with( 0, './temp.sh' )
-      remove_mock.assert_called_once_with( 'temp.sh' )
-      exists_mock.assert_called_once_with( './lib/marlin_dll' )
-      glob_mock.assert_called_once_with( './lib/marlin_dll/*.so' )
-      assertDiracSucceedsWith( result, 'MARlin_DLL/path:mytestlibrary.so', self )
+    result = self.prepareDLL( 'MARlin_DLL/path', [ 'mytestlibrary.so', 'secondLibrary.veryUseful.so' ] )
+    assertDiracSucceedsWith_equals( result, 'MARlin_DLL/path:mytestlibrary.so', self )
 
   def test_preparemarlindll_nolibs( self ):
-    exists_dict = { './lib/marlin_dll' : False }
-    def replace_exists( path ):
-      return exists_dict[path]
-    file_contents = [[]]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.open' % MODULE_NAME, mock_open()) as open_mock, \
-         patch('%s.os.chmod' % MODULE_NAME) as chmod_mock, \
-         patch('%s.shellCall' % MODULE_NAME, new=Mock(return_value=S_OK([ 0, 'MARlin_DLL/path: ', 'other_return_value_from_shell' ]))) as shell_mock, \
-         patch('%s.os.remove' % MODULE_NAME, new=Mock(side_effect=[ True ])) as remove_mock, \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=replace_exists)) as exists_mock, \
-         patch('%s.glob.glob' % MODULE_NAME, new=Mock(return_value=[ 'mytestlibrary.so', 'secondLibrary.veryUseful.so' ])) as glob_mock:
-      open_mock.side_effect = (h for h in handles)
-      result = self.marAna.prepareMARLIN_DLL( 'some_path' )
-      open_mock.assert_called_once_with( 'temp.sh', 'w' )
-      assertMockCalls( handles[0].__enter__().write,
-                       ['#!/bin/bash\n', 'source some_path > /dev/null\necho $MARLIN_DLL'], self)
-      assertEqualsImproved( len( handles ), 1, self )
-      chmod_mock.assert_called_once_with( 'temp.sh', 0755 )
-      shell_mock.assert_called_once_with( 0, './temp.sh' )
-      remove_mock.assert_called_once_with( 'temp.sh' )
-      exists_mock.assert_called_once_with( './lib/marlin_dll' )
-      self.assertFalse( glob_mock.called )
-      assertDiracSucceedsWith( result, 'MARlin_DLL/path', self )
+    result = self.prepareDLL( 'MARlin_DLL/path: ', [ 'mytestlibrary.so', 'secondLibrary.veryUseful.so' ],
+                              libDirExists = False )
+    assertDiracSucceedsWith_equals( result, 'MARlin_DLL/path', self )
 
   def test_preparemarlindll_swaplibpositions( self ):
     self.marAna.ProcessorListToExclude = [ 'mytestlibrary.so' ]
-    exists_dict = { './lib/marlin_dll' : True }
-    def replace_exists( path ):
-      return exists_dict[path]
-    file_contents = [[]]
-    handles = FileUtil.getMultipleReadHandles( file_contents )
-    with patch('%s.open' % MODULE_NAME, mock_open()) as open_mock, \
-         patch('%s.os.chmod' % MODULE_NAME) as chmod_mock, \
-         patch('%s.shellCall' % MODULE_NAME, new=Mock(return_value=S_OK([ 0, 'MARlin_DLL/path', 'other_return_value_from_shell' ]))) as shell_mock, \
-         patch('%s.os.remove' % MODULE_NAME, new=Mock(side_effect=[ True ])) as remove_mock, \
-         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(side_effect=replace_exists)) as exists_mock, \
-         patch('%s.glob.glob' % MODULE_NAME, new=Mock(return_value=[ 'testlibLCFIPlus.so', 'testlibLCFIVertex.1.so'  ])) as glob_mock:
-      open_mock.side_effect = (h for h in handles)
-      result = self.marAna.prepareMARLIN_DLL( 'some_path' )
-      open_mock.assert_called_once_with( 'temp.sh', 'w' )
-      assertMockCalls( handles[0].__enter__().write,
-                       ['#!/bin/bash\n', 'source some_path > /dev/null\necho $MARLIN_DLL'], self)
-      assertEqualsImproved( len( handles ), 1, self )
-      chmod_mock.assert_called_once_with( 'temp.sh', 0755 )
-      shell_mock.assert_called_once_with( 0, './temp.sh' )
-      remove_mock.assert_called_once_with( 'temp.sh' )
-      exists_mock.assert_called_once_with( './lib/marlin_dll' )
-      glob_mock.assert_called_once_with( './lib/marlin_dll/*.so' )
-      assertDiracSucceedsWith( result, 'MARlin_DLL/path:testlibLCFIVertex.1.so:testlibLCFIPlus.so', self )
+    result = self.prepareDLL( 'MARlin_DLL/path', [ 'testlibLCFIPlus.so', 'testlibLCFIVertex.1.so' ] )
+    assertDiracSucceedsWith_equals( result, 'MARlin_DLL/path:testlibLCFIVertex.1.so:testlibLCFIPlus.so', self )
 
 class MarlinAnalysisRunTestCase( MarlinAnalysisFixture, unittest.TestCase ):
   ''' Tests for the runMarlin method
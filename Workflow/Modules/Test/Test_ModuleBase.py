@@ -8,13 +8,16 @@ from mock import patch, call, mock_open, MagicMock as Mock
 
 from DIRAC import S_OK, S_ERROR
 from ILCDIRAC.Workflow.Modules.ModuleBase import ModuleBase, generateRandomString
+from ILCDIRAC.Core.Utilities.LogParsers import StdHepSplitLogParser
+from ILCDIRAC.Core.Utilities.LogSink import BUFFER_SIZE
 from ILCDIRAC.Tests.Utilities.GeneralUtils import assertEqualsImproved, \
   assertDiracFailsWith, assertDiracSucceeds, assertDiracSucceedsWith, \
-  assertDiracSucceedsWith_equals, assertMockCalls
+  assertDiracSucceedsWith_equals, assertMockCalls, assertListContentEquals
 
 __RCSID__ = "$Id$"
 
 MODULE_NAME = 'ILCDIRAC.Workflow.Modules.ModuleBase'
+SINK_MODULE = 'ILCDIRAC.Core.Utilities.LogSink'
 
 class ModuleBaseTestCase( unittest.TestCase ): #pylint: disable=too-many-public-methods
   """ Test the ModuleBase module
@@ -376,9 +379,9 @@ class ModuleBaseTestCase( unittest.TestCase ): #pylint: disable=too-many-public-
     guid_dict = { 'testfile_allworks.stdhep' : 'test_myGuid_1', 'myothertest_file' : 'test_myGuid_2' }
     size_dict = { 'testfile_allworks.stdhep' : 24852, 'myothertest_file' : 948524 }
     adler_dict = { 'testfile_allworks.stdhep' : '9803531', 'myothertest_file' : 'checksum1230#' }
-    with patch('%s.makeGuid' % MODULE_NAME, new=Mock(side_effect=lambda path: guid_dict[path])) as guid_mock, \
-         patch('%s.os.path.getsize' % MODULE_NAME, new=Mock(side_effect=lambda path: size_dict[path])), \
-         patch('%s.fileAdler' % MODULE_NAME, new=Mock(side_effect=lambda path: adler_dict[path])), \
+    digest_dict = dict( ( fname, { 'GUID' : guid_dict[fname], 'Size' : size_dict[fname],
+                                   'Adler32' : adler_dict[fname] } ) for fname in guid_dict )
+    with patch('%s.getFileDigests' % MODULE_NAME, new=Mock(return_value=S_OK(digest_dict))) as digest_mock, \
          patch('%s.os.getcwd' % MODULE_NAME, new=Mock(return_value='/cur/working/test/')):
       candidateFiles = { 'testfile_allworks.stdhep' : {
         'lfn': 'testfile_allworks.stdhep', 'path' : '/test/clic/ilc/mytestfile.txt',
@@ -406,7 +409,15 @@ class ModuleBaseTestCase( unittest.TestCase ): #pylint: disable=too-many-public-
             'path': '/dir/clid/user/myothertestfile.txt',
             'GUID': 'test_myGuid_2'} }
       assertDiracSucceedsWith_equals( result, expected_dict, self )
-      assertMockCalls( guid_mock, [ 'testfile_allworks.stdhep', 'myothertest_file' ], self )
+      assertListContentEquals( digest_mock.call_args[0][0], [ 'testfile_allworks.stdhep', 'myothertest_file' ],
+                               self )
+
+  def test_getfilemetadata_digest_fails( self ):
+    with patch('%s.getFileDigests' % MODULE_NAME, new=Mock(return_value=S_ERROR('digest_test_err'))):
+      candidateFiles = { 'testfile_allworks.stdhep' : {
+        'lfn': 'testfile_allworks.stdhep', 'path' : '/test/clic/ilc/mytestfile.txt',
+        'workflowSE': 'testSE_dip4_allgood' } }
+      assertDiracFailsWith( self.moba.getFileMetadata( candidateFiles ), 'digest_test_err', self )
 
   def test_resolveinputvars( self ):
     mb = self.moba
@@ -716,6 +727,25 @@ class ModuleBaseTestCase( unittest.TestCase ): #pylint: disable=too-many-public-
   def test_redirectlogoutput_emptymsg( self ):
     self.assertIsNone( self.moba.redirectLogOutput( 'fd', '' ) )
 
+  def test_redirectlogoutput_parser_progress( self ):
+    self.moba.eventstring = [ '' ]
+    self.moba.applicationName = 'stdhepsplit'
+    self.moba.jobID = 1234
+    report_mock = Mock()
+    report_mock.setJobParameter.return_value = S_OK()
+    self.moba.workflow_commons[ 'JobReport' ] = report_mock
+    clock = [ 1000 ]
+    with patch('%s.time.time' % MODULE_NAME, new=lambda: clock[ 0 ]), \
+         patch('%s.open' % SINK_MODULE, mock_open(), create=True):
+      parser = self.moba.addLogParser( StdHepSplitLogParser() )
+      clock[ 0 ] = 1100
+      self.moba.redirectLogOutput( 0, 'Open output file out_1.stdhep' )
+      self.assertFalse( report_mock.setJobParameter.called )
+      clock[ 0 ] = 1400
+      self.moba.redirectLogOutput( 0, 'Record = 300' )
+    assertEqualsImproved( parser.numberOfEvents, { 'out_1.stdhep' : 300 }, self )
+    report_mock.setJobParameter.assert_called_once_with( 'stdhepsplit progress', '300 events, 0.75 events/s', True )
+
   def test_redirectlogoutput_default( self ):
     self.moba.eventstring = 'testevent123'
     log_mock = Mock()
@@ -737,11 +767,11 @@ class ModuleBaseTestCase( unittest.TestCase ): #pylint: disable=too-many-public-
     self.moba.applicationLog = 'appLog.txt'
     self.moba.excludeAllButEventString = False
     with patch('sys.stdout', new_callable=StringIO) as print_mock, \
-         patch('%s.open' % MODULE_NAME, mock_open()) as open_mock:
+         patch('%s.open' % SINK_MODULE, mock_open(), create=True) as open_mock:
       self.assertIsNone( self.moba.redirectLogOutput( 1, 'mytestmessage' ) )
       if print_mock.getvalue() not in [ 'mytestmessage\n', '' ]:
         self.fail( 'Suitable output not found' )
-      open_mock.assert_any_call( 'appLog.txt', 'a' )
+      open_mock.assert_any_call( 'appLog.txt', 'a', BUFFER_SIZE )
       open_mock = open_mock()
       open_mock.write.assert_called_once_with( 'mytestmessage\n' )
       assertEqualsImproved( self.moba.stdError, 'mytestmessage', self )
@@ -753,10 +783,10 @@ class ModuleBaseTestCase( unittest.TestCase ): #pylint: disable=too-many-public-
     self.moba.applicationLog = 'appLog.txt'
     self.moba.excludeAllButEventString = True
     with patch('sys.stdout', new_callable=StringIO) as print_mock, \
-         patch('%s.open' % MODULE_NAME, mock_open()) as open_mock:
+         patch('%s.open' % SINK_MODULE, mock_open(), create=True) as open_mock:
       self.assertIsNone( self.moba.redirectLogOutput( 0, 'mytestmessage' ) )
       assert print_mock.getvalue() == ''
-      open_mock.assert_any_call( 'appLog.txt', 'a' )
+      open_mock.assert_any_call( 'appLog.txt', 'a', BUFFER_SIZE )
       self.assertFalse( open_mock().called )
 
   def test_redirectlogoutput_writetofile_3( self ):
@@ -766,10 +796,10 @@ class ModuleBaseTestCase( unittest.TestCase ): #pylint: disable=too-many-public-
     self.moba.applicationLog = 'appLog.txt'
     self.moba.excludeAllButEventString = True
     with patch('sys.stdout', new_callable=StringIO) as print_mock, \
-         patch('%s.open' % MODULE_NAME, mock_open()) as open_mock:
+         patch('%s.open' % SINK_MODULE, mock_open(), create=True) as open_mock:
       self.assertIsNone( self.moba.redirectLogOutput( 0, 'mytestmessage' ) )
       assert print_mock.getvalue() == ''
-      open_mock.assert_any_call( 'appLog.txt', 'a' )
+      open_mock.assert_any_call( 'appLog.txt', 'a', BUFFER_SIZE )
       open_mock = open_mock()
       self.assertFalse( open_mock.write.called )
 
@@ -780,15 +810,51 @@ class ModuleBaseTestCase( unittest.TestCase ): #pylint: disable=too-many-public-
     self.moba.applicationLog = 'appLog.txt'
     self.moba.excludeAllButEventString = True
     with patch('sys.stdout', new_callable=StringIO) as print_mock, \
-         patch('%s.open' % MODULE_NAME, mock_open()) as open_mock:
+         patch('%s.open' % SINK_MODULE, mock_open(), create=True) as open_mock:
       self.assertIsNone( self.moba.redirectLogOutput( 1, '1390specialTestEvente89f' ) )
       if print_mock.getvalue() not in [ '1390specialTestEvente89f\n', '' ]:
         self.fail( 'Suitable output not found' )
-      open_mock.assert_any_call( 'appLog.txt', 'a' )
+      open_mock.assert_any_call( 'appLog.txt', 'a', BUFFER_SIZE )
       open_mock = open_mock()
       open_mock.write.assert_called_once_with( '1390specialTestEvente89f\n' )
       assertEqualsImproved( self.moba.stdError, '1390specialTestEvente89f', self )
 
+  def test_getenvironmentsnapshot( self ):
+    options = { '/Software/EnvironmentCache/Locations' : [ '/shared/EnvironmentSnapshots' ] }
+    self.moba.ops = Mock()
+    self.moba.ops.getValue.side_effect = lambda option, default: options.get( option, default )
+    with patch('%s.EnvironmentCache' % MODULE_NAME) as cache_mock, \
+         patch('%s.getLocalAreaLocation' % MODULE_NAME, new=Mock(return_value='/local/area')):
+      cache_mock().getSnapshot.return_value = S_OK( 'snapshot' )
+      assertDiracSucceedsWith_equals( self.moba.getEnvironmentSnapshot( 'env.sh' ), 'snapshot', self )
+      cache_mock.assert_called_with( [ '/shared/EnvironmentSnapshots', '/local/area/EnvironmentSnapshots' ] )
+      cache_mock().getSnapshot.assert_called_with( 'env.sh' )
+    options['/Software/EnvironmentCache/Enabled'] = False
+    with patch('%s.EnvironmentCache' % MODULE_NAME) as cache_mock, \
+         patch('%s.captureEnvironment' % MODULE_NAME, new=Mock(return_value=S_OK( 'captured' ))) as capture_mock:
+      assertDiracSucceedsWith_equals( self.moba.getEnvironmentSnapshot( 'env.sh' ), 'captured', self )
+      capture_mock.assert_called_once_with( 'env.sh' )
+      self.assertFalse( cache_mock.called )
+
+  def test_getenvironmentcommand( self ):
+    self.moba.applicationName = 'Marlin'
+    self.moba.applicationVersion = 'v1'
+    snapshot_mock = Mock()
+    snapshot_mock.getScript.return_value = [ 'export A=1', 'unset B' ]
+    with patch('%s.os.path.isfile' % MODULE_NAME, new=Mock(return_value=True)), \
+         patch('%s.os.getcwd' % MODULE_NAME, new=Mock(return_value='/job')), \
+         patch('%s.ModuleBase.getEnvironmentSnapshot' % MODULE_NAME, new=Mock(return_value=S_OK(snapshot_mock))), \
+         patch('%s.open' % MODULE_NAME, mock_open(), create=True) as open_mock:
+      assertEqualsImproved( self.moba.getEnvironmentCommand( 'env.sh' ), 'source /job/Marlin_v1_Environment.sh', self )
+      open_mock.assert_called_once_with( '/job/Marlin_v1_Environment.sh', 'w' )
+      open_mock().write.assert_called_once_with( 'export A=1\nunset B\n' )
+
+  def test_getenvironmentcommand_nosnapshot( self ):
+    assertEqualsImproved( self.moba.getEnvironmentCommand( 'missing_env.sh' ), 'source missing_env.sh', self )
+    with patch('%s.os.path.isfile' % MODULE_NAME, new=Mock(return_value=True)), \
+         patch('%s.ModuleBase.getEnvironmentSnapshot' % MODULE_NAME, new=Mock(return_value=S_ERROR('no bash'))):
+      assertEqualsImproved( self.moba.getEnvironmentCommand( 'env.sh' ), 'source env.sh', self )
+
   def test_cleanup( self ):
     file_mock = Mock()
     with patch('%s.File' % MODULE_NAME, new=Mock(return_value=file_mock)):
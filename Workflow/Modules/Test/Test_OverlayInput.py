@@ -2,6 +2,7 @@
 """Test the OverlayInput WorkflowModule"""
 
 import os
+import re
 import shutil
 import tempfile
 import unittest
@@ -377,20 +378,75 @@ class TestOverlayExecute( unittest.TestCase ):
                                       'testfile2.ppt' : ['KEK'] }, 'Failed' : ''} )
   def test_execute( self ):
     rpc_mock = Mock()
-    rpc_mock.canRun.return_value = S_OK(1)
+    rpc_mock.waitForSlot.return_value = S_OK(1)
+    rpc_mock.releaseLease.return_value = S_OK('SomeSite')
     with patch('%s.Operations.getValue' % MODULE_NAME, new=Mock(return_value=2)), \
-         patch('%s.FileCatalogClient.findFilesByMetadata' % MODULE_NAME, new=Mock(return_value=S_OK(['file1.txt', 'file2.ppt']))), \
+         patch('%s.OverlayInput._OverlayInput__findFilesByMetadata' % MODULE_NAME, new=Mock(return_value=S_OK(['file1.txt', 'file2.ppt']))), \
          patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value = True)), \
          patch('%s.os.remove' % MODULE_NAME, new=Mock(return_value=True)) as remove_mock, \
          patch('%s.open' % MODULE_NAME, mock_open(), create=True) as mo, \
          patch('%s.RPCClient' % MODULE_NAME, new=Mock(return_value=rpc_mock)), \
          patch('%s.os.mkdir' % MODULE_NAME, new=Mock(return_value = True)), \
          patch('%s.os.chdir' % MODULE_NAME, new=Mock(return_value = True)), \
-         patch('%s.DataManager.getFile' % MODULE_NAME, new=Mock(return_value=S_OK('Nothing'))), \
+         patch('%s.DataManager.getFile' % MODULE_NAME, new=Mock(side_effect=lambda lfn: S_OK({'Successful': {lfn: {}}, 'Failed': {}}))), \
+         patch('%s.DataManager.getActiveReplicas' % MODULE_NAME, new=Mock(return_value=S_ERROR('no replicas'))), \
          patch('%s.wasteCPUCycles' % MODULE_NAME):
       result = self.over.execute()
       assertDiracSucceedsWith_equals( result, 'OverlayInput finished successfully', self )
       assertEqualsImproved( self.over.applicationLog, os.getcwd() + '/Overlay_input.log', self )
+      rpc_mock.releaseLease.assert_called_once_with( 1 )
+
+  def test_execute_waits_for_slot( self ):
+    rpc_mock = Mock()
+    rpc_mock.waitForSlot.side_effect = [ S_OK(0), S_OK(0), S_OK(0), S_OK(7) ]
+    rpc_mock.releaseLease.return_value = S_OK('SomeSite')
+    with patch('%s.Operations.getValue' % MODULE_NAME, new=Mock(return_value=2)), \
+         patch('%s.OverlayInput._OverlayInput__findFilesByMetadata' % MODULE_NAME, new=Mock(return_value=S_OK(['file1.txt', 'file2.ppt']))), \
+         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value = True)), \
+         patch('%s.os.remove' % MODULE_NAME, new=Mock(return_value=True)), \
+         patch('%s.open' % MODULE_NAME, mock_open(), create=True), \
+         patch('%s.RPCClient' % MODULE_NAME, new=Mock(return_value=rpc_mock)), \
+         patch('%s.os.mkdir' % MODULE_NAME, new=Mock(return_value = True)), \
+         patch('%s.os.chdir' % MODULE_NAME, new=Mock(return_value = True)), \
+         patch('%s.DataManager.getFile' % MODULE_NAME, new=Mock(side_effect=lambda lfn: S_OK({'Successful': {lfn: {}}, 'Failed': {}}))), \
+         patch('%s.DataManager.getActiveReplicas' % MODULE_NAME, new=Mock(return_value=S_ERROR('no replicas'))), \
+         patch('%s.random.uniform' % MODULE_NAME, new=Mock(return_value=1.5)), \
+         patch('%s.time.sleep' % MODULE_NAME) as sleep_mock, \
+         patch('%s.wasteCPUCycles' % MODULE_NAME):
+      assertDiracSucceeds( self.over.execute(), self )
+    rpc_mock.waitForSlot.assert_called_with( 'SomeSite', 600, 2 )
+    ## the service answered at once, the job waits before asking again
+    assertEqualsImproved( sleep_mock.mock_calls[:3], [ call(45.0), call(90.0), call(180.0) ], self )
+    rpc_mock.releaseLease.assert_called_once_with( 7 )
+
+  def test_execute_waits_for_slot_blocking( self ):
+    clock = [ 1500000000.0 ]
+    def waitForSlot( _site, timeout, _duration ):
+      """ the service waits the full time for the first calls """
+      clock[0] += timeout
+      return S_OK( 7 if clock[0] > 1500001500 else 0 )
+    rpc_mock = Mock()
+    rpc_mock.waitForSlot.side_effect = waitForSlot
+    rpc_mock.releaseLease.return_value = S_OK('SomeSite')
+    with patch('%s.Operations.getValue' % MODULE_NAME, new=Mock(return_value=2)), \
+         patch('%s.OverlayInput._OverlayInput__findFilesByMetadata' % MODULE_NAME, new=Mock(return_value=S_OK(['file1.txt', 'file2.ppt']))), \
+         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value = True)), \
+         patch('%s.os.remove' % MODULE_NAME, new=Mock(return_value=True)), \
+         patch('%s.open' % MODULE_NAME, mock_open(), create=True), \
+         patch('%s.RPCClient' % MODULE_NAME, new=Mock(return_value=rpc_mock)), \
+         patch('%s.os.mkdir' % MODULE_NAME, new=Mock(return_value = True)), \
+         patch('%s.os.chdir' % MODULE_NAME, new=Mock(return_value = True)), \
+         patch('%s.DataManager.getFile' % MODULE_NAME, new=Mock(side_effect=lambda lfn: S_OK({'Successful': {lfn: {}}, 'Failed': {}}))), \
+         patch('%s.DataManager.getActiveReplicas' % MODULE_NAME, new=Mock(return_value=S_ERROR('no replicas'))), \
+         patch('%s.random.uniform' % MODULE_NAME, new=Mock(return_value=1.5)), \
+         patch('%s.time.time' % MODULE_NAME, new=Mock(side_effect=lambda: clock[0])), \
+         patch('%s.time.sleep' % MODULE_NAME) as sleep_mock, \
+         patch('%s.wasteCPUCycles' % MODULE_NAME):
+      assertDiracSucceeds( self.over.execute(), self )
+    ## the service waited for a slot, the job asks again at once
+    assertEqualsImproved( len( rpc_mock.waitForSlot.mock_calls ), 3, self )
+    self.assertNotIn( call(45.0), sleep_mock.mock_calls )
+    rpc_mock.releaseLease.assert_called_once_with( 7 )
 
   def test_execute_resolve_fails( self ):
     result = self.over.execute()
@@ -426,7 +482,8 @@ class TestOverlayExecute( unittest.TestCase ):
   def test_getfcfiles( self ):
     ops_dict = { '/Overlay/clic_cdr/200TeV/testdetectorv2000/myTestBkgEvt/ProdID' : 98421,
                  '/Overlay/clic_cdr/200TeV/testdetectorv2000/myTestBkgEvt/NbEvts' : 482,
-                 '/Overlay/clic_cdr/200TeV/testdetectorv2000/myTestBkgEvt/EvtType' : 'someTestEventType' }
+                 '/Overlay/clic_cdr/200TeV/testdetectorv2000/myTestBkgEvt/EvtType' : 'someTestEventType',
+                 '/Overlay/FileListCache/TTL' : 0 }
     self.over.energy = 123
     self.over.useEnergyForFileLookup = True
     self.over.BkgEvtType = 'myTestBkgEvt'
@@ -441,12 +498,13 @@ class TestOverlayExecute( unittest.TestCase ):
     assertDiracSucceedsWith_equals( result, 9824, self )
     fcc_mock.findFilesByMetadata.assert_called_once_with(
       { 'Energy' : '123', 'EvtType' : 'someTestEventType', 'ProdID' : 98421, 'Datatype' : 'SIM',
-        'DetectorModel' : 'testdetectorv2000', 'Machine' : 'clic' } )
+        'DetectorModel' : 'testdetectorv2000', 'Machine' : 'clic' }, '/' )
 
   def test_getfcfiles_othercase( self ):
     ops_dict = { '/Overlay/ilc_dbd/TestILCDetectorv1/200TeV/otherTestEvt/ProdID' : 139,
                  '/Overlay/ilc_dbd/200TeV/TestILCDetectorv1/otherTestEvt/NbEvts' : 2145,
-                 '/Overlay/ilc_dbd/200TeV/TestILCDetectorv1/otherTestEvt/EvtType' : 'ilc_evt_testme' }
+                 '/Overlay/ilc_dbd/200TeV/TestILCDetectorv1/otherTestEvt/EvtType' : 'ilc_evt_testme',
+                 '/Overlay/FileListCache/TTL' : 0 }
     self.over.energy = 0
     self.over.useEnergyForFileLookup = False
     self.over.detectormodel = ''
@@ -463,11 +521,11 @@ class TestOverlayExecute( unittest.TestCase ):
     result = self.over._OverlayInput__getFilesFromFC()
     assertDiracSucceedsWith_equals( result, 2948, self )
     fcc_mock.findFilesByMetadata.assert_called_once_with(
-      { 'EvtType' : 'ilc_evt_testme', 'ProdID' : 82492, 'Datatype' : 'SIM', 'Machine' : 'ilc' } )
+      { 'EvtType' : 'ilc_evt_testme', 'ProdID' : 82492, 'Datatype' : 'SIM', 'Machine' : 'ilc' }, '/' )
 
   def test_getfilesfromFC( self ):
     ops_mock = Mock()
-    ops_mock.getValue.side_effect = [ '1245', 2849, None ]
+    ops_mock.getValue.side_effect = [ '1245', 2849, None, 0 ]
     self.over.ops = ops_mock
     fcc_mock = Mock()
     fcc_mock.findFilesByMetadata.return_value = S_OK( '1245' )
@@ -480,7 +538,21 @@ class TestOverlayExecute( unittest.TestCase ):
     assertDiracSucceeds( self.over._OverlayInput__getFilesFromFC(), self )
     fcc_mock.findFilesByMetadata.assert_called_once_with(
       { 'Energy' : '9842', 'EvtType' : None, 'Datatype' : 'SIM', 'DetectorModel' : 'myTestDetectorv021',
-        'Machine' : 'clic', 'ProdID' : '1245' } )
+        'Machine' : 'clic', 'ProdID' : '1245' }, '/' )
+
+  def test_findfiles_cached( self ):
+    ops_dict = { '/Overlay/FileListCache/TTL' : 3600,
+                 '/Overlay/FileListCache/Locations' : [ '/cvmfs/lists' ],
+                 '/Overlay/FileListCache/Directory' : '' }
+    ops_mock = Mock()
+    ops_mock.getValue.side_effect = lambda key, default: ops_dict[key]
+    self.over.ops = ops_mock
+    with patch('%s.getLocalAreaLocation' % MODULE_NAME, new=Mock(return_value='/local/area')), \
+         patch('%s.findFilesByMetadataCached' % MODULE_NAME, new=Mock(return_value=S_OK(['lfn1']))) as find_mock:
+      assertDiracSucceedsWith_equals( self.over._OverlayInput__findFilesByMetadata( { 'ProdID' : 3 } ),
+                                      [ 'lfn1' ], self )
+      find_mock.assert_called_once_with( self.over.fcc, { 'ProdID' : 3 }, '/',
+                                         [ '/cvmfs/lists', '/local/area/OverlayFileLists' ], 3600 )
 
   def test_getfilesfromlyon( self ):
     import subprocess
@@ -600,6 +672,118 @@ def get_RAL_lines( expanded_lfn, with_watchdog = False ):
                    'declare -x appstatus=$?\n', 'exit $appstatus\n' ] )
   return result
 
+class TestOverlayParallel( unittest.TestCase ):
+  """ Tests the parallel download mode of the Overlayinput class
+  """
+  def setUp( self ):
+    self.curdir = os.getcwd()
+    self.tmpdir = tempfile.mkdtemp("", dir = "./")
+    os.chdir(self.tmpdir)
+    self.over = OverlayInput()
+    self.over.lfns = [ '/ilc/prod/bkg/file%s.slcio' % index for index in xrange(10) ]
+    self.over.datMan = Mock()
+    self.over.datMan.getActiveReplicas.side_effect = lambda lfn: S_OK( { 'Successful' : { lfn : { 'SE1' : 'pfn', 'SE2' : 'pfn' } },
+                                                                         'Failed' : {} } )
+
+  def tearDown( self ):
+    os.chdir(self.curdir)
+    cleanup(self.tmpdir)
+
+  @staticmethod
+  def storageElement( badSE ):
+    """ return a StorageElement mock creating the local file except for badSE """
+    def createSE( seName ):
+      """ the storage element mock """
+      se_mock = Mock()
+      def getFile( lfn, localPath ):
+        """ create the local file """
+        if seName == badSE:
+          return S_ERROR( 'transfer failed' )
+        with open( os.path.join( localPath, os.path.basename( lfn ) ), 'w' ) as oFile:
+          oFile.write( 'content' )
+        return S_OK( { 'Successful' : { lfn : 7 }, 'Failed' : {} } )
+      se_mock.getFile.side_effect = getFile
+      return se_mock
+    return createSE
+
+  def test_parallel_retries_other_replica( self ):
+    with patch('%s.StorageElement' % MODULE_NAME, new=Mock(side_effect=self.storageElement( 'SE1' ))):
+      result = self.over._OverlayInput__getFilesParallel( 4, 3, 2 )
+    assertDiracSucceeds( result, self )
+    assertEqualsImproved( len( result['Value'] ), 4, self )
+    assertEqualsImproved( len( set( result['Value'] ) ), 4, self )
+    with open( 'overlay_progress.txt' ) as progressFile:
+      assertEqualsImproved( sorted( progressFile.read().split() ), sorted( result['Value'] ), self )
+
+  def test_parallel_fails( self ):
+    with patch('%s.StorageElement' % MODULE_NAME, new=Mock(return_value=Mock(getFile=Mock(return_value=S_ERROR('bad'))))):
+      assertDiracFailsWith( self.over._OverlayInput__getFilesParallel( 4, 3, 2 ), 'failed to get files', self )
+
+  def test_parallel_resume( self ):
+    with open( 'overlay_progress.txt', 'w' ) as progressFile:
+      progressFile.write( '%s\n%s\n' % ( self.over.lfns[0], self.over.lfns[1] ) )
+    for index in xrange(3):
+      with open( os.path.basename( self.over.lfns[index] ), 'w' ) as oFile:
+        oFile.write( 'content' )
+    se_mock = Mock(side_effect=self.storageElement( None ))
+    with patch('%s.StorageElement' % MODULE_NAME, new=se_mock):
+      result = self.over._OverlayInput__getFilesParallel( 3, 2, 2 )
+    assertDiracSucceeds( result, self )
+    assertEqualsImproved( result['Value'][:2], self.over.lfns[:2], self )
+    assertEqualsImproved( se_mock.call_count, 1, self )
+    self.assertNotIn( result['Value'][2], self.over.lfns[:2] )
+
+  def test_parallel_site_getter( self ):
+    self.over.site = 'LCG.CERN.ch'
+    scripts = []
+    def shellCallMock( _timeout, comm, **_kwargs ):
+      """ run the xrdcp of the script, the odd files are not on EOS """
+      scriptName = comm.split( './' )[1].rstrip( '"' )
+      with open( scriptName ) as script:
+        lfile = re.search( r'eospublic.cern.ch/(\S+)', script.read() ).group( 1 )
+      scripts.append( scriptName )
+      if int( lfile[-7] ) % 2 == 0:
+        with open( os.path.basename( lfile ), 'w' ) as oFile:
+          oFile.write( 'content' )
+      return S_OK( ( 0, '', '' ) )
+    se_mock = Mock( side_effect=self.storageElement( None ) )
+    with patch('%s.shellCall' % MODULE_NAME, new=Mock(side_effect=shellCallMock)), \
+         patch('%s.StorageElement' % MODULE_NAME, new=se_mock):
+      result = self.over._OverlayInput__getFilesParallel( 4, 3, 2 )
+    assertDiracSucceeds( result, self )
+    assertEqualsImproved( len( set( result['Value'] ) ), 4, self )
+    ## every file was tried with xrdcp first, the files not on EOS come from the replicas
+    assertEqualsImproved( len( scripts ), len( result['Value'] ), self )
+    oddFiles = [ lfn for lfn in result['Value'] if int( lfn[-7] ) % 2 ]
+    assertEqualsImproved( se_mock.call_count, len( oddFiles ), self )
+    ## each thread has its own script, which is removed
+    self.assertNotIn( 'overlayinput.sh', scripts )
+    assertEqualsImproved( [ name for name in os.listdir( '.' ) if name.endswith( '.sh' ) ], [], self )
+
+  def test_getoverlayfile_without_replicas( self ):
+    lfn = self.over.lfns[0]
+    self.over.datMan.getActiveReplicas.side_effect = None
+    self.over.datMan.getActiveReplicas.return_value = S_OK( { 'Successful' : {}, 'Failed' : { lfn : 'No replicas' } } )
+    self.over.datMan.getFile.return_value = S_OK( { 'Successful' : {}, 'Failed' : { lfn : 'transfer failed' } } )
+    result = self.over._OverlayInput__getOverlayFile( lfn )
+    assertEqualsImproved( result[0], lfn, self )
+    assertDiracFailsWith( result[1], 'transfer failed', self )
+    ## a successful transfer without the local file is a failure
+    self.over.datMan.getFile.return_value = S_OK( { 'Successful' : { lfn : {} }, 'Failed' : {} } )
+    assertDiracFailsWith( self.over._OverlayInput__getOverlayFile( lfn )[1], 'file not found', self )
+    with open( 'file0.slcio', 'w' ) as oFile:
+      oFile.write( 'content' )
+    assertDiracSucceedsWith_equals( self.over._OverlayInput__getOverlayFile( lfn )[1], 'file0.slcio', self )
+
+  def test_parallel_all_present( self ):
+    with open( 'overlay_progress.txt', 'w' ) as progressFile:
+      progressFile.write( '%s\n' % self.over.lfns[0] )
+    with open( os.path.basename( self.over.lfns[0] ), 'w' ) as oFile:
+      oFile.write( 'content' )
+    with patch('%s.StorageElement' % MODULE_NAME) as se_mock:
+      assertDiracSucceedsWith_equals( self.over._OverlayInput__getFilesParallel( 1, 2, 2 ), self.over.lfns[:1], self )
+      self.assertFalse( se_mock.called )
+
 def get_KEK_lines( expanded_lfn, with_watchdog = False ):
   result = []
   if with_watchdog:
@@ -626,6 +810,11 @@ def runTests():
   testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
   print testResult
 
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( TestOverlayParallel )
+
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
+  print testResult
+
 
 if __name__ == '__main__':
   runTests()
@@ -2,6 +2,9 @@
 Unit tests for the StdHepSplit module
 """
 
+import os
+import shutil
+import tempfile
 import unittest
 from mock import patch, MagicMock as Mock
 
@@ -230,3 +233,36 @@ exit $?
         { 'outputFile' : '/last/file.stdhep', 'outputPath' : 123, 'outputDataSE' : 'myTestDataSE' } ], self )
       assertListContentEquals( self.shs.workflow_commons[ 'ProductionOutputData' ].split(';'),
                                'first_entry;a;;dontdeleteme;/some/dir/mytestOutput_file/ignored_file;/some/dir/mytestOutput_file/opfile1;/some/dir/mytestOutput_file/protonpeter;/last/file.stdhep;/mydir/files/run1.stdhep'.split(';'), self )
+
+  def test_execute_native( self ):
+    basedir = os.getcwd()
+    tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    stdhepFile = os.path.join( os.getenv( "DIRAC", "" ), "ILCDIRAC/Testfiles/qq_ln_gen_6701_975.stdhep" )
+    self.shs.platform = 'TestPlatV1'
+    self.shs.InputFile = 'something'
+    self.shs.OutputFile = 'mytestOutput_file.stdhep'
+    self.shs.nbEventsPerSlice = 40
+    self.shs.nativeSplit = True
+    self.shs.workflow_commons[ 'ProductionOutputData' ] = 'first_entry;/some/dir/mytestOutput_file.stdhep'
+    self.shs.listoutput = { 'outputPath' : 123, 'outputDataSE' : 'myTestDataSE' }
+    try:
+      os.chdir( tmpdir )
+      with patch('%s.StdHepSplit.resolveInputVariables' % MODULE_NAME, new=Mock(return_value=S_OK())), \
+           patch('%s.resolveIFpaths' % MODULE_NAME, new=Mock(return_value=S_OK([ stdhepFile ]))), \
+           patch('%s.getSoftwareFolder' % MODULE_NAME, new=Mock()) as getsoft_mock, \
+           patch('%s.shellCall' % MODULE_NAME, new=Mock()) as shell_mock, \
+           patch('%s.StdHepSplit.listDir' % MODULE_NAME, new=Mock()):
+        assertDiracSucceeds( self.shs.execute(), self )
+        self.assertFalse( getsoft_mock.called )
+        self.assertFalse( shell_mock.called )
+      assertEqualsImproved( sorted( os.listdir( '.' ) ), [ 'mytestOutput_file_%d.stdhep' % index
+                                                           for index in ( 1, 2, 3 ) ], self )
+    finally:
+      os.chdir( basedir )
+      shutil.rmtree( tmpdir )
+    assertEqualsImproved( self.shs.workflow_commons[ 'file_number_of_event_relation' ],
+                          { 'mytestOutput_file_1.stdhep' : 40, 'mytestOutput_file_2.stdhep' : 40,
+                            'mytestOutput_file_3.stdhep' : 20 }, self )
+    assertListContentEquals( self.shs.workflow_commons[ 'ProductionOutputData' ].split(';'),
+                             [ 'first_entry', '/some/dir/mytestOutput_file_1.stdhep',
+                               '/some/dir/mytestOutput_file_2.stdhep', '/some/dir/mytestOutput_file_3.stdhep' ], self )
@@ -154,12 +154,14 @@ class UploadLogFileTestCase( unittest.TestCase ):
          patch.object(self.ulf, '_tarTheLogFiles', new=Mock(return_value=S_OK( { 'fileName' : 'some_name' } ))), \
          patch.object(self.ulf, '_tryFailoverTransfer', new=Mock(return_value=S_OK( { 'Request' : request_mock, 'uploadedSE' : 'mock_se' } ))), \
          patch.object(self.ulf, '_createLogUploadRequest', new=Mock(return_value=S_OK())) as uploadreq_mock, \
+         patch('%s.os.path.exists' % MODULE_NAME, new=Mock(return_value=True)), \
+         patch('%s.os.path.getsize' % MODULE_NAME, new=Mock(return_value=1234)), \
          patch('%s.UploadLogFile.logWorkingDirectory' % MODULE_NAME, new=Mock()):
       assertDiracSucceeds( self.ulf.execute(), self )
       log_mock.error.assert_called_once_with(
         "Completely failed to upload log files to mySEMOCK, will attempt upload to failover SE",
         { 'Successful' : [], 'Failed' : [ 'some_file_failed' ] } )
-      uploadreq_mock.assert_called_once_with( 'mySEMOCK', '', 'mock_se' )
+      uploadreq_mock.assert_called_once_with( 'mySEMOCK', '', 'mock_se', 1234 )
 
   def test_execute_logupload_fails( self ):
     log_mock = Mock()
@@ -184,7 +186,7 @@ class UploadLogFileTestCase( unittest.TestCase ):
         ( 'Completely failed to upload log files to mySEMOCK, will attempt upload to failover SE',
           { 'Successful' : [], 'Failed' : [ 'some_file_failed' ] } ),
         ( 'Failed to create failover request', 'upload_mock_err' ) ], self )
-      uploadreq_mock.assert_called_once_with( 'mySEMOCK', '', 'mock_se' )
+      uploadreq_mock.assert_called_once_with( 'mySEMOCK', '', 'mock_se', 0 )
 
   def test_populatelogdir_nopermissions( self ):
     log_mock = Mock()
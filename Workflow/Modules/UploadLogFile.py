@@ -17,6 +17,7 @@ from DIRAC.RequestManagementSystem.Client.File             import File
 from DIRAC.Resources.Storage.StorageElement import StorageElementItem as StorageElement
 from DIRAC import S_OK, S_ERROR, gLogger, gConfig
 
+from ILCDIRAC.Core.Utilities.FileDigest                    import getFileDigest
 from ILCDIRAC.Workflow.Modules.ModuleBase                  import ModuleBase
 from ILCDIRAC.Core.Utilities.ProductionData import getLogPath, getExperimentFromPath
 
@@ -199,7 +200,8 @@ class UploadLogFile(ModuleBase):
     
     self.workflow_commons['Request'] = resFailover['Value']['Request']
     uploadedSE = resFailover['Value']['uploadedSE']
-    res = self._createLogUploadRequest(self.logSE.name, self.logLFNPath, uploadedSE)
+    tarFileSize = os.path.getsize(tarFileLocal) if os.path.exists(tarFileLocal) else 0
+    res = self._createLogUploadRequest(self.logSE.name, self.logLFNPath, uploadedSE, tarFileSize)
     if not res['OK']:
       self.log.error('Failed to create failover request', res['Message'])
       self.setApplicationStatus('Failed To Upload Logs To Failover')
@@ -282,10 +284,12 @@ class UploadLogFile(ModuleBase):
       return S_OK()
     
   #############################################################################
-  def _createLogUploadRequest(self, targetSE, logFileLFN, uploadedSE):
+  def _createLogUploadRequest(self, targetSE, logFileLFN, uploadedSE, logFileSize=0):
     """ Set a request to upload job log files from the output sandbox
         Changed to be similar to LHCb createLogUploadRequest
         using LHCb LogUpload Request and Removal Request
+
+        The size of the log file is used to monitor the transfers of the LogUpload operation
     """
     self.log.info('Setting log upload request for %s at %s' %(targetSE, logFileLFN))
     request = self._getRequestContainer()
@@ -296,6 +300,7 @@ class UploadLogFile(ModuleBase):
 
     upFile = File()
     upFile.LFN = logFileLFN
+    upFile.Size = logFileSize
     logUpload.addFile( upFile )
 
     logRemoval = Operation()
@@ -337,8 +342,18 @@ class UploadLogFile(ModuleBase):
     random.shuffle(self.failoverSEs)
     self.log.info("Attempting to store file %s to the following SE(s):\n%s" % (tarFileName,
                                                                                ', '.join(self.failoverSEs )))
-    result = failoverTransfer.transferAndRegisterFile(tarFileName, '%s/%s' % (tarFileDir, tarFileName), self.logLFNPath,
-                                                      self.failoverSEs, fileMetaDict = { "GUID": None },
+    tarFilePath = '%s/%s' % (tarFileDir, tarFileName)
+    fileMetaDict = { "GUID": None }
+    resDigest = getFileDigest(tarFilePath)
+    if resDigest['OK']:
+      fileMetaDict = { "GUID": resDigest['Value']['GUID'],
+                       "Checksum": resDigest['Value']['Adler32'],
+                       "ChecksumType": "ADLER32" }
+    else:
+      self.log.warn("Could not compute checksum of the log tarball, it will be computed during the upload",
+                    resDigest['Message'])
+    result = failoverTransfer.transferAndRegisterFile(tarFileName, tarFilePath, self.logLFNPath,
+                                                      self.failoverSEs, fileMetaDict = fileMetaDict,
                                                       fileCatalog = catalogs )
     if not result['OK']:
       self.log.error('Failed to upload logs to all destinations')
@@ -21,6 +21,7 @@ from ILCDIRAC.Core.Utilities.ProcessList                   import ProcessList
 from ILCDIRAC.Core.Utilities.resolvePathsAndNames          import getProdFilename
 from ILCDIRAC.Core.Utilities.PrepareLibs                   import removeLibc
 from ILCDIRAC.Core.Utilities.GeneratorModels               import GeneratorModels
+from ILCDIRAC.Core.Utilities.LogParsers                    import WhizardLogParser
 from ILCDIRAC.Core.Utilities.WhizardOptions                import WhizardOptions
 
 from DIRAC import gLogger, S_OK, S_ERROR
@@ -393,6 +394,7 @@ class WhizardAnalysis(ModuleBase):
     comm = 'sh -c "./%s"' % (scriptName)    
     self.setApplicationStatus('Whizard %s step %s' %(self.applicationVersion, self.STEP_NUMBER))
     self.stdError = ''
+    parser = self.addLogParser(WhizardLogParser())
     self.result = shellCall(0, comm, callbackFunction = self.redirectLogOutput, bufferLimit=209715200)
     #self.result = {'OK':True,'Value':(0,'Disabled Execution','')}
     if not self.result['OK']:
@@ -402,36 +404,14 @@ class WhizardAnalysis(ModuleBase):
       self.setApplicationStatus('%s failed terribly, you are doomed!' % (self.applicationName))
       if not self.ignoreapperrors:
         return S_ERROR('%s did not produce the expected log' % (self.applicationName))
-    lumi = ''
-    message = ""
-    success = False
     ###Analyse log file
-    with open(self.applicationLog) as logfile:
-      for line in logfile:
-        if line.count('! Event sample corresponds to luminosity'):
-          elems = line.split()
-          lumi = elems[-1]
-        if line.count("*** Fatal error:"):
-          status = 1
-          message = line
-          break
-        elif line.count("PYSTOP"):
-          status = 1
-          message = line
-          break
-        elif line.count("No matrix element available"):
-          status = 1
-          message = line
-          break
-        elif line.count("Floating point exception"):
-          status = 1
-          message = line
-          break
-        elif line.count("Event generation finished."):
-          success = True
-        else:
-          status = 0
-    if success:
+    if not parser.linesParsed:
+      ## the output did not go through redirectLogOutput
+      with open(self.applicationLog) as logfile:
+        parser.parseLines(logfile)
+    lumi = parser.luminosity
+    message = parser.errorMessage
+    if parser.succeeded():
       status = 0
     else:
       status = 1
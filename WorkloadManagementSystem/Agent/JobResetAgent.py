@@ -15,13 +15,30 @@ Job Reset Agent takes care of the following cases
   * Marks a Job Done if there is no request and minorStatus and appStatus are in final states
   * Marks a Job Done if request status is Done
   * Resets requests if the request status is other than Done
+
+For the staging jobs the input data of all jobs is read from the JobDB in chunks, the replicas of the files are
+used to find the tape storage elements holding them, the staging status is obtained from every tape storage element
+in chunks of ChunkSize files with up to MaxThreads calls in parallel, and the jobs are reset in chunks.
+
+Between full scans, which are done every FullScanPeriod seconds, only the Completed and Failed jobs which reached
+the age of one day since the last cycle, whose request changed since the last cycle, or whose treatment failed in
+the last cycle, are checked. The requests of the examined jobs are read again by job ID to find the changed ones.
+The cursor of the last cycle, the request status of the examined jobs and the jobs to retry are kept in a state file
+in the work directory of the agent. Staging jobs are always checked, their files can be staged without any change of
+the job.
 """
 
+import json
+import os
+import tempfile
+import time
+
 from collections import defaultdict
 from datetime import datetime, timedelta
 
 from DIRAC import S_OK, S_ERROR
 from DIRAC.Core.Base.AgentModule import AgentModule
+from DIRAC.Core.Utilities.List import breakListIntoChunks
 from DIRAC.Core.Utilities.PrettyPrint import printTable
 from DIRAC.Core.DISET.RPCClient import RPCClient
 
@@ -32,6 +49,8 @@ from DIRAC.WorkloadManagementSystem.Client.JobMonitoringClient import JobMonitor
 from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
 from DIRAC.DataManagementSystem.Client.DataManager import DataManager
 
+from ILCDIRAC.Core.Utilities.Concurrency import mapConcurrently, starmapConcurrently
+
 __RCSID__ = "$Id$"
 
 AGENT_NAME = 'WorkloadManagement/JobResetAgent'
@@ -42,6 +61,11 @@ FINAL_APP_STATES = ["Job Finished Successfully",
 FINAL_MINOR_STATES = ["Pending Requests",
                       "Application Finished Successfully"]
 
+STATE_FILE_NAME = "JobResetAgentState.json"
+STATE_VERSION = 2
+#: format of the dates written to the state file
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
 
 class JobResetAgent(AgentModule):
   """ JobResetAgent """
@@ -59,6 +83,20 @@ class JobResetAgent(AgentModule):
     self.addressFrom = "ilcdirac-admin@cern.ch"
     self.emailSubject = "JobResetAgent"
 
+    self.chunkSize = 1000
+    self.maxThreads = 4
+    self.tapeSEs = {}
+
+    self.fullScanPeriod = 7 * 86400
+    self.stateFile = None
+    self.fullScan = True
+    self.cursor = None
+    self.lastCycle = None
+    self.lastFullScan = 0
+    self.jobStates = {}
+    self.changedRequestJobs = set()
+    self.retryJobs = set()
+
     self.accounting = defaultdict(list)
     self.errors = []
 
@@ -76,6 +114,12 @@ class JobResetAgent(AgentModule):
                                       useCertificates=True,
                                       timeout=10)
 
+  def initialize(self):
+    """ load the state of the previous cycles """
+    self.stateFile = os.path.join(self.am_getWorkDirectory(), STATE_FILE_NAME)
+    self.loadState()
+    return S_OK()
+
   def beginExecution(self):
     """ Reload the configurations before every cycle """
 
@@ -84,6 +128,10 @@ class JobResetAgent(AgentModule):
     self.addressFrom = self.am_getOption('MailFrom', self.addressFrom)
     self.userJobTypes = self.am_getOption('UserJobs', self.userJobTypes)
     self.prodJobTypes = self.am_getOption('ProdJobs', self.prodJobTypes)
+    self.chunkSize = self.am_getOption('ChunkSize', self.chunkSize)
+    self.maxThreads = self.am_getOption('MaxThreads', self.maxThreads)
+    self.fullScanPeriod = self.am_getOption('FullScanPeriod', self.fullScanPeriod)
+    self.tapeSEs = {}
     self.accounting.clear()
 
     return S_OK()
@@ -125,9 +173,107 @@ class JobResetAgent(AgentModule):
     self.log.error(errStr, varMsg)
     self.errors.append(errStr + varMsg)
 
-  def getJobs(self, status, jobType=None, minorStatus=None):
+  def loadState(self):
+    """ read the cursor and the examined jobs from the state file, without it a full scan is done """
+    try:
+      with open(self.stateFile) as stateFile:
+        state = json.load(stateFile)
+    except (IOError, OSError, ValueError) as err:
+      self.log.notice("No previous state loaded", "%s: %s" % (self.stateFile, err))
+      return S_OK()
+
+    if state.get('Version') != STATE_VERSION:
+      self.log.notice("Ignoring state with version", "%s" % state.get('Version'))
+      return S_OK()
+
+    self.cursor = state['Cursor']
+    self.lastCycle = datetime.strptime(state['LastCycle'], DATE_FORMAT)
+    self.lastFullScan = state['LastFullScan']
+    self.jobStates = dict((int(jobID), jobState) for jobID, jobState in state['Jobs'].iteritems())
+    self.retryJobs = set(state['Retry'])
+    self.log.notice("Loaded state of %d jobs, cursor at %s" % (len(self.jobStates), self.cursor))
+    return S_OK()
+
+  def saveState(self, cycleStart):
+    """ write the cursor and the examined jobs to the state file, the file is replaced atomically
+
+    :param cycleStart: datetime when the cycle started
+    """
+    if not self.stateFile:
+      return S_OK()
+
+    # jobs which became older than one day after the start of the cycle are new in the next cycle
+    cycleStart = cycleStart.replace(microsecond=0)
+    self.cursor = (cycleStart - timedelta(days=1)).strftime(DATE_FORMAT)
+    self.lastCycle = cycleStart
+    state = dict(Version=STATE_VERSION, Cursor=self.cursor, LastCycle=self.lastCycle.strftime(DATE_FORMAT),
+                 LastFullScan=self.lastFullScan, Retry=sorted(self.retryJobs),
+                 Jobs=dict((str(jobID), jobState) for jobID, jobState in self.jobStates.iteritems()))
+    try:
+      tmpHandle, tmpName = tempfile.mkstemp(dir=os.path.dirname(self.stateFile), prefix='.tmp_jobreset_')
+      with os.fdopen(tmpHandle, 'w') as stateFile:
+        json.dump(state, stateFile)
+      os.rename(tmpName, self.stateFile)
+    except (IOError, OSError) as err:
+      self.logError("Failure to save state", "%s: %s" % (self.stateFile, err))
+      return S_ERROR(str(err))
+    return S_OK()
+
+  def recordJobState(self, jobID, requestStatus):
+    """ remember the request status of an examined job """
+    self.jobStates[jobID] = dict(RequestStatus=requestStatus, LastUpdate=int(time.time()))
+
+  def getChangedRequestJobs(self):
+    """ returns the examined jobs whose request changed status, or was updated, since the last cycle
+
+    The requests are read again for the examined jobs which had a request, in chunks of ChunkSize jobs
+    """
+    jobIDs = sorted(jobID for jobID, jobState in self.jobStates.iteritems() if jobState['RequestStatus'])
+    changedJobs = set()
+    for chunk in breakListIntoChunks(jobIDs, self.chunkSize):
+      res = self.reqClient.readRequestsForJobs(chunk)
+      if not res['OK']:
+        return res
+
+      for jobID in chunk:
+        request = res['Value']['Successful'].get(jobID)
+        status = request.Status if request else None
+        lastUpdate = getattr(request, 'LastUpdate', None)
+        if status != self.jobStates[jobID]['RequestStatus'] or (lastUpdate and lastUpdate >= self.lastCycle):
+          self.log.verbose("Request of job %s changed" % jobID, "%s -> %s" % (self.jobStates[jobID]['RequestStatus'],
+                                                                               status))
+          changedJobs.add(jobID)
+    return S_OK(changedJobs)
+
+  def prepareScan(self):
+    """ decides if all jobs have to be checked in this cycle or only the new and changed ones """
+    self.changedRequestJobs = set()
+    self.fullScan = not (self.stateFile and self.cursor and self.lastCycle) or time.time() - self.lastFullScan >= self.fullScanPeriod
+    if not self.fullScan:
+      res = self.getChangedRequestJobs()
+      if res['OK']:
+        self.changedRequestJobs = res['Value'] | self.retryJobs
+      else:
+        self.log.error("Failure to get changed requests, doing a full scan", res['Message'])
+        self.fullScan = True
+
+    if self.fullScan:
+      self.log.notice("Checking all jobs")
+      self.lastFullScan = int(time.time())
+      self.jobStates = {}
+    else:
+      self.log.notice("Checking jobs changed since %s, %d with changed requests, %d to retry" %
+                      (self.cursor, len(self.changedRequestJobs), len(self.retryJobs)))
+    # the jobs whose treatment fails in this cycle are retried in the next one
+    self.retryJobs = set()
+
+  def getJobs(self, status, jobType=None, minorStatus=None, incremental=True):
     """ returns jobs with a given status, job type, minor status and
-        lastUpdateTime older than 1 day """
+        lastUpdateTime older than 1 day
+
+    If incremental is True and no full scan is done in this cycle, only the jobs which became older than 1 day
+    since the last cycle, and the jobs whose request changed status, are returned
+    """
 
     attrDict = dict(Status=status)
     if jobType:
@@ -136,13 +282,22 @@ class JobResetAgent(AgentModule):
     if minorStatus:
       attrDict['MinorStatus'] = minorStatus
 
-    time = datetime.now() - timedelta(days=1)
-    res = self.jobDB.selectJobs(attrDict, older=time)
+    olderThan = datetime.now() - timedelta(days=1)
+    if self.fullScan or not incremental:
+      res = self.jobDB.selectJobs(attrDict, older=olderThan)
+    else:
+      res = self.jobDB.selectJobs(attrDict, older=olderThan, newer=self.cursor)
+      if res['OK'] and self.changedRequestJobs:
+        newJobs = res['Value']
+        res = self.jobDB.selectJobs(dict(attrDict, JobID=sorted(self.changedRequestJobs)), older=olderThan)
+        if res['OK']:
+          res['Value'] = list(set(newJobs) | set(res['Value']))
+
     if not res['OK']:
       self.logError("Failure to get Jobs", res['Message'])
       return res
 
-    jobIDs = map(int, res['Value'])
+    jobIDs = sorted(map(int, res['Value']))
     return S_OK(jobIDs)
 
   def treatUserJobWithNoReq(self, jobID):
@@ -289,6 +444,7 @@ class JobResetAgent(AgentModule):
     res = self.reqClient.readRequestsForJobs(jobIDs)
     if not res['OK']:
       self.logError('Failure to read requests for jobs', res['Message'])
+      self.retryJobs.update(jobIDs)
       return res
 
     result = res['Value']
@@ -296,30 +452,83 @@ class JobResetAgent(AgentModule):
       if ((jobID not in result['Successful'] and jobID not in result['Failed']) or (jobID in result['Failed'] \
           and 'Request not found' in result['Failed'][jobID])):
         self.log.notice("No request found for job: %s" % jobID)
-        treatJobWithNoReq(jobID)
+        self.recordJobState(jobID, None)
+        res = treatJobWithNoReq(jobID)
 
       elif jobID in result['Successful']:
         self.log.notice("Found the request for Job: %s " % jobID)
         request = result['Successful'][jobID]
-        treatJobWithReq(jobID, request)
+        self.recordJobState(jobID, request.Status)
+        res = treatJobWithReq(jobID, request)
+
+      else:
+        self.log.warn("Failure to read the request for job", "%s: %s" % (jobID, result['Failed'][jobID]))
+        res = S_ERROR(result['Failed'][jobID])
+
+      if not res['OK']:
+        self.retryJobs.add(jobID)
 
     return S_OK()
 
+  def isTapeSE(self, seName, voName):
+    """ returns True if the storage element is a tape storage element, the answer is cached for the cycle """
+    if seName not in self.tapeSEs:
+      res = StorageElement(seName, vo=voName).getStatus()
+      if not res['OK']:
+        self.logError("Failure to get status of StorageElement", "%s: %s" % (seName, res['Message']))
+        return False
+      self.tapeSEs[seName] = bool(res['Value'].get('TapeSE'))
+    return self.tapeSEs[seName]
+
+  def getTapeReplicas(self, lfns):
+    """ returns a dictionary of tape storage element to the list of lfns with a replica on it """
+    voName = lfns[0].split('/')[1]
+    chunks = breakListIntoChunks(lfns, self.chunkSize)
+    results = mapConcurrently(lambda chunk: self.dataManager.getReplicas(chunk, getUrl=False), chunks, self.maxThreads)
+
+    tapeReplicas = defaultdict(list)
+    for chunk, res in zip(chunks, results):
+      if not res['OK']:
+        self.logError("Failure to get replicas for LFNs", "%s: %s" % (len(chunk), res['Message']))
+        continue
+      for lfn, error in res['Value']['Failed'].iteritems():
+        self.log.warn("Failure to get replicas for LFN", "%s: %s" % (lfn, error))
+      for lfn, replicas in res['Value']['Successful'].iteritems():
+        for seName in replicas:
+          if self.isTapeSE(seName, voName):
+            tapeReplicas[seName].append(lfn)
+
+    return S_OK(tapeReplicas)
+
   def getStagedFiles(self, lfns):
-    """ returns a list of staged files """
+    """ returns a list of files which are staged on one of the tape storage elements holding them """
     if not lfns:
       self.log.notice("No LFNs passed to check staging status")
       return S_OK()
 
     voName = lfns[0].split('/')[1]
-    se = StorageElement("CERN-SRM", vo=voName)
-    res = se.getFileMetadata(lfns)
-    if not res["OK"]:
-      self.logError("Failure to getFileMetadata for LFNs", "%s" % lfns)
-      return res
+    tapeReplicas = self.getTapeReplicas(lfns)['Value']
+    seChunks = [(seName, chunk) for seName, seLFNs in tapeReplicas.iteritems()
+                for chunk in breakListIntoChunks(seLFNs, self.chunkSize)]
+    if not seChunks:
+      self.log.notice("No tape replicas found for %d LFNs" % len(lfns))
+      return S_OK([])
+
+    results = starmapConcurrently(lambda seName, chunk: StorageElement(seName, vo=voName).getFileMetadata(chunk),
+                                  seChunks, self.maxThreads)
+    stagedFiles = set()
+    failedCalls = 0
+    for (seName, chunk), res in zip(seChunks, results):
+      if not res["OK"]:
+        self.logError("Failure to getFileMetadata for LFNs", "%s: %s" % (seName, len(chunk)))
+        failedCalls += 1
+        continue
+      stagedFiles.update(lfn for lfn, val in res["Value"]["Successful"].iteritems() if val.get("Cached", 0) > 0)
+
+    if failedCalls == len(seChunks):
+      return S_ERROR("Failure to getFileMetadata for all LFNs")
 
-    stagedFiles = [lfn for lfn, val in res["Value"]["Successful"].iteritems() if val["Cached"] > 0]
-    return S_OK(stagedFiles)
+    return S_OK(list(stagedFiles))
 
   @staticmethod
   def cleanLFN(lfn):
@@ -329,10 +538,10 @@ class JobResetAgent(AgentModule):
     return lfn
 
   def getInputDataForJobs(self, jobList):
-    """ returns the input data for a given list of jobIDs """
+    """ returns the input data for a given list of jobIDs, read from the JobDB with up to maxThreads queries at once """
+    jobList = list(jobList)
     inputData = defaultdict(list)
-    for jobID in jobList:
-      res = self.jobMonClient.getInputData(jobID)
+    for jobID, res in zip(jobList, mapConcurrently(self.jobDB.getInputData, jobList, self.maxThreads)):
       if not res['OK']:
         self.logError("Failure to get input data for", "JobID: %s, Message: %s" % (jobID, res["Message"]))
         continue
@@ -344,15 +553,20 @@ class JobResetAgent(AgentModule):
     return S_OK(inputData)
 
   def rescheduleJobs(self, jobsToReschedule):
-    """ resets a list of jobs """
+    """ resets a list of jobs, in chunks """
     result = dict(Failed=[], Successful=[])
-    for job in jobsToReschedule:
-      res = self.jobManagerClient.resetJob(job)
+    for chunk in breakListIntoChunks(sorted(jobsToReschedule), self.chunkSize):
+      res = self.jobManagerClient.resetJob(chunk)
       if res['OK']:
-        result['Successful'].append(job)
-      else:
-        self.logError("Failed to reset job", "%s: %s" % (job, res['Message']))
-        result['Failed'].append(job)
+        result['Successful'].extend(chunk)
+        continue
+
+      failed = set(res.get('InvalidJobIDs', []) + res.get('NonauthorizedJobIDs', []) + res.get('FailedJobIDs', []))
+      if not failed:
+        failed = set(chunk)
+      self.logError("Failed to reset jobs", "%s: %s" % (sorted(failed), res['Message']))
+      result['Failed'].extend(job for job in chunk if job in failed)
+      result['Successful'].extend(job for job in chunk if job not in failed)
 
     self.log.info("Reset jobs: %s" % result)
     return S_OK(result)
@@ -368,7 +582,7 @@ class JobResetAgent(AgentModule):
       self.log.notice("No input data found for job list %s" % jobList)
       return S_OK()
 
-    self.log.notice("Input Data found: %s" % inputData)
+    self.log.notice("Input Data found for %d files" % len(inputData))
     res = self.getStagedFiles(inputData.keys())
     if not res['OK']:
       return res
@@ -377,15 +591,15 @@ class JobResetAgent(AgentModule):
 
     jobsToReschedule = set()
     for lfn in stagedFiles:
-      jobsToReschedule.add(inputData[lfn])
-      self.log.notice("Jobs to be rescheduled: %s" % jobsToReschedule)
+      jobsToReschedule.update(inputData[lfn])
+    self.log.notice("Jobs to be rescheduled: %s" % jobsToReschedule)
 
-      if self.enabled and jobsToReschedule:
-        res = self.rescheduleJobs(jobsToReschedule)
-        if res["OK"]:
-          for jobID in res["Value"]["Successful"]:
-            self.accounting["Staging"].append({"JobID": jobID, "JobStatus": "Staging", "Treatment": (
-                                               "Job Rescheduled because associated files are already Staged")})
+    if self.enabled and jobsToReschedule:
+      res = self.rescheduleJobs(jobsToReschedule)
+      if res["OK"]:
+        for jobID in res["Value"]["Successful"]:
+          self.accounting["Staging"].append({"JobID": jobID, "JobStatus": "Staging", "Treatment": (
+                                             "Job Rescheduled because associated files are already Staged")})
 
     return S_OK()
 
@@ -420,11 +634,16 @@ class JobResetAgent(AgentModule):
       return res
 
     self.log.notice("Job %s is successfully maked as %s" % (jobID, status))
+    # the job is not Completed or Failed with pending requests anymore, its request is not followed
+    self.jobStates.pop(jobID, None)
     return S_OK()
 
   def execute(self):
     """ main execution loop of Agent """
 
+    cycleStart = datetime.now()
+    self.prepareScan()
+
     # process completed prod jobs
     res = self.getJobs(status="Completed", jobType=self.prodJobTypes)
     if res["OK"]:
@@ -459,7 +678,7 @@ class JobResetAgent(AgentModule):
         self.log.notice("No user jobs found with Completed status")
 
     # process STAGING jobs
-    res = self.getJobs(status="Staging")
+    res = self.getJobs(status="Staging", incremental=False)
     if res["OK"]:
       stagingJobs = res["Value"]
       if stagingJobs:
@@ -470,4 +689,6 @@ class JobResetAgent(AgentModule):
     # send email notification
     self.sendNotification()
 
+    self.saveState(cycleStart)
+
     return S_OK()
@@ -6,11 +6,28 @@
 """ The Download Input Data module wraps around the Replica Management
     components to provide access to datasets by available site protocols as
     defined in the CS for the VO.
+
+    The storage metadata of the files is obtained with one call per local SE, and
+    the files are downloaded in parallel by up to MaxParallelDownloads threads, with
+    at most MaxBytesInFlight bytes being transferred at the same time (both from the
+    Configuration). If a download fails the other replicas are tried.
+    Files are downloaded in the order of the input data. If a FileReadyCallback is given
+    in the arguments it is called with the LFN and the file dictionary as soon as a file
+    and all the files before it are available, so that applications reading their input
+    in order can start before all files are downloaded.
+
+    If InputDataCacheDir is given in the Configuration, or the ILCDIRAC_INPUTDATA_CACHE
+    environment variable is set, the files are obtained through an
+    :class:`~ILCDIRAC.Core.Utilities.InputDataCache.InputDataCache` shared between the
+    jobs of the node, limited to InputDataCacheSize GB.
 """
 
 import os
 import tempfile
 import random
+import threading
+
+from multiprocessing.pool import ThreadPool
 
 from DIRAC                                                          import S_OK, S_ERROR, gLogger
 from DIRAC.Core.DISET.RPCClient                                     import RPCClient
@@ -18,9 +35,15 @@ from DIRAC.Resources.Storage.StorageElement                         import Stora
 from DIRAC.Core.Utilities.Os                                        import getDiskSpace
 from DIRAC.DataManagementSystem.Utilities.DMSHelpers                import DMSHelpers
 
+from ILCDIRAC.Core.Utilities.InputDataCache                         import InputDataCache, DEFAULT_MAX_SIZE
+
 __RCSID__ = "$Id$"
 
 COMPONENT_NAME = 'DownloadInputData'
+#: default number of files downloaded in parallel
+MAX_PARALLEL_DOWNLOADS = 4
+#: default maximum number of bytes of the files being downloaded at the same time
+MAX_BYTES_IN_FLIGHT = 10 * 1024 * 1024 * 1024
 
 def _isCached( lfn, seName ):
   result = StorageElement( seName ).getFileMetadata( lfn )
@@ -31,6 +54,22 @@ def _isCached( lfn, seName ):
   metadata = result['Value']['Successful'][lfn]
   return metadata.get( 'Cached', metadata['Accessible'] )
 
+def _getStorageMetadata( seName, lfns ):
+  """ Get the storage metadata of the files with a single call to the SE
+
+  :returns: dictionary lfn: metadata dictionary, or error message if it could not be obtained
+  """
+  lfns = list( lfns )
+  if not lfns:
+    return {}
+  result = StorageElement( seName ).getFileMetadata( lfns )
+  if not result['OK']:
+    return dict.fromkeys( lfns, result['Message'] )
+  metadata = dict.fromkeys( lfns, 'Return from StorageElement.getFileMetadata() incomplete' )
+  metadata.update( result['Value']['Failed'] )
+  metadata.update( result['Value']['Successful'] )
+  return metadata
+
 class DownloadInputData( object ):
   """
    retrieve InputData LFN from localSEs (if available) or from elsewhere.
@@ -51,6 +90,18 @@ class DownloadInputData( object ):
     self.jobID = None
     self.counter = 1
     self.availableSEs = DMSHelpers().getStorageElements()
+    self.fileReadyCallback = argumentsDict.get( 'FileReadyCallback' )
+    self.maxParallelDownloads = int( self.configuration.get( 'MaxParallelDownloads', MAX_PARALLEL_DOWNLOADS ) )
+    self.maxBytesInFlight = int( self.configuration.get( 'MaxBytesInFlight', MAX_BYTES_IN_FLIGHT ) )
+    self.bytesInFlight = 0
+    self.transferCondition = threading.Condition()
+    self.cache = None
+    cacheDir = self.configuration.get( 'InputDataCacheDir', os.environ.get( 'ILCDIRAC_INPUTDATA_CACHE', '' ) )
+    if cacheDir:
+      cacheSize = float( self.configuration.get( 'InputDataCacheSize', DEFAULT_MAX_SIZE / 1024. ** 3 ) )
+      self.cache = InputDataCache( cacheDir, int( cacheSize * 1024 ** 3 ) )
+    # checksum, or GUID if unknown, of the files, used as key in the cache
+    self.checksums = {}
 
   #############################################################################
   def execute( self, dataToResolve = None ):
@@ -105,6 +156,7 @@ class DownloadInputData( object ):
       # Get and remove size and GUIS
       size = reps.pop( 'Size' )
       guid = reps.pop( 'GUID' )
+      self.checksums[lfn] = reps.get( 'Checksum' ) or guid
       # Remove all other items that are not SEs
       for item in reps.keys():
         if item not in self.availableSEs:
@@ -114,12 +166,15 @@ class DownloadInputData( object ):
       for seName in diskSEs:
         if seName in reps:
           downloadReplicas[lfn]['SE'].append( seName )
-      # If no disk replicas, take tape replicas
-      if not downloadReplicas[lfn]['SE']:
-        for seName in tapeSEs:
-          if seName in reps and _isCached( lfn, seName ):
-            # Only consider replicas that are cached
-            downloadReplicas[lfn]['SE'].append( seName )
+
+    # If no disk replicas, take tape replicas, only consider replicas that are cached
+    storageMetadata = {}
+    for seName in tapeSEs:
+      storageMetadata[seName] = _getStorageMetadata( seName, [lfn for lfn, info in downloadReplicas.iteritems()
+                                                              if not info['SE'] and seName in replicas[lfn]] )
+      for lfn, metadata in storageMetadata[seName].iteritems():
+        if isinstance( metadata, dict ) and metadata.get( 'Cached', metadata['Accessible'] ):
+          downloadReplicas[lfn]['SE'].append( seName )
 
     totalSize = 0
     verbose = self.log.verbose( 'Replicas to download are:' )
@@ -158,23 +213,23 @@ class DownloadInputData( object ):
       self.__setJobParam( COMPONENT_NAME, report )
       return S_OK( { 'Failed': self.inputData, 'Successful': {}} )
 
-    resolvedData = {}
-    localSECount = 0
-    for lfn, info in downloadReplicas.iteritems():
-      seName = info['SE']
-      guid = info['GUID']
-      reps = replicas.get( lfn, {} )
+    # Get the storage metadata of the files at their selected SE, one call per SE
+    for seName in set( info['SE'] for info in downloadReplicas.itervalues() if info['SE'] ):
+      lfns = [lfn for lfn, info in downloadReplicas.iteritems()
+              if info['SE'] == seName and lfn not in storageMetadata.get( seName, {} )]
+      storageMetadata.setdefault( seName, {} ).update( _getStorageMetadata( seName, lfns ) )
+
+    toDownload = []
+    for lfn in self.inputData:
+      if lfn not in downloadReplicas:
+        continue
+      seName = downloadReplicas[lfn]['SE']
       if seName:
-        result = StorageElement( seName ).getFileMetadata( lfn )
-        if not result['OK']:
-          self.log.error( "Error getting metadata", result['Message'] )
+        metadata = storageMetadata[seName][lfn]
+        if not isinstance( metadata, dict ):
+          self.log.error( 'Could not get Storage Metadata for %s at %s: %s' % ( lfn, seName, metadata ) )
           failedReplicas.add( lfn )
           continue
-        if lfn in result['Value']['Failed']:
-          self.log.error( 'Could not get Storage Metadata for %s at %s: %s' % ( lfn, seName, result['Value']['Failed'][lfn] ) )
-          failedReplicas.add( lfn )
-          continue
-        metadata = result['Value']['Successful'][lfn]
         if metadata.get( 'Lost', False ):
           error = "PFN has been Lost by the StorageElement"
         elif metadata.get( 'Unavailable', False ):
@@ -187,37 +242,21 @@ class DownloadInputData( object ):
           self.log.error( error, lfn )
           failedReplicas.add( lfn )
           continue
-
         self.log.info( 'Preliminary checks OK, download %s from %s:' % ( lfn, seName ) )
-        result = self._downloadFromSE( lfn, seName, reps, guid )
-        if not result['OK']:
-          self.log.error( "Download failed", "Tried downloading from SE %s: %s" % ( seName, result['Message'] ) )
-      else:
-        result = {'OK':False}
+      toDownload.append( ( lfn, seName, replicas.get( lfn, {} ), downloadReplicas[lfn]['GUID'],
+                           int( downloadReplicas[lfn].get( 'Size', 0 ) ) ) )
 
+    resolvedData = {}
+    localSECount = 0
+    for lfn, result, fromLocalSE in self.__downloadFiles( toDownload ):
       if not result['OK']:
-        reps.pop( seName, None )
-        # Check the other SEs
-        if reps:
-          self.log.info( 'Trying to download from any SE' )
-          result = self._downloadFromBestSE( lfn, reps, guid )
-          if not result['OK']:
-            self.log.error( "Download from best SE failed", "Tried downloading %s: %s" % ( lfn, result['Message'] ) )
-            failedReplicas.add( lfn )
-        else:
-          failedReplicas.add( lfn )
-      else:
+        failedReplicas.add( lfn )
+        continue
+      if fromLocalSE:
         localSECount += 1
-      if result['OK']:
-        # Rename file if downloaded FileName does not match the LFN... How can this happen?
-        lfnName = os.path.basename( lfn )
-        oldPath = result['Value']['path']
-        fileName = os.path.basename( oldPath )
-        if lfnName != fileName:
-          newPath = os.path.join( os.path.dirname( oldPath ), lfnName )
-          os.rename( oldPath, newPath )
-          result['Value']['path'] = newPath
-        resolvedData[lfn] = result['Value']
+      resolvedData[lfn] = result['Value']
+      if self.fileReadyCallback:
+        self.fileReadyCallback( lfn, result['Value'] )
 
     # Report datasets that could not be downloaded
     report = ''
@@ -236,9 +275,86 @@ class DownloadInputData( object ):
 
     if report:
       self.__setJobParam( COMPONENT_NAME, report )
+    if self.cache:
+      self.__setJobParam( 'InputDataCache', self.cache.getStatistics() )
 
     return S_OK( {'Successful': resolvedData, 'Failed':failedReplicas} )
 
+  #############################################################################
+  def __downloadFiles( self, toDownload ):
+    """ Download the files with up to maxParallelDownloads threads
+
+    :param list toDownload: tuples of arguments of :func:`_downloadFile`
+    :returns: iterator over the tuples (lfn, result, fromLocalSE), in the order of toDownload,
+              every tuple is yielded as soon as the file and all the files before it are done
+    """
+    if self.maxParallelDownloads <= 1 or len( toDownload ) <= 1:
+      for args in toDownload:
+        yield self._downloadFile( *args )
+      return
+
+    pool = ThreadPool( min( self.maxParallelDownloads, len( toDownload ) ) )
+    try:
+      for downloaded in pool.imap( lambda args: self._downloadFile( *args ), toDownload ):
+        yield downloaded
+    finally:
+      pool.close()
+      pool.join()
+
+  def _downloadFile( self, lfn, seName, reps, guid, size ):
+    """ Download a file from the selected SE, or from any other SE if it fails
+
+    :returns: tuple (lfn, result, fromLocalSE)
+    """
+    self.__reserveBandwidth( size )
+    try:
+      if seName:
+        result = self._downloadFromSE( lfn, seName, reps, guid )
+        if not result['OK']:
+          self.log.error( "Download failed", "Tried downloading from SE %s: %s" % ( seName, result['Message'] ) )
+      else:
+        result = {'OK':False}
+
+      fromLocalSE = result['OK']
+      if not result['OK']:
+        otherReps = dict( reps )
+        otherReps.pop( seName, None )
+        # Check the other SEs
+        if not otherReps:
+          return lfn, S_ERROR( 'No other replica' ), False
+        self.log.info( 'Trying to download from any SE' )
+        result = self._downloadFromBestSE( lfn, otherReps, guid )
+        if not result['OK']:
+          self.log.error( "Download from best SE failed", "Tried downloading %s: %s" % ( lfn, result['Message'] ) )
+          return lfn, result, False
+    finally:
+      self.__releaseBandwidth( size )
+
+    # Rename file if downloaded FileName does not match the LFN... How can this happen?
+    lfnName = os.path.basename( lfn )
+    oldPath = result['Value']['path']
+    fileName = os.path.basename( oldPath )
+    if lfnName != fileName:
+      newPath = os.path.join( os.path.dirname( oldPath ), lfnName )
+      os.rename( oldPath, newPath )
+      result['Value']['path'] = newPath
+    return lfn, result, fromLocalSE
+
+  def __reserveBandwidth( self, size ):
+    """ Wait until the file fits in the bytes that can be transferred at the same time,
+        a file is always allowed if nothing else is being transferred
+    """
+    with self.transferCondition:
+      while self.bytesInFlight and self.bytesInFlight + size > self.maxBytesInFlight:
+        self.transferCondition.wait()
+      self.bytesInFlight += size
+
+  def __releaseBandwidth( self, size ):
+    """ Give back the bytes of a finished transfer """
+    with self.transferCondition:
+      self.bytesInFlight -= size
+      self.transferCondition.notify_all()
+
   #############################################################################
   def __checkDiskSpace( self, totalSize ):
     """Compare available disk space to the file size reported from the catalog
@@ -320,19 +436,27 @@ class DownloadInputData( object ):
         return S_OK( fileDict )
 
     localFile = os.path.join( downloadDir, fileName )
-    result = StorageElement( seName ).getFile( lfn, localPath = downloadDir )
+    if self.cache:
+      downloads = []
+      def downloadToCache( cacheDir ):
+        """ download the file into the cache, remembering the result """
+        downloads.append( self.__getFileFromSE( lfn, seName, cacheDir ) )
+        return downloads[-1]
+      result = self.cache.getFile( lfn, self.checksums.get( lfn, guid ), localFile, downloadToCache )
+      if result['OK']:
+        return S_OK( {'turl':'Downloaded',
+                      'protocol':'Downloaded',
+                      'se':seName,
+                      'pfn':reps[seName],
+                      'guid':guid,
+                      'path':localFile} )
+      if downloads and not downloads[-1]['OK']:
+        return result
+      self.log.warn( 'Failed to use the input data cache, downloading directly:', result['Message'] )
+
+    result = self.__getFileFromSE( lfn, seName, downloadDir )
     if not result['OK']:
-      self.log.warn( 'Problem getting %s from %s:\n%s' % ( lfn, seName, result['Message'] ) )
-      self.__cleanFailedFile( lfn, downloadDir )
       return result
-    if lfn in result['Value']['Failed']:
-      self.log.warn( 'Problem getting %s from %s:\n%s' % ( lfn, seName, result['Value']['Failed'][lfn] ) )
-      self.__cleanFailedFile( lfn, downloadDir )
-      return S_ERROR( result['Value']['Failed'][lfn] )
-    if lfn not in result['Value']['Successful']:
-      self.log.warn( "%s got from %s not in Failed nor Successful???\n" % ( lfn, seName ) )
-      self.__cleanFailedFile( lfn, downloadDir )
-      return S_ERROR( "Return from StorageElement.getFile() incomplete" )
 
     if os.path.exists( localFile ):
       self.log.verbose( "File %s successfully downloaded locally to %s" % ( lfn, localFile ) )
@@ -347,6 +471,24 @@ class DownloadInputData( object ):
       self.log.warn( 'File does not exist in local directory after download' )
       return S_ERROR( 'OK download result but file missing in current directory' )
 
+  def __getFileFromSE( self, lfn, seName, downloadDir ):
+    """ Get the file from the Storage Element into downloadDir, remove remnants if it fails
+    """
+    result = StorageElement( seName ).getFile( lfn, localPath = downloadDir )
+    if not result['OK']:
+      self.log.warn( 'Problem getting %s from %s:\n%s' % ( lfn, seName, result['Message'] ) )
+      self.__cleanFailedFile( lfn, downloadDir )
+      return result
+    if lfn in result['Value']['Failed']:
+      self.log.warn( 'Problem getting %s from %s:\n%s' % ( lfn, seName, result['Value']['Failed'][lfn] ) )
+      self.__cleanFailedFile( lfn, downloadDir )
+      return S_ERROR( result['Value']['Failed'][lfn] )
+    if lfn not in result['Value']['Successful']:
+      self.log.warn( "%s got from %s not in Failed nor Successful???\n" % ( lfn, seName ) )
+      self.__cleanFailedFile( lfn, downloadDir )
+      return S_ERROR( "Return from StorageElement.getFile() incomplete" )
+    return S_OK()
+
   #############################################################################
   def __setJobParam( self, name, value ):
     """Wraps around setJobParameter of state update client
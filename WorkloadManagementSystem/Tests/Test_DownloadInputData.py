@@ -0,0 +1,171 @@
+""" Test DownloadInputData """
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import MagicMock, patch
+
+from ILCDIRAC.WorkloadManagementSystem.Client.DownloadInputData import DownloadInputData
+from ILCDIRAC.Core.Utilities.InputDataCache import InputDataCache
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC import gLogger
+
+__RCSID__ = "$Id$"
+
+MODULE_NAME = 'ILCDIRAC.WorkloadManagementSystem.Client.DownloadInputData'
+
+
+class FakeSE( object ):
+  """ storage element writing the downloaded files, records the calls """
+
+  def __init__( self, name, test ):
+    self.name = name
+    self.test = test
+
+  def getStatus( self ):
+    return S_OK( dict( Read = True, DiskSE = self.name != 'TAPE-SE', TapeSE = self.name == 'TAPE-SE' ) )
+
+  def status( self ):
+    return self.getStatus()['Value']
+
+  def getFileMetadata( self, lfns ):
+    self.test.metadataCalls.append( ( self.name, lfns ) )
+    lfns = lfns if isinstance( lfns, list ) else [ lfns ]
+    return S_OK( dict( Successful = dict( ( lfn, dict( Accessible = True, Cached = True,
+                                                       Lost = lfn in self.test.lost ) ) for lfn in lfns ),
+                       Failed = {} ) )
+
+  def getFile( self, lfn, localPath ):
+    with self.test.lock:
+      self.test.downloads.append( ( self.name, lfn ) )
+    if ( self.name, lfn ) in self.test.brokenTransfers:
+      return S_OK( dict( Successful = {}, Failed = { lfn: 'transfer failed' } ) )
+    with open( os.path.join( localPath, os.path.basename( lfn ) ), 'w' ) as out:
+      out.write( lfn )
+    return S_OK( dict( Successful = { lfn: 10 }, Failed = {} ) )
+
+
+class TestDownloadInputData( unittest.TestCase ):
+  """ Test the download of the input data """
+
+  def setUp( self ):
+    self.tmpdir = tempfile.mkdtemp( "", dir = "./" )
+    self.lock = threading.Lock()
+    self.metadataCalls = []
+    self.downloads = []
+    self.brokenTransfers = set()
+    self.lost = set()
+    self.lfns = [ '/ilc/prod/file_%d.slcio' % index for index in xrange( 6 ) ]
+    self.readyFiles = []
+    self.sePatch = patch( '%s.StorageElement' % MODULE_NAME, new = lambda seName: FakeSE( seName, self ) )
+    self.sePatch.start()
+    self.did = self.createModule( self.tmpdir )
+
+  def createModule( self, downloadDir ):
+    """ create the DownloadInputData of a job """
+    replicas = {}
+    for index, lfn in enumerate( self.lfns ):
+      replicas[ lfn ] = dict( Size = 10, GUID = 'guid%d' % index, OTHER = 'none' )
+      replicas[ lfn ][ 'TAPE-SE' if index == 5 else 'LOCAL-SE' ] = 'pfn'
+      replicas[ lfn ][ 'REMOTE-SE' ] = 'pfn'
+    arguments = dict( InputData = [ 'LFN:' + lfn for lfn in self.lfns ],
+                      Configuration = dict( LocalSEList = [ 'LOCAL-SE', 'TAPE-SE' ], MaxParallelDownloads = 3 ),
+                      FileCatalog = S_OK( dict( Successful = replicas, Failed = {} ) ),
+                      InputDataDirectory = downloadDir,
+                      FileReadyCallback = lambda lfn, fileDict: self.readyFiles.append( lfn ) )
+    with patch( '%s.DMSHelpers' % MODULE_NAME ) as dmsMock:
+      dmsMock.return_value.getStorageElements.return_value = [ 'LOCAL-SE', 'TAPE-SE', 'REMOTE-SE' ]
+      did = DownloadInputData( arguments )
+    did.log = gLogger
+    return did
+
+  def tearDown( self ):
+    self.sePatch.stop()
+    shutil.rmtree( self.tmpdir, ignore_errors = True )
+
+  def execute( self, did = None ):
+    with patch( '%s.getDiskSpace' % MODULE_NAME, return_value = 100000 ):
+      return ( did or self.did ).execute()
+
+  def test_download( self ):
+    res = self.execute()
+    self.assertTrue( res['OK'], res.get( 'Message' ) )
+    self.assertEqual( sorted( res['Value']['Successful'] ), self.lfns )
+    self.assertEqual( res['Value']['Failed'], [] )
+    self.assertEqual( self.readyFiles, self.lfns )
+    self.assertEqual( res['Value']['Successful'][ self.lfns[ 5 ] ]['se'], 'TAPE-SE' )
+    self.assertEqual( res['Value']['Successful'][ self.lfns[ 0 ] ]['path'],
+                      os.path.join( self.tmpdir, 'file_0.slcio' ) )
+    ## one metadata call per SE
+    self.assertEqual( sorted( ( seName, sorted( lfns ) ) for seName, lfns in self.metadataCalls ),
+                      [ ( 'LOCAL-SE', self.lfns[ :5 ] ), ( 'TAPE-SE', self.lfns[ 5: ] ) ] )
+
+  def test_download_fallback( self ):
+    self.brokenTransfers.add( ( 'LOCAL-SE', self.lfns[ 2 ] ) )
+    self.brokenTransfers.add( ( 'LOCAL-SE', self.lfns[ 3 ] ) )
+    self.brokenTransfers.add( ( 'REMOTE-SE', self.lfns[ 3 ] ) )
+    self.lost.add( self.lfns[ 4 ] )
+    res = self.execute()
+    self.assertTrue( res['OK'], res.get( 'Message' ) )
+    self.assertEqual( sorted( res['Value']['Successful'] ), [ self.lfns[ index ] for index in ( 0, 1, 2, 5 ) ] )
+    self.assertEqual( res['Value']['Failed'], [ self.lfns[ 3 ], self.lfns[ 4 ] ] )
+    self.assertEqual( res['Value']['Successful'][ self.lfns[ 2 ] ]['se'], 'REMOTE-SE' )
+    self.assertEqual( self.readyFiles, [ self.lfns[ index ] for index in ( 0, 1, 2, 5 ) ] )
+    self.assertNotIn( self.lfns[ 4 ], [ lfn for _se, lfn in self.downloads ] )
+
+  def test_bandwidth_limit( self ):
+    self.did.maxBytesInFlight = 15
+    inFlight = []
+    original = self.did._downloadFromSE
+
+    def checkedDownload( *args ):
+      inFlight.append( self.did.bytesInFlight )
+      return original( *args )
+    self.did._downloadFromSE = checkedDownload
+    res = self.execute()
+    self.assertEqual( len( res['Value']['Successful'] ), 6 )
+    self.assertEqual( max( inFlight ), 10 )
+    self.assertEqual( self.did.bytesInFlight, 0 )
+
+  def test_shared_cache( self ):
+    cache = InputDataCache( os.path.join( self.tmpdir, 'cache' ) )
+    self.did.cache = cache
+    res = self.execute()
+    self.assertEqual( len( res['Value']['Successful'] ), 6 )
+    self.assertEqual( len( self.downloads ), 6 )
+    ## second job on the node
+    secondDir = os.path.join( self.tmpdir, 'job2' )
+    os.mkdir( secondDir )
+    secondJob = self.createModule( secondDir )
+    secondJob.cache = cache
+    cache.getFile = MagicMock( side_effect = cache.getFile )
+    res = self.execute( secondJob )
+    self.assertEqual( len( res['Value']['Successful'] ), 6 )
+    self.assertEqual( len( self.downloads ), 6 )
+    self.assertIn( ( self.lfns[ 0 ], 'guid0', os.path.join( secondDir, 'file_0.slcio' ) ),
+                   [ args[ 0 ][ :3 ] for args in cache.getFile.call_args_list ] )
+    self.assertTrue( os.path.samefile( res['Value']['Successful'][ self.lfns[ 0 ] ]['path'],
+                                       os.path.join( self.tmpdir, 'file_0.slcio' ) ) )
+    self.assertEqual( cache.getStatistics(), 'hits 6/12 (50%), 0.0 MB from cache' )
+
+  def test_not_enough_disk( self ):
+    with patch( '%s.getDiskSpace' % MODULE_NAME, return_value = 1 ):
+      res = self.did.execute()
+    self.assertFalse( res['OK'] )
+    self.assertEqual( self.downloads, [] )
+
+  def test_metadata_fails( self ):
+    with patch.object( FakeSE, 'getFileMetadata', return_value = S_ERROR( 'SE down' ) ):
+      res = self.execute()
+    ## the file that is not known to be cached on tape is downloaded from anywhere
+    self.assertEqual( res['Value']['Successful'].keys(), self.lfns[ 5: ] )
+    self.assertEqual( res['Value']['Successful'][ self.lfns[ 5 ] ]['se'], 'REMOTE-SE' )
+    self.assertEqual( res['Value']['Failed'], self.lfns[ :5 ] )
+
+if __name__ == "__main__":
+  SUITE = unittest.defaultTestLoader.loadTestsFromTestCase( TestDownloadInputData )
+  TESTRESULT = unittest.TextTestRunner( verbosity = 2 ).run( SUITE )
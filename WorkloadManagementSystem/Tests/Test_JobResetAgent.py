@@ -1,5 +1,8 @@
 """ Test JobResetAgent """
 
+import os
+import shutil
+import tempfile
 import unittest
 
 from datetime import datetime, timedelta
@@ -35,6 +38,7 @@ class TestJobResetAgent(unittest.TestCase):
     self.today = datetime(2018, 12, 25, 0, 0, 0, 0)
     self.agent.datetime = MagicMock()
     self.agent.datetime.now.return_value = self.today
+    self.agent.datetime.strptime.side_effect = datetime.strptime
 
     self.jobResetAgent = JobResetAgent()
     self.jobResetAgent.log = gLogger
@@ -106,6 +110,112 @@ class TestJobResetAgent(unittest.TestCase):
     self.assertEquals(res["Value"], [1, 2, 3])
     self.jobResetAgent.jobDB.selectJobs.assert_called_once_with(attrDict, older=self.today - timedelta(days=1))
 
+  def test_get_jobs_incremental(self):
+    """ test for getJobs function between two full scans """
+    attrDict = {"JobType": "User", "Status": "Completed"}
+    self.jobResetAgent.fullScan = False
+    self.jobResetAgent.cursor = "2018-12-23 00:00:00"
+    self.jobResetAgent.changedRequestJobs = set([7, 5])
+    self.jobResetAgent.jobDB.selectJobs.side_effect = [S_OK(["1", "2"]), S_OK(["5"])]
+    res = self.jobResetAgent.getJobs("Completed", "User")
+    self.assertEquals(res["Value"], [1, 2, 5])
+    self.jobResetAgent.jobDB.selectJobs.assert_has_calls([
+        call(attrDict, older=self.today - timedelta(days=1), newer="2018-12-23 00:00:00"),
+        call(dict(attrDict, JobID=[5, 7]), older=self.today - timedelta(days=1))])
+
+    # without changed requests only the new jobs are selected
+    self.jobResetAgent.changedRequestJobs = set()
+    self.jobResetAgent.jobDB.selectJobs.reset_mock()
+    self.jobResetAgent.jobDB.selectJobs.side_effect = [S_OK(["3"])]
+    self.assertEquals(self.jobResetAgent.getJobs("Completed", "User")["Value"], [3])
+    self.assertEquals(self.jobResetAgent.jobDB.selectJobs.call_count, 1)
+
+    # all jobs are selected if not incremental
+    self.jobResetAgent.jobDB.selectJobs.reset_mock()
+    self.jobResetAgent.jobDB.selectJobs.side_effect = [S_OK(["3", "4"])]
+    self.assertEquals(self.jobResetAgent.getJobs("Staging", incremental=False)["Value"], [3, 4])
+    self.jobResetAgent.jobDB.selectJobs.assert_called_once_with({"Status": "Staging"},
+                                                                older=self.today - timedelta(days=1))
+
+  def test_prepare_scan(self):
+    """ test for prepareScan function """
+    # no state: full scan
+    self.jobResetAgent.jobStates = {1: {'RequestStatus': None, 'LastUpdate': 0}}
+    self.jobResetAgent.prepareScan()
+    self.assertTrue(self.jobResetAgent.fullScan)
+    self.assertEquals(self.jobResetAgent.jobStates, {})
+    self.jobResetAgent.reqClient.readRequestsForJobs.assert_not_called()
+
+    # state from the last cycle: only jobs with changed requests and jobs to retry
+    self.jobResetAgent.stateFile = "state.json"
+    self.jobResetAgent.cursor = "2018-12-23 00:00:00"
+    self.jobResetAgent.lastCycle = datetime(2018, 12, 24)
+    self.jobResetAgent.chunkSize = 2
+    self.jobResetAgent.retryJobs = set([9])
+    self.jobResetAgent.jobStates = {1: {'RequestStatus': 'Failed', 'LastUpdate': 0},
+                                    2: {'RequestStatus': 'Done', 'LastUpdate': 0},
+                                    3: {'RequestStatus': 'Failed', 'LastUpdate': 0},
+                                    4: {'RequestStatus': 'Waiting', 'LastUpdate': 0},
+                                    5: {'RequestStatus': None, 'LastUpdate': 0}}
+    changedStatus = MagicMock(Status="Waiting", LastUpdate=datetime(2018, 12, 23))
+    sameStatus = MagicMock(Status="Done", LastUpdate=datetime(2018, 12, 23))
+    updated = MagicMock(Status="Waiting", LastUpdate=datetime(2018, 12, 24, 10))
+    self.jobResetAgent.reqClient.readRequestsForJobs.side_effect = [
+        S_OK({'Successful': {1: changedStatus, 2: sameStatus}, 'Failed': {}}),
+        S_OK({'Successful': {4: updated}, 'Failed': {3: 'Request not found'}})]
+    self.jobResetAgent.prepareScan()
+    self.assertFalse(self.jobResetAgent.fullScan)
+    self.assertEquals(self.jobResetAgent.changedRequestJobs, set([1, 3, 4, 9]))
+    self.assertEquals(self.jobResetAgent.retryJobs, set())
+    self.jobResetAgent.reqClient.readRequestsForJobs.assert_has_calls([call([1, 2]), call([3, 4])])
+
+    # failure to get the requests: full scan
+    self.jobResetAgent.reqClient.readRequestsForJobs.side_effect = None
+    self.jobResetAgent.reqClient.readRequestsForJobs.return_value = S_ERROR()
+    self.jobResetAgent.prepareScan()
+    self.assertTrue(self.jobResetAgent.fullScan)
+
+    # full scan period reached
+    self.jobResetAgent.reqClient.readRequestsForJobs.return_value = S_OK({'Successful': {}, 'Failed': {}})
+    self.jobResetAgent.fullScanPeriod = 0
+    self.jobResetAgent.prepareScan()
+    self.assertTrue(self.jobResetAgent.fullScan)
+
+  def test_save_load_state(self):
+    """ test the state is kept between two instances of the agent """
+    tmpdir = tempfile.mkdtemp()
+    try:
+      self.jobResetAgent.stateFile = os.path.join(tmpdir, JRA.STATE_FILE_NAME)
+      self.jobResetAgent.lastFullScan = 1234
+      self.jobResetAgent.recordJobState(1, 'Failed')
+      self.jobResetAgent.recordJobState(2, None)
+      self.jobResetAgent.retryJobs = set([3])
+      self.assertTrue(self.jobResetAgent.saveState(self.today.replace(microsecond=5))["OK"])
+      self.assertEquals(os.listdir(tmpdir), [JRA.STATE_FILE_NAME])
+
+      otherAgent = JobResetAgent()
+      otherAgent.log = gLogger
+      otherAgent.stateFile = self.jobResetAgent.stateFile
+      otherAgent.loadState()
+      self.assertEquals(otherAgent.cursor, "2018-12-24 00:00:00")
+      self.assertEquals(otherAgent.lastCycle, self.today)
+      self.assertEquals(otherAgent.retryJobs, set([3]))
+      self.assertEquals(otherAgent.lastFullScan, 1234)
+      self.assertEquals(sorted(otherAgent.jobStates), [1, 2])
+      self.assertEquals(otherAgent.jobStates[1]['RequestStatus'], 'Failed')
+
+      # a broken state file is ignored
+      with open(otherAgent.stateFile, 'w') as stateFile:
+        stateFile.write("{not json")
+      otherAgent = JobResetAgent()
+      otherAgent.log = gLogger
+      otherAgent.stateFile = self.jobResetAgent.stateFile
+      otherAgent.loadState()
+      self.assertIsNone(otherAgent.cursor)
+      self.assertEquals(otherAgent.jobStates, {})
+    finally:
+      shutil.rmtree(tmpdir)
+
   def test_treat_User_Job_With_No_Req(self):
     """ test for treatUserJobWithNoReq function """
     self.jobResetAgent.markJob = MagicMock()
@@ -249,8 +359,8 @@ class TestJobResetAgent(unittest.TestCase):
   def test_check_jobs(self):
     """ test for checkJobs function """
     jobIDs = [1, 2]
-    dummy_treatJobWithNoReq = MagicMock()
-    dummy_treatJobWithReq = MagicMock()
+    dummy_treatJobWithNoReq = MagicMock(return_value=S_OK())
+    dummy_treatJobWithReq = MagicMock(return_value=S_OK())
 
     # if the readRequestsForJobs func returns error than checkJobs should exit and return an error
     self.jobResetAgent.reqClient.readRequestsForJobs.return_value = S_ERROR()
@@ -265,6 +375,7 @@ class TestJobResetAgent(unittest.TestCase):
                                  treatJobWithReq=dummy_treatJobWithReq)
     dummy_treatJobWithNoReq.assert_has_calls([call(jobIDs[0]), call(jobIDs[1])])
     dummy_treatJobWithReq.assert_not_called()
+    self.assertEquals(self.jobResetAgent.jobStates[jobIDs[0]]['RequestStatus'], None)
 
     dummy_treatJobWithNoReq.reset_mock()
     req1 = Request({"RequestID": 1})
@@ -277,6 +388,20 @@ class TestJobResetAgent(unittest.TestCase):
     dummy_treatJobWithNoReq.assert_not_called()
     dummy_treatJobWithReq.assert_has_calls([call(jobIDs[0], req1), call(jobIDs[1], req2)])
 
+  def test_check_jobs_retry(self):
+    """ test the jobs whose treatment failed are retried in the next cycle """
+    jobIDs = [1, 2, 3]
+    treatJobWithNoReq = MagicMock(return_value=S_ERROR("Failed to mark"))
+    treatJobWithReq = MagicMock(return_value=S_OK())
+    self.jobResetAgent.reqClient.readRequestsForJobs.return_value = S_OK({'Successful': {2: Request()},
+                                                                          'Failed': {3: 'Connection lost'}})
+    self.jobResetAgent.checkJobs(jobIDs, treatJobWithNoReq=treatJobWithNoReq, treatJobWithReq=treatJobWithReq)
+    self.assertEquals(self.jobResetAgent.retryJobs, set([1, 3]))
+
+    self.jobResetAgent.reqClient.readRequestsForJobs.return_value = S_ERROR()
+    self.jobResetAgent.checkJobs([4, 5], treatJobWithNoReq=treatJobWithNoReq, treatJobWithReq=treatJobWithReq)
+    self.assertEquals(self.jobResetAgent.retryJobs, set([1, 3, 4, 5]))
+
   def test_get_staged_files(self):
     """ test for getStagedFiles function """
     stagedFile = "/ilc/fake/lfn1/staged"
@@ -286,6 +411,10 @@ class TestJobResetAgent(unittest.TestCase):
     res = self.jobResetAgent.getStagedFiles([])
     self.assertTrue(res["OK"])
 
+    self.jobResetAgent.dataManager.getReplicas.return_value = S_OK({'Successful': {stagedFile: {'TAPE-SE': 'pfn'},
+                                                                                  nonStagedFile: {'TAPE-SE': 'pfn'}},
+                                                                   'Failed': {}})
+    SeModule.StorageElementItem.getStatus = MagicMock(return_value=S_OK({'TapeSE': True}))
     SeModule.StorageElementItem.getFileMetadata = MagicMock(return_value=S_ERROR())
     res = self.jobResetAgent.getStagedFiles(lfns)
     self.assertFalse(res["OK"])
@@ -295,31 +424,88 @@ class TestJobResetAgent(unittest.TestCase):
     res = self.jobResetAgent.getStagedFiles(lfns)
     self.assertEquals(res["Value"], [stagedFile])
 
+  def test_get_staged_files_tape_ses(self):
+    """ test getStagedFiles asks every tape storage element holding the files, in chunks """
+    lfns = ["/ilc/fake/lfn%d" % index for index in xrange(5)]
+    self.jobResetAgent.chunkSize = 2
+    self.jobResetAgent.dataManager.getReplicas.side_effect = lambda chunk, getUrl: S_OK(
+        {'Successful': {lfn: {'CERN-SRM': 'pfn', 'DESY-SRM': 'pfn', 'DISK-SE': 'pfn'} if lfn != lfns[4] else {}
+                        for lfn in chunk},
+         'Failed': {}})
+    self.jobResetAgent.tapeSEs = {'CERN-SRM': True, 'DESY-SRM': True, 'DISK-SE': False}
+    # only the third file is staged
+    SeModule.StorageElementItem.getFileMetadata = MagicMock(side_effect=lambda chunk: S_OK(
+        {'Successful': {lfn: {'Cached': 1 if lfn == lfns[2] else 0} for lfn in chunk}}))
+    res = self.jobResetAgent.getStagedFiles(lfns)
+    self.assertEquals(res["Value"], [lfns[2]])
+    self.assertEquals(self.jobResetAgent.dataManager.getReplicas.call_count, 3)
+    self.assertEquals(SeModule.StorageElementItem.getFileMetadata.call_count, 4)
+    self.assertEquals(sorted(lfn for args, _kwargs in SeModule.StorageElementItem.getFileMetadata.call_args_list
+                             for lfn in args[0]), sorted(lfns[:4] * 2))
+
+    # only files with a tape replica are looked at
+    self.jobResetAgent.dataManager.getReplicas.side_effect = None
+    self.jobResetAgent.dataManager.getReplicas.return_value = S_OK({'Successful': {lfns[0]: {'DISK-SE': 'pfn'}},
+                                                                   'Failed': {lfns[1]: 'No such file'}})
+    SeModule.StorageElementItem.getFileMetadata.reset_mock()
+    self.assertEquals(self.jobResetAgent.getStagedFiles(lfns[:2])["Value"], [])
+    SeModule.StorageElementItem.getFileMetadata.assert_not_called()
+
+  def test_is_tape_se(self):
+    """ test isTapeSE function """
+    SeModule.StorageElementItem.getStatus = MagicMock(return_value=S_ERROR())
+    self.assertFalse(self.jobResetAgent.isTapeSE('CERN-SRM', 'ilc'))
+    SeModule.StorageElementItem.getStatus.return_value = S_OK({'TapeSE': True, 'DiskSE': False})
+    self.assertTrue(self.jobResetAgent.isTapeSE('CERN-SRM', 'ilc'))
+    self.assertTrue(self.jobResetAgent.isTapeSE('CERN-SRM', 'ilc'))
+    SeModule.StorageElementItem.getStatus.return_value = S_OK({'TapeSE': False, 'DiskSE': True})
+    self.assertFalse(self.jobResetAgent.isTapeSE('CERN-DST-EOS', 'ilc'))
+    self.assertEquals(SeModule.StorageElementItem.getStatus.call_count, 3)
+
   def test_get_input_data_for_jobs(self):
     """ test for getInputDataForJobs function """
     jobIDs = [1, 2]
     lfn1 = "/ilc/fake/lfn1"
     lfn2 = "/ilc/fake/lfn2"
-    self.jobResetAgent.jobMonClient.getInputData.return_value = S_ERROR()
+    self.jobResetAgent.jobDB.getInputData.return_value = S_ERROR()
 
     res = self.jobResetAgent.getInputDataForJobs(jobIDs)
     self.assertEquals(res["Value"], {})
 
-    self.jobResetAgent.jobMonClient.getInputData.return_value = S_OK([lfn1, lfn2])
+    self.jobResetAgent.jobDB.getInputData.return_value = S_OK([lfn1, "LFN:" + lfn2])
     res = self.jobResetAgent.getInputDataForJobs(jobIDs)
     self.assertEquals(res["Value"], {lfn1: jobIDs, lfn2: jobIDs})
 
+    # the input data of the jobs is read in parallel
+    self.jobResetAgent.maxThreads = 2
+    self.jobResetAgent.jobDB.getInputData.reset_mock()
+    self.jobResetAgent.jobDB.getInputData.side_effect = lambda jobID: S_OK([lfn1]) if jobID == 1 else S_ERROR()
+    self.assertEquals(self.jobResetAgent.getInputDataForJobs(jobIDs)["Value"], {lfn1: [1]})
+    self.assertEquals(sorted(self.jobResetAgent.jobDB.getInputData.call_args_list), [call(1), call(2)])
+
   def test_reschedule_jobs(self):
     """ test for rescheduleJobs function """
     jobShouldFailToReset = 1
     jobShouldSuccessfullyReset = 2
     jobsToReschedule = [jobShouldFailToReset, jobShouldSuccessfullyReset]
 
-    self.jobResetAgent.jobManagerClient.resetJob.side_effect = [S_ERROR(), S_OK()]
+    failedReset = S_ERROR()
+    failedReset['FailedJobIDs'] = [jobShouldFailToReset]
+    self.jobResetAgent.jobManagerClient.resetJob.return_value = failedReset
     res = self.jobResetAgent.rescheduleJobs(jobsToReschedule)
     self.assertTrue(res["OK"])
     self.assertEquals(res["Value"]["Successful"], [jobShouldSuccessfullyReset])
     self.assertEquals(res["Value"]["Failed"], [jobShouldFailToReset])
+    self.jobResetAgent.jobManagerClient.resetJob.assert_called_once_with(jobsToReschedule)
+
+    # the jobs are reset in chunks, a failure without details fails the whole chunk
+    self.jobResetAgent.chunkSize = 1
+    self.jobResetAgent.jobManagerClient.resetJob.reset_mock()
+    self.jobResetAgent.jobManagerClient.resetJob.side_effect = [S_ERROR(), S_OK()]
+    res = self.jobResetAgent.rescheduleJobs(set(jobsToReschedule))
+    self.assertEquals(res["Value"]["Successful"], [jobShouldSuccessfullyReset])
+    self.assertEquals(res["Value"]["Failed"], [jobShouldFailToReset])
+    self.assertEquals(self.jobResetAgent.jobManagerClient.resetJob.call_count, 2)
 
   def test_check_staging_jobs(self):
     """ test for checkStagingJobs function """
@@ -342,8 +528,8 @@ class TestJobResetAgent(unittest.TestCase):
     jobsToReschedule = set()
     jobsToReschedule.add(jobShouldBeRescheduled)
     self.jobResetAgent.getInputDataForJobs.reset_mock()
-    self.jobResetAgent.getInputDataForJobs.return_value = S_OK({stagedFile: jobShouldBeRescheduled,
-                                                                notStagedFile: jobShouldNotBeResecheduled})
+    self.jobResetAgent.getInputDataForJobs.return_value = S_OK({stagedFile: [jobShouldBeRescheduled],
+                                                                notStagedFile: [jobShouldNotBeResecheduled]})
     self.jobResetAgent.getStagedFiles.return_value = S_OK([stagedFile])
     self.jobResetAgent.checkStagingJobs(jobIDs)
     self.jobResetAgent.rescheduleJobs.assert_called_once_with(jobsToReschedule)
@@ -388,8 +574,11 @@ class TestJobResetAgent(unittest.TestCase):
 
     self.jobResetAgent.jobStateUpdateClient.setJobStatus.reset_mock()
     self.jobResetAgent.jobStateUpdateClient.setJobStatus.return_value = S_OK()
+    self.jobResetAgent.recordJobState(self.fakeJobID, 'Done')
     res = self.jobResetAgent.markJob(self.fakeJobID, fakeJobStatus, minorStatus=fakeMinorStatus, application=fakeApp)
     self.assertTrue(res["OK"])
+    # the marked job is not followed anymore
+    self.assertNotIn(self.fakeJobID, self.jobResetAgent.jobStates)
     self.jobResetAgent.jobStateUpdateClient.setJobStatus.assert_called_once_with(self.fakeJobID, fakeJobStatus,
                                                                                  fakeMinorStatus, fakeApp)
 